@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Admission control middleware.
+
+Matches the request against the routes of the app to find its class (see
+`app.core.admission`), waits for the class to let it in, and answers a
+503 with a Retry-After header when it is rejected, before anything of the
+request is run.
+"""
+
+from typing import Optional, Sequence
+from starlette.responses import JSONResponse
+from starlette.routing import BaseRoute
+from app.api.metrics import match_route
+from app.core.admission import AdmissionController, route_class_name
+
+
+class AdmissionMiddleware:
+    """Limit the requests running at once by class of route"""
+
+    def __init__(self, app, routes: Sequence[BaseRoute], controller: Optional[AdmissionController] = None):
+        self.app = app
+        # the list of routes of the app, the routes included after the middleware was added too
+        self.routes = routes
+        self.controller = controller or AdmissionController()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route = match_route(scope, self.routes)
+        name = route_class_name(scope["method"], route.path) if route is not None else None
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        reason = await self.controller.acquire(name)
+        if reason is not None:
+            response = JSONResponse(
+                {"detail": "Server overloaded, retry later", "reason": reason},
+                status_code=503,
+                headers={"Retry-After": str(self.controller.retry_after(name))})
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(name)
@@ -1,15 +1,44 @@
 #!/usr/bin/env python3
 """ FastApi server. """
 
-from fastapi import FastAPI
+import asyncio
+from typing import Set
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from app.models.engine import db_storage
 from app.models.engine.db_storage import init_db
+from app.models.engine.media_storage import sweep_orphans
 from app.api.routes.posts import post_router
 from app.api.routes.comments import comment_router
 from app.api.routes.likes import like_router
+from app.api.routes.metrics import metrics_router
+from app.api.routes.admin import admin_router
+from app.api.routes.media import media_router
+from app.api.routes.search import search_router
+from app.api.routes.trending import trending_router
+from app.api.routes.notifications import notification_router
+from app.api.routes.live import live_router
 
 from app.api.routes.users import user_router   # router as Router
 from app.api.auth.auth import auth_router  # router as AuthRouter
+from app.api.dependencies import causal_consistency, require_admin
+from app.api.metrics import MetricsMiddleware
+from app.api.tracing import TracingMiddleware
+from app.api.profiling import ProfilingMiddleware
+from app.api.admission import AdmissionMiddleware
+from app.api.deadlines import DeadlineMiddleware
+from app.core.config import CONFIG
+from app.core.loop_monitor import loop_monitor
+from app.core.rate_limit import MongoBucketStore, rate_limiter
+from app.core.tracing import tracer
+from app.utils.images import image_variants
+from app.utils.live import post_events
+from app.utils.notifications import notifications
+from app.utils.follow_graph import build_follow_graph, refresh_follow_graph
+from app.utils.suggestions import run_suggestions
+from app.utils.search import build_post_index, build_user_index, refresh_search_indexes, search_deletions
+from app.utils.trending import checkpoint_trending, load_trending, save_trending
+from app.utils.views import view_counters
 
 
 app = FastAPI()
@@ -23,11 +52,45 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-app.include_router(auth_router, tags=['Auth'], prefix='/auth')
-app.include_router(user_router, tags=['Users'], prefix='/users')
-app.include_router(post_router, tags=['Posts'], prefix='/posts')
-app.include_router(comment_router, tags=['Comments'], prefix='/comments')
-app.include_router(like_router, tags=['Likes'], prefix='/likes')
+# The middlewares added last run first.
+# the requests over the limits of their class of route are rejected before running
+if CONFIG.admission_enabled:
+    app.add_middleware(AdmissionMiddleware, routes=app.routes)
+
+# the deadline of a request covers its wait in the admission queue
+app.add_middleware(DeadlineMiddleware, routes=app.routes)
+
+# Adding the metrics middleware after, so it measures the whole request, rejections included
+if CONFIG.metrics_enabled or CONFIG.debug:
+    app.add_middleware(MetricsMiddleware)
+
+# the profiled requests are sampled from their start, the middlewares included
+app.add_middleware(ProfilingMiddleware)
+
+# the traces start before the metrics, their root span covers the whole request
+app.add_middleware(TracingMiddleware)
+
+# every request carrying a token runs in the causally consistent session of that token
+session_dependencies = [Depends(causal_consistency)]
+
+app.include_router(auth_router, tags=['Auth'], prefix='/auth', dependencies=session_dependencies)
+app.include_router(user_router, tags=['Users'], prefix='/users', dependencies=session_dependencies)
+app.include_router(post_router, tags=['Posts'], prefix='/posts', dependencies=session_dependencies)
+app.include_router(comment_router, tags=['Comments'], prefix='/comments', dependencies=session_dependencies)
+app.include_router(like_router, tags=['Likes'], prefix='/likes', dependencies=session_dependencies)
+app.include_router(media_router, tags=['Media'], prefix='/media')
+app.include_router(search_router, tags=['Search'], prefix='/search', dependencies=session_dependencies)
+app.include_router(trending_router, tags=['Trending'], prefix='/trending')
+app.include_router(notification_router, tags=['Notifications'], prefix='/notifications',
+                   dependencies=session_dependencies)
+app.include_router(live_router, tags=['Live'], prefix='/live')
+if CONFIG.metrics_enabled:
+    app.include_router(metrics_router, tags=['Metrics'])
+app.include_router(admin_router, tags=['Admin'], prefix='/admin', dependencies=[Depends(require_admin)])
+
+
+# the tasks running as long as the server
+background_tasks: Set[asyncio.Task] = set()
 
 
 @app.on_event('startup')
@@ -37,6 +100,48 @@ async def on_startup():
     This function connects to MongoDB using the provided MONGODB_URL.
     """
     await init_db()
+    if CONFIG.rate_limit_backend == 'mongodb':
+        # the buckets shared by the workers
+        rate_limiter.store = MongoBucketStore(db_storage.storage.database)
+        await rate_limiter.store.init()
+    # the deletions from before the indexes are built are already applied
+    await search_deletions.init()
+    await build_post_index()
+    await build_user_index()
+    if CONFIG.search_refresh_seconds:
+        background_tasks.add(asyncio.ensure_future(refresh_search_indexes()))
+    await load_trending(db_storage.storage.database)
+    if CONFIG.trending_checkpoint_seconds:
+        background_tasks.add(asyncio.ensure_future(checkpoint_trending(db_storage.storage.database)))
+    background_tasks.add(asyncio.ensure_future(notifications.run()))
+    background_tasks.add(asyncio.ensure_future(view_counters.run()))
+    await build_follow_graph()
+    if CONFIG.follow_graph_refresh_seconds:
+        background_tasks.add(asyncio.ensure_future(refresh_follow_graph()))
+    if CONFIG.suggestions_refresh_seconds:
+        background_tasks.add(asyncio.ensure_future(run_suggestions()))
+    if CONFIG.media_sweep_seconds:
+        background_tasks.add(asyncio.ensure_future(sweep_orphans()))
+    if CONFIG.live_change_stream and db_storage.storage.name == 'mongodb':
+        background_tasks.add(asyncio.ensure_future(post_events.watch(db_storage.storage.database)))
+    loop_monitor.start()
+
+
+@app.on_event('shutdown')
+async def on_shutdown():
+    """
+    Stop the loop monitor, the background tasks and the image pool, save the trends,
+    and write the notifications, view counts and traces still queued
+    """
+    await loop_monitor.stop()
+    for task in background_tasks:
+        task.cancel()
+    await image_variants.close()
+    await notifications.flush()
+    await view_counters.flush()
+    if CONFIG.trending_checkpoint_seconds:
+        await save_trending(db_storage.storage.database)
+    tracer.close()
 
 
 @app.get('/', tags=['Root'])
@@ -8,19 +8,22 @@ from app.core.config import CONFIG
 from app.models.user import User, UserCreateRequest, UserResponse
 from app.utils.auth import hash_password, verify_password, create_access_token, create_refresh_access_token
 from fastapi import APIRouter, Body, HTTPException, status, Depends
-from app.api.dependencies import get_current_user, oauth2_scheme
+from app.api.dependencies import RateLimit, get_current_user, oauth2_scheme
 from pydantic import EmailStr
 from app.models.token import Token, BlackListedTokens
 from app.utils.mail import send_password_reset_email
+from app.utils.search import user_index
+from app.api.tracing import TracedRoute
 
 
-auth_router = APIRouter()
+auth_router = APIRouter(route_class=TracedRoute)
 
 
 @auth_router.post('/register',
                   status_code=status.HTTP_201_CREATED,
                   response_description='Register a new user',
-                  response_model=Token)
+                  response_model=Token,
+                  dependencies=[Depends(RateLimit('sign_up'))])
 async def sign_up(user_create: UserCreateRequest) -> Token:
     """Register a new user"""
     user_data = user_create.model_dump(exclude_unset=True)
@@ -40,6 +43,7 @@ async def sign_up(user_create: UserCreateRequest) -> Token:
 
     user = User(**user_data)
     await user.create()
+    user_index.add(user.id, user.username, user.full_name)
 
     payload = {
         "user_id": user.id,
@@ -51,7 +55,8 @@ async def sign_up(user_create: UserCreateRequest) -> Token:
     return Token(access_token=access_token, refresh_token=refresh_token)
 
 
-@auth_router.post('/login', response_model=Token)
+@auth_router.post('/login', response_model=Token,
+                  dependencies=[Depends(RateLimit('login', user_field='username'))])
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     """
     Login the user
@@ -98,7 +103,8 @@ async def logout_user(
 # and should be embedded under a single key.
 @auth_router.post('/forgot-password',
                   status_code=status.HTTP_200_OK,
-                  response_model=dict)
+                  response_model=dict,
+                  dependencies=[Depends(RateLimit('forgot_password', user_field='email'))])
 async def forgot_password(email: EmailStr = Body(..., embed=True)) -> dict:
     """Send password reset email."""
     user = await User.find_one(User.email == email)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Deadline middleware.
+
+Runs each request with its deadline (see `app.core.deadlines`). When the
+deadline expires the request is cancelled, whatever it is waiting for (a
+command of motor, the admission queue, ...), and answered with a 504 if it
+has not started responding. A command stopped by MongoDB because of its
+maxTimeMS is answered the same way.
+"""
+
+from typing import Sequence
+import anyio
+from pymongo.errors import PyMongoError
+from starlette.responses import JSONResponse
+from starlette.routing import BaseRoute
+from app.api.metrics import match_route
+from app.core.deadlines import deadline, deadline_ms
+
+
+class DeadlineMiddleware:
+    """Cancel the requests running past their deadline"""
+
+    def __init__(self, app, routes: Sequence[BaseRoute]):
+        self.app = app
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route = match_route(scope, self.routes)
+        header = None
+        for name, value in scope.get("headers", ()):
+            if name == b"x-deadline-ms":
+                header = value.decode("latin-1")
+                break
+        timeout_ms = deadline_ms(scope["method"], route.path, header) if route is not None else 0
+        if not timeout_ms:
+            await self.app(scope, receive, send)
+            return
+
+        started = False
+
+        async def send_started(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        expired = False
+        with anyio.move_on_after(timeout_ms / 1000) as cancel_scope, deadline(timeout_ms / 1000):
+            try:
+                await self.app(scope, receive, send_started)
+            except PyMongoError as e:
+                if not e.timeout or started:
+                    raise
+                expired = True
+        if (expired or cancel_scope.cancelled_caught) and not started:
+            response = JSONResponse({"detail": "Request deadline exceeded"}, status_code=504)
+            await response(scope, receive, send)
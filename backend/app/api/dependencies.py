@@ -3,9 +3,16 @@
 
 from app.models.user import User
 from app.models.token import BlackListedTokens
-from fastapi import Depends, HTTPException, status
+from app.models.engine.read_routing import read_router
+from fastapi import Depends, Header, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
+from fastapi.security.utils import get_authorization_scheme_param
 from app.core.config import CONFIG
+from app.core.tracing import tracer
+from app.core.rate_limit import rate_limiter
+from typing import Optional
+import hmac
+import math
 import jwt
 
 # typically used for routes that require OAuth2-style authentication using username/email and password.
@@ -15,6 +22,7 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl='/auth/login', scheme_name="JWT")
 ALGORITHM = "HS256"
 
 
+@tracer.traced("auth")
 async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
     """
     Dependency to retrieve the current authenticated user based on the JWT token.
@@ -62,3 +70,93 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
             detail="Could not find user"
         )
     return user
+
+
+async def causal_consistency(request: Request):
+    """
+    Dependency running the request inside a causally consistent session
+    tied to the caller's token, so the user always sees his own writes.
+    """
+    scheme, token = get_authorization_scheme_param(request.headers.get('Authorization'))
+    if scheme.lower() != 'bearer':
+        token = None
+
+    async with read_router.causal_session(token):
+        yield
+
+
+async def secondary_reads():
+    """
+    Dependency for read-only routes: their reads may be served by a secondary
+    no more stale than the configured max staleness.
+    """
+    with read_router.secondary_reads():
+        yield
+
+
+def is_admin_token(token: Optional[str]) -> bool:
+    """Whether the token is the admin token, always False when ADMIN_TOKEN is not set"""
+    return bool(CONFIG.admin_token and token and hmac.compare_digest(token, CONFIG.admin_token))
+
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    """
+    Dependency of the admin routes: the X-Admin-Token header must match ADMIN_TOKEN.
+    The admin routes are disabled when ADMIN_TOKEN is not set.
+    """
+    if not CONFIG.admin_token:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin routes are disabled"
+        )
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Invalid admin token"
+        )
+
+
+class RateLimit:
+    """
+    Dependency limiting the requests of a route by client IP and by account
+    (see app/core/rate_limit.py), answering a 429 with a Retry-After header.
+
+    Attributes:
+        route (str): Name of the rules of the route.
+        user_field (Optional[str]): Field of the body (form or JSON) holding the account.
+    """
+
+    def __init__(self, route: str, user_field: Optional[str] = None):
+        self.route = route
+        self.user_field = user_field
+
+    async def __call__(self, request: Request) -> None:
+        if not rate_limiter.enabled:
+            return
+        keys = []
+        if request.client:
+            keys.append(('ip', request.client.host))
+        if self.user_field:
+            user = await self.body_field(request)
+            if user:
+                keys.append(('user', user.strip().lower()))
+        for key, value in keys:
+            wait = await rate_limiter.hit(self.route, key, value)
+            if wait:
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Too many requests, retry later",
+                    headers={"Retry-After": str(math.ceil(wait))}
+                )
+
+    async def body_field(self, request: Request) -> Optional[str]:
+        """The user field of the body, read once: the route gets the body parsed by the request"""
+        try:
+            if request.headers.get('content-type', '').startswith('application/json'):
+                body = await request.json()
+            else:
+                body = await request.form()
+        except Exception:
+            return None
+        value = body.get(self.user_field) if hasattr(body, 'get') else None
+        return value if isinstance(value, str) else None
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Profiling middleware.
+
+A request sent with the admin token and the `X-Profile: 1` header (or the
+`profile=1` query parameter) is profiled, the id of its profile is returned
+in the `X-Profile-Id` header, to be fetched at `/admin/profiles/{id}`.
+Without the admin token the flag is ignored.
+
+When PROFILE_CONTINUOUS_HZ is set, every request is sampled at that rate
+for the continuous profile of its route, at `/admin/profiles/routes`.
+"""
+
+import sys
+from urllib.parse import parse_qs
+from app.api.dependencies import is_admin_token
+from app.api.metrics import route_template
+from app.core.profiling import profiler
+
+
+def profile_requested(scope) -> bool:
+    """Whether the request asks to be profiled, with the admin token"""
+    flag, token = None, None
+    for name, value in scope.get("headers", ()):
+        if name == b"x-profile":
+            flag = value
+        elif name == b"x-admin-token":
+            token = value.decode("latin-1")
+    if flag is None and b"profile" in scope.get("query_string", b""):
+        flag = parse_qs(scope["query_string"].decode("latin-1")).get("profile", [""])[0].encode()
+    return flag in (b"1", b"true") and is_admin_token(token)
+
+
+class ProfilingMiddleware:
+    """Profile the requests asking for it, and sample every request in continuous mode"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # the frame of this call is on the stack of the loop thread while the request runs
+        marker = sys._getframe()
+        if profile_requested(scope):
+            profile = profiler.start(marker, scope["method"], scope["path"])
+
+            async def send_profile_id(message):
+                if message["type"] == "http.response.start":
+                    header = (b"x-profile-id", profile.summary.id.encode())
+                    message = {**message, "headers": [*message.get("headers", ()), header]}
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_profile_id)
+            finally:
+                profiler.stop(profile, route_template(scope))
+        elif profiler.continuous_hz:
+            profiler.enter(marker, scope)
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                profiler.leave(marker)
+        else:
+            await self.app(scope, receive, send)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+""" Defining the admin routes, to inspect the server """
+
+from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import PlainTextResponse
+from app.core.loop_monitor import LoopBlock, loop_monitor
+from app.core.profiling import ProfileSummary, folded, profiler
+from app.models.engine.slow_queries import SlowQuery, slow_query_log
+from app.api.tracing import TracedRoute
+from typing import List, Optional
+
+admin_router = APIRouter(route_class=TracedRoute)
+
+
+@admin_router.get('/slow-queries',
+                  response_description='Slow queries by shape, the slowest first')
+async def get_slow_queries() -> List[SlowQuery]:
+    """
+    Return the queries slower than SLOW_QUERY_MS, grouped by shape,
+    with the plan of each shape
+    """
+    await slow_query_log.wait_explains()
+    return slow_query_log.slowest()
+
+
+@admin_router.delete('/slow-queries',
+                     status_code=status.HTTP_200_OK)
+async def clear_slow_queries() -> dict:
+    """Forget the slow queries seen so far"""
+    slow_query_log.clear()
+    return {"message": "Slow queries cleared"}
+
+
+@admin_router.get('/loop-blocks',
+                  response_description='Times the event loop was blocked, the latest first')
+async def get_loop_blocks() -> List[LoopBlock]:
+    """
+    Return the last times the event loop was blocked for more than
+    LOOP_BLOCK_THRESHOLD_MS, with the stack of the blocking code
+    """
+    return list(reversed(loop_monitor.blocks))
+
+
+@admin_router.get('/profiles',
+                  response_description='Profiles of the requests profiled on demand, the latest first')
+async def get_profiles() -> List[ProfileSummary]:
+    """Return the profiles kept of the requests sent with X-Profile: 1"""
+    return profiler.summaries()
+
+
+@admin_router.get('/profiles/routes',
+                  response_class=PlainTextResponse,
+                  response_description='Folded stacks of the continuous profile')
+async def get_routes_profile(route: Optional[str] = None) -> str:
+    """
+    Return the continuous profile of a route ('GET /users/{user_id}'),
+    or of every route with the route as root frame, as folded stacks
+    """
+    return folded(profiler.route_stacks(route))
+
+
+@admin_router.get('/profiles/{profile_id}',
+                  response_class=PlainTextResponse,
+                  response_description='Folded stacks of the request')
+async def get_profile(profile_id: str) -> str:
+    """Return the profile of a request as folded stacks, for flamegraph.pl or speedscope"""
+    profile = profiler.profile(profile_id)
+    if profile is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Profile not found"
+        )
+    return folded(profile.stacks)
+
+
+@admin_router.delete('/profiles',
+                     status_code=status.HTTP_200_OK)
+async def clear_profiles() -> dict:
+    """Forget the request profiles and the continuous profile"""
+    profiler.clear()
+    return {"message": "Profiles cleared"}
@@ -1,15 +1,22 @@
 #!/usr/bin/env python3
 """ Defining Routes for the comment class """
 
-from fastapi import APIRouter, status, HTTPException, Depends
-from app.api.dependencies import get_current_user
+import asyncio
+from fastapi import APIRouter, status, HTTPException, Depends, Header
+from fastapi.responses import StreamingResponse
+from app.api.dependencies import get_current_user, secondary_reads
+from app.core.config import CONFIG
 from app.models.comment import Comment, CommentCreateRequest, UpdateCommentRequest, CommentResponse
 from app.models.post import Post
 from app.models.user import User
-from typing import List
+from app.utils.comment_streams import comment_streams
+from app.utils.live import post_events
+from app.utils.notifications import notifications
+from app.api.tracing import TracedRoute
+from typing import AsyncIterator, List, Optional
 
 
-comment_router = APIRouter()
+comment_router = APIRouter(route_class=TracedRoute)
 
 
 @comment_router.post('/',
@@ -41,13 +48,16 @@ async def create_comment(
     await comment.create()
 
     await post.add_comment(comment)
+    notifications.notify(post.user_id, 'comment', user.id, user.username, post_id=post.id)
+    post_events.emit('comment', comment.model_dump(by_alias=True))
 
     return CommentResponse(**comment.model_dump(by_alias=True))
 
 
 @comment_router.get('/post/{post_id}',
                     status_code=status.HTTP_200_OK,
-                    response_description='Get all comments of a post')
+                    response_description='Get all comments of a post',
+                    dependencies=[Depends(secondary_reads)])
 async def get_all_comments_of_post(
         post_id: str,
         current_user: User = Depends(get_current_user)) -> List[CommentResponse]:
@@ -67,6 +77,53 @@ async def get_all_comments_of_post(
     return [CommentResponse(**comment.model_dump(by_alias=True)) for comment in comments]
 
 
+async def _comment_events(post_id: str, last_event_id: Optional[str]) -> AsyncIterator[str]:
+    """The frames of the stream: the page of comments, then the new events and the keepalives"""
+    broadcaster, viewer, frames = await comment_streams.open(post_id, last_event_id)
+    try:
+        yield f"retry: 3000\n\n{''.join(frames)}"
+        while True:
+            try:
+                messages = await asyncio.wait_for(viewer.get(), CONFIG.sse_keepalive_seconds)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if viewer.dropped:
+                # too slow: the whole page instead of the events missed
+                viewer.dropped = 0
+                yield broadcaster.reset_frame()
+            else:
+                yield ''.join(messages)
+    finally:
+        comment_streams.close(broadcaster, viewer)
+
+
+@comment_router.get('/post/{post_id}/stream',
+                    status_code=status.HTTP_200_OK,
+                    response_description='Stream the comments of a post')
+async def stream_comments_of_post(
+        post_id: str,
+        last_event_id: Optional[str] = Header(None, alias='Last-Event-ID'),
+        current_user: User = Depends(get_current_user)) -> StreamingResponse:
+    """
+    Stream the comments of a post as Server-Sent Events: the latest comments
+    first, then the `comment`, `comment_updated` and `comment_deleted` events.
+    Reconnecting with Last-Event-ID resumes after that comment.
+    """
+
+    # the post of a stream already open was found by its first viewer
+    if not comment_streams.watched(post_id) and not await Post.get(post_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail='Post not found'
+        )
+
+    return StreamingResponse(
+        _comment_events(post_id, last_event_id),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @comment_router.put('/{comment_id}',
                     status_code=status.HTTP_200_OK,
                     response_description='Update a comment by ID')
@@ -87,6 +144,7 @@ async def update_comment(
     comment_data = update_comment.model_dump(exclude_unset=True)
     comment.update_timestamps()
     await comment.set(comment_data)
+    post_events.emit('comment_updated', comment.model_dump(by_alias=True))
     return CommentResponse(**comment.model_dump(by_alias=True))
 
 
@@ -114,6 +172,7 @@ async def delete_comment(
         )
     await comment.delete()
     await post.remove_comment(comment)
+    post_events.emit('comment_deleted', comment.model_dump(by_alias=True))
     return {"message": "Comment deleted successfully"}
 
 
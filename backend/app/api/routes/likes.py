@@ -2,13 +2,16 @@
 """ Defining Routes for the like class """
 
 from fastapi import APIRouter, HTTPException, status, Depends
-from app.api.dependencies import get_current_user
+from app.api.dependencies import get_current_user, secondary_reads
 from app.models.like import Like, LikeCreateRequest, LikeResponse
 from app.models.post import Post
 from app.models.user import User
+from app.utils.live import post_events
+from app.utils.notifications import notifications
+from app.api.tracing import TracedRoute
 from typing import List
 
-like_router = APIRouter()
+like_router = APIRouter(route_class=TracedRoute)
 
 
 @like_router.post('/',
@@ -47,6 +50,8 @@ async def like_post(
     await like.create()
 
     await post.add_like(like)
+    notifications.notify(post.user_id, 'like', user.id, user.username, post_id=post.id)
+    post_events.emit('like', like.model_dump(by_alias=True))
 
     return LikeResponse(**like.model_dump(by_alias=True))
 
@@ -77,13 +82,15 @@ async def unlike_post(
 
     await like.delete()
     await post.remove_like(like)
+    post_events.emit('unlike', like.model_dump(by_alias=True))
 
     return {"message": "Like deleted successfully"}
 
 
 @like_router.get('/post/{post_id}',
                  status_code=status.HTTP_200_OK,
-                 response_description='Get all likes of a post')
+                 response_description='Get all likes of a post',
+                 dependencies=[Depends(secondary_reads)])
 async def get_all_likes_of_post(
         post_id: str,
         current_user: User = Depends(get_current_user)) -> List[LikeResponse]:
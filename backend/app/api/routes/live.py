@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+""" Defining the WebSocket of the live events of the posts """
+
+import asyncio
+import json
+from typing import Optional
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, status
+from fastapi.security.utils import get_authorization_scheme_param
+from app.api.dependencies import get_current_user
+from app.core.config import CONFIG
+from app.core.metrics import REGISTRY
+from app.core.pubsub import Subscriber
+from app.utils.live import post_events
+
+live_router = APIRouter()
+
+LIVE_CONNECTIONS = REGISTRY.gauge("live_connections", "Number of open live connections")
+
+
+async def _send_events(websocket: WebSocket, subscriber: Subscriber) -> None:
+    """Send the events as they come, telling the client how many were dropped while it was slow"""
+    while True:
+        messages = await subscriber.get()
+        if subscriber.dropped:
+            dropped, subscriber.dropped = subscriber.dropped, 0
+            await websocket.send_text(json.dumps({'type': 'dropped', 'count': dropped}))
+        for message in messages:
+            await websocket.send_text(message)
+
+
+async def _receive_commands(websocket: WebSocket, subscriber: Subscriber) -> None:
+    """Subscribe and unsubscribe as the client asks, until it disconnects"""
+    broker = post_events.broker
+    while True:
+        text = await websocket.receive_text()
+        try:
+            command = json.loads(text)
+            subscribe = [str(post_id) for post_id in command.get('subscribe', [])]
+            unsubscribe = [str(post_id) for post_id in command.get('unsubscribe', [])]
+        except (AttributeError, TypeError, ValueError):
+            subscriber.put(json.dumps({'type': 'error', 'detail': 'Invalid command'}))
+            continue
+        broker.unsubscribe(subscriber, unsubscribe)
+        if len(subscriber.topics | set(subscribe)) > CONFIG.live_max_subscriptions:
+            subscriber.put(json.dumps({'type': 'error', 'detail': 'Too many subscriptions'}))
+        else:
+            broker.subscribe(subscriber, subscribe)
+        subscriber.put(json.dumps({'type': 'subscribed', 'post_ids': sorted(subscriber.topics)}))
+
+
+@live_router.websocket('/posts')
+async def live_posts(websocket: WebSocket, token: Optional[str] = None):
+    """
+    The live likes and comments of posts. Authenticated by the token in the Authorization
+    header, or the token query parameter for the browsers. The client sends
+    {"subscribe": [post ids]} and {"unsubscribe": [post ids]}, and receives the events
+    {"type": "like" | "unlike" | "comment" | "comment_updated" | "comment_deleted", "post_id", "data"}
+    of the posts subscribed to.
+    """
+    if token is None:
+        scheme, token = get_authorization_scheme_param(websocket.headers.get('Authorization'))
+    try:
+        if not token:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+        await get_current_user(token)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+
+    subscriber = Subscriber(CONFIG.live_queue_size)
+    LIVE_CONNECTIONS.inc()
+    receiver = asyncio.ensure_future(_receive_commands(websocket, subscriber))
+    sender = asyncio.ensure_future(_send_events(websocket, subscriber))
+    try:
+        # the first one to end, the client disconnecting or a send failing, ends the other
+        done, pending = await asyncio.wait((receiver, sender), return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for task in done:
+            task.result()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        sender.cancel()
+        post_events.broker.unsubscribe(subscriber)
+        LIVE_CONNECTIONS.dec()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+""" Defining Routes for the uploaded media """
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from fastapi.responses import StreamingResponse
+from app.api.dependencies import get_current_user
+from app.models.engine import media_storage
+from app.models.engine.media_storage import MediaTooLarge
+from app.models.media import MediaFile
+from app.models.user import User
+from app.core.config import CONFIG
+from app.utils.http import RangeNotSatisfiable, http_date, not_modified, parse_range
+from app.api.tracing import TracedRoute
+
+media_router = APIRouter(route_class=TracedRoute)
+
+# the files never change once uploaded
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+@media_router.post('/',
+                   status_code=status.HTTP_201_CREATED,
+                   response_description='Upload a media file')
+async def upload_media(
+        request: Request,
+        filename: str = 'upload',
+        current_user: User = Depends(get_current_user)) -> MediaFile:
+    """
+    Upload a media file, sent as the raw body of the request with its Content-Type.
+    The body is streamed to the media store, set the returned url as the media_url of a post.
+    A content already stored is not stored again, its file is returned once the body is hashed.
+    """
+    content_type = request.headers.get('content-type') or 'application/octet-stream'
+    if content_type.startswith('multipart/'):
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail='Send the file as the body of the request, with its own Content-Type'
+        )
+    too_large = HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f'Media larger than {CONFIG.media_max_bytes} bytes'
+    )
+    try:
+        content_length = int(request.headers.get('content-length') or 0)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Invalid Content-Length'
+        )
+    if content_length > CONFIG.media_max_bytes:
+        raise too_large
+
+    try:
+        return await media_storage.media_store.save(
+            request.stream(), filename, content_type,
+            user_id=current_user.id, max_bytes=CONFIG.media_max_bytes)
+    except MediaTooLarge:
+        raise too_large
+
+
+@media_router.get('/{media_id}',
+                  response_description='Get a media file, or a range of its bytes')
+async def get_media(media_id: str, request: Request) -> Response:
+    """
+    Stream a media file. Supports the Range (a single range of bytes, with If-Range)
+    and the conditional (If-None-Match, If-Modified-Since) requests.
+    """
+    store = media_storage.media_store
+    media = await store.info(media_id)
+    if not media:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail='Media not found'
+        )
+
+    etag = f'"{media.sha256 or media.id}"'
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(media.uploaded_at),
+        'Cache-Control': CACHE_CONTROL,
+        'Accept-Ranges': 'bytes',
+    }
+    if not_modified(request.headers, etag, media.uploaded_at):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    try:
+        byte_range = parse_range(request.headers, media.length, etag, media.uploaded_at)
+    except RangeNotSatisfiable:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail='Range not satisfiable',
+            headers={'Content-Range': f'bytes */{media.length}'}
+        )
+
+    if byte_range is None:
+        start, end, status_code = 0, media.length - 1, status.HTTP_200_OK
+    else:
+        (start, end), status_code = byte_range, status.HTTP_206_PARTIAL_CONTENT
+        headers['Content-Range'] = f'bytes {start}-{end}/{media.length}'
+    headers['Content-Length'] = str(end - start + 1)
+    return StreamingResponse(store.read(media.id, start, end), status_code=status_code, media_type=media.content_type, headers=headers)
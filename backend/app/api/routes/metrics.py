@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+""" Defining the route exposing the metrics """
+
+from fastapi import APIRouter, Response
+from app.core.metrics import REGISTRY
+from app.api.tracing import TracedRoute
+
+metrics_router = APIRouter(route_class=TracedRoute)
+
+# content type of the Prometheus text format
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@metrics_router.get('/metrics',
+                    response_description='Metrics in the Prometheus text format')
+async def get_metrics() -> Response:
+    """
+    Return the metrics of the server, to be scraped by Prometheus
+    """
+    return Response(content=REGISTRY.render(), media_type=PROMETHEUS_CONTENT_TYPE)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+""" Defining Routes for the notifications """
+
+import base64
+from datetime import datetime
+from typing import Optional, Tuple
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, status
+from app.api.dependencies import get_current_user, secondary_reads
+from app.models.notification import Notification, NotificationPage, NotificationReadRequest, NotificationResponse
+from app.models.user import User
+from app.api.tracing import TracedRoute
+
+notification_router = APIRouter(route_class=TracedRoute)
+
+
+def encode_cursor(notification: Notification) -> str:
+    """The opaque cursor of the page after a notification"""
+    return base64.urlsafe_b64encode(f"{notification.updated_at.isoformat()}|{notification.id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """The time and id of the last notification of the previous page, ValueError if invalid"""
+    try:
+        updated_at, notification_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(updated_at), notification_id
+    except (TypeError, UnicodeDecodeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+@notification_router.get('',
+                         status_code=status.HTTP_200_OK,
+                         response_description='Get the notifications of the current user',
+                         dependencies=[Depends(secondary_reads)])
+async def get_notifications(
+        limit: int = Query(20, ge=1, le=50),
+        cursor: Optional[str] = None,
+        unread: bool = False,
+        current_user: User = Depends(get_current_user)) -> NotificationPage:
+    """
+    The notifications of the current user, the most recent first, with the number of unread ones;
+    only the unread ones with unread=true. Pass the next_cursor of a page as the cursor of the next one.
+    """
+    query = {'user_id': current_user.id}
+    if unread:
+        query['read'] = False
+    if cursor:
+        try:
+            updated_at, notification_id = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail='Invalid cursor'
+            )
+        query['$or'] = [{'updated_at': {'$lt': updated_at}},
+                        {'updated_at': updated_at, '_id': {'$lt': notification_id}}]
+
+    found = await Notification.find(query).sort(
+        -Notification.updated_at, -Notification.id).limit(limit + 1).to_list()
+    page, more = found[:limit], len(found) > limit
+    unread_count = await Notification.find(
+        Notification.user_id == current_user.id, Notification.read == False).count()  # noqa: E712
+    return NotificationPage(
+        results=[NotificationResponse(**notification.model_dump(by_alias=True)) for notification in page],
+        unread_count=unread_count,
+        next_cursor=encode_cursor(page[-1]) if more else None)
+
+
+@notification_router.post('/read',
+                          status_code=status.HTTP_200_OK,
+                          response_description='Mark notifications as read')
+async def read_notifications(
+        read: NotificationReadRequest = Body(NotificationReadRequest()),
+        current_user: User = Depends(get_current_user)) -> dict:
+    """Mark the notifications of the ids as read, all of them without ids; return the number left unread"""
+    query = {'user_id': current_user.id, 'read': False}
+    if read.ids is not None:
+        query['_id'] = {'$in': read.ids}
+    await Notification.find(query).update({'$set': {'read': True}})
+    unread_count = await Notification.find(
+        Notification.user_id == current_user.id, Notification.read == False).count()  # noqa: E712
+    return {"unread_count": unread_count}
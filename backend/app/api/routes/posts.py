@@ -1,15 +1,32 @@
 #!/usr/bin/env python3
 """ Defining Routes for the post class """
 
-from fastapi import APIRouter, HTTPException, status, Depends
-from app.api.dependencies import get_current_user
+from fastapi import APIRouter, HTTPException, Query, status, Depends
+from app.api.dependencies import get_current_user, secondary_reads
 from app.models.comment import Comment
 from app.models.like import Like
+from app.models.engine import media_storage
+from app.models.media import media_id_from_url
 from app.models.post import Post, PostCreateRequest, PostResponse, UpdatePostRequest
 from app.models.user import User
-from typing import List
+from app.utils.images import image_variants
+from app.utils.search import post_index, remove_post
+from app.utils.trending import extract_hashtags, trending_tags
+from app.utils.views import view_counters
+from app.api.tracing import TracedRoute
+from typing import List, Optional
 
-post_router = APIRouter()
+post_router = APIRouter(route_class=TracedRoute)
+
+
+async def check_media(media_url: Optional[str]) -> None:
+    """A media url pointing at an uploaded media must point at an existing one"""
+    media_id = media_id_from_url(media_url)
+    if media_id and not await media_storage.media_store.info(media_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Media not found'
+        )
 
 
 @post_router.post('/',
@@ -28,27 +45,35 @@ async def create_post(
             status_code=status.HTTP_404_NOT_FOUND,
             detail='User not found'
         )
+    await check_media(post_create.media_url)
     post_data = post_create.model_dump(exclude_unset=True)
+    post_data['hashtags'] = extract_hashtags(post_data.get('content'))
     post = Post(**post_data)
     await post.create()
+    await media_storage.retain(post.media_urls())
 
     await user.add_post(post)
+    post_index.add(post.id, post.content)
+    trending_tags.add(post.hashtags)
+    image_variants.schedule(post)
 
     return PostResponse(**post.model_dump(by_alias=True))
 
 
 @post_router.get('/',
                  status_code=status.HTTP_200_OK,
-                 response_description='Get All Post')
+                 response_description='Get All Post',
+                 dependencies=[Depends(secondary_reads)])
 async def get_all_posts() -> List[PostResponse]:
     """Get all posts; !! will be removed"""
     posts = await Post.find().to_list()
-    return [PostResponse(**post.model_dump(by_alias=True)) for post in posts]
+    return [view_counters.response(post) for post in posts]
 
 
 @post_router.get('/user/{user_id}',
                  status_code=status.HTTP_200_OK,
-                 response_description='Get all posts of a user')
+                 response_description='Get all posts of a user',
+                 dependencies=[Depends(secondary_reads)])
 async def get_all_posts_of_user(
         user_id: str,
         current_user: User = Depends(get_current_user)) -> List[PostResponse]:
@@ -60,12 +85,31 @@ async def get_all_posts_of_user(
             detail='User not found'
         )
     posts = user.posts
-    return [PostResponse(**post.model_dump(by_alias=True)) for post in posts]
+    view_counters.impressions(post.id for post in posts)
+    return [view_counters.response(post) for post in posts]
+
+
+@post_router.get('/tag/{tag}',
+                 status_code=status.HTTP_200_OK,
+                 response_description='Get the posts of a hashtag',
+                 dependencies=[Depends(secondary_reads)])
+async def get_posts_of_hashtag(
+        tag: str,
+        limit: int = Query(20, ge=1, le=100),
+        current_user: User = Depends(get_current_user)) -> List[PostResponse]:
+    """Get the most recent posts of a hashtag, the tag without the #"""
+    hashtags = extract_hashtags(f"#{tag}")
+    if not hashtags:
+        return []
+    posts = await Post.find(Post.hashtags == hashtags[0]).sort(-Post.created_at).limit(limit).to_list()
+    view_counters.impressions(post.id for post in posts)
+    return [view_counters.response(post) for post in posts]
 
 
 @post_router.get('/{post_id}',
                  status_code=status.HTTP_200_OK,
-                 response_description='Get Post By Id')
+                 response_description='Get Post By Id',
+                 dependencies=[Depends(secondary_reads)])
 async def get_post_by_id(
         post_id: str,
         current_user: User = Depends(get_current_user)) -> PostResponse:
@@ -76,7 +120,8 @@ async def get_post_by_id(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Post not found!"
         )
-    return PostResponse(**post.model_dump(by_alias=True))
+    view_counters.view(post.id)
+    return view_counters.response(post)
 
 
 @post_router.put('/{post_id}',
@@ -95,9 +140,26 @@ async def update_post(
             detail='Post not found'
         )
     post_date = updated_post.model_dump(exclude_unset=True)
+    media_changed = 'media_url' in post_date and post_date['media_url'] != post.media_url
+    if media_changed:
+        await check_media(post_date['media_url'])
+        previous_media = post.media_urls()
+        # the variants of the previous image
+        post_date['media_variants'] = None
+    if 'content' in post_date:
+        previous_hashtags = set(post.hashtags)
+        post_date['hashtags'] = extract_hashtags(post_date['content'])
     post.update_timestamps()
     await post.set(post_date)
-    return PostResponse(**post.model_dump(by_alias=True))
+    if 'content' in post_date:
+        post_index.add(post.id, post.content)
+        # only the hashtags added are new uses
+        trending_tags.add([tag for tag in post.hashtags if tag not in previous_hashtags])
+    if media_changed:
+        await media_storage.retain(post.media_urls())
+        await media_storage.release(previous_media)
+        image_variants.schedule(post)
+    return view_counters.response(post)
 
 
 @post_router.delete('/{post_id}',
@@ -117,6 +179,8 @@ async def delete_post_by_id(
     await Like.find(Like.post_id == post.id).delete()
     await Comment.find(Comment.post_id == post.id).delete()
     await post.delete()
+    await remove_post(post.id)
+    await media_storage.release(post.media_urls())
     await current_user.remove_post(post)
     return {"message": "Post deleted successfully"}
 
@@ -134,6 +198,8 @@ async def delete_all_post():
         # Delete each post
         for post in posts:
             await post.delete()
+            await remove_post(post.id)
+            await media_storage.release(post.media_urls())
 
         return {"message": "All posts deleted successfully"}
     except Exception as e:
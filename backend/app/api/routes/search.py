@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+""" Defining Routes for the search """
+
+from beanie.operators import In
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from app.api.dependencies import get_current_user, secondary_reads
+from app.models.post import Post, PostSearchResponse
+from app.models.user import User, UserSummary
+from app.utils.search import decode_cursor, encode_cursor, post_index, user_index
+from app.utils.views import view_counters
+from app.api.tracing import TracedRoute
+from typing import List, Optional
+
+search_router = APIRouter(route_class=TracedRoute)
+
+
+@search_router.get('/posts',
+                   status_code=status.HTTP_200_OK,
+                   response_description='Search the posts by content',
+                   dependencies=[Depends(secondary_reads)])
+async def search_posts(
+        q: str = Query(..., min_length=1, max_length=200),
+        limit: int = Query(20, ge=1, le=50),
+        cursor: Optional[str] = None,
+        current_user: User = Depends(get_current_user)) -> PostSearchResponse:
+    """
+    Search the posts by the words of their content, the most relevant first (BM25).
+    Pass the next_cursor of a page as the cursor of the next one.
+    """
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Invalid cursor'
+        )
+
+    hits = post_index.search(q, limit + 1, after)
+    page, more = hits[:limit], len(hits) > limit
+    posts = await Post.find(In(Post.id, [post_id for _, _, post_id in page])).to_list()
+    by_id = {post.id: post for post in posts}
+    # the posts deleted by another worker meanwhile are left out
+    shown = [by_id[post_id] for _, _, post_id in page if post_id in by_id]
+    view_counters.impressions(post.id for post in shown)
+    results = [view_counters.response(post) for post in shown]
+    next_cursor = encode_cursor(page[-1][0], page[-1][1]) if more else None
+    return PostSearchResponse(results=results, next_cursor=next_cursor)
+
+
+@search_router.get('/users',
+                   status_code=status.HTTP_200_OK,
+                   response_description='Search the users by the beginning of their names',
+                   dependencies=[Depends(secondary_reads)])
+async def search_users(
+        q: str = Query(..., min_length=1, max_length=100),
+        limit: int = Query(10, ge=1, le=20),
+        current_user: User = Depends(get_current_user)) -> List[UserSummary]:
+    """
+    The users whose username or full name, or a later word of them, starts with
+    the text typed, ignoring case and accents; the shortest names first.
+    """
+    user_ids = user_index.search(q, limit)
+    users = await User.find(In(User.id, user_ids)).project(UserSummary).to_list()
+    by_id = {user.id: user for user in users}
+    # the users deleted by another worker meanwhile are left out
+    return [by_id[user_id] for user_id in user_ids if user_id in by_id]
@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+""" Defining Routes for the trending hashtags """
+
+from typing import List
+from fastapi import APIRouter, Query, status
+from app.models.post import TrendingTag
+from app.utils.trending import trending_tags
+from app.api.tracing import TracedRoute
+
+trending_router = APIRouter(route_class=TracedRoute)
+
+
+@trending_router.get('',
+                     status_code=status.HTTP_200_OK,
+                     response_description='The trending hashtags')
+async def get_trending(limit: int = Query(10, ge=1, le=100)) -> List[TrendingTag]:
+    """
+    The hashtags used the most in the posts of the last TRENDING_WINDOW_SECONDS,
+    with their estimated counts; counted in memory, without a query.
+    """
+    return [TrendingTag(tag=tag, count=count) for tag, count in trending_tags.trending(limit)]
@@ -3,18 +3,26 @@
 
 from typing import List
 from beanie import DeleteRules
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, Query, status, Depends
 from app.models.comment import Comment
 from app.models.like import Like
-from app.models.user import User, UserResponse, UpdateUserRequest
-from app.api.dependencies import get_current_user
+from app.models.notification import Notification
+from app.models.suggestion import SuggestedUser, Suggestions
+from app.models.engine import media_storage
+from app.models.user import Relationship, User, UserResponse, UpdateUserRequest
+from app.api.dependencies import get_current_user, secondary_reads
 from app.utils.auth import hash_password
+from app.utils.follow_graph import follow_graph
+from app.utils.notifications import notifications
+from app.utils.search import remove_user, user_index
+from app.api.tracing import TracedRoute
 
-user_router = APIRouter()
+user_router = APIRouter(route_class=TracedRoute)
 
 
 @user_router.get('/',
-                 response_model=List[UserResponse])
+                 response_model=List[UserResponse],
+                 dependencies=[Depends(secondary_reads)])
 async def get_all_users(
         current_user: User = Depends(get_current_user)) -> List[UserResponse]:
     """Get all users"""
@@ -23,8 +31,28 @@ async def get_all_users(
     return [UserResponse(**user.model_dump(by_alias=True)) for user in users]
 
 
+@user_router.get('/suggestions',
+                 response_description='Users suggested to follow',
+                 dependencies=[Depends(secondary_reads)])
+async def get_suggestions(
+        limit: int = Query(10, ge=1, le=50),
+        current_user: User = Depends(get_current_user)) -> List[SuggestedUser]:
+    """
+    The users followed by the most of the accounts the current user follows,
+    precomputed every SUGGESTIONS_REFRESH_SECONDS; without the ones followed since.
+    """
+
+    suggestions = await Suggestions.get(current_user.id)
+    if not suggestions:
+        return []
+    following = {getattr(link, 'ref', link).id for link in current_user.following}
+    users = [user for user in suggestions.users if user.id not in following and user.id != current_user.id]
+    return users[:limit]
+
+
 @user_router.get('/{user_id}',
-                 response_model=UserResponse)
+                 response_model=UserResponse,
+                 dependencies=[Depends(secondary_reads)])
 async def get_user(
         user_id: str,
         current_user: User = Depends(get_current_user)) -> UserResponse:
@@ -56,6 +84,8 @@ async def update_user(
 
     user.update_timestamps()
     await user.set(user_data)
+    if 'username' in user_data or 'full_name' in user_data:
+        user_index.add(user.id, user.username, user.full_name)
 
     return UserResponse(**user.model_dump(by_alias=True))
 
@@ -76,13 +106,16 @@ async def follow_user(friend_id: str, current_user: User = Depends(get_current_u
 
     await current_user.save()
     await friend.save()
+    follow_graph.follow(current_user.id, friend.id)
+    notifications.notify(friend.id, 'follow', current_user.id, current_user.username)
 
     return {"message": "follow successfully"}
 
 
 @user_router.get('/{user_id}/followers',
                  status_code=status.HTTP_200_OK,
-                 response_description='List followers')
+                 response_description='List followers',
+                 dependencies=[Depends(secondary_reads)])
 async def get_followers(
         user_id: str,
         current_user: User = Depends(get_current_user)) -> List[UserResponse]:
@@ -99,7 +132,8 @@ async def get_followers(
 
 @user_router.get('/{user_id}/following',
                  status_code=status.HTTP_200_OK,
-                 response_description='List following')
+                 response_description='List following',
+                 dependencies=[Depends(secondary_reads)])
 async def get_following(
         user_id: str,
         current_user: User = Depends(get_current_user)) -> List[UserResponse]:
@@ -114,6 +148,29 @@ async def get_following(
     return user.following
 
 
+@user_router.get('/{user_id}/relationship',
+                 status_code=status.HTTP_200_OK,
+                 response_description='Relationship with a user')
+async def get_relationship(
+        user_id: str,
+        current_user: User = Depends(get_current_user)) -> Relationship:
+    """
+    Whether the current user and the user follow each other, and their
+    follower counts; answered by the follow index, once the user is found
+    """
+
+    if not await User.find(User.id == user_id).count():
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail='User not found')
+    index = follow_graph.index
+    return Relationship(
+        following=index.follows(current_user.id, user_id),
+        followed_by=index.follows(user_id, current_user.id),
+        followers_count=index.followers_count(user_id),
+        following_count=index.following_count(user_id),
+        known_followers_count=len(index.known_followers(current_user.id, user_id)))
+
+
 @user_router.delete('/unfollow/{friend_id}',
                     status_code=status.HTTP_200_OK,
                     response_description='Unfollow user')
@@ -135,6 +192,7 @@ async def unfollow_user(
 
     await current_user.save()
     await friend.save()
+    follow_graph.unfollow(current_user.id, friend.id)
 
     return {"message": "Unfollowed successfully"}
 
@@ -154,9 +212,14 @@ async def delete_user(user_id: str, current_user: User = Depends(get_current_use
         await Comment.find(Comment.post_id == post.id).delete()
         await Like.find(Like.post_id == post.id).delete()
         await post.delete()
+        await media_storage.release(post.media_urls())
         await user.remove_post(post)
+    await Notification.find(Notification.user_id == user.id).delete()
+    await Suggestions.find(Suggestions.id == user.id).delete()
     # Delete the user
     await user.delete()
+    await remove_user(user.id, [post.id for post in posts])
+    follow_graph.remove_user(user.id)
     return {"message": "user deleted successfully"}
 
 
@@ -173,6 +236,8 @@ async def delete_all_users():
         # Delete each users
         for user in users:
             await user.delete()
+            await remove_user(user.id)
+            follow_graph.remove_user(user.id)
 
         return {"message": "All users deleted successfully"}
     except Exception as e:
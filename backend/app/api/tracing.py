@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Tracing middleware: a trace per sampled request.
+
+The root span is named after the route template (`GET /posts/{post_id}`),
+its children are the dependencies (with the authentication), the endpoint
+function, each database command, the password hashing and the serialization
+of the response. The trace id is returned in the `traceparent` header, and
+a `traceparent` header sent by the caller is continued.
+
+The routers use `TracedRoute`, whose routes open the span of their
+dependencies with a first dependency of their own, and run the endpoint
+function in its span, the span of the serialization following it.
+"""
+
+import asyncio
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Optional
+from fastapi import Depends
+from fastapi.dependencies.utils import get_parameterless_sub_dependant
+from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
+from app.api.metrics import route_template
+from app.core.tracing import SPAN_KIND_SERVER, current_span, tracer
+
+
+class TracingMiddleware:
+    """Trace the sampled HTTP requests"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        traceparent = None
+        for name, value in scope.get("headers", ()):
+            if name == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+        if not tracer.sample_rate:
+            await self.app(scope, receive, send)
+            return
+
+        with tracer.start_trace(scope["method"], kind=SPAN_KIND_SERVER, traceparent=traceparent) as root:
+            if root is None:
+                await self.app(scope, receive, send)
+                return
+
+            async def send_traced(message):
+                if message["type"] == "http.response.start":
+                    root.attributes["http.status_code"] = message["status"]
+                    header = f"00-{root.trace.trace_id}-{root.span_id}-01".encode()
+                    message = {**message, "headers": [*message.get("headers", ()), (b"traceparent", header)]}
+                await send(message)
+
+            root.attributes["http.method"] = scope["method"]
+            root.attributes["url.path"] = scope["path"]
+            try:
+                await self.app(scope, receive, send_traced)
+            finally:
+                route = route_template(scope)
+                root.name = f"{scope['method']} {route}"
+                root.attributes["http.route"] = route
+
+
+class _RouteStep:
+    """The span of the step of a route running, its dependencies then its serialization"""
+
+    __slots__ = ('_span',)
+
+    def __init__(self):
+        self._span = None
+
+    def start(self, name: str) -> None:
+        self.end()
+        self._span = tracer.span(name)
+        self._span.__enter__()
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        span, self._span = self._span, None
+        if span is not None:
+            span.__exit__(type(error) if error else None, error, error.__traceback__ if error else None)
+
+
+_route_step: ContextVar[Optional[_RouteStep]] = ContextVar('route_step', default=None)
+
+
+async def _start_dependencies() -> None:
+    """The first dependency of a traced route, starting the span of the others"""
+    step = _route_step.get()
+    if step is not None:
+        step.start("dependencies")
+
+
+def _traced_endpoint(endpoint: Callable) -> Callable:
+    """The endpoint function run in its span, ending the one of the dependencies"""
+    name = f"handler {endpoint.__name__}"
+    is_coroutine = asyncio.iscoroutinefunction(endpoint)
+
+    @wraps(endpoint)
+    async def traced(**values):
+        step = _route_step.get()
+        if step is None:
+            return await endpoint(**values) if is_coroutine else await run_in_threadpool(endpoint, **values)
+        step.end()
+        with tracer.span(name):
+            result = await endpoint(**values) if is_coroutine else await run_in_threadpool(endpoint, **values)
+        step.start("serialize")
+        return result
+    return traced
+
+
+class TracedRoute(APIRoute):
+    """A route tracing its dependencies, its endpoint function and the serialization of its response"""
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        super().__init__(path, endpoint, **kwargs)
+        self.dependant.dependencies.insert(0, get_parameterless_sub_dependant(
+            depends=Depends(_start_dependencies, use_cache=False), path=self.path_format))
+
+    def get_route_handler(self) -> Callable:
+        self.dependant.call = _traced_endpoint(self.endpoint)
+        handler = super().get_route_handler()
+
+        async def traced_handler(request):
+            if current_span() is None:
+                return await handler(request)
+            step = _RouteStep()
+            token = _route_step.set(step)
+            try:
+                return await handler(request)
+            except BaseException as e:
+                step.end(e)
+                raise
+            finally:
+                step.end()
+                _route_step.reset(token)
+        return traced_handler
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Admission control: how many requests of each class of route run at once.
+
+The routes are split in classes, by priority:
+    - auth: the token refresh, /auth/me and the logout, cheap and needed
+      by every client to keep going;
+    - read: the other GET routes;
+    - write: the other routes (login and register hash passwords);
+    - heavy: the cascade deletes, the delete-all routes and the media uploads.
+
+Each class runs at most `limit` requests at once, and all the classes
+together at most ADMISSION_MAX_CONCURRENCY. A request over the limits waits
+in the queue of its class, at most `queue` of them and `wait_ms` each, then
+it is rejected. When a request ends, the waiting requests of the classes of
+higher priority are let in first. A class is also rejected outright while
+the event loop lag is over its `max_lag_ms`: the heavy routes are shed
+first, the auth ones last.
+
+The classes are configured in the ADMISSION_CLASSES environment variable,
+as JSON overriding the defaults: `{"heavy": {"limit": 2, "wait_ms": 200}}`.
+"""
+
+import json
+import math
+from collections import deque
+from typing import Dict, Optional
+import anyio
+from pydantic import BaseModel
+from app.core.config import CONFIG
+from app.core.loop_monitor import loop_monitor
+from app.core.metrics import REGISTRY
+
+
+AUTH, READ, WRITE, HEAVY = 'auth', 'read', 'write', 'heavy'
+
+# routes whose class is not the one of their method, by method and route template
+ROUTE_CLASSES = {
+    ('POST', '/auth/refresh-token'): AUTH,
+    ('GET', '/auth/me'): AUTH,
+    ('POST', '/auth/logout'): AUTH,
+    ('DELETE', '/users/{user_id}'): HEAVY,
+    ('DELETE', '/posts/{post_id}'): HEAVY,
+    ('DELETE', '/users/'): HEAVY,
+    ('DELETE', '/posts/'): HEAVY,
+    ('DELETE', '/comments/'): HEAVY,
+    ('POST', '/media/'): HEAVY,
+}
+
+# routes never limited, to watch the server while it is overloaded
+EXEMPT_PREFIXES = ('/admin/', '/metrics')
+# the streams, open as long as their clients watch, and the media downloads, as
+# long as their clients read, which would hold a slot each
+EXEMPT_ROUTES = {
+    ('GET', '/comments/post/{post_id}/stream'),
+    ('GET', '/media/{media_id}'),
+}
+
+# reasons of the rejections
+QUEUE_FULL, TIMEOUT, LOOP_LAG = 'queue_full', 'timeout', 'loop_lag'
+
+ADMITTED = REGISTRY.counter(
+    "admission_admitted_total", "Number of requests admitted, by route class", ("class",))
+SHED = REGISTRY.counter(
+    "admission_shed_total", "Number of requests rejected with a 503, by route class and reason",
+    ("class", "reason"))
+ACTIVE = REGISTRY.gauge(
+    "admission_active", "Number of requests running, by route class", ("class",))
+QUEUED = REGISTRY.gauge(
+    "admission_queued", "Number of requests waiting to run, by route class", ("class",))
+
+
+class RouteClass(BaseModel):
+    """
+    Limits of a class of routes.
+
+    Attributes:
+        name (str): Name of the class.
+        priority (int): Order in which the waiting requests are let in, lowest first.
+        limit (int): Maximum number of requests running at once.
+        queue (int): Maximum number of requests waiting.
+        wait_ms (float): Maximum time a request waits before being rejected.
+        max_lag_ms (float): Event loop lag from which the requests are rejected, 0 to never.
+        retry_after (int): Seconds the rejected clients are told to wait, in Retry-After.
+    """
+    name: str
+    priority: int
+    limit: int
+    queue: int
+    wait_ms: float
+    max_lag_ms: float = 0
+    retry_after: int = 1
+
+
+DEFAULT_CLASSES = {
+    AUTH: RouteClass(name=AUTH, priority=0, limit=64, queue=512, wait_ms=2000, max_lag_ms=1000),
+    READ: RouteClass(name=READ, priority=1, limit=64, queue=256, wait_ms=1000, max_lag_ms=500),
+    WRITE: RouteClass(name=WRITE, priority=2, limit=32, queue=128, wait_ms=1000, max_lag_ms=250),
+    HEAVY: RouteClass(name=HEAVY, priority=3, limit=4, queue=16, wait_ms=500, max_lag_ms=100,
+                      retry_after=5),
+}
+
+
+def load_classes(overrides: Optional[str] = CONFIG.admission_classes) -> Dict[str, RouteClass]:
+    """The default classes, with the limits set in ADMISSION_CLASSES"""
+    classes = {name: route_class.model_copy() for name, route_class in DEFAULT_CLASSES.items()}
+    for name, limits in json.loads(overrides or '{}').items():
+        classes[name] = classes[name].model_copy(update=limits)
+    return classes
+
+
+def route_class_name(method: str, route: str) -> Optional[str]:
+    """Class of a route, None when the route is never limited"""
+    if route == '/' or route.startswith(EXEMPT_PREFIXES) or (method, route) in EXEMPT_ROUTES:
+        return None
+    return ROUTE_CLASSES.get((method, route), READ if method in ('GET', 'HEAD') else WRITE)
+
+
+class _Waiter:
+    __slots__ = ('event', 'admitted')
+
+    def __init__(self):
+        self.event = anyio.Event()
+        self.admitted = False
+
+
+class _ClassState:
+    __slots__ = ('config', 'active', 'waiters', 'labels')
+
+    def __init__(self, config: RouteClass):
+        self.config = config
+        self.active = 0
+        self.waiters: deque = deque()
+        self.labels = (config.name,)
+
+
+class AdmissionController:
+    """
+    Lets the requests run within the limits of their class.
+
+    Attributes:
+        max_concurrency (int): Maximum number of requests running at once, all classes together.
+        active (int): Number of requests running.
+    """
+
+    def __init__(self, classes: Optional[Dict[str, RouteClass]] = None,
+                 max_concurrency: int = CONFIG.admission_max_concurrency):
+        self.max_concurrency = max_concurrency
+        self.active = 0
+        self._states = {name: _ClassState(config) for name, config in (classes or load_classes()).items()}
+        self._by_priority = sorted(self._states.values(), key=lambda state: state.config.priority)
+
+    def route_class(self, name: str) -> RouteClass:
+        return self._states[name].config
+
+    def retry_after(self, name: str) -> int:
+        """Seconds a rejected request of the class should wait"""
+        config = self._states[name].config
+        return max(config.retry_after, math.ceil(loop_monitor.lag))
+
+    async def acquire(self, name: str) -> Optional[str]:
+        """Wait for a request of the class to be let in; None once it is, else why it is rejected"""
+        state = self._states[name]
+        config = state.config
+        if config.max_lag_ms and loop_monitor.lag * 1000 >= config.max_lag_ms:
+            return self._reject(state, LOOP_LAG)
+        if state.active < config.limit and self.active < self.max_concurrency and not state.waiters:
+            self._admit(state)
+            return None
+        if len(state.waiters) >= config.queue:
+            return self._reject(state, QUEUE_FULL)
+
+        waiter = _Waiter()
+        state.waiters.append(waiter)
+        QUEUED.inc(state.labels)
+        try:
+            with anyio.move_on_after(config.wait_ms / 1000):
+                await waiter.event.wait()
+        except BaseException:
+            # cancelled right after being let in
+            if waiter.admitted:
+                self.release(name)
+            raise
+        finally:
+            if not waiter.admitted:
+                # timed out, or the request was cancelled while waiting
+                state.waiters.remove(waiter)
+                QUEUED.dec(state.labels)
+        if waiter.admitted:
+            return None
+        return self._reject(state, TIMEOUT)
+
+    def release(self, name: str) -> None:
+        """A request of the class is done, let the next waiting ones in"""
+        state = self._states[name]
+        state.active -= 1
+        self.active -= 1
+        ACTIVE.dec(state.labels)
+        self._dispatch()
+
+    def _admit(self, state: _ClassState) -> None:
+        state.active += 1
+        self.active += 1
+        ACTIVE.inc(state.labels)
+        ADMITTED.inc(state.labels)
+
+    def _reject(self, state: _ClassState, reason: str) -> str:
+        SHED.inc((state.config.name, reason))
+        return reason
+
+    def _dispatch(self) -> None:
+        for state in self._by_priority:
+            while state.waiters and self.active < self.max_concurrency:
+                if state.active >= state.config.limit:
+                    break
+                waiter = state.waiters.popleft()
+                QUEUED.dec(state.labels)
+                waiter.admitted = True
+                self._admit(state)
+                waiter.event.set()
+            if self.active >= self.max_concurrency:
+                return
@@ -4,6 +4,7 @@
 from dotenv import load_dotenv
 from os import getenv
 from pydantic import BaseModel
+from typing import Optional
 
 load_dotenv()
 
@@ -16,6 +17,133 @@ class Settings(BaseModel):
     port: int = int(getenv("PORT")) or 8000
     db_name: str = getenv("DB_NAME")
 
+    # 'mongodb' or 'memory' (in process, data is lost on exit; needs mongomock-motor)
+    storage_engine: str = getenv("STORAGE_ENGINE") or "mongodb"
+    test_storage_engine: str = getenv("TEST_STORAGE_ENGINE") or "memory"
+
+    # send the reads of the read-only routes to the secondaries of the replica set
+    secondary_reads: bool = (getenv("SECONDARY_READS") or "false").lower() == "true"
+    read_max_staleness_seconds: int = int(getenv("READ_MAX_STALENESS_SECONDS") or 90)
+    causal_sessions_max_tokens: int = int(getenv("CAUSAL_SESSIONS_MAX_TOKENS") or 100000)
+
+    # record the requests metrics and expose them at /metrics
+    metrics_enabled: bool = (getenv("METRICS_ENABLED") or "true").lower() == "true"
+    # report the database commands of each request in the response headers
+    debug: bool = (getenv("DEBUG") or "false").lower() == "true"
+
+    # log and explain the database commands slower than this (0 to disable)
+    slow_query_ms: float = float(getenv("SLOW_QUERY_MS", 100))
+    slow_query_max_shapes: int = int(getenv("SLOW_QUERY_MAX_SHAPES") or 1000)
+
+    # token of the /admin routes, sent in the X-Admin-Token header (admin routes disabled when unset)
+    admin_token: Optional[str] = getenv("ADMIN_TOKEN")
+
+    # share of the requests traced (0 to 1), the traces are written in OTLP JSON
+    # to 'stdout' or to a file rotated at TRACE_FILE_MAX_BYTES
+    trace_sample_rate: float = float(getenv("TRACE_SAMPLE_RATE") or 0)
+    trace_export: str = getenv("TRACE_EXPORT") or "stdout"
+    trace_file_max_bytes: int = int(getenv("TRACE_FILE_MAX_BYTES") or 10 * 1024 * 1024)
+    trace_file_backups: int = int(getenv("TRACE_FILE_BACKUPS") or 5)
+
+    # sampling interval of the requests profiled on demand (X-Profile header or ?profile=1 with the admin token)
+    profile_interval_ms: float = float(getenv("PROFILE_INTERVAL_MS") or 1)
+    # samples per second of every request, aggregated by route (0 to disable)
+    profile_continuous_hz: float = float(getenv("PROFILE_CONTINUOUS_HZ") or 0)
+    profile_max_stored: int = int(getenv("PROFILE_MAX_STORED") or 20)
+    profile_max_stacks: int = int(getenv("PROFILE_MAX_STACKS") or 10000)
+
+    # measure the event loop lag this often (0 to disable), and capture the stack
+    # of what blocks the loop for longer than LOOP_BLOCK_THRESHOLD_MS
+    loop_monitor_interval_ms: float = float(getenv("LOOP_MONITOR_INTERVAL_MS", 50))
+    loop_block_threshold_ms: float = float(getenv("LOOP_BLOCK_THRESHOLD_MS") or 100)
+
+    # limit the requests running at once, by class of route (see app/core/admission.py)
+    admission_enabled: bool = (getenv("ADMISSION_ENABLED") or "true").lower() == "true"
+    admission_max_concurrency: int = int(getenv("ADMISSION_MAX_CONCURRENCY") or 128)
+    # JSON overriding the limits of the classes: {"heavy": {"limit": 2}}
+    admission_classes: Optional[str] = getenv("ADMISSION_CLASSES")
+
+    # deadline of the requests (0 for none), sent to MongoDB as maxTimeMS;
+    # JSON of the deadlines by route: {"DELETE /users/{user_id}": 30000}
+    request_deadline_ms: float = float(getenv("REQUEST_DEADLINE_MS", 10000))
+    request_deadline_max_ms: float = float(getenv("REQUEST_DEADLINE_MAX_MS") or 60000)
+    request_deadlines: Optional[str] = getenv("REQUEST_DEADLINES")
+
+    # rate limits of the auth routes, by client IP and by account (see app/core/rate_limit.py);
+    # backend 'memory' (buckets of the process) or 'mongodb' (shared by the workers);
+    # JSON overriding the rules: {"login": {"user": {"burst": 3, "per_minute": 0.5}}}
+    rate_limit_enabled: bool = (getenv("RATE_LIMIT_ENABLED") or "true").lower() == "true"
+    rate_limit_backend: str = getenv("RATE_LIMIT_BACKEND") or "memory"
+    rate_limit_shards: int = int(getenv("RATE_LIMIT_SHARDS") or 16)
+    rate_limit_gc_seconds: float = float(getenv("RATE_LIMIT_GC_SECONDS") or 60)
+    rate_limits: Optional[str] = getenv("RATE_LIMITS")
+
+    # the uploaded media: 'gridfs' in the database, or 'disk' in MEDIA_DIR
+    media_store: str = getenv("MEDIA_STORE") or "gridfs"
+    media_dir: str = getenv("MEDIA_DIR") or "media"
+    media_chunk_bytes: int = int(getenv("MEDIA_CHUNK_BYTES") or 256 * 1024)
+    media_max_bytes: int = int(getenv("MEDIA_MAX_BYTES") or 1024 * 1024 * 1024)
+    # the uploads no post referenced for MEDIA_ORPHAN_SECONDS are deleted, looked
+    # for every MEDIA_SWEEP_SECONDS (0 for never)
+    media_orphan_seconds: float = float(getenv("MEDIA_ORPHAN_SECONDS") or 24 * 3600)
+    media_sweep_seconds: float = float(getenv("MEDIA_SWEEP_SECONDS", 3600))
+
+    # the resized variants of the uploaded images, made by a pool of processes (0 for none)
+    image_workers: int = int(getenv("IMAGE_WORKERS", 2))
+    image_max_pending: int = int(getenv("IMAGE_MAX_PENDING") or 256)
+    image_max_bytes: int = int(getenv("IMAGE_MAX_BYTES") or 20 * 1024 * 1024)
+
+    # the search indexes of the posts and users (see app/utils/search.py); refreshed
+    # from the other workers every SEARCH_REFRESH_SECONDS (0 for never)
+    search_max_scan: int = int(getenv("SEARCH_MAX_SCAN") or 50000)
+    search_refresh_seconds: float = float(getenv("SEARCH_REFRESH_SECONDS", 10))
+
+    # the trending hashtags (see app/utils/trending.py), counted in a sliding window of
+    # TRENDING_BUCKETS count-min sketches, saved every TRENDING_CHECKPOINT_SECONDS (0 for never)
+    trending_window_seconds: float = float(getenv("TRENDING_WINDOW_SECONDS") or 24 * 3600)
+    trending_buckets: int = int(getenv("TRENDING_BUCKETS") or 24)
+    trending_width: int = int(getenv("TRENDING_WIDTH") or 4096)
+    trending_depth: int = int(getenv("TRENDING_DEPTH") or 4)
+    trending_top: int = int(getenv("TRENDING_TOP") or 100)
+    trending_checkpoint_seconds: float = float(getenv("TRENDING_CHECKPOINT_SECONDS", 60))
+
+    # the notifications (see app/utils/notifications.py), queued and written in bulk every
+    # NOTIFICATIONS_FLUSH_SECONDS, or as soon as NOTIFICATIONS_MAX_PENDING are waiting
+    notifications_flush_seconds: float = float(getenv("NOTIFICATIONS_FLUSH_SECONDS") or 1)
+    notifications_max_pending: int = int(getenv("NOTIFICATIONS_MAX_PENDING") or 10000)
+    # times the actions are written again after a failed write, then dropped
+    notifications_max_retries: int = int(getenv("NOTIFICATIONS_MAX_RETRIES", 3))
+
+    # the impressions and views of the posts (see app/utils/views.py), counted in memory in
+    # VIEWS_SHARDS shards and written every VIEWS_FLUSH_SECONDS, or as soon as VIEWS_MAX_PENDING posts wait
+    views_flush_seconds: float = float(getenv("VIEWS_FLUSH_SECONDS") or 5)
+    views_max_pending: int = int(getenv("VIEWS_MAX_PENDING") or 50000)
+    views_shards: int = int(getenv("VIEWS_SHARDS") or 16)
+    # times the counts of a post are written again after a failed write, then dropped
+    views_max_retries: int = int(getenv("VIEWS_MAX_RETRIES", 3))
+
+    # the live events of the posts (see app/utils/live.py), from a change stream of MongoDB
+    # unless LIVE_CHANGE_STREAM=false; the events waiting per connection past LIVE_QUEUE_SIZE are dropped
+    live_change_stream: bool = (getenv("LIVE_CHANGE_STREAM") or "true").lower() == "true"
+    live_queue_size: int = int(getenv("LIVE_QUEUE_SIZE") or 100)
+    live_max_subscriptions: int = int(getenv("LIVE_MAX_SUBSCRIPTIONS") or 100)
+
+    # the streams of the comments of the posts (see app/utils/comment_streams.py): the latest
+    # SSE_PAGE_SIZE comments first, and a comment line every SSE_KEEPALIVE_SECONDS while idle
+    sse_page_size: int = int(getenv("SSE_PAGE_SIZE") or 20)
+    sse_keepalive_seconds: float = float(getenv("SSE_KEEPALIVE_SECONDS") or 15)
+
+    # the follow index (see app/utils/follow_graph.py), built again every FOLLOW_GRAPH_REFRESH_SECONDS
+    # (0 for never) with the follows of the other workers
+    follow_graph_refresh_seconds: float = float(getenv("FOLLOW_GRAPH_REFRESH_SECONDS", 600))
+
+    # the users suggested to follow (see app/utils/suggestions.py), the SUGGESTIONS_TOP friends of
+    # friends computed every SUGGESTIONS_REFRESH_SECONDS (0 for never) by SUGGESTIONS_WORKERS processes
+    suggestions_refresh_seconds: float = float(getenv("SUGGESTIONS_REFRESH_SECONDS", 3600))
+    suggestions_top: int = int(getenv("SUGGESTIONS_TOP") or 20)
+    suggestions_max_fanout: int = int(getenv("SUGGESTIONS_MAX_FANOUT") or 1000)
+    suggestions_workers: int = int(getenv("SUGGESTIONS_WORKERS", 1))
+
     root_url: str = "http://127.0.0.1:8080"
 
     jwt_secret_key: str = getenv('JWT_SECRET_KEY')
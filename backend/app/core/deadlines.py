@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Request deadlines.
+
+Every request gets a deadline: REQUEST_DEADLINE_MS by default, longer for
+the routes of ROUTE_DEADLINES (the cascade deletes), set by route in
+REQUEST_DEADLINES as JSON (`{"DELETE /users/{user_id}": 30000}`), or
+by the client in the `X-Deadline-Ms` header, up to REQUEST_DEADLINE_MAX_MS.
+
+Inside `deadline()` every command sent by motor carries the time left as
+its `maxTimeMS`, through the client side operation timeout of pymongo
+(`pymongo.timeout`, kept in a contextvar which motor copies to its
+threads): MongoDB stops the queries of the requests nobody waits for any
+more, and pymongo raises a timeout error instead of waiting for them.
+"""
+
+import json
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+import pymongo
+from app.core.config import CONFIG
+
+
+# deadline of the routes needing more than the default, in milliseconds (0 for none), by 'METHOD route'
+ROUTE_DEADLINES = {
+    'DELETE /users/{user_id}': 30000,
+    'DELETE /posts/{post_id}': 30000,
+    'DELETE /users/': 60000,
+    'DELETE /posts/': 60000,
+    'DELETE /comments/': 60000,
+    # none for the media, their time depends on the size of the file and the client
+    'POST /media/': 0,
+    'GET /media/{media_id}': 0,
+    # nor for the streams
+    'GET /comments/post/{post_id}/stream': 0,
+}
+
+
+def load_deadlines(overrides: Optional[str] = CONFIG.request_deadlines) -> Dict[str, float]:
+    """The deadlines of the routes, with the ones set in REQUEST_DEADLINES"""
+    return {**ROUTE_DEADLINES, **json.loads(overrides or '{}')}
+
+
+def deadline_ms(method: str, route: str, header: Optional[str] = None,
+                deadlines: Optional[Dict[str, float]] = None) -> float:
+    """Deadline of a request in milliseconds, 0 for none"""
+    default = (deadlines or _DEADLINES).get(f"{method} {route}", CONFIG.request_deadline_ms)
+    if header:
+        try:
+            requested = float(header)
+        except ValueError:
+            requested = 0
+        if requested > 0:
+            return min(requested, CONFIG.request_deadline_max_ms)
+    return default
+
+
+_DEADLINES = load_deadlines()
+
+_deadline: ContextVar[Optional[float]] = ContextVar('deadline', default=None)
+
+
+@contextmanager
+def deadline(seconds: float) -> Iterator[None]:
+    """Run the block with a deadline, the earlier one when nested"""
+    expires = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None and current < expires:
+        expires, seconds = current, max(current - time.monotonic(), 0.001)
+    token = _deadline.set(expires)
+    try:
+        with pymongo.timeout(seconds):
+            yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the deadline of the current request, None without one"""
+    expires = _deadline.get()
+    return None if expires is None else expires - time.monotonic()
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Follow graphs in compressed sparse row (CSR) arrays.
+
+The users are numbered 0..n-1; the accounts followed by user u are
+`indices[indptr[u]:indptr[u + 1]]`, sorted. Both are flat typed arrays, so a
+graph costs 4 bytes per edge and 8 per user instead of a Python object each.
+
+The friends of friends of u are the row u of A·A, A being the adjacency
+matrix: the product is computed a row at a time (Gustavson's algorithm), the
+rows of the accounts u follows summed in a sparse accumulator. The sums are
+the number of accounts u follows who follow the candidate.
+
+The follow index keeps both directions of the graph in CSR arrays, the ids
+of the users interned to their numbers. A follow or unfollow copies the row
+it changes out of the arrays into an array of its own, kept sorted, which
+replaces it until the index is built again: the membership is a binary
+search in a row, the degree its length, the intersection of two rows a
+binary search of the elements of the shorter one in the longer one.
+"""
+
+import heapq
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+def csr_from_edges(n: int, sources: Sequence[int], targets: Sequence[int]) -> Tuple[array, array]:
+    """The CSR arrays (indptr, indices) of the edges source -> target, duplicates removed"""
+    counts = array('q', bytes(8 * (n + 1)))
+    for source in sources:
+        counts[source + 1] += 1
+    for i in range(n):
+        counts[i + 1] += counts[i]
+    indices = array('i', bytes(4 * len(targets)))
+    fill = array('q', counts)
+    for source, target in zip(sources, targets):
+        indices[fill[source]] = target
+        fill[source] += 1
+
+    # the rows sorted, then compacted without their duplicates
+    indptr = array('q', bytes(8 * (n + 1)))
+    end = 0
+    for u in range(n):
+        row = sorted(set(indices[counts[u]:counts[u + 1]]))
+        indices[end:end + len(row)] = array('i', row)
+        end += len(row)
+        indptr[u + 1] = end
+    del indices[end:]
+    return indptr, indices
+
+
+def transpose(indptr: array, indices: array) -> Tuple[array, array]:
+    """The CSR arrays of the reversed edges"""
+    n = len(indptr) - 1
+    sources = array('i')
+    for u in range(n):
+        sources.extend(array('i', [u]) * (indptr[u + 1] - indptr[u]))
+    return csr_from_edges(n, indices, sources)
+
+
+def in_degrees(n: int, indices: Iterable[int]) -> array:
+    """The number of followers of each user"""
+    degrees = array('i', bytes(4 * n))
+    for target in indices:
+        degrees[target] += 1
+    return degrees
+
+
+class FriendsOfFriends:
+    """
+    The accounts most followed by the accounts a user follows, which the user does not follow.
+
+    Attributes:
+        indptr (array): Start of the row of each user in indices, n + 1 of them.
+        indices (array): The accounts followed, row by row.
+        max_fanout (int): Accounts following more than this are not summed, their follows say little.
+        followers (array): The in-degree of each user, breaking the ties of the scores.
+    """
+
+    def __init__(self, indptr: array, indices: array, max_fanout: int = 1000):
+        self.indptr = indptr
+        self.indices = indices
+        self.max_fanout = max_fanout
+        self.followers = in_degrees(len(indptr) - 1, indices)
+
+    def suggest(self, user: int, k: int) -> List[Tuple[int, int]]:
+        """The k best (candidate, score) of the user, the best first"""
+        indptr, indices = self.indptr, self.indices
+        following = indices[indptr[user]:indptr[user + 1]]
+        scores: Counter = Counter()
+        for friend in following:
+            start, stop = indptr[friend], indptr[friend + 1]
+            if stop - start <= self.max_fanout:
+                scores.update(indices[start:stop])
+        scores.pop(user, None)
+        for friend in following:
+            scores.pop(friend, None)
+        followers = self.followers
+        return heapq.nlargest(k, scores.items(), key=lambda item: (item[1], followers[item[0]], -item[0]))
+
+    def suggest_range(self, start: int, stop: int, k: int) -> Tuple[array, array]:
+        """The suggestions of the users start..stop-1, k per user padded with -1, and their scores"""
+        candidates = array('i', [-1]) * ((stop - start) * k)
+        scores = array('i', bytes(4 * len(candidates)))
+        for user in range(start, stop):
+            offset = (user - start) * k
+            for i, (candidate, score) in enumerate(self.suggest(user, k)):
+                candidates[offset + i] = candidate
+                scores[offset + i] = score
+        return candidates, scores
+
+
+class _Adjacency:
+    """One direction of the follow index: CSR arrays, and the rows changed since they were built"""
+
+    __slots__ = ('indptr', 'indices', 'rows')
+
+    def __init__(self, indptr: array, indices: array):
+        self.indptr = indptr
+        self.indices = indices
+        self.rows: Dict[int, array] = {}
+
+    def bounds(self, u: int) -> Tuple[Sequence[int], int, int]:
+        """The array holding the row of u, and the bounds of the row in it"""
+        row = self.rows.get(u)
+        if row is not None:
+            return row, 0, len(row)
+        if u + 1 < len(self.indptr):
+            return self.indices, self.indptr[u], self.indptr[u + 1]
+        return self.indices, 0, 0
+
+    def contains(self, u: int, v: int) -> bool:
+        values, lo, hi = self.bounds(u)
+        i = bisect_left(values, v, lo, hi)
+        return i < hi and values[i] == v
+
+    def degree(self, u: int) -> int:
+        values, lo, hi = self.bounds(u)
+        return hi - lo
+
+    def row(self, u: int) -> array:
+        values, lo, hi = self.bounds(u)
+        return values[lo:hi]
+
+    def _editable(self, u: int) -> array:
+        row = self.rows.get(u)
+        if row is None:
+            row = self.rows[u] = self.row(u)
+        return row
+
+    def add(self, u: int, v: int) -> bool:
+        if self.contains(u, v):
+            return False
+        insort(self._editable(u), v)
+        return True
+
+    def discard(self, u: int, v: int) -> bool:
+        if not self.contains(u, v):
+            return False
+        row = self._editable(u)
+        del row[bisect_left(row, v)]
+        return True
+
+    def intersection(self, u: int, other: '_Adjacency', w: int) -> List[int]:
+        """The elements of the row u also in the row w of the other direction"""
+        short, lo, hi = self.bounds(u)
+        long, long_lo, long_hi = other.bounds(w)
+        if hi - lo > long_hi - long_lo:
+            short, lo, hi, long, long_lo, long_hi = long, long_lo, long_hi, short, lo, hi
+        found = []
+        for i in range(lo, hi):
+            v = short[i]
+            j = bisect_left(long, v, long_lo, long_hi)
+            if j < long_hi and long[j] == v:
+                found.append(v)
+                long_lo = j + 1
+        return found
+
+    def nbytes(self) -> int:
+        return (self.indptr.itemsize * len(self.indptr) + self.indices.itemsize * len(self.indices)
+                + sum(row.itemsize * len(row) for row in self.rows.values()))
+
+
+class FollowIndex:
+    """
+    Who follows whom, in memory, by user id.
+
+    Attributes:
+        users (int): Number of users interned, the removed ones included.
+        edges (int): Number of follows.
+    """
+
+    def __init__(self):
+        self._ids: List[str] = []
+        self._numbers: Dict[str, int] = {}
+        empty = array('q', [0])
+        self._following = _Adjacency(empty, array('i'))
+        self._followers = _Adjacency(empty, array('i'))
+        self.edges = 0
+
+    @property
+    def users(self) -> int:
+        return len(self._ids)
+
+    def build(self, ids: List[str], indptr: array, indices: array) -> None:
+        """Replace the index by the graph of the CSR arrays, the users numbered by their index in ids"""
+        reverse = transpose(indptr, indices)
+        self._ids = list(ids)
+        self._numbers = {user_id: number for number, user_id in enumerate(self._ids)}
+        self._following = _Adjacency(indptr, indices)
+        self._followers = _Adjacency(*reverse)
+        self.edges = len(indices)
+
+    def _number(self, user_id: str, create: bool = False) -> Optional[int]:
+        number = self._numbers.get(user_id)
+        if number is None and create:
+            number = self._numbers[user_id] = len(self._ids)
+            self._ids.append(user_id)
+        return number
+
+    def follows(self, user_id: str, other_id: str) -> bool:
+        """Whether the user follows the other one"""
+        u, v = self._number(user_id), self._number(other_id)
+        return u is not None and v is not None and self._following.contains(u, v)
+
+    def mutual(self, user_id: str, other_id: str) -> bool:
+        """Whether the two users follow each other"""
+        return self.follows(user_id, other_id) and self.follows(other_id, user_id)
+
+    def following_count(self, user_id: str) -> int:
+        u = self._number(user_id)
+        return 0 if u is None else self._following.degree(u)
+
+    def followers_count(self, user_id: str) -> int:
+        u = self._number(user_id)
+        return 0 if u is None else self._followers.degree(u)
+
+    def following(self, user_id: str) -> List[str]:
+        u = self._number(user_id)
+        return [] if u is None else [self._ids[v] for v in self._following.row(u)]
+
+    def followers(self, user_id: str) -> List[str]:
+        u = self._number(user_id)
+        return [] if u is None else [self._ids[v] for v in self._followers.row(u)]
+
+    def common_following(self, user_id: str, other_id: str) -> List[str]:
+        """The accounts both users follow"""
+        u, v = self._number(user_id), self._number(other_id)
+        if u is None or v is None:
+            return []
+        return [self._ids[w] for w in self._following.intersection(u, self._following, v)]
+
+    def known_followers(self, user_id: str, other_id: str) -> List[str]:
+        """The accounts the user follows who follow the other one"""
+        u, v = self._number(user_id), self._number(other_id)
+        if u is None or v is None:
+            return []
+        return [self._ids[w] for w in self._following.intersection(u, self._followers, v)]
+
+    def add(self, user_id: str, other_id: str) -> bool:
+        """The user follows the other one, whether it did not already"""
+        u, v = self._number(user_id, create=True), self._number(other_id, create=True)
+        if not self._following.add(u, v):
+            return False
+        self._followers.add(v, u)
+        self.edges += 1
+        return True
+
+    def remove(self, user_id: str, other_id: str) -> bool:
+        """The user unfollows the other one, whether it followed it"""
+        u, v = self._number(user_id), self._number(other_id)
+        if u is None or v is None or not self._following.discard(u, v):
+            return False
+        self._followers.discard(v, u)
+        self.edges -= 1
+        return True
+
+    def remove_user(self, user_id: str) -> None:
+        """Remove the follows of the user and of its followers to it; its number is not reused"""
+        u = self._number(user_id)
+        if u is None:
+            return
+        for v in self._following.row(u):
+            self.remove(user_id, self._ids[v])
+        for w in self._followers.row(u):
+            self.remove(self._ids[w], user_id)
+
+    def nbytes(self) -> int:
+        """Size of the arrays of the two directions, the interned ids not included"""
+        return self._following.nbytes() + self._followers.nbytes()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Event loop lag monitor.
+
+A task of the event loop sleeps LOOP_MONITOR_INTERVAL_MS and measures how
+late it wakes up: the lag, the time the loop was busy running something
+else without yielding (bcrypt, the validation of huge documents, ...). The
+lag is exported as the `event_loop_lag_seconds` histogram.
+
+A watchdog thread checks the heartbeat of that task: when the loop has not
+run it for LOOP_BLOCK_THRESHOLD_MS, the stack of the loop thread is
+captured, the code blocking the loop, and logged. The last blocks are kept
+with their duration, served at /admin/loop-blocks.
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+from typing import List, Optional
+from pydantic import BaseModel
+from app.core.config import CONFIG
+from app.core.metrics import REGISTRY
+from app.core.profiling import short_path
+
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG = REGISTRY.histogram(
+    "event_loop_lag_seconds", "Delay of the event loop in running a ready task, in seconds",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+LOOP_BLOCKS = REGISTRY.counter(
+    "event_loop_blocks_total", "Number of times the event loop was blocked longer than the threshold")
+
+
+class LoopBlock(BaseModel):
+    """
+    A time the event loop was blocked.
+
+    Attributes:
+        started (datetime): When the loop stopped running its tasks.
+        duration_ms (float): How long it was blocked, the threshold while it still is.
+        stack (List[str]): Stack of the loop thread when the threshold was crossed, the innermost last.
+    """
+    started: datetime
+    duration_ms: float
+    stack: List[str]
+
+
+def thread_stack(thread_id: int) -> List[str]:
+    """Stack of a thread, one 'path:line in function' per frame, the innermost last"""
+    frame = sys._current_frames().get(thread_id)
+    if frame is None:
+        return []
+    return [f"{short_path(summary.filename)}:{summary.lineno} in {summary.name}"
+            for summary in traceback.extract_stack(frame)]
+
+
+class LoopMonitor:
+    """
+    Measures the lag of the event loop it is started on.
+
+    Attributes:
+        interval (float): Seconds between two measures, 0 disables the monitor.
+        threshold (float): Seconds of lag from which the loop is blocked.
+        lag (float): Last lag measured, in seconds, 0 when the monitor is not running.
+        max_lag (float): Largest lag measured since the last reset, in seconds.
+        blocks (deque): The last blocks, the latest last.
+    """
+
+    def __init__(self, interval_ms: float = CONFIG.loop_monitor_interval_ms,
+                 threshold_ms: float = CONFIG.loop_block_threshold_ms, max_blocks: int = 100):
+        self.interval = interval_ms / 1000
+        self.threshold = threshold_ms / 1000
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.blocks: deque = deque(maxlen=max_blocks)
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._loop_thread_id = 0
+        # when the loop last ran the monitor task, and the block in progress
+        self._beat = 0.0
+        self._block: Optional[LoopBlock] = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        """Monitor the running asyncio loop (nothing is done under another event loop)"""
+        if not self.interval or self.running:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.perf_counter()
+        self._stopped.clear()
+        self._task = loop.create_task(self._measure())
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._watch, name='loop-monitor', daemon=True)
+            self._thread.start()
+
+    async def stop(self) -> None:
+        """Stop the monitor"""
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.lag = 0.0
+
+    def reset(self) -> float:
+        """Start measuring a new max lag, return the previous one"""
+        with self._lock:
+            max_lag, self.max_lag = self.max_lag, 0.0
+        return max_lag
+
+    def blocked_longer_than(self, seconds: float) -> List[LoopBlock]:
+        """The kept blocks longer than this"""
+        with self._lock:
+            return [block for block in self.blocks if block.duration_ms >= seconds * 1000]
+
+    async def _measure(self) -> None:
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            lag = max(0.0, now - expected)
+            LOOP_LAG.observe(lag)
+            with self._lock:
+                self._beat = now
+                self.lag = lag
+                self.max_lag = max(self.max_lag, lag)
+                block, self._block = self._block, None
+                if block is not None:
+                    # the loop runs again, the block is over
+                    block.duration_ms = round(lag * 1000, 3)
+            if block is not None:
+                # counted here, the metrics are only updated from the loop
+                LOOP_BLOCKS.inc()
+
+    def _watch(self) -> None:
+        # checking a few times per threshold captures the stack soon after it is crossed
+        period = min(self.interval, self.threshold) / 2 or 0.01
+        while not self._stopped.wait(period):
+            with self._lock:
+                lag = time.perf_counter() - self._beat - self.interval
+                if lag < self.threshold or self._block is not None:
+                    continue
+                started = datetime.now().timestamp() - lag
+                block = self._block = LoopBlock(started=datetime.fromtimestamp(started),
+                                                duration_ms=round(lag * 1000, 3),
+                                                stack=thread_stack(self._loop_thread_id))
+                self.blocks.append(block)
+            logger.warning("Event loop blocked for more than %.0fms:\n%s",
+                           self.threshold * 1000, '\n'.join(block.stack[-15:]))
+
+
+loop_monitor = LoopMonitor()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Statistical profiler of the requests.
+
+A thread samples the stack of the event loop thread at a fixed interval. A
+sample belongs to the request whose frame is on the stack: the frame of the
+coroutine of the profiling middleware, which stays the same object while the
+request is suspended. Concurrent requests are told apart that way.
+
+Two modes:
+    - on demand, for one request, every PROFILE_INTERVAL_MS; the samples
+      taken while the request waits (for the database, for a thread) are
+      counted as `(waiting)`, so the profile covers the wall time.
+    - continuous, for every request, PROFILE_CONTINUOUS_HZ times a second;
+      the stacks are aggregated by route, only while a request runs.
+
+The profiles are folded stacks (`frame;frame;frame count`, the root first),
+the input of flamegraph.pl, speedscope or inferno. The sampler thread only
+holds the GIL while it samples, the Python code is still only sampled when
+the loop thread releases the GIL (every `sys.getswitchinterval()`, 5 ms by
+default, when it runs Python code).
+"""
+
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from datetime import datetime
+from types import FrameType
+from typing import Any, Dict, List, Optional
+from pydantic import BaseModel
+from app.core.config import CONFIG
+
+
+WAITING = "(waiting)"
+TRUNCATED = "(truncated)"
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def short_path(filename: str) -> str:
+    """Path of a source file relative to the backend or to the site-packages"""
+    if filename.startswith(_ROOT):
+        return os.path.relpath(filename, _ROOT)
+    _, found, rest = filename.rpartition('site-packages' + os.sep)
+    return rest if found else os.path.basename(filename)
+
+
+class ProfileSummary(BaseModel):
+    """
+    A profile of a request.
+
+    Attributes:
+        id (str): Id of the profile.
+        method (str): Method of the request.
+        path (str): Path of the request.
+        route (str): Route template of the request.
+        started (datetime): When the request started.
+        duration_ms (float): Duration of the request.
+        samples (int): Number of samples, waiting ones included.
+    """
+    id: str
+    method: str
+    path: str
+    route: str = ''
+    started: datetime
+    duration_ms: float = 0
+    samples: int = 0
+
+
+class Profile:
+    """The samples of a profiled request"""
+
+    def __init__(self, marker: FrameType, thread_id: int, method: str, path: str, max_stacks: int):
+        self.summary = ProfileSummary(id=uuid.uuid4().hex, method=method, path=path,
+                                      started=datetime.now())
+        self.marker = marker
+        self.thread_id = thread_id
+        self.stacks: Counter = Counter()
+        self.max_stacks = max_stacks
+        self._start = time.perf_counter()
+
+    def add(self, stack: str) -> None:
+        if stack not in self.stacks and len(self.stacks) >= self.max_stacks:
+            stack = TRUNCATED
+        self.stacks[stack] += 1
+
+    def finish(self, route: str) -> None:
+        self.summary.route = route
+        self.summary.duration_ms = (time.perf_counter() - self._start) * 1000
+        self.summary.samples = sum(self.stacks.values())
+        # the frames are released with the request
+        self.marker = None
+
+
+def folded(stacks: Counter) -> str:
+    """Folded stacks, the most sampled first"""
+    return ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class Profiler:
+    """
+    Samples the stacks of the requests being profiled, from a thread started with the first one.
+
+    Attributes:
+        interval (float): Seconds between two samples of the profiled requests.
+        continuous_hz (float): Samples per second of every request, 0 disables the continuous mode.
+        max_stored (int): Number of request profiles kept.
+        max_stacks (int): Maximum number of distinct stacks of a profile or of a route.
+    """
+
+    def __init__(self, interval_ms: float = CONFIG.profile_interval_ms,
+                 continuous_hz: float = CONFIG.profile_continuous_hz,
+                 max_stored: int = CONFIG.profile_max_stored,
+                 max_stacks: int = CONFIG.profile_max_stacks):
+        self.interval = interval_ms / 1000
+        self.continuous_hz = continuous_hz
+        self.max_stored = max_stored
+        self.max_stacks = max_stacks
+        self.profiles: 'OrderedDict[str, Profile]' = OrderedDict()
+        # the requests being profiled, by the frame marking them
+        self._sessions: Dict[FrameType, Profile] = {}
+        # the requests running while the continuous mode is on, with their scope
+        self._running: Dict[FrameType, Any] = {}
+        self._threads: Counter = Counter()
+        self._routes: Dict[str, Counter] = {}
+        self._labels: Dict[Any, str] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # requests
+
+    def start(self, marker: FrameType, method: str, path: str) -> Profile:
+        """Profile the request of the marker frame, running in this thread"""
+        profile = Profile(marker, threading.get_ident(), method, path, self.max_stacks)
+        with self._lock:
+            self._sessions[marker] = profile
+            self._threads[profile.thread_id] += 1
+        self._ensure_thread()
+        return profile
+
+    def stop(self, profile: Profile, route: str) -> None:
+        """Stop profiling a request and keep its profile"""
+        with self._lock:
+            self._sessions.pop(profile.marker, None)
+            self._release_thread(profile.thread_id)
+            profile.finish(route)
+            self.profiles[profile.summary.id] = profile
+            while len(self.profiles) > self.max_stored:
+                self.profiles.popitem(last=False)
+
+    def enter(self, marker: FrameType, scope) -> None:
+        """Sample a request for the continuous profile of its route"""
+        with self._lock:
+            self._running[marker] = scope
+            self._threads[threading.get_ident()] += 1
+        self._ensure_thread()
+
+    def leave(self, marker: FrameType) -> None:
+        with self._lock:
+            self._running.pop(marker, None)
+            self._release_thread(threading.get_ident())
+
+    def _release_thread(self, thread_id: int) -> None:
+        self._threads[thread_id] -= 1
+        if self._threads[thread_id] <= 0:
+            del self._threads[thread_id]
+
+    # profiles
+
+    def profile(self, profile_id: str) -> Optional[Profile]:
+        with self._lock:
+            return self.profiles.get(profile_id)
+
+    def summaries(self) -> List[ProfileSummary]:
+        """The kept profiles, the latest first"""
+        with self._lock:
+            return [profile.summary for profile in reversed(self.profiles.values())]
+
+    def route_stacks(self, route: Optional[str] = None) -> Counter:
+        """Continuous profile of a route, or of every route, the route being the root frame"""
+        with self._lock:
+            if route is not None:
+                return Counter(self._routes.get(route, {}))
+            return Counter({f"{name};{stack}": count for name, stacks in self._routes.items()
+                            for stack, count in stacks.items()})
+
+    def clear(self) -> None:
+        with self._lock:
+            self.profiles.clear()
+            self._routes.clear()
+
+    # sampling
+
+    def _ensure_thread(self) -> None:
+        self._wake.set()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                profiling, running = bool(self._sessions), bool(self._running)
+            if profiling:
+                time.sleep(self.interval)
+            elif running and self.continuous_hz:
+                time.sleep(1 / self.continuous_hz)
+            else:
+                self._wake.clear()
+                self._wake.wait()
+                continue
+            self.sample()
+
+    def sample(self) -> None:
+        """Take a sample of the requests being profiled"""
+        with self._lock:
+            threads = list(self._threads)
+            sessions = dict(self._sessions)
+            running = dict(self._running) if self.continuous_hz else {}
+        frames = sys._current_frames()
+        seen = set()
+        for thread_id in threads:
+            frame = frames.get(thread_id)
+            chain = []
+            while frame is not None:
+                chain.append(frame)
+                if frame in sessions:
+                    sessions[frame].add(self._fold(chain))
+                    seen.add(frame)
+                if frame in running:
+                    self._add_route(running[frame], self._fold(chain))
+                frame = frame.f_back
+        for marker, profile in sessions.items():
+            if marker not in seen:
+                profile.add(WAITING)
+
+    def _fold(self, chain: List[FrameType]) -> str:
+        """The stack from the marker frame, last of the chain, to the running frame"""
+        labels = []
+        for frame in reversed(chain):
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = (f"{code.co_name} "
+                                              f"({short_path(code.co_filename)}:{code.co_firstlineno})")
+            labels.append(label)
+        return ';'.join(labels)
+
+    def _add_route(self, scope, stack: str) -> None:
+        route = scope.get('route')
+        name = f"{scope['method']} {route.path if route is not None else 'unmatched'}"
+        with self._lock:
+            stacks = self._routes.setdefault(name, Counter())
+            if stack not in stacks and len(stacks) >= self.max_stacks:
+                stack = TRUNCATED
+            stacks[stack] += 1
+
+
+profiler = Profiler()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+In-process publish/subscribe of messages by topic.
+
+A subscriber (a live connection) subscribes to topics, and each message
+published on a topic is put in the queue of its subscribers; the message is
+encoded once by the publisher and shared by all of them. Putting a message
+never waits: the queue of a subscriber is bounded, and when it is full
+because the client reads slower than the messages come, the oldest message
+is dropped and counted, so a slow client never delays the others nor grows
+the memory of the process.
+
+An idle subscriber costs a few hundred bytes: its queue is only allocated
+with its first message, and it waits for messages on a single future.
+"""
+
+import asyncio
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Set
+from app.core.metrics import REGISTRY
+
+PUBLISHED = REGISTRY.counter("pubsub_messages_total", "Number of messages published")
+DELIVERED = REGISTRY.counter("pubsub_deliveries_total", "Number of messages put in the queues of the subscribers")
+DROPPED = REGISTRY.counter("pubsub_dropped_total", "Number of messages dropped from the queues of slow subscribers")
+SUBSCRIBERS = REGISTRY.gauge("pubsub_subscribers", "Number of subscribers")
+
+
+class Subscriber:
+    """
+    The queue of the messages of the topics of a subscriber.
+
+    Attributes:
+        max_queue (int): Messages kept waiting, the oldest dropped past it.
+        topics (Set[str]): The topics subscribed to.
+        dropped (int): Messages dropped since the last get.
+    """
+    __slots__ = ('max_queue', 'topics', 'dropped', '_queue', '_waiter')
+
+    def __init__(self, max_queue: int = 100):
+        self.max_queue = max_queue
+        self.topics: Set[str] = set()
+        self.dropped = 0
+        self._queue: Optional[Deque[str]] = None
+        self._waiter: Optional[asyncio.Future] = None
+
+    def put(self, message: str) -> None:
+        """Queue a message, dropping the oldest one when full"""
+        if self._queue is None:
+            self._queue = deque()
+        elif len(self._queue) >= self.max_queue:
+            self._queue.popleft()
+            self.dropped += 1
+            DROPPED.inc()
+        self._queue.append(message)
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def get(self) -> List[str]:
+        """All the messages waiting, after waiting for one"""
+        while not self._queue:
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        messages = list(self._queue)
+        # the queue is freed while idle
+        self._queue = None
+        return messages
+
+
+class Broker:
+    """The subscribers by topic"""
+
+    def __init__(self):
+        self._topics: Dict[str, Set[Subscriber]] = {}
+        self._subscribers = 0
+
+    def topics(self) -> int:
+        """Number of topics with subscribers"""
+        return len(self._topics)
+
+    def subscribe(self, subscriber: Subscriber, topics: Iterable[str]) -> None:
+        if not subscriber.topics:
+            self._subscribers += 1
+        for topic in topics:
+            self._topics.setdefault(topic, set()).add(subscriber)
+            subscriber.topics.add(topic)
+        SUBSCRIBERS.set(self._subscribers)
+
+    def unsubscribe(self, subscriber: Subscriber, topics: Optional[Iterable[str]] = None) -> None:
+        """Unsubscribe from the topics, all of them by default"""
+        had_topics = bool(subscriber.topics)
+        for topic in list(subscriber.topics if topics is None else topics):
+            subscribers = self._topics.get(topic)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._topics[topic]
+            subscriber.topics.discard(topic)
+        if had_topics and not subscriber.topics:
+            self._subscribers -= 1
+        SUBSCRIBERS.set(self._subscribers)
+
+    def publish(self, topic: str, message: str) -> int:
+        """Put the message in the queue of the subscribers of the topic, return how many"""
+        subscribers = self._topics.get(topic)
+        PUBLISHED.inc()
+        if not subscribers:
+            return 0
+        for subscriber in subscribers:
+            subscriber.put(message)
+        DELIVERED.inc(amount=len(subscribers))
+        return len(subscribers)
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Token bucket rate limiter.
+
+Each key (a route and a client IP, or a route and an account) has a bucket
+of `burst` tokens, refilled at `per_minute` tokens a minute; a request takes
+a token, and is refused while the bucket is empty. A bucket is refilled
+lazily, when it is used, from the time elapsed since its last use: it is
+only a tuple (tokens, last use, time it is full again), whatever the rate.
+
+The buckets are split in shards, each with its own lock, by hash of the key.
+A full bucket is the same as a missing one, so the buckets full again are
+dropped, one shard at a time: every RATE_LIMIT_GC_SECONDS all the shards
+have been swept, without a pause for all the keys at once.
+
+With RATE_LIMIT_BACKEND=mongodb the buckets are documents of the
+`rate_limits` collection, updated atomically by MongoDB, so the workers of
+the server share them; they expire with a TTL index once full again.
+
+The rules are set by route and by key in RATE_LIMITS, as JSON overriding the
+defaults: `{"login": {"user": {"burst": 3, "per_minute": 0.5}}}`.
+"""
+
+import json
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from pydantic import BaseModel
+from pymongo import ReturnDocument
+from app.core.config import CONFIG
+from app.core.metrics import REGISTRY
+
+
+LIMITED = REGISTRY.counter(
+    "rate_limited_total", "Number of requests refused by the rate limiter, by rule", ("rule",))
+
+
+class RateRule(BaseModel):
+    """
+    Rate allowed for a key.
+
+    Attributes:
+        burst (int): Requests allowed at once, the size of the bucket.
+        per_minute (float): Requests allowed per minute in the long run, the refill rate.
+    """
+    burst: int
+    per_minute: float
+
+    @property
+    def rate(self) -> float:
+        """Tokens per second"""
+        return self.per_minute / 60
+
+
+# the rules by route, keyed by client IP ('ip') and by the account in the request ('user')
+DEFAULT_RULES = {
+    'login': {'ip': RateRule(burst=20, per_minute=10), 'user': RateRule(burst=5, per_minute=1)},
+    'sign_up': {'ip': RateRule(burst=10, per_minute=2)},
+    'forgot_password': {'ip': RateRule(burst=5, per_minute=1), 'user': RateRule(burst=3, per_minute=0.2)},
+}
+
+
+def load_rules(overrides: Optional[str] = CONFIG.rate_limits) -> Dict[str, Dict[str, RateRule]]:
+    """The default rules, with the ones set in RATE_LIMITS"""
+    rules = {route: dict(route_rules) for route, route_rules in DEFAULT_RULES.items()}
+    for route, route_rules in json.loads(overrides or '{}').items():
+        for key, rule in route_rules.items():
+            rules.setdefault(route, {})[key] = RateRule(**rule)
+    return rules
+
+
+# a bucket: tokens left, time of the last use, time it is full again
+Bucket = Tuple[float, float, float]
+
+
+class _Shard:
+    __slots__ = ('buckets', 'lock')
+
+    def __init__(self):
+        self.buckets: Dict[str, Bucket] = {}
+        self.lock = threading.Lock()
+
+
+class MongoBucketStore:
+    """The buckets in a MongoDB collection, shared by the workers"""
+
+    COLLECTION = 'rate_limits'
+
+    def __init__(self, database):
+        self.collection = database[self.COLLECTION]
+
+    async def init(self) -> None:
+        """Drop the buckets once full again"""
+        await self.collection.create_index('expires', expireAfterSeconds=0)
+
+    async def hit(self, key: str, rule: RateRule, now: float) -> float:
+        """Take a token, atomically; 0 if there was one, else seconds until there is"""
+        burst, rate = float(rule.burst), rule.rate
+        refilled = {'$min': [burst, {'$add': [
+            {'$ifNull': ['$tokens', burst]},
+            {'$multiply': [{'$subtract': [now, {'$ifNull': ['$updated', now]}]}, rate]}]}]}
+        bucket = await self.collection.find_one_and_update(
+            {'_id': key},
+            [{'$set': {'tokens': refilled, 'updated': now}},
+             {'$set': {'allowed': {'$gte': ['$tokens', 1]},
+                       'tokens': {'$cond': [{'$gte': ['$tokens', 1]}, {'$subtract': ['$tokens', 1]}, '$tokens']}}},
+             {'$set': {'expires': {'$add': [
+                 '$$NOW',
+                 {'$multiply': [{'$divide': [{'$subtract': [burst, '$tokens']}, rate]}, 1000]}]}}}],
+            upsert=True, return_document=ReturnDocument.AFTER)
+        if bucket['allowed']:
+            return 0.0
+        return (1 - bucket['tokens']) / rate
+
+
+class RateLimiter:
+    """
+    The buckets of the keys.
+
+    Attributes:
+        enabled (bool): Whether the requests are limited.
+        rules (Dict[str, Dict[str, RateRule]]): The rules, by route and by key.
+        store (Optional[MongoBucketStore]): Shared buckets, used instead of the ones of the process.
+    """
+
+    def __init__(self, shards: int = CONFIG.rate_limit_shards, gc_seconds: float = CONFIG.rate_limit_gc_seconds,
+                 rules: Optional[Dict[str, Dict[str, RateRule]]] = None):
+        self.enabled = CONFIG.rate_limit_enabled
+        self.rules = rules if rules is not None else load_rules()
+        self.store: Optional[MongoBucketStore] = None
+        self._shards: List[_Shard] = [_Shard() for _ in range(shards)]
+        # a shard is swept every gc_seconds / shards
+        self._gc_interval = gc_seconds / shards
+        self._next_gc = time.monotonic() + self._gc_interval
+        self._next_shard = 0
+
+    def __len__(self) -> int:
+        """Number of buckets in the process"""
+        return sum(len(shard.buckets) for shard in self._shards)
+
+    async def hit(self, route: str, key: str, value: str) -> float:
+        """A request of the route for the key (ip, user) of this value; 0 if allowed, else seconds to wait"""
+        rule = self.rules.get(route, {}).get(key)
+        if not self.enabled or rule is None:
+            return 0.0
+        bucket_key = f"{route}:{key}:{value}"
+        if self.store is not None:
+            wait = await self.store.hit(bucket_key, rule, time.time())
+        else:
+            wait = self.take(bucket_key, rule)
+        if wait:
+            LIMITED.inc((f"{route}:{key}",))
+        return wait
+
+    def take(self, key: str, rule: RateRule, now: Optional[float] = None) -> float:
+        """Take a token of the bucket of the key; 0 if there was one, else seconds until there is"""
+        if now is None:
+            now = time.monotonic()
+        shard = self._shards[hash(key) % len(self._shards)]
+        rate, burst = rule.rate, rule.burst
+        with shard.lock:
+            bucket = shard.buckets.get(key)
+            tokens = burst if bucket is None else min(burst, bucket[0] + (now - bucket[1]) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            shard.buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+        if now >= self._next_gc:
+            self.collect(now)
+        return 0.0 if allowed else (1 - tokens) / rate
+
+    def collect(self, now: Optional[float] = None) -> int:
+        """Drop the full buckets of the next shard, return how many"""
+        if now is None:
+            now = time.monotonic()
+        self._next_gc = now + self._gc_interval
+        shard = self._shards[self._next_shard]
+        self._next_shard = (self._next_shard + 1) % len(self._shards)
+        with shard.lock:
+            full = [key for key, bucket in shard.buckets.items() if bucket[2] <= now]
+            for key in full:
+                del shard.buckets[key]
+        return len(full)
+
+    def clear(self) -> None:
+        for shard in self._shards:
+            with shard.lock:
+                shard.buckets.clear()
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+"""
+Background tasks started from a request.
+
+A task copies the contextvars of the code creating it: started by a request,
+it would carry the deadline of the request (its `pymongo.timeout`), its query
+stats, its trace span and its session, and outlive them. `detached` starts
+it in an empty context instead.
+"""
+
+import asyncio
+import contextvars
+from typing import Coroutine
+
+
+def detached(coro: Coroutine) -> asyncio.Task:
+    """Run the coroutine in a task of an empty context, bound to no request"""
+    return contextvars.Context().run(asyncio.ensure_future, coro)
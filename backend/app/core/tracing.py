@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Request tracing: spans linked by trace id, exported in OTLP JSON.
+
+A trace is started for a sampled share of the requests (TRACE_SAMPLE_RATE),
+or when the caller sent a sampled W3C `traceparent` header, unless tracing is
+off (a TRACE_SAMPLE_RATE of 0): a caller can not turn it on. The spans opened
+while it runs are its children, through a contextvar, and it is exported
+once the request is done, as one OTLP `ExportTraceServiceRequest` JSON per
+line, to stdout or to a rotating file (TRACE_EXPORT). The lines are written
+by a background thread, not by the event loop.
+
+Outside of a sampled trace, opening a span costs a contextvar lookup.
+"""
+
+import inspect
+import json
+import logging
+import os
+import random
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from queue import SimpleQueue
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from app.core.config import CONFIG
+
+
+# kinds of the spans in OTLP
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+STATUS_CODE_UNSET = 0
+STATUS_CODE_ERROR = 2
+
+SERVICE_NAME = "snapgram-backend"
+
+
+class Span:
+    """
+    A timed operation of a trace.
+
+    Attributes:
+        trace (Trace): The trace of the span.
+        span_id (str): Id of the span, 16 hex digits.
+        parent_id (Optional[str]): Id of the parent span.
+        name (str): Name of the operation.
+        kind (int): OTLP kind of the span.
+        start (int): Start time in nanoseconds since the epoch.
+        end (int): End time in nanoseconds since the epoch.
+        attributes (Dict[str, Any]): Attributes of the operation.
+        error (Optional[str]): Error raised by the operation.
+    """
+
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'kind', 'start', 'end', 'attributes', 'error')
+
+    def __init__(self, trace: 'Trace', name: str, parent_id: Optional[str] = None,
+                 kind: int = SPAN_KIND_INTERNAL, attributes: Optional[Dict[str, Any]] = None,
+                 start: Optional[int] = None):
+        self.trace = trace
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start = start or time.time_ns()
+        self.end = 0
+        self.attributes = attributes or {}
+        self.error: Optional[str] = None
+        trace.spans.append(self)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """The span in OTLP JSON"""
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(self.end or self.start),
+            "attributes": [{"key": key, "value": _otlp_value(value)}
+                           for key, value in self.attributes.items()],
+            "status": ({"code": STATUS_CODE_ERROR, "message": self.error} if self.error
+                       else {"code": STATUS_CODE_UNSET}),
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class Trace:
+    """
+    The spans of a request.
+
+    Attributes:
+        trace_id (str): Id of the trace, 32 hex digits.
+        spans (List[Span]): The spans, in the order they started.
+    """
+
+    __slots__ = ('trace_id', 'spans')
+
+    def __init__(self, trace_id: Optional[str] = None):
+        self.trace_id = trace_id or f"{random.getrandbits(128):032x}"
+        self.spans: List[Span] = []
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """The trace as an OTLP ExportTraceServiceRequest"""
+        return {"resourceSpans": [{
+            "resource": {"attributes": [
+                {"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": __name__},
+                            "spans": [span.to_otlp() for span in self.spans]}],
+        }]}
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    """An attribute value in OTLP JSON"""
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def parse_traceparent(header: Optional[str]):
+    """Trace id, parent span id and sampled flag of a W3C traceparent header, None if invalid"""
+    parts = (header or '').strip().split('-')
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        flags = int(parts[3][:2], 16)
+        int(parts[1], 16), int(parts[2], 16)
+    except ValueError:
+        return None
+    if parts[1] == '0' * 32 or parts[2] == '0' * 16:
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+
+class LineExporter:
+    """
+    Writes each trace as a line of JSON, from a background thread,
+    to stdout or to a file rotated when it reaches max_bytes.
+    """
+
+    def __init__(self, target: str, max_bytes: int = 10 * 1024 * 1024, backups: int = 5):
+        if target == 'stdout':
+            handler = logging.StreamHandler(sys.stdout)
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+            handler = RotatingFileHandler(target, maxBytes=max_bytes, backupCount=backups)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+
+        queue = SimpleQueue()
+        self.logger = logging.getLogger(f"{__name__}.export.{id(self)}")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(QueueHandler(queue))
+        self.listener = QueueListener(queue, handler)
+        self.listener.start()
+
+    def export(self, payload: Dict[str, Any]) -> None:
+        """Queue a trace to be written"""
+        self.logger.info(json.dumps(payload, separators=(',', ':')))
+
+    def close(self) -> None:
+        """Write the queued traces and stop the thread"""
+        self.listener.stop()
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar('span', default=None)
+
+
+def current_span() -> Optional[Span]:
+    """The span running in the current context, None outside of a sampled trace"""
+    return _current_span.get()
+
+
+class Tracer:
+    """
+    Starts the traces and their spans.
+
+    Attributes:
+        sample_rate (float): Share of the requests traced, from 0 to 1.
+        exporter: Where the traces go, anything with an export(payload) method.
+    """
+
+    def __init__(self, sample_rate: float = CONFIG.trace_sample_rate, exporter=None):
+        self.sample_rate = sample_rate
+        self._exporter = exporter
+
+    @property
+    def exporter(self):
+        """The exporter, the one of TRACE_EXPORT is only created with the first trace"""
+        if self._exporter is None:
+            self._exporter = LineExporter(CONFIG.trace_export, CONFIG.trace_file_max_bytes,
+                                          CONFIG.trace_file_backups)
+        return self._exporter
+
+    @exporter.setter
+    def exporter(self, exporter) -> None:
+        self._exporter = exporter
+
+    def close(self) -> None:
+        """Write the traces not exported yet"""
+        close = getattr(self._exporter, 'close', None)
+        if close is not None:
+            close()
+        self._exporter = None
+
+    @contextmanager
+    def start_trace(self, name: str, kind: int = SPAN_KIND_SERVER,
+                    traceparent: Optional[str] = None) -> Iterator[Optional[Span]]:
+        """
+        Run the block in a new trace, continuing the one of the traceparent header if any.
+        Yields the root span, or None when the trace is not sampled.
+        """
+        parent = parse_traceparent(traceparent)
+        if parent is not None:
+            trace_id, parent_id, sampled = parent
+            sampled = sampled and self.sample_rate > 0
+        else:
+            trace_id, parent_id = None, None
+            sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        if not sampled:
+            yield None
+            return
+
+        root = Span(Trace(trace_id), name, parent_id=parent_id, kind=kind)
+        token = _current_span.set(root)
+        try:
+            yield root
+        except BaseException as e:
+            root.error = repr(e)
+            raise
+        finally:
+            root.end = time.time_ns()
+            _current_span.reset(token)
+            self.exporter.export(root.trace.to_otlp())
+
+    @contextmanager
+    def span(self, name: str, kind: int = SPAN_KIND_INTERNAL, **attributes) -> Iterator[Optional[Span]]:
+        """Run the block in a child span of the current one, if any"""
+        parent = _current_span.get()
+        if parent is None:
+            yield None
+            return
+
+        span = Span(parent.trace, name, parent_id=parent.span_id, kind=kind, attributes=attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = repr(e)
+            raise
+        finally:
+            span.end = time.time_ns()
+            _current_span.reset(token)
+
+    def add_span(self, name: str, seconds: float, kind: int = SPAN_KIND_INTERNAL,
+                 error: Optional[str] = None, **attributes) -> None:
+        """Add a span ending now to the current one, for an operation timed elsewhere"""
+        parent = _current_span.get()
+        if parent is None:
+            return
+        end = time.time_ns()
+        span = Span(parent.trace, name, parent_id=parent.span_id, kind=kind,
+                    attributes=attributes, start=end - int(seconds * 1e9))
+        span.end = end
+        span.error = error
+
+    def traced(self, name: Optional[str] = None) -> Callable:
+        """Decorator running a function, sync or async, in a span"""
+        def decorator(function: Callable) -> Callable:
+            span_name = name or function.__name__
+            if inspect.iscoroutinefunction(function):
+                @wraps(function)
+                async def wrapper(*args, **kwargs):
+                    with self.span(span_name):
+                        return await function(*args, **kwargs)
+            else:
+                @wraps(function)
+                def wrapper(*args, **kwargs):
+                    with self.span(span_name):
+                        return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+
+tracer = Tracer()
@@ -3,14 +3,14 @@
 The BaseModel module that all classes will inherit from
 """
 
-from beanie import Document
+from app.models.engine.read_routing import RoutedDocument
 from pydantic import Field
 from typing import Optional
 from datetime import datetime
 import uuid
 
 
-class Common(Document):
+class Common(RoutedDocument):
     """
     Base class for MongoDB documents using Beanie and Pydantic.
 
@@ -1,24 +1,102 @@
 #!/usr/bin/env python3
 """ Module for MongoDB database connection. """
-from beanie import init_beanie
-from motor.motor_asyncio import AsyncIOMotorClient
+from typing import Any, Dict, List, Optional, Type
+from beanie import Document, init_beanie
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 from app.core.config import CONFIG
 from app.models.post import Post
 from app.models.user import User
 from app.models.token import BlackListedTokens
 from app.models.comment import Comment
 from app.models.like import Like
+from app.models.notification import Notification
+from app.models.suggestion import Suggestions
+from app.models.engine.read_routing import read_router
+from app.models.engine.monitoring import command_monitor
+from app.models.engine.slow_queries import slow_query_log
+from app.models.engine import media_storage
+
+
+DOCUMENT_MODELS: List[Type[Document]] = [User, Post, Comment, Like, Notification, Suggestions, BlackListedTokens]
+
+
+class DBStorage:
+    """
+    MongoDB storage engine.
+
+    Attributes:
+        name (str): Name of the engine, as set in STORAGE_ENGINE.
+        supports_sessions (bool): Whether the engine supports client sessions.
+        url (str): MongoDB connection url.
+        db_name (str): Name of the database.
+        client: The motor client, once initialized.
+        database: The motor database, once initialized.
+    """
+
+    name = 'mongodb'
+    supports_sessions = True
+
+    def __init__(self, url: Optional[str] = None, db_name: Optional[str] = None):
+        self.url = url or CONFIG.mongodb_url
+        self.db_name = db_name or CONFIG.db_name
+        self.client: Optional[AsyncIOMotorClient] = None
+        self.database: Optional[AsyncIOMotorDatabase] = None
+
+    def create_client(self) -> AsyncIOMotorClient:
+        """Create the motor client, its commands are reported to the command monitor"""
+        return AsyncIOMotorClient(self.url, event_listeners=[command_monitor])
+
+    async def init(self, document_models: Optional[List[Type[Document]]] = None) -> AsyncIOMotorDatabase:
+        """
+        Connect to the database and setup Beanie ORM for the document models.
+        """
+        self.client = self.create_client()
+        self.database = self.client[self.db_name]
+        await init_beanie(self.database, document_models=document_models or DOCUMENT_MODELS)
+        read_router.bind(self.client if self.supports_sessions else None)
+        slow_query_log.bind(self)
+        return self.database
+
+    async def explain(self, command: Dict[str, Any]) -> Dict[str, Any]:
+        """Run the command with explain, in executionStats verbosity"""
+        return await self.database.command({'explain': command, 'verbosity': 'executionStats'})
+
+    async def drop(self) -> None:
+        """Drop the database"""
+        await self.client.drop_database(self.db_name)
+
+
+def get_storage(engine: Optional[str] = None, db_name: Optional[str] = None) -> DBStorage:
+    """
+    Return the storage engine by name: 'mongodb' or 'memory'.
+    Defaults to the STORAGE_ENGINE setting.
+    """
+    engine = engine or CONFIG.storage_engine
+    if engine == DBStorage.name:
+        return DBStorage(db_name=db_name)
+    if engine == 'memory':
+        # the in-memory engine depends on mongomock, only import it when used
+        from app.models.engine.memory_storage import MemoryStorage
+        return MemoryStorage(db_name=db_name)
+    raise ValueError(f"Unknown storage engine: {engine}")
+
+
+# the storage engine initialized at startup
+storage: Optional[DBStorage] = None
 
 
 async def init_db():
     """
     Initialize MongoDB database connection and setup Beanie ORM.
-    This function connects to MongoDB using the MONGODB_URL.
+    This function connects to MongoDB using the MONGODB_URL,
+    or keeps the data in memory when STORAGE_ENGINE is 'memory'.
     Note: Beanie is an async MongoDB ORM for Python.
     """
+    global storage
     try:
-        client = AsyncIOMotorClient(CONFIG.mongodb_url)
-        database = client[CONFIG.db_name]
-        await init_beanie(database, document_models=[User, Post, Comment, Like, BlackListedTokens])
+        storage = get_storage()
+        await storage.init()
+        media_storage.media_store = media_storage.get_media_store(storage)
+        await media_storage.media_store.init()
     except Exception as e:
         raise ConnectionError(f"Failed to connect to the database: {e}")
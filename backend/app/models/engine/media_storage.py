@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+"""
+Module for the storage of the uploaded media.
+
+The files are streamed in and out chunk by chunk, never held in memory
+whole: into GridFS (the `media` bucket of the database), or into files of
+MEDIA_DIR with the memory storage engine or MEDIA_STORE=disk. The files
+are immutable once uploaded.
+
+The files are content addressed: the SHA-256 of an upload is computed while
+it streams in, and when a file with the same content is already stored the
+new copy is dropped and the existing file returned, so each content is
+stored once. An upload to GridFS is spooled to a temporary file until it is
+hashed, so the database is never written a content it already has, at the
+cost of writing every upload once to the local disk. The file returned for
+a content already stored has the name and the user of the upload, but the
+stored file keeps the ones of its first upload: `info` (and `GET /media`)
+answers with them.
+
+The posts showing a file hold a reference to it (see `retain` and
+`release`): a file no post references any more is deleted. A file uploaded
+but never shown by a post is deleted by `sweep_orphans` once no post
+referenced it for MEDIA_ORPHAN_SECONDS since its last upload.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Iterable, List, Optional
+import anyio
+from bson import ObjectId
+from bson.errors import InvalidId
+from gridfs.errors import NoFile
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from app.core.config import CONFIG
+from app.core.metrics import REGISTRY
+from app.models.media import MediaFile, media_id_from_url
+
+DEDUPLICATED = REGISTRY.counter(
+    "media_deduplicated_total", "Number of uploads of a content already stored")
+DEDUPLICATED_BYTES = REGISTRY.counter(
+    "media_deduplicated_bytes_total", "Bytes of the uploads of a content already stored")
+SWEPT = REGISTRY.counter("media_swept_total", "Number of uploaded files deleted without ever being referenced")
+
+logger = logging.getLogger(__name__)
+
+SHA256_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+
+class MediaTooLarge(Exception):
+    """The upload is over MEDIA_MAX_BYTES"""
+
+
+def _object_id(media_id: str) -> Optional[ObjectId]:
+    try:
+        return ObjectId(media_id)
+    except (InvalidId, TypeError):
+        return None
+
+
+async def _hashed(chunks: AsyncIterator[bytes], digest, max_bytes: int) -> AsyncIterator[bytes]:
+    """The chunks, added to the digest, raising MediaTooLarge past max_bytes"""
+    length = 0
+    async for chunk in chunks:
+        length += len(chunk)
+        if length > max_bytes:
+            raise MediaTooLarge()
+        digest.update(chunk)
+        yield chunk
+
+
+def _deduplicated(media: MediaFile, filename: str, user_id: Optional[str]) -> MediaFile:
+    """The stored file of the content, as uploaded by the user"""
+    DEDUPLICATED.inc()
+    DEDUPLICATED_BYTES.inc(amount=media.length)
+    return media.model_copy(update={'filename': filename, 'user_id': user_id})
+
+
+class MediaStore:
+    """
+    Where the media files are kept.
+
+    Attributes:
+        chunk_size (int): Size of the chunks written and read, in bytes.
+    """
+
+    def __init__(self, chunk_size: int = CONFIG.media_chunk_bytes):
+        self.chunk_size = chunk_size
+
+    async def init(self) -> None:
+        """Create what the store needs"""
+
+    async def save(self, chunks: AsyncIterator[bytes], filename: str, content_type: str,
+                   user_id: Optional[str] = None, max_bytes: int = CONFIG.media_max_bytes) -> MediaFile:
+        """
+        Write the chunks to a new file, or return the file with the same content.
+        Raise MediaTooLarge past max_bytes (nothing is kept).
+        """
+        raise NotImplementedError
+
+    async def info(self, media_id: str) -> Optional[MediaFile]:
+        """The file of this id, None when there is none"""
+        raise NotImplementedError
+
+    async def find(self, sha256: str) -> Optional[MediaFile]:
+        """The file with this SHA-256, None when there is none"""
+        raise NotImplementedError
+
+    def read(self, media_id: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """The bytes of the file from start to end (included), chunk by chunk"""
+        raise NotImplementedError
+
+    async def add_refs(self, media_id: str, amount: int) -> Optional[int]:
+        """
+        Add to the references to the file, return their number, None when there is no file.
+        The file is deleted when they are removed and none is left.
+        """
+        raise NotImplementedError
+
+    async def delete(self, media_id: str) -> bool:
+        """Delete the file, whether it existed"""
+        raise NotImplementedError
+
+    async def sweep(self, before: datetime) -> int:
+        """Delete the files without references last uploaded before this time, return how many"""
+        raise NotImplementedError
+
+
+class GridFSMediaStore(MediaStore):
+    """
+    The media in the GridFS bucket `media` of the database, their SHA-256
+    and references in the metadata of the files, the SHA-256 unique.
+    """
+
+    BUCKET = 'media'
+
+    def __init__(self, database, chunk_size: int = CONFIG.media_chunk_bytes):
+        super().__init__(chunk_size)
+        self.files = database[f"{self.BUCKET}.files"]
+        self.chunks = database[f"{self.BUCKET}.chunks"]
+        self.bucket = AsyncIOMotorGridFSBucket(database, bucket_name=self.BUCKET, chunk_size_bytes=chunk_size)
+
+    async def init(self) -> None:
+        await self.files.create_index('metadata.sha256', unique=True, sparse=True)
+
+    async def save(self, chunks: AsyncIterator[bytes], filename: str, content_type: str,
+                   user_id: Optional[str] = None, max_bytes: int = CONFIG.media_max_bytes) -> MediaFile:
+        digest = hashlib.sha256()
+        # hashed before anything is written to the database
+        async with anyio.wrap_file(tempfile.TemporaryFile()) as spool:
+            buffer = bytearray()
+            async for chunk in _hashed(chunks, digest, max_bytes):
+                buffer += chunk
+                if len(buffer) >= self.chunk_size:
+                    await spool.write(bytes(buffer))
+                    buffer.clear()
+            await spool.write(bytes(buffer))
+            sha256 = digest.hexdigest()
+            existing = await self.find(sha256)
+            if existing:
+                await self._uploaded_again(existing)
+                return _deduplicated(existing, filename, user_id)
+
+            await spool.seek(0)
+            media_id = ObjectId()
+            metadata = {'content_type': content_type, 'user_id': user_id, 'refs': 0, 'sha256': sha256}
+            grid_in = self.bucket.open_upload_stream_with_id(media_id, filename, metadata=metadata)
+            try:
+                while chunk := await spool.read(self.chunk_size):
+                    await grid_in.write(chunk)
+            except BaseException:
+                await grid_in.abort()
+                raise
+        try:
+            await grid_in.close()
+        except DuplicateKeyError:
+            # the same content uploaded at the same time
+            await self.chunks.delete_many({'files_id': media_id})
+            existing = await self.find(sha256)
+            await self._uploaded_again(existing)
+            return _deduplicated(existing, filename, user_id)
+        return await self.info(str(media_id))
+
+    async def _uploaded_again(self, media: MediaFile) -> None:
+        """Keep a file without references from the sweep, as long as for a new upload"""
+        if media.refs <= 0:
+            await self.files.update_one({'_id': ObjectId(media.id)},
+                                        {'$set': {'metadata.uploaded_again_at': datetime.now(timezone.utc)}})
+
+    @staticmethod
+    def _media(doc) -> MediaFile:
+        metadata = doc.get('metadata') or {}
+        return MediaFile(id=str(doc['_id']), filename=doc['filename'], length=doc['length'],
+                         content_type=metadata.get('content_type', 'application/octet-stream'),
+                         uploaded_at=doc['uploadDate'].replace(tzinfo=timezone.utc),
+                         user_id=metadata.get('user_id'), sha256=metadata.get('sha256'),
+                         refs=metadata.get('refs', 0))
+
+    async def info(self, media_id: str) -> Optional[MediaFile]:
+        oid = _object_id(media_id)
+        doc = await self.files.find_one({'_id': oid}) if oid else None
+        return self._media(doc) if doc else None
+
+    async def find(self, sha256: str) -> Optional[MediaFile]:
+        doc = await self.files.find_one({'metadata.sha256': sha256})
+        return self._media(doc) if doc else None
+
+    async def read(self, media_id: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        grid_out = await self.bucket.open_download_stream(ObjectId(media_id))
+        end = grid_out.length - 1 if end is None else end
+        grid_out.seek(start)
+        left = end - start + 1
+        while left > 0:
+            chunk = await grid_out.read(min(self.chunk_size, left))
+            if not chunk:
+                break
+            left -= len(chunk)
+            yield chunk
+
+    async def add_refs(self, media_id: str, amount: int) -> Optional[int]:
+        oid = _object_id(media_id)
+        if not oid:
+            return None
+        doc = await self.files.find_one_and_update(
+            {'_id': oid}, {'$inc': {'metadata.refs': amount}}, return_document=ReturnDocument.AFTER)
+        if not doc:
+            return None
+        refs = doc['metadata']['refs']
+        if amount < 0 and refs <= 0:
+            # unless referenced again meanwhile
+            deleted = await self.files.delete_one({'_id': oid, 'metadata.refs': {'$lte': 0}})
+            if deleted.deleted_count:
+                await self.chunks.delete_many({'files_id': oid})
+        return refs
+
+    async def delete(self, media_id: str) -> bool:
+        oid = _object_id(media_id)
+        if not oid:
+            return False
+        try:
+            await self.bucket.delete(oid)
+        except NoFile:
+            return False
+        return True
+
+    async def sweep(self, before: datetime) -> int:
+        orphan = {'metadata.refs': {'$lte': 0}, 'uploadDate': {'$lt': before},
+                  'metadata.uploaded_again_at': {'$not': {'$gte': before}}}
+        swept = 0
+        async for doc in self.files.find(orphan, {'_id': 1}):
+            # unless referenced or uploaded again meanwhile
+            deleted = await self.files.delete_one({'_id': doc['_id'], **orphan})
+            if deleted.deleted_count:
+                await self.chunks.delete_many({'files_id': doc['_id']})
+                swept += 1
+        return swept
+
+
+class DiskMediaStore(MediaStore):
+    """
+    The media in files of a directory: `<id>` for the bytes, `<id>.json`
+    for the rest, and `sha256-<hash>` the id of the file of a content. A
+    file is written as `<id>.part`, renamed once complete, so a partial
+    upload is never served.
+
+    The references are counted by the process: the directory is not
+    shared by several workers. The `<id>.json` of a file is written again
+    (or touched) with each change of its references and each upload of its
+    content, its modification time is the one the sweep compares.
+
+    Attributes:
+        directory (str): The directory of the files.
+    """
+
+    def __init__(self, directory: str = CONFIG.media_dir, chunk_size: int = CONFIG.media_chunk_bytes):
+        super().__init__(chunk_size)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        # the files completed and the references updated one at a time
+        self._lock = anyio.Lock()
+
+    def _path(self, media_id: str) -> Optional[str]:
+        # the id is an ObjectId, never a path
+        return os.path.join(self.directory, media_id) if _object_id(media_id) else None
+
+    def _hash_path(self, sha256: str) -> Optional[str]:
+        return os.path.join(self.directory, f"sha256-{sha256}") if SHA256_PATTERN.fullmatch(sha256) else None
+
+    async def _write_info(self, media: MediaFile) -> None:
+        async with await anyio.open_file(f"{self._path(media.id)}.json", 'w') as f:
+            await f.write(media.model_dump_json(by_alias=True, exclude={'url'}))
+
+    async def save(self, chunks: AsyncIterator[bytes], filename: str, content_type: str,
+                   user_id: Optional[str] = None, max_bytes: int = CONFIG.media_max_bytes) -> MediaFile:
+        media_id = str(ObjectId())
+        path = self._path(media_id)
+        digest = hashlib.sha256()
+        length = 0
+        buffer = bytearray()
+        try:
+            async with await anyio.open_file(f"{path}.part", 'wb') as f:
+                async for chunk in _hashed(chunks, digest, max_bytes):
+                    length += len(chunk)
+                    buffer += chunk
+                    # the small chunks of the request are written a chunk of the store at a time
+                    if len(buffer) >= self.chunk_size:
+                        await f.write(bytes(buffer))
+                        buffer.clear()
+                await f.write(bytes(buffer))
+
+            async with self._lock:
+                existing = await self.find(digest.hexdigest())
+                if existing:
+                    await anyio.Path(f"{path}.part").unlink()
+                    if existing.refs <= 0:
+                        # kept from the sweep, as long as a new upload
+                        await anyio.Path(f"{self._path(existing.id)}.json").touch()
+                    return _deduplicated(existing, filename, user_id)
+                media = MediaFile(id=media_id, filename=filename, content_type=content_type, length=length,
+                                  uploaded_at=datetime.now(timezone.utc), user_id=user_id,
+                                  sha256=digest.hexdigest())
+                await self._write_info(media)
+                await anyio.Path(f"{path}.part").rename(path)
+                await anyio.Path(self._hash_path(media.sha256)).write_text(media_id)
+        except BaseException:
+            with anyio.CancelScope(shield=True):
+                await anyio.Path(f"{path}.part").unlink(missing_ok=True)
+            raise
+        return media
+
+    async def info(self, media_id: str) -> Optional[MediaFile]:
+        path = self._path(media_id)
+        if not path or not await anyio.Path(path).exists():
+            return None
+        return MediaFile(**json.loads(await anyio.Path(f"{path}.json").read_text()))
+
+    async def find(self, sha256: str) -> Optional[MediaFile]:
+        path = self._hash_path(sha256)
+        if not path or not await anyio.Path(path).exists():
+            return None
+        return await self.info(await anyio.Path(path).read_text())
+
+    async def read(self, media_id: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        async with await anyio.open_file(self._path(media_id), 'rb') as f:
+            await f.seek(start)
+            left = None if end is None else end - start + 1
+            while left is None or left > 0:
+                chunk = await f.read(self.chunk_size if left is None else min(self.chunk_size, left))
+                if not chunk:
+                    break
+                if left is not None:
+                    left -= len(chunk)
+                yield chunk
+
+    async def add_refs(self, media_id: str, amount: int) -> Optional[int]:
+        async with self._lock:
+            media = await self.info(media_id)
+            if media is None:
+                return None
+            media.refs += amount
+            if amount < 0 and media.refs <= 0:
+                await self._delete(media)
+            else:
+                await self._write_info(media)
+            return media.refs
+
+    async def _delete(self, media: MediaFile) -> None:
+        path = self._path(media.id)
+        await anyio.Path(path).unlink()
+        await anyio.Path(f"{path}.json").unlink(missing_ok=True)
+        if media.sha256:
+            await anyio.Path(self._hash_path(media.sha256)).unlink(missing_ok=True)
+
+    async def delete(self, media_id: str) -> bool:
+        async with self._lock:
+            media = await self.info(media_id)
+            if media is None:
+                return False
+            await self._delete(media)
+            return True
+
+    async def sweep(self, before: datetime) -> int:
+        swept = 0
+        async for path in anyio.Path(self.directory).iterdir():
+            if not _object_id(path.name):
+                continue
+            async with self._lock:
+                media = await self.info(path.name)
+                if media is None or media.refs > 0:
+                    continue
+                modified = (await anyio.Path(f"{path}.json").stat()).st_mtime
+                if modified < before.timestamp():
+                    await self._delete(media)
+                    swept += 1
+        return swept
+
+
+def get_media_store(storage) -> MediaStore:
+    """
+    The media store of MEDIA_STORE: 'gridfs' in the database of the storage engine,
+    or 'disk'. The memory storage engine always keeps the media on disk.
+    """
+    if CONFIG.media_store == 'gridfs' and storage.name == 'mongodb':
+        return GridFSMediaStore(storage.database)
+    if CONFIG.media_store not in ('gridfs', 'disk'):
+        raise ValueError(f"Unknown media store: {CONFIG.media_store}")
+    return DiskMediaStore()
+
+
+# the media store initialized at startup
+media_store: Optional[MediaStore] = None
+
+
+def media_ids(urls: Iterable[Optional[str]]) -> List[str]:
+    """The ids of the uploaded media among the urls"""
+    return [media_id for media_id in map(media_id_from_url, urls) if media_id]
+
+
+async def retain(urls: Iterable[Optional[str]]) -> None:
+    """Reference the uploaded media of the urls (the media of a post)"""
+    for media_id in media_ids(urls):
+        await media_store.add_refs(media_id, 1)
+
+
+async def release(urls: Iterable[Optional[str]]) -> None:
+    """Remove a reference to the uploaded media of the urls, deleting the ones left unreferenced"""
+    for media_id in media_ids(urls):
+        await media_store.add_refs(media_id, -1)
+
+
+async def sweep_orphans(interval: float = CONFIG.media_sweep_seconds,
+                        grace: float = CONFIG.media_orphan_seconds) -> None:
+    """Delete every interval the files no post referenced for grace seconds since their last upload"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            swept = await media_store.sweep(datetime.now(timezone.utc) - timedelta(seconds=grace))
+        except Exception:
+            logger.exception("Failed to sweep the unreferenced media")
+            continue
+        SWEPT.inc(amount=swept)
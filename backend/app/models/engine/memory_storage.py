@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""
+Module for the in-memory storage engine.
+
+The documents are kept in process by mongomock, behind the same motor API as
+MongoDB, so the models and the routes run unchanged. Mongomock is completed
+with what beanie needs to fetch the links (`$lookup` with a sub-pipeline on
+lists of DBRef, `$unset`) and with the two things MongoDB does to make these
+queries fast: an `_id` index, and running a `$match` before the `$lookup`
+stages it does not depend on.
+
+The commands are reported to the command monitor like those sent to MongoDB,
+without their size, and `explain` tells whether a query uses the `_id` index
+(IDHACK) or scans the collection (COLLSCAN). The partial filter of the
+unique indexes created by beanie is kept.
+
+All this is done by subclasses of the mongomock client, database and
+collection, used only by the client of this engine: mongomock itself is left
+as it is for the other code of the process using it.
+
+Requires the optional `mongomock-motor` package.
+"""
+
+from contextvars import ContextVar
+from functools import wraps
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from bson import DBRef
+
+from app.models.engine.db_storage import DBStorage
+from app.models.engine.monitoring import record_command
+from app.models.engine.slow_queries import command_filter, slow_query_log
+
+try:
+    from mongomock import aggregate as mongomock_aggregate
+    from mongomock.collection import Collection as MongoMockCollection
+    from mongomock.command_cursor import CommandCursor
+    from mongomock.database import Database as MongoMockDatabase
+    from mongomock.filtering import filter_applies
+    from mongomock.mongo_client import MongoClient as MongoMockClient
+    from mongomock_motor import AsyncMongoMockClient
+except ImportError as e:  # pragma: no cover
+    raise ImportError(
+        "The memory storage engine requires mongomock-motor: pip install mongomock-motor") from e
+
+
+# stages only adding or removing the fields named by them
+FIELD_STAGES = ('$lookup', '$unwind', '$set', '$addFields', '$unset')
+LOGICAL_OPERATORS = ('$and', '$or', '$nor')
+
+# the MongoDB command sent by each method of the collections
+COMMAND_NAMES = {
+    'find': 'find',
+    'find_one': 'find',
+    'aggregate': 'aggregate',
+    'count_documents': 'aggregate',
+    'distinct': 'distinct',
+    'insert_one': 'insert',
+    'insert_many': 'insert',
+    'update_one': 'update',
+    'update_many': 'update',
+    'replace_one': 'update',
+    'delete_one': 'delete',
+    'delete_many': 'delete',
+    'find_one_and_delete': 'findAndModify',
+    'find_one_and_replace': 'findAndModify',
+    'find_one_and_update': 'findAndModify',
+    'bulk_write': 'bulkWrite',
+}
+
+# whether a command is being run, the calls it makes to the other methods are not reported
+_in_command: ContextVar[bool] = ContextVar('in_command', default=False)
+
+
+def _path_values(document: Dict[str, Any], path: str) -> List[Any]:
+    """
+    Return the values found at a dotted path of a document,
+    going through the lists and the DBRef (`posts.$id`).
+    """
+    values: List[Any] = [document]
+    for key in path.split('.'):
+        found = []
+        for value in values:
+            for item in (value if isinstance(value, list) else [value]):
+                if isinstance(item, DBRef):
+                    item = {'$id': item.id, '$ref': item.collection}
+                if isinstance(item, dict) and key in item:
+                    found.append(item[key])
+        values = found
+
+    flat = []
+    for value in values:
+        if isinstance(value, list):
+            flat.extend(value)
+        else:
+            flat.append(value)
+    return flat
+
+
+def _find_by_id(collection: MongoMockCollection, ids: Iterable[Any]) -> List[Dict[str, Any]]:
+    """Return the documents of the ids using the `_id` index, in the order of the ids"""
+    store = collection._store
+    documents = []
+    seen = set()
+    for _id in ids:
+        if _id in seen or _id not in store:
+            continue
+        seen.add(_id)
+        documents.append(store[_id])
+    return documents
+
+
+def _handle_lookup_stage(in_collection, database, options):
+    """`$lookup` stage supporting lists of DBRef and a sub-pipeline after the equality match"""
+    if 'let' in options:
+        return mongomock_aggregate._PIPELINE_HANDLERS['$lookup'](in_collection, database, options)
+
+    local_field = options['localField']
+    foreign_field = options['foreignField']
+    pipeline = options.get('pipeline')
+    foreign_collection = database.get_collection(options['from'])
+
+    for document in in_collection:
+        values = _path_values(document, local_field)
+        if foreign_field == '_id':
+            # the lookup stages only set top level fields, a shallow copy keeps the store intact
+            matches = [dict(doc) for doc in _find_by_id(foreign_collection, values)]
+        else:
+            matches = list(foreign_collection.find({foreign_field: {'$in': values or [None]}}))
+        if pipeline:
+            matches = _process_pipeline(matches, database, pipeline)
+        document[options['as']] = matches
+
+    return in_collection
+
+
+def _handle_unset_stage(in_collection, unused_database, options):
+    """`$unset` stage of top level fields"""
+    fields = [options] if isinstance(options, str) else options
+    for document in in_collection:
+        for field in fields:
+            document.pop(field, None)
+    return in_collection
+
+
+def _handle_facet_stage(in_collection, database, options):
+    """`$facet` stage, its pipelines run with the stages of this engine"""
+    return [{title: _process_pipeline(in_collection, database, pipeline) for title, pipeline in options.items()}]
+
+
+# the stages run by this engine instead of mongomock
+STAGE_HANDLERS = {
+    '$lookup': _handle_lookup_stage,
+    '$unset': _handle_unset_stage,
+    '$facet': _handle_facet_stage,
+}
+
+
+def _process_pipeline(documents: List[Dict[str, Any]], database, pipeline: List[Dict[str, Any]]):
+    """Run a pipeline on the documents, the stages of STAGE_HANDLERS by this engine, the others by mongomock"""
+    for stage in pipeline:
+        operator, options = next(iter(stage.items()))
+        handler = STAGE_HANDLERS.get(operator)
+        if handler is not None:
+            documents = handler(documents, database, options)
+        else:
+            documents = list(mongomock_aggregate.process_pipeline(documents, database, [stage], None))
+    return documents
+
+
+def _stage_fields(stage: Dict[str, Any]) -> Optional[set]:
+    """Return the top level fields written by a stage, None when unknown"""
+    operator, options = next(iter(stage.items()))
+    if operator not in FIELD_STAGES:
+        return None
+    if operator == '$lookup':
+        return {options['as'].split('.')[0]}
+    if operator == '$unwind':
+        path = options['path'] if isinstance(options, dict) else options
+        return {path.lstrip('$').split('.')[0]}
+    if operator == '$unset':
+        fields = [options] if isinstance(options, str) else options
+        return {field.split('.')[0] for field in fields}
+    return {field.split('.')[0] for field in options}
+
+
+def _filter_fields(spec: Dict[str, Any]) -> Optional[set]:
+    """Return the top level fields read by a filter, None when it cannot be known"""
+    fields = set()
+    for key, value in spec.items():
+        if key in LOGICAL_OPERATORS:
+            for sub_spec in value:
+                sub_fields = _filter_fields(sub_spec)
+                if sub_fields is None:
+                    return None
+                fields |= sub_fields
+        elif key.startswith('$'):
+            return None
+        else:
+            fields.add(key.split('.')[0])
+    return fields
+
+
+def _split_leading_match(pipeline: List[Dict[str, Any]]):
+    """
+    Like the MongoDB planner, take out the first `$match` when the stages
+    before it do not write any of the fields it reads.
+    Return the filter and the remaining pipeline.
+    """
+    written = set()
+    for index, stage in enumerate(pipeline):
+        if '$match' in stage:
+            read = _filter_fields(stage['$match'])
+            if read is None or read & written:
+                break
+            return stage['$match'], pipeline[:index] + pipeline[index + 1:]
+        fields = _stage_fields(stage)
+        if fields is None:
+            break
+        written |= fields
+    return {}, pipeline
+
+
+def _filter_ids(filter) -> Optional[List[Any]]:
+    """The ids selected by a filter on `_id` (equality or `$in`), None for other filters"""
+    _id = filter.get('_id') if isinstance(filter, dict) else None
+    if _id is None:
+        return None
+    if isinstance(_id, dict):
+        return _id.get('$in') if list(_id) == ['$in'] else None
+    return None if isinstance(_id, list) else [_id]
+
+
+def _command_document(collection, command_name: str, args, kwargs) -> Dict[str, Any]:
+    """The MongoDB command equivalent to a call of a collection method"""
+    name = collection.name
+    if command_name == 'distinct':
+        query = args[1] if len(args) > 1 else kwargs.get('filter')
+        return {'distinct': name, 'key': args[0] if args else kwargs.get('key'), 'query': query or {}}
+
+    query = args[0] if args else kwargs.get('filter', kwargs.get('pipeline'))
+    if command_name == 'aggregate':
+        # count_documents sends its filter in a $match
+        pipeline = query if isinstance(query, list) else [{'$match': query or {}}]
+        return {'aggregate': name, 'pipeline': pipeline}
+    if command_name == 'find':
+        return {'find': name, 'filter': query or {}}
+    if command_name == 'findAndModify':
+        return {'findAndModify': name, 'query': query or {}}
+    if command_name in ('update', 'delete'):
+        return {command_name: name, f"{command_name}s": [{'q': query or {}}]}
+    return {command_name: name}
+
+
+def _report(command_name: str, seconds: float, collection, args, kwargs) -> None:
+    """Report a command, with its command document only when it is slow"""
+    command = None
+    if slow_query_log.enabled(seconds):
+        command = _command_document(collection, command_name, args, kwargs)
+    record_command(command_name, seconds, command=command, collection=collection.name)
+
+
+def _monitored(method: Callable, command_name: str) -> Callable:
+    """Report a call of a collection method as a command"""
+    # find and aggregate return a cursor, the command is reported when it is created
+    @wraps(method)
+    def monitored(self, *args, **kwargs):
+        if _in_command.get():
+            return method(self, *args, **kwargs)
+        token = _in_command.set(True)
+        start = perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            _in_command.reset(token)
+            _report(command_name, perf_counter() - start, self, args, kwargs)
+    return monitored
+
+
+class MemoryCollection(MongoMockCollection):
+    """A mongomock collection with an `_id` index, the stages beanie needs, and monitored"""
+
+    def with_options(self, *args, **kwargs) -> 'MemoryCollection':
+        return _memory(super().with_options(*args, **kwargs), MemoryCollection)
+
+    def _iter_documents(self, filter):
+        """Iterate over the matching documents, using the `_id` index when the filter allows it"""
+        ids = _filter_ids(filter)
+        if ids is not None:
+            return (document for document in _find_by_id(self, ids)
+                    if filter_applies(filter, document))
+        return super()._iter_documents(filter)
+
+    def create_indexes(self, indexes, session=None):
+        """Create the indexes with all their options, mongomock drops the partial filters"""
+        return [self.create_index(list(index.document['key'].items()), session=session,
+                                  **{key: value for key, value in index.document.items() if key != 'key'})
+                for index in indexes]
+
+    def aggregate(self, pipeline, session=None, **unused_kwargs):
+        """Aggregate, starting from the documents of the leading `$match`"""
+        if session:
+            raise NotImplementedError('Mongomock does not handle sessions yet')
+        spec, pipeline = _split_leading_match(list(pipeline))
+        in_collection = [document for document in self.find(spec)]
+        return CommandCursor(_process_pipeline(in_collection, self.database, pipeline))
+
+
+for _method_name, _command_name in COMMAND_NAMES.items():
+    setattr(MemoryCollection, _method_name, _monitored(getattr(MemoryCollection, _method_name), _command_name))
+
+
+class MemoryDatabase(MongoMockDatabase):
+    """A mongomock database of memory collections"""
+
+    def get_collection(self, *args, **kwargs) -> MemoryCollection:
+        return _memory(super().get_collection(*args, **kwargs), MemoryCollection)
+
+
+class MemoryClient(MongoMockClient):
+    """A mongomock client of memory databases"""
+
+    def get_database(self, *args, **kwargs) -> MemoryDatabase:
+        return _memory(super().get_database(*args, **kwargs), MemoryDatabase)
+
+
+def _memory(instance, cls):
+    """
+    The mongomock instance made one of this engine: mongomock creates the plain
+    classes, the subclasses only add methods, they keep the same state.
+    """
+    if not isinstance(instance, cls):
+        instance.__class__ = cls
+    return instance
+
+
+class MemoryStorage(DBStorage):
+    """
+    In-memory storage engine, for the tests and the benchmarks.
+    Each instance holds its own data, which is lost with the process.
+    """
+
+    name = 'memory'
+    supports_sessions = False
+
+    def create_client(self) -> AsyncMongoMockClient:
+        """Create the in-memory client"""
+        return AsyncMongoMockClient(mock_mongo_client=MemoryClient())
+
+    async def explain(self, command: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Explain a query like MongoDB does, in executionStats verbosity,
+        the only index being the one of `_id`.
+        """
+        command_name = next(iter(command))
+        collection = self.database.delegate[command[command_name]]
+        query = command_filter(command) or {}
+        if command_name == 'aggregate':
+            query, _ = _split_leading_match(list(query))
+
+        start = perf_counter()
+        ids = _filter_ids(query)
+        returned = sum(1 for _ in collection._iter_documents(query))
+        if ids is not None:
+            plan = {'stage': 'IDHACK'}
+            examined = len(_find_by_id(collection, ids))
+            keys = len(ids)
+        else:
+            plan = {'stage': 'COLLSCAN'}
+            examined = len(collection._store)
+            keys = 0
+        return {
+            'queryPlanner': {'namespace': f"{self.db_name}.{collection.name}", 'winningPlan': plan},
+            'executionStats': {'nReturned': returned,
+                               'executionTimeMillis': round((perf_counter() - start) * 1000),
+                               'totalKeysExamined': keys, 'totalDocsExamined': examined},
+        }
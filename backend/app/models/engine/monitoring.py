@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Module attributing the database commands to the code that sent them.
+
+`track_commands()` starts counting the commands sent in the current context
+(a request, a test), the counts are kept in a contextvar, which motor copies
+to the threads running the commands. The trackings nest: a command counts
+for every tracking it is sent in.
+
+With MongoDB the commands are reported by a pymongo command listener,
+the in-memory engine reports them itself (without their size in bytes).
+Every command is also checked by the slow query log, and added to the
+trace of the request when it is sampled.
+"""
+
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional
+from bson import encode
+from pymongo import monitoring
+from app.core.tracing import SPAN_KIND_CLIENT, current_span, tracer
+from app.models.engine.slow_queries import slow_query_log
+
+
+class DBStats:
+    """
+    Database commands sent during a tracking.
+
+    Attributes:
+        commands (int): Number of commands.
+        seconds (float): Total duration of the commands.
+        bytes (int): Total size of the commands and of their replies.
+        by_command (Dict[str, int]): Number of commands by name (find, aggregate, ...).
+        parent (Optional[DBStats]): The enclosing tracking.
+    """
+
+    def __init__(self, parent: Optional['DBStats'] = None):
+        self.commands = 0
+        self.seconds = 0.0
+        self.bytes = 0
+        self.by_command: Dict[str, int] = {}
+        self.parent = parent
+        # the commands of a request may run in several threads of motor
+        self._lock = threading.Lock()
+
+    def add(self, command_name: Optional[str], seconds: float = 0.0, size: int = 0) -> None:
+        """Count a command (or only the size of a command being sent when no name)"""
+        stats = self
+        while stats is not None:
+            with stats._lock:
+                if command_name:
+                    stats.commands += 1
+                    stats.seconds += seconds
+                    stats.by_command[command_name] = stats.by_command.get(command_name, 0) + 1
+                stats.bytes += size
+            stats = stats.parent
+
+    def __repr__(self) -> str:
+        return (f"DBStats(commands={self.commands}, seconds={self.seconds:.6f}, "
+                f"bytes={self.bytes}, by_command={self.by_command})")
+
+
+_current_stats: ContextVar[Optional[DBStats]] = ContextVar('db_stats', default=None)
+
+
+@contextmanager
+def track_commands() -> Iterator[DBStats]:
+    """Count the database commands sent inside the block"""
+    stats = DBStats(parent=_current_stats.get())
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+
+def record_command(command_name: Optional[str], seconds: float = 0.0, size: int = 0,
+                   command: Optional[Dict[str, Any]] = None, collection: Optional[str] = None,
+                   error: Optional[str] = None) -> None:
+    """Count a command in the current trackings, if any, check whether it is slow and trace it"""
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.add(command_name, seconds, size)
+    if command_name and command is not None:
+        slow_query_log.observe(command_name, command, seconds)
+    if command_name and current_span() is not None:
+        if collection is None and command is not None:
+            collection = str(command.get(command_name, ''))
+        tracer.add_span(f"db.{command_name}", seconds, kind=SPAN_KIND_CLIENT, error=error,
+                        **{"db.system": "mongodb", "db.operation": command_name,
+                           "db.collection": collection or ''})
+
+
+class CommandMonitor(monitoring.CommandListener):
+    """pymongo listener reporting the commands of the motor client"""
+
+    def __init__(self):
+        # the commands being run, only the started event carries them
+        self._commands: Dict[Any, Dict[str, Any]] = {}
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        if slow_query_log.threshold_ms or current_span() is not None:
+            self._commands[event.connection_id, event.request_id] = event.command
+        if _current_stats.get() is not None:
+            record_command(None, size=len(encode(event.command)))
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        command = self._commands.pop((event.connection_id, event.request_id), None)
+        size = len(encode(event.reply)) if _current_stats.get() is not None else 0
+        record_command(event.command_name, event.duration_micros / 1e6, size, command)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        command = self._commands.pop((event.connection_id, event.request_id), None)
+        record_command(event.command_name, event.duration_micros / 1e6, command=command,
+                       error=str(event.failure.get('errmsg', 'failed')))
+
+
+command_monitor = CommandMonitor()
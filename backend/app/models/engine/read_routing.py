@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Routing of the database reads between the primary and the secondaries.
+
+Read-only routes can ask for their queries to be sent to a secondary
+(`secondaryPreferred` bounded by a max staleness), while every request
+authenticated with a token runs inside a causally consistent session, so a
+user always reads his own writes even when the read is served by a secondary.
+"""
+
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Tuple
+
+from beanie import Document
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorClientSession, AsyncIOMotorCollection
+from pymongo.read_preferences import SecondaryPreferred
+
+from app.core.config import CONFIG
+
+
+# collection methods accepting a `session` keyword argument
+SESSION_METHODS = frozenset({
+    'find', 'find_one', 'aggregate', 'count_documents', 'distinct',
+    'insert_one', 'insert_many', 'replace_one', 'update_one', 'update_many',
+    'delete_one', 'delete_many', 'find_one_and_update', 'bulk_write',
+})
+
+_current_session: ContextVar[Optional[AsyncIOMotorClientSession]] = ContextVar(
+    'current_session', default=None)
+_prefer_secondary: ContextVar[bool] = ContextVar('prefer_secondary', default=False)
+
+
+class CausalTokenStore:
+    """
+    Remember, for each token, the cluster and operation times of the last
+    request, so the next session of the same token starts causally after it.
+
+    The store is bounded; the least recently used tokens are forgotten first.
+    """
+
+    def __init__(self, max_tokens: int):
+        self.max_tokens = max_tokens
+        self._times: "OrderedDict[str, Tuple[Any, Any]]" = OrderedDict()
+
+    def get(self, token: str) -> Optional[Tuple[Any, Any]]:
+        """Return the (cluster_time, operation_time) saved for a token"""
+        times = self._times.get(token)
+        if times is not None:
+            self._times.move_to_end(token)
+        return times
+
+    def save(self, token: str, cluster_time: Any, operation_time: Any) -> None:
+        """Save the latest times seen by a token"""
+        if cluster_time is None and operation_time is None:
+            return
+        self._times[token] = (cluster_time, operation_time)
+        self._times.move_to_end(token)
+        while len(self._times) > self.max_tokens:
+            self._times.popitem(last=False)
+
+    def clear(self) -> None:
+        """Forget every token"""
+        self._times.clear()
+
+
+class RoutedCollection:
+    """
+    Proxy of a motor collection that runs the operations inside
+    the causally consistent session of the current request.
+    """
+
+    __slots__ = ('_collection', '_session')
+
+    def __init__(self, collection: AsyncIOMotorCollection, session: AsyncIOMotorClientSession):
+        self._collection = collection
+        self._session = session
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._collection, name)
+        if name not in SESSION_METHODS:
+            return attr
+
+        session = self._session
+
+        def with_session(*args, **kwargs):
+            if kwargs.get('session') is None:
+                kwargs['session'] = session
+            return attr(*args, **kwargs)
+        return with_session
+
+
+class ReadRouter:
+    """
+    Route the collections used by the documents according to the
+    read preference and the session of the current request.
+    """
+
+    def __init__(self):
+        self.client: Optional[AsyncIOMotorClient] = None
+        self.tokens = CausalTokenStore(CONFIG.causal_sessions_max_tokens)
+        self.secondary_preference = SecondaryPreferred(
+            max_staleness=CONFIG.read_max_staleness_seconds)
+        self._secondary_collections: Dict[str, AsyncIOMotorCollection] = {}
+
+    def bind(self, client: Optional[AsyncIOMotorClient]) -> None:
+        """Set the client used to start the sessions, None disables the routing"""
+        self.client = client
+        self.tokens.clear()
+        self._secondary_collections.clear()
+
+    @property
+    def enabled(self) -> bool:
+        """Routing is only done when configured and bound to a client"""
+        return CONFIG.secondary_reads and self.client is not None
+
+    def route(self, collection: AsyncIOMotorCollection) -> Any:
+        """Return the collection to use for the current request"""
+        if _prefer_secondary.get():
+            secondary = self._secondary_collections.get(collection.full_name)
+            if secondary is None:
+                secondary = collection.with_options(read_preference=self.secondary_preference)
+                self._secondary_collections[collection.full_name] = secondary
+            collection = secondary
+
+        session = _current_session.get()
+        if session is None:
+            return collection
+        return RoutedCollection(collection, session)
+
+    @asynccontextmanager
+    async def causal_session(self, token: Optional[str]):
+        """
+        Run the block inside a causally consistent session tied to the token.
+        Without a token (or when routing is disabled) nothing is done.
+        """
+        if not token or not self.enabled:
+            yield None
+            return
+
+        session = await self.client.start_session(causal_consistency=True)
+        times = self.tokens.get(token)
+        if times is not None:
+            cluster_time, operation_time = times
+            if cluster_time is not None:
+                session.advance_cluster_time(cluster_time)
+            if operation_time is not None:
+                session.advance_operation_time(operation_time)
+
+        context_token = _current_session.set(session)
+        try:
+            yield session
+        finally:
+            _current_session.reset(context_token)
+            self.tokens.save(token, session.cluster_time, session.operation_time)
+            await session.end_session()
+
+    @contextmanager
+    def secondary_reads(self):
+        """Send the reads of the block to a secondary when possible"""
+        if not self.enabled:
+            yield
+            return
+        context_token = _prefer_secondary.set(True)
+        try:
+            yield
+        finally:
+            _prefer_secondary.reset(context_token)
+
+
+read_router = ReadRouter()
+
+
+class RoutedDocument(Document):
+    """
+    Document whose collection is routed by the read router.
+    """
+
+    @classmethod
+    def get_motor_collection(cls) -> AsyncIOMotorCollection:
+        return read_router.route(super().get_motor_collection())
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Module logging the slow database queries.
+
+A command slower than SLOW_QUERY_MS is logged with its collection, filter and
+duration, and grouped with the other commands of the same shape: the same
+command on the same collection with the same filter, values aside
+(`{"email": "?"}`). The first time a shape is seen, its plan is captured in
+the background with `explain` in `executionStats` verbosity, which tells
+whether it scanned the whole collection.
+
+The log keeps at most SLOW_QUERY_MAX_SHAPES shapes, the least recent ones
+are dropped first. It keeps no values of the queries (tokens, emails, ids),
+only their shape, and the explains run outside of the request of the query.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set
+from pydantic import BaseModel
+from app.core.config import CONFIG
+from app.core.tasks import detached
+
+
+logger = logging.getLogger(__name__)
+
+# the commands supported by explain, with the field holding their filter
+EXPLAINABLE_COMMANDS = {
+    'find': 'filter',
+    'aggregate': 'pipeline',
+    'count': 'query',
+    'distinct': 'query',
+    'findAndModify': 'query',
+    'update': 'updates',
+    'delete': 'deletes',
+}
+
+# fields of a sent command which are not part of the query
+SESSION_FIELDS = ('lsid', 'txnNumber', 'autocommit', 'startTransaction', 'readConcern', 'writeConcern')
+
+
+def query_shape(value: Any) -> Any:
+    """The query with its values replaced by '?', operators and fields kept"""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        if value and all(isinstance(item, dict) for item in value):
+            # a list of sub-queries or of pipeline stages
+            return [query_shape(item) for item in value]
+        return '?'
+    return '?'
+
+
+def command_filter(command: Dict[str, Any]) -> Any:
+    """The filter (or pipeline) of a command"""
+    command_name = next(iter(command))
+    field = EXPLAINABLE_COMMANDS.get(command_name)
+    if field is None:
+        return None
+    value = command.get(field)
+    if field in ('updates', 'deletes'):
+        # the statements of a write command, their filter is 'q'
+        return value[0].get('q') if value else None
+    return value
+
+
+def explainable(command: Dict[str, Any]) -> Dict[str, Any]:
+    """The command without the fields of the session, ready to be explained"""
+    return {key: value for key, value in command.items()
+            if not key.startswith('$') and key not in SESSION_FIELDS}
+
+
+def plan_summary(plan: Dict[str, Any]) -> str:
+    """Stages of a winning plan, with the index of the index scans: 'FETCH IXSCAN { email: 1 }'"""
+    stages = []
+    while plan:
+        stage = plan.get('stage', '?')
+        if 'keyPattern' in plan:
+            keys = ', '.join(f"{key}: {direction}" for key, direction in plan['keyPattern'].items())
+            stage = f"{stage} {{ {keys} }}"
+        stages.append(stage)
+        plan = plan.get('inputStage') or (plan.get('inputStages') or [None])[0]
+    return ' '.join(stages)
+
+
+def find_key(document: Any, key: str) -> Optional[Any]:
+    """First value of a key in nested documents (explain of an aggregate nests the find stages)"""
+    if isinstance(document, dict):
+        if key in document:
+            return document[key]
+        values = document.values()
+    elif isinstance(document, list):
+        values = document
+    else:
+        return None
+    for value in values:
+        found = find_key(value, key)
+        if found is not None:
+            return found
+    return None
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    """The event loop running in this thread, if any"""
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+class Explain(BaseModel):
+    """
+    Summary of the explain of a query shape.
+
+    Attributes:
+        plan (str): Stages of the winning plan, COLLSCAN when no index is used.
+        docs_examined (int): Documents read to answer the query.
+        keys_examined (int): Index keys read to answer the query.
+        returned (int): Documents returned.
+        time_ms (float): Execution time of the explained query.
+        error (Optional[str]): Why the query could not be explained.
+    """
+    plan: str = ''
+    docs_examined: int = 0
+    keys_examined: int = 0
+    returned: int = 0
+    time_ms: float = 0
+    error: Optional[str] = None
+
+    @classmethod
+    def from_explain(cls, explain: Dict[str, Any]) -> 'Explain':
+        """Summarize the output of an explain command"""
+        stats = find_key(explain, 'executionStats') or {}
+        return cls(plan=plan_summary(find_key(explain, 'winningPlan') or {}),
+                   docs_examined=stats.get('totalDocsExamined', 0),
+                   keys_examined=stats.get('totalKeysExamined', 0),
+                   returned=stats.get('nReturned', 0),
+                   time_ms=stats.get('executionTimeMillis', 0))
+
+
+class SlowQuery(BaseModel):
+    """
+    The slow queries of a shape.
+
+    Attributes:
+        command (str): Name of the command (find, aggregate, update, ...).
+        collection (str): Collection queried.
+        shape (str): Filter or pipeline of the queries, values aside.
+        count (int): Number of slow queries of this shape.
+        total_ms (float): Total duration of the slow queries.
+        max_ms (float): Duration of the slowest query.
+        last_seen (datetime): When the last slow query was seen.
+        explain (Optional[Explain]): Plan of the query, once explained.
+    """
+    command: str
+    collection: str
+    shape: str
+    count: int = 0
+    total_ms: float = 0
+    max_ms: float = 0
+    last_seen: datetime
+    explain: Optional[Explain] = None
+
+
+class SlowQueryLog:
+    """
+    The slow queries grouped by shape, explained by the storage engine bound to the log.
+
+    Attributes:
+        threshold_ms (float): Duration from which a query is slow, 0 disables the log.
+        max_shapes (int): Maximum number of shapes kept.
+    """
+
+    def __init__(self, threshold_ms: float = CONFIG.slow_query_ms,
+                 max_shapes: int = CONFIG.slow_query_max_shapes):
+        self.threshold_ms = threshold_ms
+        self.max_shapes = max_shapes
+        self.queries: 'OrderedDict[str, SlowQuery]' = OrderedDict()
+        self.storage = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._explains: Set[asyncio.Future] = set()
+        # the commands are reported from the threads of motor
+        self._lock = threading.Lock()
+
+    def bind(self, storage) -> None:
+        """Explain the queries with this storage engine, from the running event loop"""
+        self.storage = storage
+        # None when not run by asyncio, the queries are then logged but not explained
+        self._loop = _running_loop()
+
+    def enabled(self, seconds: float) -> bool:
+        """Whether a command of this duration is logged"""
+        return bool(self.threshold_ms) and seconds * 1000 >= self.threshold_ms
+
+    def observe(self, command_name: str, command: Optional[Dict[str, Any]], seconds: float) -> None:
+        """Log a command if it is slow"""
+        if not command or not self.enabled(seconds):
+            return
+        collection = str(command.get(command_name, ''))
+        query = command_filter(command)
+        duration_ms = seconds * 1000
+        logger.warning("Slow query: %s %s %s %.1fms", command_name, collection,
+                       json.dumps(query, default=str), duration_ms)
+
+        shape = json.dumps(query_shape(query), sort_keys=True)
+        key = f"{command_name} {collection} {shape}"
+        with self._lock:
+            entry = self.queries.get(key)
+            is_new = entry is None
+            if is_new:
+                entry = self.queries[key] = SlowQuery(command=command_name, collection=collection,
+                                                      shape=shape, last_seen=datetime.now())
+                while len(self.queries) > self.max_shapes:
+                    self.queries.popitem(last=False)
+            else:
+                self.queries.move_to_end(key)
+            entry.count += 1
+            entry.total_ms += duration_ms
+            entry.max_ms = max(entry.max_ms, duration_ms)
+            entry.last_seen = datetime.now()
+
+        if is_new and command_name in EXPLAINABLE_COMMANDS and self._loop and not self._loop.is_closed():
+            if _running_loop() is self._loop:
+                self._start_explain(entry, explainable(command))
+            else:
+                # reported from a thread of motor
+                self._loop.call_soon_threadsafe(self._start_explain, entry, explainable(command))
+
+    def _start_explain(self, entry: SlowQuery, command: Dict[str, Any]) -> None:
+        # not in the context of the slow query, its deadline, stats and span
+        task = detached(self._explain(entry, command))
+        self._explains.add(task)
+        task.add_done_callback(self._explains.discard)
+
+    async def _explain(self, entry: SlowQuery, command: Dict[str, Any]) -> None:
+        try:
+            entry.explain = Explain.from_explain(await self.storage.explain(command))
+        except Exception as e:
+            entry.explain = Explain(error=str(e))
+
+    async def wait_explains(self) -> None:
+        """Wait for the explains in progress"""
+        # let the explains scheduled from the threads of motor start
+        await asyncio.sleep(0)
+        if self._explains:
+            await asyncio.gather(*self._explains, return_exceptions=True)
+
+    def slowest(self) -> List[SlowQuery]:
+        """The shapes, the slowest in total first"""
+        with self._lock:
+            queries = list(self.queries.values())
+        return sorted(queries, key=lambda query: query.total_ms, reverse=True)
+
+    def clear(self) -> None:
+        """Forget the slow queries"""
+        with self._lock:
+            self.queries.clear()
+
+
+slow_query_log = SlowQueryLog()
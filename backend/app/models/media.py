@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""media module"""
+
+from datetime import datetime
+from typing import Optional
+from urllib.parse import urlparse
+from pydantic import BaseModel, Field, computed_field
+
+# prefix of the url of the uploaded media, as set in Post.media_url
+MEDIA_URL_PREFIX = '/media/'
+
+
+class MediaFile(BaseModel):
+    """
+    An uploaded media file, kept by the media store.
+
+    Attributes:
+        id (str): Unique identifier of the file.
+        filename (str): Name of the file given by the uploader.
+        content_type (str): Media type of the file (e.g., image/png, video/mp4).
+        length (int): Size of the file in bytes.
+        uploaded_at (datetime): Timestamp of the end of the upload, in UTC.
+        user_id (Optional[str]): ID of the user who uploaded the file.
+        sha256 (Optional[str]): SHA-256 of the content, in hex, the same for the same content.
+        refs (int): Number of references to the file, from the posts showing it.
+    """
+    id: str = Field(alias="_id")
+    filename: str
+    content_type: str
+    length: int
+    uploaded_at: datetime
+    user_id: Optional[str] = None
+    sha256: Optional[str] = None
+    refs: int = 0
+
+    class Config:
+        populate_by_name = True
+
+    @computed_field
+    @property
+    def url(self) -> str:
+        """The url serving the file, to set as the media_url of a post"""
+        return f"{MEDIA_URL_PREFIX}{self.id}"
+
+
+def media_id_from_url(url: Optional[str]) -> Optional[str]:
+    """The id of the uploaded media a url (a media_url) points at, None for another url"""
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if parsed.netloc or not parsed.path.startswith(MEDIA_URL_PREFIX):
+        return None
+    return parsed.path[len(MEDIA_URL_PREFIX):] or None
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+""" Defining the Notification module """
+
+from datetime import datetime
+from typing import List, Optional
+from pydantic import BaseModel, Field, computed_field
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from app.models.common import Common
+
+# what the actors did, by kind of notification
+ACTIONS = {
+    'like': 'liked your post',
+    'comment': 'commented on your post',
+    'follow': 'started following you',
+}
+
+
+class Notification(Common):
+    """
+    Represents a notification of a user: the actors who liked or commented a post
+    of the user, or followed the user, since the user last read it.
+
+    Attributes:
+        user_id (str): ID of the user notified.
+        kind (str): What the actors did: like, comment or follow.
+        post_id (Optional[str]): ID of the post liked or commented.
+        actor_ids (List[str]): IDs of the last actors, the most recent last.
+        actor_names (List[str]): Usernames of the last actors, the most recent last.
+        actor_count (int): Number of actions notified, all actors included.
+        read (bool): Whether the user read it; the actions after that are a new notification.
+    """
+    user_id: str
+    kind: str
+    post_id: Optional[str] = None
+    actor_ids: List[str] = []
+    actor_names: List[str] = []
+    actor_count: int = 0
+    read: bool = False
+
+    class Settings:
+        """
+        Settings for the Notification class .
+        Attributes:
+            name(str): Name of the MongoDB collection
+            where Notification documents are stored.
+            indexes: The notifications of a user, the most recent first; the unread ones,
+                by kind and post, to count them and add the new actions to them; and one
+                unread notification at most by user, kind and post.
+        """
+        name = 'notifications'
+        indexes = [
+            IndexModel([('user_id', ASCENDING), ('updated_at', DESCENDING), ('_id', DESCENDING)]),
+            IndexModel([('user_id', ASCENDING), ('read', ASCENDING), ('kind', ASCENDING), ('post_id', ASCENDING)]),
+            IndexModel([('user_id', ASCENDING), ('kind', ASCENDING), ('post_id', ASCENDING)],
+                       unique=True, partialFilterExpression={'read': False}),
+        ]
+
+
+class NotificationResponse(BaseModel):
+    """
+    Notification response model for API responses.
+
+    Attributes:
+        id (str): Unique identifier of the notification.
+        kind (str): What the actors did: like, comment or follow.
+        post_id (Optional[str]): ID of the post liked or commented.
+        actor_ids (List[str]): IDs of the last actors, the most recent last.
+        actor_names (List[str]): Usernames of the last actors, the most recent last.
+        actor_count (int): Number of actions notified.
+        read (bool): Whether the user read it.
+        created_at (Optional[datetime]): Timestamp of the first action.
+        updated_at (Optional[datetime]): Timestamp of the last action.
+    """
+    id: str = Field(alias="_id")
+    kind: str
+    post_id: Optional[str] = None
+    actor_ids: List[str] = []
+    actor_names: List[str] = []
+    actor_count: int = 0
+    read: bool = False
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+    class Config:
+        populate_by_name = True
+
+    @computed_field
+    @property
+    def message(self) -> str:
+        """The notification as text: 'alice and 312 others liked your post'"""
+        actor = self.actor_names[-1] if self.actor_names else 'Someone'
+        others = self.actor_count - 1
+        if others > 0:
+            actor += f" and {others} {'other' if others == 1 else 'others'}"
+        return f"{actor} {ACTIONS.get(self.kind, self.kind)}"
+
+
+class NotificationPage(BaseModel):
+    """
+    A page of the notifications of a user.
+
+    Attributes:
+        results (List[NotificationResponse]): The notifications, the most recent first.
+        unread_count (int): Number of unread notifications of the user.
+        next_cursor (Optional[str]): Cursor of the next page, None on the last page.
+    """
+    results: List[NotificationResponse]
+    unread_count: int
+    next_cursor: Optional[str] = None
+
+
+class NotificationReadRequest(BaseModel):
+    """
+    Request model to mark notifications as read.
+
+    Attributes:
+        ids (Optional[List[str]]): IDs of the notifications read, all of them when None.
+    """
+    ids: Optional[List[str]] = None
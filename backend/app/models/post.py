@@ -5,9 +5,11 @@ from app.models.common import Common
 from app.models.comment import Comment
 from app.models.like import Like
 from pydantic import BaseModel, Field, model_validator
-from typing import Optional, List
+from typing import Dict, Optional, List
 from datetime import datetime
 from beanie import Link
+from bson import DBRef
+from pymongo import ASCENDING, DESCENDING, IndexModel
 
 
 class Post(Common):
@@ -18,7 +20,14 @@ class Post(Common):
         user_id (str): ID of the user who created the post.
         content (Optional[str]): Text content of the post.
         media_type (Optional[str]): Type of media (e.g., image, video).
-        media_url (Optional[str]): URL or path to the media associated with the post.
+        media_url (Optional[str]): URL or path to the media associated with the post,
+            /media/{id} for a media uploaded to POST /media.
+        media_variants (Optional[Dict[str, str]]): URLs of the resized images of an uploaded image,
+            by variant name (thumbnail, feed), set in the background once generated.
+        hashtags (List[str]): The hashtags of the content, lowercased, set when it is created or updated.
+        impressions (int): Number of times the post was shown in a list of posts.
+        views (int): Number of times the post was opened.
+            Both are counted in memory and added in bulk (see app/utils/views.py).
 
         comments: a list of comments made to the post, it is lined to the Comment class
         likes: a list of likes made to the post, it is linked to the Like class
@@ -30,6 +39,10 @@ class Post(Common):
     content: Optional[str] = None
     media_type: Optional[str] = None
     media_url: Optional[str] = None
+    media_variants: Optional[Dict[str, str]] = None
+    hashtags: List[str] = []
+    impressions: int = 0
+    views: int = 0
     comments: Optional[List[Link[Comment]]] = []
     likes: Optional[List[Link[Like]]] = []
 
@@ -39,36 +52,53 @@ class Post(Common):
         Attributes:
             name(str): Name of the MongoDB collection
             where Post documents are stored.
+            indexes: The posts of a hashtag, the most recent first.
         """
         name = 'posts'
+        indexes = [IndexModel([('hashtags', ASCENDING), ('created_at', DESCENDING)])]
 
     async def add_comment(self, comment: Comment):
         """
         Add the created comment to post.comments
         """
         self.comments.append(comment)
-        await self.save()
+        await self._update_links('$push', 'comments', comment)
 
     async def remove_comment(self, comment: Comment):
         """
         Remove the deleted comment from post.comments
         """
         self.comments = [cmt for cmt in self.comments if cmt.id != comment.id]
-        await self.save()
+        await self._update_links('$pull', 'comments', comment)
 
     async def add_like(self, like: Like):
         """
         Add the created like to post.likes
         """
         self.likes.append(like)
-        await self.save()
+        await self._update_links('$push', 'likes', like)
 
     async def remove_like(self, like: Like):
         """
         Remove the deleted like from post.likes
         """
         self.likes = [lk for lk in self.likes if lk.id != like.id]
-        await self.save()
+        await self._update_links('$pull', 'likes', like)
+
+    async def _update_links(self, operator: str, field: str, document: Common):
+        """
+        Push or pull the link of a document, without writing the rest of the post:
+        saving it whole would undo the counts added meanwhile, and the other links
+        """
+        link = DBRef(document.Settings.name, document.id)
+        await Post.find_one(Post.id == self.id).update({operator: {field: link}})
+
+    def media_urls(self) -> List[str]:
+        """
+        The urls of the media of the post, its variants included
+        """
+        urls = [self.media_url] if self.media_url else []
+        return urls + list((self.media_variants or {}).values())
 
     @model_validator(mode='before')
     def check_content_or_media_url(cls, values):
@@ -138,6 +168,10 @@ class PostResponse(BaseModel):
         content (Optional[str]): Text content of the post.
         media_type (Optional[str]): Type of media (e.g., image, video).
         media_url (Optional[str]): URL or path to the media associated with the post.
+        media_variants (Optional[Dict[str, str]]): URLs of the resized images, by variant name.
+        hashtags (List[str]): The hashtags of the content.
+        impressions (int): Number of times the post was shown in a list of posts.
+        views (int): Number of times the post was opened.
         created_at (Optional[datetime]): Timestamp when the post was created.
         updated_at (Optional[datetime]): Timestamp when the post was last updated.
     """
@@ -146,6 +180,10 @@ class PostResponse(BaseModel):
     content: Optional[str] = None
     media_type: Optional[str] = None
     media_url: Optional[str] = None
+    media_variants: Optional[Dict[str, str]] = None
+    hashtags: List[str] = []
+    impressions: int = 0
+    views: int = 0
     created_at: Optional[datetime]
     updated_at: Optional[datetime]
 
@@ -156,3 +194,27 @@ class PostResponse(BaseModel):
         json_encoders = {
             datetime: lambda date: date.isoformat(),
         }
+
+
+class PostSearchResponse(BaseModel):
+    """
+    A page of the posts matching a search.
+
+    Attributes:
+        results (List[PostResponse]): The posts, the most relevant first.
+        next_cursor (Optional[str]): Cursor of the next page, None on the last page.
+    """
+    results: List[PostResponse]
+    next_cursor: Optional[str] = None
+
+
+class TrendingTag(BaseModel):
+    """
+    A hashtag used a lot lately.
+
+    Attributes:
+        tag (str): The hashtag, without the #.
+        count (int): Estimated number of posts using it in the window of the trends.
+    """
+    tag: str
+    count: int
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+""" Defining the Suggestions module """
+
+from typing import List
+from app.models.common import Common
+from app.models.user import UserSummary
+
+
+class SuggestedUser(UserSummary):
+    """
+    A user suggested to follow.
+
+    Attributes:
+    - mutual: The number of accounts followed by the user suggested to who follow this one.
+    """
+    mutual: int
+
+
+class Suggestions(Common):
+    """
+    The users suggested to a user to follow, computed in batch (see app/utils/suggestions.py).
+
+    Attributes:
+        id (str): ID of the user.
+        users (List[SuggestedUser]): The users suggested, the best first.
+    Settings:
+        name (str): MongoDB collection name for storing Suggestions documents.
+    """
+
+    users: List[SuggestedUser] = []
+
+    class Settings:
+        """
+        Settings for the Suggestions class.
+
+        Attributes:
+            name (str): Name of the MongoDB collection where Suggestions documents are stored.
+        """
+        name = 'suggestions'
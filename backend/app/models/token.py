@@ -2,7 +2,7 @@
 """token module"""
 
 from typing import Optional
-from beanie import Document
+from app.models.engine.read_routing import RoutedDocument
 from datetime import datetime
 from pydantic import BaseModel, Field
 
@@ -21,7 +21,7 @@ class Token(BaseModel):
     token_type: Optional[str] = 'Bearer'
 
 
-class BlackListedTokens(Document):
+class BlackListedTokens(RoutedDocument):
     """
     Represents a blacklisted token, which will be used in logout.
 
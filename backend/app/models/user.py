@@ -139,3 +139,40 @@ class UserResponse(BaseModel):
         json_encoders = {
             datetime: lambda date: date.isoformat(),
         }
+
+
+class UserSummary(BaseModel):
+    """
+    The fields of a user shown in the lists of users, like the search results.
+
+    Attributes:
+    - id: The user's ID.
+    - username: The user's username.
+    - full_name: The user's full name (optional).
+    - profile_picture_url: URL to the user's profile picture (optional).
+    """
+    id: str = Field(alias="_id")
+    username: str
+    full_name: Optional[str] = None
+    profile_picture_url: Optional[str] = None
+
+    class Config:
+        populate_by_name = True
+
+
+class Relationship(BaseModel):
+    """
+    The relationship of the current user with another user.
+
+    Attributes:
+    - following: Whether the current user follows the user.
+    - followed_by: Whether the user follows the current user.
+    - followers_count: The number of followers of the user.
+    - following_count: The number of accounts the user follows.
+    - known_followers_count: The number of accounts followed by the current user who follow the user.
+    """
+    following: bool
+    followed_by: bool
+    followers_count: int
+    following_count: int
+    known_followers_count: int
@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+""" fixtures shared by the tests """
+
+import pytest
+from app.core.rate_limit import rate_limiter
+
+
+@pytest.fixture(scope="session", autouse=True)
+def no_rate_limits():
+    """The tests register and login many users from the same client: no rate limits but in test_rate_limit."""
+    enabled = rate_limiter.enabled
+    rate_limiter.enabled = False
+    yield
+    rate_limiter.enabled = enabled
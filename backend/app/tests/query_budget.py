@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+"""
+Query budget of the tests: fails when a block sends more database commands
+than expected, to catch the N+1 queries when they are introduced.
+
+    with query_budget(4):
+        response = await ac.get(f"/comments/post/{post_id}", headers=headers)
+
+The commands of the requests sent to the app inside the block are counted,
+whatever the storage engine of the tests.
+"""
+
+from contextlib import contextmanager
+from typing import Iterator
+from app.models.engine.monitoring import DBStats, track_commands
+
+
+@contextmanager
+def query_budget(max_commands: int) -> Iterator[DBStats]:
+    """Assert the block sends at most max_commands database commands"""
+    with track_commands() as stats:
+        yield stats
+    assert stats.commands <= max_commands, (
+        f"{stats.commands} database commands sent, the budget is {max_commands}: {stats.by_command}")
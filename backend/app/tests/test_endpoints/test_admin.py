@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+""" testing the admin endpoints """
+
+import json
+import uuid
+import pytest
+from httpx import AsyncClient
+from app.api.app import app
+from app.models.comment import Comment
+from app.models.post import Post
+from app.models.token import BlackListedTokens
+from app.models.user import User
+from app.models.like import Like
+from app.models.notification import Notification
+from app.models.engine.db_storage import get_storage
+from app.models.engine.slow_queries import query_shape, slow_query_log
+from app.core.config import CONFIG
+
+
+ADMIN_HEADERS = {"X-Admin-Token": "test-admin-token"}
+
+
+@pytest.fixture(scope="module")
+def anyio_backend():
+    """The queries are explained in the background on the asyncio loop, like with uvicorn."""
+    return "asyncio"
+
+
+@pytest.fixture(scope="module", autouse=True)
+async def initialize_db():
+    """Initialize the test database, every query being slow."""
+    storage = get_storage(CONFIG.test_storage_engine, db_name="test_db")
+    await storage.init(document_models=[User, Post, Comment, Like, Notification, BlackListedTokens])
+    admin_token, threshold_ms = CONFIG.admin_token, slow_query_log.threshold_ms
+    CONFIG.admin_token = ADMIN_HEADERS["X-Admin-Token"]
+    slow_query_log.threshold_ms = 1e-6
+    slow_query_log.clear()
+    yield
+    CONFIG.admin_token, slow_query_log.threshold_ms = admin_token, threshold_ms
+    slow_query_log.clear()
+    # Drop the test database after tests are done
+    await storage.drop()
+
+
+@pytest.mark.anyio
+async def test_slow_queries():
+    """Test the slow queries are grouped by shape and explained."""
+    slow_query_log.clear()
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        unique_id = uuid.uuid4()
+        register_data = {
+            "email": f"test_admin_{unique_id}@example.com",
+            "username": f"test_admin_{unique_id}",
+            "password": "testpassword"
+        }
+        login_response = await ac.post("/auth/register", json=register_data)
+        assert login_response.status_code == 201
+        headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+
+        for _ in range(3):
+            response = await ac.get("/auth/me", headers=headers)
+            assert response.status_code == 200
+
+        response = await ac.get("/admin/slow-queries", headers=ADMIN_HEADERS)
+        assert response.status_code == 200
+        queries = {(query["command"], query["collection"], query["shape"]): query
+                   for query in response.json()}
+
+        # the token blacklist is scanned, once per request
+        blacklist = queries[("find", "black_listed_tokens", json.dumps({"token": "?"}))]
+        assert blacklist["count"] == 3
+        assert blacklist["explain"]["plan"] == "COLLSCAN"
+        assert blacklist["explain"]["error"] is None
+
+        # the email lookup of the registration
+        email_lookup = queries[("find", "users", json.dumps({"email": "?"}))]
+        # the values of the queries are not kept
+        assert register_data["email"] not in response.text
+        assert email_lookup["explain"]["plan"] == "COLLSCAN"
+
+        response = await ac.delete("/admin/slow-queries", headers=ADMIN_HEADERS)
+        assert response.status_code == 200
+        response = await ac.get("/admin/slow-queries", headers=ADMIN_HEADERS)
+        # only the queries sent since, if any
+        assert all(query["count"] == 1 for query in response.json())
+
+
+@pytest.mark.anyio
+async def test_admin_token_required():
+    """Test the admin routes need the admin token."""
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get("/admin/slow-queries")
+        assert response.status_code == 403
+        response = await ac.get("/admin/slow-queries", headers={"X-Admin-Token": "wrong"})
+        assert response.status_code == 403
+
+
+def test_query_shape():
+    """Test the values of the queries are left out of their shape."""
+    query = {"$or": [{"user_id": "a"}, {"post_id": {"$in": ["b", "c"]}}], "count": 3}
+    assert query_shape(query) == {"$or": [{"user_id": "?"}, {"post_id": {"$in": "?"}}], "count": "?"}
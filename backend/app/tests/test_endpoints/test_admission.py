@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+""" testing the admission control """
+
+import uuid
+import anyio
+import pytest
+from httpx import AsyncClient
+from app.api.app import app
+from app.api.admission import AdmissionMiddleware
+from app.core.admission import (AUTH, HEAVY, LOOP_LAG, QUEUE_FULL, READ, SHED, TIMEOUT, WRITE,
+                                AdmissionController, RouteClass, load_classes, route_class_name)
+from app.core.loop_monitor import loop_monitor
+from app.models.comment import Comment
+from app.models.post import Post
+from app.models.token import BlackListedTokens
+from app.models.user import User
+from app.models.like import Like
+from app.models.notification import Notification
+from app.models.engine.db_storage import get_storage
+from app.core.config import CONFIG
+
+
+@pytest.fixture(scope="module", autouse=True)
+async def initialize_db():
+    """Initialize the test database."""
+    storage = get_storage(CONFIG.test_storage_engine, db_name="test_db")
+    await storage.init(document_models=[User, Post, Comment, Like, Notification, BlackListedTokens])
+    yield
+    # Drop the test database after tests are done
+    await storage.drop()
+
+
+def controller(max_concurrency: int = 10, **limits) -> AdmissionController:
+    """A controller whose classes run one request at once, one more waiting 1 second"""
+    classes = {name: RouteClass(**{"name": name, "priority": priority, "limit": 1, "queue": 1,
+                                   "wait_ms": 1000, "max_lag_ms": 100 * (4 - priority), **limits})
+               for priority, name in enumerate((AUTH, READ, WRITE, HEAVY))}
+    return AdmissionController(classes, max_concurrency=max_concurrency)
+
+
+@pytest.mark.anyio
+async def test_queue_and_limits():
+    """Test a request over the limit waits for a running one, and is rejected when the queue is full."""
+    admission = controller()
+    results = []
+
+    async def request(name):
+        results.append(await admission.acquire(name))
+
+    assert await admission.acquire(WRITE) is None
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(request, WRITE)
+        await anyio.sleep(0.01)
+        # the second one waits, the third one does not fit in the queue
+        assert results == []
+        assert await admission.acquire(WRITE) == QUEUE_FULL
+        # the other classes have their own limit
+        assert await admission.acquire(READ) is None
+        admission.release(WRITE)
+    assert results == [None]
+    assert admission.active == 2
+
+    admission = controller(wait_ms=20)
+    shed_before = SHED.get((WRITE, TIMEOUT))
+    assert await admission.acquire(WRITE) is None
+    assert await admission.acquire(WRITE) == TIMEOUT
+    assert SHED.get((WRITE, TIMEOUT)) == shed_before + 1
+    admission.release(WRITE)
+    assert admission.active == 0
+
+
+@pytest.mark.anyio
+async def test_priority():
+    """Test the waiting requests of the cheaper classes are let in first."""
+    admission = controller(max_concurrency=1)
+    order = []
+
+    async def request(name):
+        assert await admission.acquire(name) is None
+        order.append(name)
+        admission.release(name)
+
+    assert await admission.acquire(HEAVY) is None
+    async with anyio.create_task_group() as tg:
+        for name in (HEAVY, WRITE, READ, AUTH):
+            tg.start_soon(request, name)
+            await anyio.sleep(0.01)
+        admission.release(HEAVY)
+    assert order == [AUTH, READ, WRITE, HEAVY]
+
+
+@pytest.mark.anyio
+async def test_loop_lag_sheds_heavy_first():
+    """Test the classes are rejected from their own loop lag, the heavy routes first."""
+    admission = controller()
+    lag = loop_monitor.lag
+    loop_monitor.lag = 0.15
+    try:
+        assert await admission.acquire(HEAVY) == LOOP_LAG
+        assert await admission.acquire(WRITE) is None
+        assert await admission.acquire(READ) is None
+        assert await admission.acquire(AUTH) is None
+    finally:
+        loop_monitor.lag = lag
+
+
+@pytest.mark.anyio
+async def test_rejected_with_503():
+    """Test a rejected request gets a 503 with Retry-After, without running."""
+    admission = controller(queue=0, retry_after=5)
+    limited_app = AdmissionMiddleware(app, app.routes, controller=admission)
+    async with AsyncClient(app=limited_app, base_url="http://test") as ac:
+        unique_id = uuid.uuid4()
+        register_data = {
+            "email": f"test_admission_{unique_id}@example.com",
+            "username": f"test_admission_{unique_id}",
+            "password": "testpassword"
+        }
+        login_response = await ac.post("/auth/register", json=register_data)
+        assert login_response.status_code == 201
+        headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+        user_id = (await ac.get("/auth/me", headers=headers)).json()["_id"]
+
+        # a cascade delete is running
+        assert await admission.acquire(HEAVY) is None
+        response = await ac.delete(f"/users/{user_id}", headers=headers)
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "5"
+        assert response.json()["reason"] == QUEUE_FULL
+        # the user was not deleted, the reads still run
+        response = await ac.get(f"/users/{user_id}", headers=headers)
+        assert response.status_code == 200
+        admission.release(HEAVY)
+
+        response = await ac.delete(f"/users/{user_id}", headers=headers)
+        assert response.status_code == 200
+        assert admission.active == 0
+
+
+def test_route_classes():
+    """Test the classes of the routes, and their configuration."""
+    assert route_class_name("POST", "/auth/refresh-token") == AUTH
+    assert route_class_name("GET", "/posts/{post_id}") == READ
+    assert route_class_name("POST", "/auth/login") == WRITE
+    assert route_class_name("DELETE", "/users/{user_id}") == HEAVY
+    assert route_class_name("GET", "/admin/slow-queries") is None
+    assert route_class_name("GET", "/metrics") is None
+    assert route_class_name("GET", "/media/{media_id}") is None
+    assert route_class_name("DELETE", "/likes/{like_id}") == WRITE
+
+    classes = load_classes('{"heavy": {"limit": 2}}')
+    assert classes[HEAVY].limit == 2
+    assert classes[HEAVY].queue == load_classes()[HEAVY].queue
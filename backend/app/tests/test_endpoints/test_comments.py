@@ -3,23 +3,24 @@
 import uuid
 import pytest
 from httpx import AsyncClient
-from motor.motor_asyncio import AsyncIOMotorClient
-from beanie import init_beanie
 from app.models.token import BlackListedTokens
 from app.models.user import User
 from app.models.post import Post
 from app.models.comment import Comment
 from app.api.app import app
+from app.models.engine.db_storage import get_storage
+from app.core.config import CONFIG
+from app.tests.query_budget import query_budget
 
 
 @pytest.fixture(scope="module", autouse=True)
 async def initialize_db():
     """Initialize the test database."""
-    client = AsyncIOMotorClient("mongodb://localhost:27017")
-    await init_beanie(database=client.test_db, document_models=[User, Post, Comment, BlackListedTokens])
+    storage = get_storage(CONFIG.test_storage_engine, db_name="test_db")
+    await storage.init(document_models=[User, Post, Comment, BlackListedTokens])
     yield
     # Drop the test database after tests are done
-    await client.drop_database("test_db")
+    await storage.drop()
 
 
 @pytest.mark.anyio
@@ -231,3 +232,33 @@ async def test_delete_comment():
         response = await ac.delete(f"/comments/{comment_id}", headers=headers)
         assert response.status_code == 200
         assert response.json() == {"message": "Comment deleted successfully"}
+
+
+@pytest.mark.anyio
+async def test_get_all_comments_of_post_query_budget():
+    """Test the comments of a post are read in a fixed number of queries."""
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        unique_id = uuid.uuid4()
+        register_data = {
+            "email": f"test_budget_{unique_id}@example.com",
+            "username": f"test_budget_{unique_id}",
+            "password": "testpassword"
+        }
+        login_response = await ac.post("/auth/register", json=register_data)
+        assert login_response.status_code == 201
+        headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+        user_id = (await ac.get("/auth/me", headers=headers)).json()['_id']
+
+        post_response = await ac.post("/posts/", json={"user_id": user_id, "content": "post"}, headers=headers)
+        assert post_response.status_code == 201
+        post_id = post_response.json()["_id"]
+        for i in range(5):
+            comment_data = {"post_id": post_id, "user_id": user_id, "content": f"comment {i}"}
+            response = await ac.post("/comments/", json=comment_data, headers=headers)
+            assert response.status_code == 201
+
+        # 2 to authenticate, 1 for the post and its comments, whatever their number
+        with query_budget(3):
+            response = await ac.get(f"/comments/post/{post_id}", headers=headers)
+        assert response.status_code == 200
+        assert len(response.json()) == 5
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+""" testing the request deadlines """
+
+import time
+import anyio
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+from pymongo import _csot
+from pymongo.errors import ExecutionTimeout
+from app.api.deadlines import DeadlineMiddleware
+from app.core.deadlines import deadline, deadline_ms, load_deadlines, remaining
+from app.core.config import CONFIG
+
+
+slow_app = FastAPI()
+slow_app.add_middleware(DeadlineMiddleware, routes=slow_app.routes)
+
+
+@slow_app.get('/sleep/{ms}')
+async def sleep(ms: int) -> dict:
+    """Wait, then tell the time left and the timeout motor sends as maxTimeMS"""
+    await anyio.sleep(ms / 1000)
+    return {"remaining": remaining(), "max_time": _csot.remaining()}
+
+
+@slow_app.get('/max-time-expired')
+async def max_time_expired() -> dict:
+    """A query stopped by MongoDB"""
+    raise ExecutionTimeout("operation exceeded time limit", code=50)
+
+
+@pytest.fixture(autouse=True)
+def short_deadlines():
+    """A deadline of 200ms by default."""
+    default, maximum = CONFIG.request_deadline_ms, CONFIG.request_deadline_max_ms
+    CONFIG.request_deadline_ms, CONFIG.request_deadline_max_ms = 200, 1000
+    yield
+    CONFIG.request_deadline_ms, CONFIG.request_deadline_max_ms = default, maximum
+
+
+@pytest.mark.anyio
+async def test_deadline_propagated():
+    """Test the deadline is the timeout of the database commands of the request."""
+    async with AsyncClient(app=slow_app, base_url="http://test") as ac:
+        response = await ac.get("/sleep/10")
+        assert response.status_code == 200
+        assert 0 < response.json()["remaining"] < 0.2
+        assert 0 < response.json()["max_time"] < 0.2
+
+        response = await ac.get("/sleep/10", headers={"X-Deadline-Ms": "5000"})
+        # up to the maximum
+        assert 0.2 < response.json()["remaining"] <= 1
+
+
+@pytest.mark.anyio
+async def test_deadline_exceeded():
+    """Test a request is cancelled with a 504 when its deadline expires."""
+    async with AsyncClient(app=slow_app, base_url="http://test") as ac:
+        start = time.perf_counter()
+        response = await ac.get("/sleep/2000")
+        assert response.status_code == 504
+        assert time.perf_counter() - start < 1
+
+        response = await ac.get("/sleep/100", headers={"X-Deadline-Ms": "20"})
+        assert response.status_code == 504
+        response = await ac.get("/sleep/300", headers={"X-Deadline-Ms": "800"})
+        assert response.status_code == 200
+
+        response = await ac.get("/max-time-expired")
+        assert response.status_code == 504
+
+
+@pytest.mark.anyio
+async def test_nested_deadline():
+    """Test a nested deadline cannot extend the enclosing one."""
+    with deadline(0.05):
+        with deadline(10):
+            assert remaining() <= 0.05
+            assert _csot.remaining() <= 0.05
+    assert remaining() is None
+
+
+def test_route_deadlines():
+    """Test the deadlines of the routes and their configuration."""
+    assert deadline_ms("GET", "/posts/{post_id}") == 200
+    assert deadline_ms("DELETE", "/users/{user_id}") == 30000
+    assert deadline_ms("GET", "/posts/{post_id}", "50") == 50
+    assert deadline_ms("GET", "/posts/{post_id}", "invalid") == 200
+    deadlines = load_deadlines('{"GET /posts/{post_id}": 1500}')
+    assert deadline_ms("GET", "/posts/{post_id}", deadlines=deadlines) == 1500
@@ -4,24 +4,25 @@
 import uuid
 import pytest
 from httpx import AsyncClient
-from beanie import init_beanie
-from motor.motor_asyncio import AsyncIOMotorClient
 from app.models.comment import Comment
 from app.models.post import Post
 from app.models.token import BlackListedTokens
 from app.models.user import User
 from app.models.like import Like
+from app.models.notification import Notification
 from app.api.app import app
+from app.models.engine.db_storage import get_storage
+from app.core.config import CONFIG
 
 
 @pytest.fixture(scope="module", autouse=True)
 async def initialize_db():
     """Initialize the test database."""
-    client = AsyncIOMotorClient("mongodb://localhost:27017")
-    await init_beanie(database=client.test_db, document_models=[User, Post, Comment, Like, BlackListedTokens])
+    storage = get_storage(CONFIG.test_storage_engine, db_name="test_db")
+    await storage.init(document_models=[User, Post, Comment, Like, Notification, BlackListedTokens])
     yield
     # Drop the test database after tests are done
-    await client.drop_database("test_db")
+    await storage.drop()
 
 
 @pytest.mark.anyio
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+""" testing the live events of the posts """
+
+import asyncio
+import json
+import uuid
+import pytest
+from httpx import AsyncClient
+from starlette.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+from app.api.app import app
+from app.models.engine.db_storage import get_storage
+from app.core.config import CONFIG
+from app.core.pubsub import Broker, Subscriber
+from app.models.comment import Comment
+from app.models.like import Like
+from app.models.notification import Notification
+from app.models.post import Post
+from app.models.token import BlackListedTokens
+from app.models.user import User
+from app.tests.query_budget import query_budget
+from app.utils.comment_streams import comment_streams
+from app.utils.live import PostEvents
+
+
+@pytest.fixture(scope="module")
+def anyio_backend():
+    """The subscribers wait on asyncio futures"""
+    return "asyncio"
+
+
+@pytest.fixture(scope="module", autouse=True)
+async def initialize_db():
+    """Initialize the test database."""
+    storage = get_storage(CONFIG.test_storage_engine, db_name="test_db")
+    await storage.init(document_models=[User, Post, Comment, Like, Notification, BlackListedTokens])
+    yield
+    # Drop the test database after tests are done
+    await storage.drop()
+
+
+@pytest.mark.anyio
+async def test_fan_out_and_backpressure():
+    """Test the messages reach the subscribers of their topic, the oldest dropped for the slow ones."""
+    broker = Broker()
+    fast, slow, other = Subscriber(max_queue=3), Subscriber(max_queue=3), Subscriber()
+    broker.subscribe(fast, ["post-1"])
+    broker.subscribe(slow, ["post-1", "post-2"])
+    broker.subscribe(other, ["post-3"])
+
+    waiting = asyncio.ensure_future(fast.get())
+    await asyncio.sleep(0)
+    assert broker.publish("post-1", "m0") == 2
+    assert await waiting == ["m0"]
+    for i in range(1, 6):
+        broker.publish("post-1", f"m{i}")
+    assert await fast.get() == ["m3", "m4", "m5"] and fast.dropped == 2
+    assert await slow.get() == ["m3", "m4", "m5"] and slow.dropped == 3
+
+    broker.unsubscribe(slow, ["post-1"])
+    assert broker.publish("post-1", "m6") == 1
+    broker.unsubscribe(fast)
+    broker.unsubscribe(other)
+    assert broker.publish("post-1", "m7") == 0
+    assert broker.topics() == 1 and slow.topics == {"post-2"}
+
+
+@pytest.mark.anyio
+async def test_change_stream_dispatch():
+    """Test the changes of the likes and comments are published as events of their post."""
+    events = PostEvents()
+    subscriber = Subscriber()
+    events.broker.subscribe(subscriber, ["post-1"])
+    change = {"ns": {"coll": "comments"}, "operationType": "delete",
+              "fullDocumentBeforeChange": {"_id": "c1", "post_id": "post-1", "content": "hi"}}
+    assert events.dispatch(change) == "comment_deleted"
+    assert events.dispatch({"ns": {"coll": "likes"}, "operationType": "delete"}) is None
+    assert events.dispatch({"ns": {"coll": "posts"}, "operationType": "insert",
+                            "fullDocument": {"_id": "p", "post_id": "post-1"}}) is None
+    events.change_stream = True
+    # the writes of the routes come back from the change stream
+    events.emit("like", {"_id": "l1", "post_id": "post-1"})
+    assert [json.loads(message) for message in await subscriber.get()] == [
+        {"type": "comment_deleted", "post_id": "post-1", "data": {"_id": "c1", "post_id": "post-1", "content": "hi"}}]
+
+
+class EventStream:
+    """A request to a stream of the app, its body read as it comes, until the client disconnects"""
+
+    def __init__(self, path: str, headers: dict):
+        self.scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+            "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+            "client": ("127.0.0.1", 1234), "server": ("test", 80)}
+        self.status = None
+        self.body = ""
+        self._requested = False
+        self._received = asyncio.Event()
+        self._disconnected = asyncio.Event()
+        self._task = None
+
+    async def _receive(self) -> dict:
+        if not self._requested:
+            self._requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await self._disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def _send(self, message: dict) -> None:
+        if message["type"] == "http.response.start":
+            self.status = message["status"]
+        else:
+            self.body += message.get("body", b"").decode()
+        self._received.set()
+
+    def open(self) -> "EventStream":
+        self._task = asyncio.ensure_future(app(self.scope, self._receive, self._send))
+        return self
+
+    async def read_until(self, text: str) -> str:
+        """The body received until it holds the text"""
+        while text not in self.body and not self._task.done():
+            self._received.clear()
+            await asyncio.wait_for(self._received.wait(), 5)
+        return self.body
+
+    async def close(self) -> None:
+        self._disconnected.set()
+        await asyncio.wait_for(self._task, 5)
+
+
+async def register_async(ac: AsyncClient, name: str) -> dict:
+    """Register a user, return its id and headers"""
+    username = f"{name}_{uuid.uuid4().hex[:8]}"
+    response = await ac.post("/auth/register", json={
+        "email": f"{username}@example.com", "username": username, "password": "testpassword"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    user_id = (await ac.get("/auth/me", headers=headers)).json()["_id"]
+    return {"id": user_id, "headers": headers}
+
+
+@pytest.mark.anyio
+async def test_comment_stream():
+    """Test the stream of the comments of a post: the latest ones, the new ones, and the resume after an id."""
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        alice = await register_async(ac, "alice")
+        post_id = (await ac.post("/posts/", json={"user_id": alice["id"], "content": "streamed"},
+                                 headers=alice["headers"])).json()["_id"]
+        first = (await ac.post("/comments/", json={"user_id": alice["id"], "post_id": post_id, "content": "first"},
+                               headers=alice["headers"])).json()
+
+        viewer = EventStream(f"/comments/post/{post_id}/stream", alice["headers"]).open()
+        body = await viewer.read_until(first["_id"])
+        assert viewer.status == 200 and f'id: {first["_id"]}\nevent: comment\ndata: ' in body
+        assert comment_streams.watched(post_id)
+
+        # a second viewer gets the page from memory: the commands of its authentication only
+        with query_budget(2):
+            other = EventStream(f"/comments/post/{post_id}/stream", alice["headers"]).open()
+            await other.read_until(first["_id"])
+
+        second = (await ac.post("/comments/", json={"user_id": alice["id"], "post_id": post_id, "content": "second"},
+                                headers=alice["headers"])).json()
+        for stream in (viewer, other):
+            body = await stream.read_until(second["_id"])
+            data = json.loads(body.split(f'id: {second["_id"]}\nevent: comment\ndata: ')[1].split("\n")[0])
+            assert data["content"] == "second" and data["post_id"] == post_id
+        await ac.delete(f"/comments/{first['_id']}", headers=alice["headers"])
+        assert "event: comment_deleted" in await viewer.read_until("comment_deleted")
+        await other.close()
+        await viewer.close()
+        assert not comment_streams.watched(post_id)
+
+        # reconnecting after the second comment: only the newer ones
+        third = (await ac.post("/comments/", json={"user_id": alice["id"], "post_id": post_id, "content": "third"},
+                               headers=alice["headers"])).json()
+        resumed = EventStream(f"/comments/post/{post_id}/stream",
+                              {**alice["headers"], "Last-Event-ID": second["_id"]}).open()
+        body = await resumed.read_until(third["_id"])
+        assert second["_id"] not in body and "first" not in body
+        await resumed.close()
+
+        missing = await ac.get(f"/comments/post/{uuid.uuid4()}/stream", headers=alice["headers"])
+        assert missing.status_code == 404
+
+
+def register(client: TestClient, name: str) -> dict:
+    """Register a user, return its id and token"""
+    username = f"{name}_{uuid.uuid4().hex[:8]}"
+    response = client.post("/auth/register", json={
+        "email": f"{username}@example.com", "username": username, "password": "testpassword"})
+    token = response.json()["access_token"]
+    user_id = client.get("/auth/me", headers={"Authorization": f"Bearer {token}"}).json()["_id"]
+    return {"id": user_id, "token": token, "headers": {"Authorization": f"Bearer {token}"}}
+
+
+def test_live_posts():
+    """Test the likes and comments of the posts subscribed to are pushed on the WebSocket."""
+    client = TestClient(app)
+    alice, bob = register(client, "alice"), register(client, "bob")
+    post_ids = [client.post("/posts/", json={"user_id": alice["id"], "content": f"post {i}"},
+                            headers=alice["headers"]).json()["_id"] for i in range(2)]
+
+    with client.websocket_connect(f"/live/posts?token={alice['token']}") as websocket:
+        websocket.send_text(json.dumps({"subscribe": [post_ids[0]]}))
+        assert websocket.receive_json() == {"type": "subscribed", "post_ids": [post_ids[0]]}
+
+        client.post("/likes/", json={"user_id": bob["id"], "post_id": post_ids[1]}, headers=bob["headers"])
+        like = client.post("/likes/", json={"user_id": bob["id"], "post_id": post_ids[0]},
+                           headers=bob["headers"]).json()
+        event = websocket.receive_json()
+        assert event["type"] == "like" and event["post_id"] == post_ids[0] and event["data"]["_id"] == like["_id"]
+
+        comment = client.post("/comments/", json={"user_id": bob["id"], "post_id": post_ids[0], "content": "hi"},
+                              headers=bob["headers"]).json()
+        event = websocket.receive_json()
+        assert event["type"] == "comment" and event["data"]["content"] == "hi"
+        client.delete(f"/comments/{comment['_id']}", headers=bob["headers"])
+        assert websocket.receive_json()["type"] == "comment_deleted"
+
+        websocket.send_text("not json")
+        assert websocket.receive_json() == {"type": "error", "detail": "Invalid command"}
+        websocket.send_text(json.dumps({"unsubscribe": [post_ids[0]], "subscribe": [post_ids[1]]}))
+        assert websocket.receive_json() == {"type": "subscribed", "post_ids": [post_ids[1]]}
+
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect("/live/posts?token=invalid") as websocket:
+            websocket.receive_text()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+""" testing the event loop monitor """
+
+import asyncio
+import time
+import pytest
+from httpx import AsyncClient
+from app.api.app import app
+from app.core.loop_monitor import LOOP_BLOCKS, LOOP_LAG, LoopMonitor, loop_monitor
+from app.core.config import CONFIG
+
+
+ADMIN_HEADERS = {"X-Admin-Token": "test-admin-token"}
+
+
+@pytest.fixture(scope="module")
+def anyio_backend():
+    """The monitor measures the asyncio loop, like with uvicorn."""
+    return "asyncio"
+
+
+@pytest.fixture(scope="module", autouse=True)
+def admin_token():
+    """Enable the admin routes."""
+    token = CONFIG.admin_token
+    CONFIG.admin_token = ADMIN_HEADERS["X-Admin-Token"]
+    yield
+    CONFIG.admin_token = token
+
+
+def block_loop(seconds: float) -> None:
+    """Keep the loop busy without yielding"""
+    time.sleep(seconds)
+
+
+@pytest.mark.anyio
+async def test_blocking_call_captured():
+    """Test a call blocking the loop is measured and its stack captured."""
+    monitor = LoopMonitor(interval_ms=5, threshold_ms=50)
+    monitor.start()
+    try:
+        await asyncio.sleep(0.02)
+        lags_before, blocks_before = LOOP_LAG.count(), LOOP_BLOCKS.get()
+        block_loop(0.2)
+        await asyncio.sleep(0.02)
+
+        assert LOOP_LAG.count() > lags_before
+        assert LOOP_BLOCKS.get() == blocks_before + 1
+        assert monitor.max_lag >= 0.15
+        [block] = monitor.blocked_longer_than(0.15)
+        assert block.duration_ms >= 150
+        assert block.stack[-1].startswith("app/tests/test_endpoints/test_loop_monitor.py:")
+        assert block.stack[-1].endswith("in block_loop")
+        assert monitor.reset() >= 0.15 and monitor.max_lag == 0
+    finally:
+        await monitor.stop()
+    assert not monitor.running
+
+
+@pytest.mark.anyio
+async def test_loop_blocks_route():
+    """Test the blocks of the loop monitor of the app are served to the admins."""
+    loop_monitor.start()
+    try:
+        await asyncio.sleep(loop_monitor.interval * 2)
+        block_loop(loop_monitor.threshold * 2)
+        await asyncio.sleep(loop_monitor.interval * 2)
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            response = await ac.get("/admin/loop-blocks", headers=ADMIN_HEADERS)
+            assert response.status_code == 200
+            latest = response.json()[0]
+            assert latest["stack"][-1].endswith("in block_loop")
+            assert latest["duration_ms"] >= loop_monitor.threshold * 1000
+
+            response = await ac.get("/metrics")
+            assert "event_loop_lag_seconds_bucket" in response.text
+    finally:
+        await loop_monitor.stop()
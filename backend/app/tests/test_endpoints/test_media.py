@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+""" testing the media upload and serving """
+
+import hashlib
+import io
+import os
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta, timezone
+import pytest
+from httpx import AsyncClient
+from PIL import Image
+from pymongo import _csot
+from app.api.app import app
+from app.models.engine import media_storage
+from app.models.engine.db_storage import get_storage
+from app.models.engine.media_storage import DiskMediaStore
+from app.core.config import CONFIG
+from app.core.deadlines import deadline, remaining
+from app.models.comment import Comment
+from app.models.like import Like
+from app.models.notification import Notification
+from app.models.token import BlackListedTokens
+from app.models.post import Post
+from app.models.user import User
+from app.utils.images import image_variants
+
+
+CHUNK = bytes(range(256)) * 256
+
+
+@pytest.fixture(scope="module")
+def anyio_backend():
+    """The media stores run on asyncio, like motor."""
+    return "asyncio"
+
+
+@pytest.fixture(scope="module", autouse=True)
+async def initialize_db(tmp_path_factory):
+    """Initialize the test database, and a disk media store."""
+    storage = get_storage(CONFIG.test_storage_engine, db_name="test_db")
+    await storage.init(document_models=[User, Post, Comment, Like, Notification, BlackListedTokens])
+    media_storage.media_store = DiskMediaStore(str(tmp_path_factory.mktemp("media")), chunk_size=64 * 1024)
+    yield
+    await image_variants.close()
+    media_storage.media_store = None
+    # Drop the test database after tests are done
+    await storage.drop()
+
+
+async def auth_headers(ac: AsyncClient) -> dict:
+    """Register a new user, return the authorization header"""
+    unique_id = uuid.uuid4()
+    response = await ac.post("/auth/register", json={
+        "email": f"test_media_{unique_id}@example.com",
+        "username": f"test_media_{unique_id}",
+        "password": "testpassword"
+    })
+    assert response.status_code == 201
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def chunks(count: int):
+    """A body sent chunk by chunk, never whole in memory"""
+    for _ in range(count):
+        yield CHUNK
+
+
+@pytest.mark.anyio
+async def test_upload_and_get_media():
+    """Test uploading a file, then getting it whole, by range and conditionally."""
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        headers = await auth_headers(ac)
+        response = await ac.post("/media/?filename=clip.mp4", content=chunks(10),
+                                 headers={**headers, "Content-Type": "video/mp4"})
+        assert response.status_code == 201
+        media = response.json()
+        assert media["length"] == len(CHUNK) * 10
+        assert media["content_type"] == "video/mp4"
+        assert media["url"] == f"/media/{media['_id']}"
+
+        response = await ac.get(media["url"])
+        assert response.status_code == 200
+        assert response.content == CHUNK * 10
+        assert response.headers["content-type"] == "video/mp4"
+        assert response.headers["accept-ranges"] == "bytes"
+        etag, last_modified = response.headers["etag"], response.headers["last-modified"]
+
+        response = await ac.get(media["url"], headers={"Range": "bytes=100-299"})
+        assert response.status_code == 206
+        assert response.content == (CHUNK * 10)[100:300]
+        assert response.headers["content-range"] == f"bytes 100-299/{media['length']}"
+
+        response = await ac.get(media["url"], headers={"Range": "bytes=-10"})
+        assert response.status_code == 206
+        assert response.content == CHUNK[-10:]
+        response = await ac.get(media["url"], headers={"Range": f"bytes={len(CHUNK) * 9}-"})
+        assert response.content == CHUNK
+
+        response = await ac.get(media["url"], headers={"Range": f"bytes={media['length']}-"})
+        assert response.status_code == 416
+        assert response.headers["content-range"] == f"bytes */{media['length']}"
+
+        # a range of another version of the file gets the whole file
+        response = await ac.get(media["url"], headers={"Range": "bytes=0-9", "If-Range": '"other"'})
+        assert response.status_code == 200
+        response = await ac.get(media["url"], headers={"Range": "bytes=0-9", "If-Range": etag})
+        assert response.status_code == 206
+
+        response = await ac.get(media["url"], headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+        response = await ac.get(media["url"], headers={"If-Modified-Since": last_modified})
+        assert response.status_code == 304
+
+        response = await ac.get("/media/000000000000000000000000")
+        assert response.status_code == 404
+        response = await ac.get("/media/not-an-id")
+        assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_upload_rejected():
+    """Test the uploads refused: unauthenticated, multipart, too large."""
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.post("/media/", content=b"data")
+        assert response.status_code == 401
+
+        headers = await auth_headers(ac)
+        response = await ac.post("/media/", files={"file": ("a.png", b"data", "image/png")}, headers=headers)
+        assert response.status_code == 415
+        response = await ac.post("/media/", content=b"data", headers={**headers, "Content-Length": "four"})
+        assert response.status_code == 400
+
+        max_bytes = CONFIG.media_max_bytes
+        CONFIG.media_max_bytes = len(CHUNK) * 2
+        try:
+            # without a Content-Length, refused once too much was streamed
+            response = await ac.post("/media/", content=chunks(3), headers=headers)
+            assert response.status_code == 413
+            response = await ac.post("/media/", content=CHUNK * 3, headers=headers)
+            assert response.status_code == 413
+        finally:
+            CONFIG.media_max_bytes = max_bytes
+        # nothing kept of the refused uploads
+        assert not [name for name in os.listdir(media_storage.media_store.directory) if name.endswith(".part")]
+
+
+@pytest.mark.anyio
+async def test_upload_memory_flat():
+    """Test a large upload is streamed, not held in memory."""
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        headers = await auth_headers(ac)
+        tracemalloc.start()
+        try:
+            # 32 MB
+            response = await ac.post("/media/", content=chunks(512), headers=headers)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        assert response.status_code == 201
+        assert response.json()["length"] == len(CHUNK) * 512
+        assert peak < 4 * 1024 * 1024
+
+
+@pytest.mark.anyio
+async def test_image_variants():
+    """Test the variants of the image of a post are made in the background."""
+    image = Image.new("RGB", (1600, 1200), (200, 30, 30))
+    body = io.BytesIO()
+    image.save(body, "PNG")
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        headers = await auth_headers(ac)
+        response = await ac.post("/media/?filename=red.png", content=body.getvalue(),
+                                 headers={**headers, "Content-Type": "image/png"})
+        media_url = response.json()["url"]
+        user_id = (await ac.get("/auth/me", headers=headers)).json()["_id"]
+        response = await ac.post("/posts/", json={
+            "user_id": user_id, "media_type": "image", "media_url": media_url}, headers=headers)
+        assert response.status_code == 201
+        post_id = response.json()["_id"]
+
+        await image_variants.wait()
+        response = await ac.get(f"/posts/{post_id}", headers=headers)
+        variants = response.json()["media_variants"]
+        assert set(variants) == {"thumbnail", "feed"}
+        response = await ac.get(variants["thumbnail"])
+        assert response.headers["content-type"] == "image/jpeg"
+        assert Image.open(io.BytesIO(response.content)).size == (160, 120)
+        response = await ac.get(variants["feed"])
+        assert Image.open(io.BytesIO(response.content)).size == (1080, 810)
+
+        # a new image, new variants
+        response = await ac.put(f"/posts/{post_id}", json={"media_url": "http://example.com/image.jpg"},
+                                headers=headers)
+        assert response.json()["media_variants"] is None
+
+
+@pytest.mark.anyio
+async def test_image_variants_of_deleted_post():
+    """Test the variants made for a post deleted meanwhile are not kept."""
+    body = io.BytesIO()
+    Image.new("RGB", (400, 300), (30, 30, 200)).save(body, "PNG")
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        headers = await auth_headers(ac)
+        media_url = (await ac.post("/media/?filename=gone.png", content=body.getvalue(),
+                                   headers={**headers, "Content-Type": "image/png"})).json()["url"]
+        user_id = (await ac.get("/auth/me", headers=headers)).json()["_id"]
+        response = await ac.post("/posts/", json={
+            "user_id": user_id, "media_type": "image", "media_url": media_url}, headers=headers)
+        await ac.delete(f"/posts/{response.json()['_id']}", headers=headers)
+        await image_variants.wait()
+    directory = media_storage.media_store.directory
+    kept = [name for name in os.listdir(directory) if name.endswith(".json")
+            and '-gone.png"' in open(os.path.join(directory, name)).read()]
+    assert kept == []
+
+
+@pytest.mark.anyio
+async def test_image_variants_outside_request():
+    """Test the variants are made without the deadline of the request scheduling them."""
+    async def job_deadline():
+        return remaining(), _csot.remaining()
+
+    with deadline(0.01):
+        task = image_variants._start(job_deadline())
+    assert await task == (None, None)
+
+
+@pytest.mark.anyio
+async def test_deduplicated_media():
+    """Test a content is stored once, and deleted with the last post showing it."""
+    content = uuid.uuid4().bytes * 1000
+    sha256 = hashlib.sha256(content).hexdigest()
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        headers = await auth_headers(ac)
+        user_id = (await ac.get("/auth/me", headers=headers)).json()["_id"]
+        first = (await ac.post("/media/?filename=meme.gif", content=content, headers=headers)).json()
+        other_headers = await auth_headers(ac)
+        other_id = (await ac.get("/auth/me", headers=other_headers)).json()["_id"]
+        second = (await ac.post("/media/?filename=copy.gif", content=content, headers=other_headers)).json()
+        assert first["_id"] == second["_id"]
+        # the file as uploaded by the second user
+        assert (second["filename"], second["user_id"]) == ("copy.gif", other_id)
+        assert first["user_id"] == user_id
+        assert first["sha256"] == sha256
+        assert not [name for name in os.listdir(media_storage.media_store.directory) if name.endswith(".part")]
+
+        # a hash claimed without the content gets nothing
+        response = await ac.post("/media/", content=b"", headers={**headers, "X-Content-SHA256": sha256})
+        assert response.json()["_id"] != first["_id"]
+
+        response = await ac.get(first["url"])
+        assert response.headers["etag"] == f'"{sha256}"'
+
+        post_ids = []
+        for _ in range(2):
+            response = await ac.post("/posts/", json={
+                "user_id": user_id, "content": "meme", "media_url": first["url"]}, headers=headers)
+            assert response.status_code == 201
+            post_ids.append(response.json()["_id"])
+        assert (await media_storage.media_store.info(first["_id"])).refs == 2
+
+        await ac.delete(f"/posts/{post_ids[0]}", headers=headers)
+        assert (await ac.get(first["url"])).status_code == 200
+        await ac.put(f"/posts/{post_ids[1]}", json={"content": "no meme", "media_url": "http://example.com/a.gif"},
+                     headers=headers)
+        assert (await ac.get(first["url"])).status_code == 404
+
+        response = await ac.post("/posts/", json={
+            "user_id": user_id, "content": "meme", "media_url": first["url"]}, headers=headers)
+        assert response.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_sweep_unreferenced_media():
+    """Test the uploads no post shows are deleted after the grace period, the others kept."""
+    store = media_storage.media_store
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        headers = await auth_headers(ac)
+        user_id = (await ac.get("/auth/me", headers=headers)).json()["_id"]
+        orphan = (await ac.post("/media/", content=uuid.uuid4().bytes, headers=headers)).json()
+        shown = (await ac.post("/media/", content=uuid.uuid4().bytes, headers=headers)).json()
+        response = await ac.post("/posts/", json={
+            "user_id": user_id, "content": "shown", "media_url": shown["url"]}, headers=headers)
+        assert response.status_code == 201
+
+        # within the grace period
+        await store.sweep(datetime.now(timezone.utc) - timedelta(hours=1))
+        assert await store.info(orphan["_id"]) is not None
+
+        assert await store.sweep(datetime.now(timezone.utc) + timedelta(minutes=1)) >= 1
+        assert (await ac.get(orphan["url"])).status_code == 404
+        assert (await ac.get(shown["url"])).status_code == 200
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+""" testing the metrics endpoint """
+
+import uuid
+import pytest
+from httpx import AsyncClient
+from app.api.app import app
+from app.api.metrics import BYTES_IN, DB_COMMANDS, IN_FLIGHT, LATENCY, REQUESTS, MetricsMiddleware
+from app.core.metrics import Registry
+from app.models.comment import Comment
+from app.models.post import Post
+from app.models.token import BlackListedTokens
+from app.models.user import User
+from app.models.like import Like
+from app.models.notification import Notification
+from app.models.engine.db_storage import get_storage
+from app.core.config import CONFIG
+
+
+@pytest.fixture(scope="module", autouse=True)
+async def initialize_db():
+    """Initialize the test database."""
+    storage = get_storage(CONFIG.test_storage_engine, db_name="test_db")
+    await storage.init(document_models=[User, Post, Comment, Like, Notification, BlackListedTokens])
+    yield
+    # Drop the test database after tests are done
+    await storage.drop()
+
+
+@pytest.mark.anyio
+async def test_metrics_by_route_template():
+    """Test the requests are counted by route template and status."""
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        unique_id = uuid.uuid4()
+        register_data = {
+            "email": f"test_metrics_{unique_id}@example.com",
+            "username": f"test_metrics_{unique_id}",
+            "password": "testpassword"
+        }
+        login_response = await ac.post("/auth/register", json=register_data)
+        assert login_response.status_code == 201
+        headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+
+        labels = ("GET", "/posts/{post_id}", "404")
+        requests_before = REQUESTS.get(labels)
+        latencies_before = LATENCY.count(labels)
+        for _ in range(3):
+            response = await ac.get(f"/posts/{uuid.uuid4()}", headers=headers)
+            assert response.status_code == 404
+
+        assert REQUESTS.get(labels) == requests_before + 3
+        assert LATENCY.count(labels) == latencies_before + 3
+        assert IN_FLIGHT.get() == 0
+        assert BYTES_IN.get(("POST", "/auth/register", "201")) >= len(str(register_data))
+
+        response = await ac.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        body = response.text
+        assert "# TYPE http_request_duration_seconds histogram" in body
+        assert 'http_requests_total{method="GET",route="/posts/{post_id}",status="404"}' in body
+        assert 'http_request_duration_seconds_bucket{method="GET",route="/posts/{post_id}",status="404",le="+Inf"}' in body
+        # the ids are never used as labels
+        assert str(unique_id) not in body
+
+
+@pytest.mark.anyio
+async def test_metrics_unmatched_route():
+    """Test the requests matching no route share one label."""
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        labels = ("GET", "unmatched", "404")
+        before = REQUESTS.get(labels)
+        response = await ac.get(f"/unknown/{uuid.uuid4()}")
+        assert response.status_code == 404
+        assert REQUESTS.get(labels) == before + 1
+
+
+@pytest.mark.anyio
+async def test_db_commands_of_request():
+    """Test the database commands of a request are in the metrics and in the debug headers."""
+    debug_app = MetricsMiddleware(app, debug=True)
+    async with AsyncClient(app=debug_app, base_url="http://test") as ac:
+        unique_id = uuid.uuid4()
+        register_data = {
+            "email": f"test_metrics_{unique_id}@example.com",
+            "username": f"test_metrics_{unique_id}",
+            "password": "testpassword"
+        }
+        login_response = await ac.post("/auth/register", json=register_data)
+        assert login_response.status_code == 201
+        headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+
+        labels = ("GET", "/auth/me", "200")
+        before = DB_COMMANDS.count(labels)
+        response = await ac.get("/auth/me", headers=headers)
+        assert response.status_code == 200
+        # the token blacklist and the user
+        assert response.headers["x-db-commands"] == "2"
+        assert float(response.headers["x-db-time-ms"]) >= 0
+        assert int(response.headers["x-db-bytes"]) >= 0
+        # counted by the middleware of the app and by the debug one
+        assert DB_COMMANDS.count(labels) == before + 2
+
+
+def test_registry_render():
+    """Test the Prometheus text format of the metrics."""
+    registry = Registry()
+    counter = registry.counter("jobs_total", "Number of jobs", ("queue",))
+    histogram = registry.histogram("job_seconds", "Job duration", buckets=(0.1, 1))
+    counter.inc(("a\"b",), 2)
+    histogram.observe(0.1)
+    histogram.observe(0.5)
+    histogram.observe(3)
+
+    assert registry.render() == (
+        '# HELP jobs_total Number of jobs\n'
+        '# TYPE jobs_total counter\n'
+        'jobs_total{queue="a\\"b"} 2\n'
+        '# HELP job_seconds Job duration\n'
+        '# TYPE job_seconds histogram\n'
+        'job_seconds_bucket{le="0.1"} 1\n'
+        'job_seconds_bucket{le="1"} 2\n'
+        'job_seconds_bucket{le="+Inf"} 3\n'
+        'job_seconds_sum 3.6\n'
+        'job_seconds_count 3\n'
+    )
+    with pytest.raises(ValueError):
+        registry.counter("jobs_total", "Number of jobs")
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+""" testing the notifications """
+
+import uuid
+import pytest
+from httpx import AsyncClient
+from pymongo.errors import DuplicateKeyError
+from app.api.app import app
+from app.models.engine.db_storage import get_storage
+from app.core.config import CONFIG
+from app.models.comment import Comment
+from app.models.like import Like
+from app.models.notification import Notification, NotificationResponse
+from app.models.post import Post
+from app.models.token import BlackListedTokens
+from app.models.user import User
+from app.utils.notifications import NotificationQueue, notifications
+
+
+@pytest.fixture(scope="module", autouse=True)
+async def initialize_db():
+    """Initialize the test database."""
+    storage = get_storage(CONFIG.test_storage_engine, db_name="test_db")
+    await storage.init(document_models=[User, Post, Comment, Like, Notification, BlackListedTokens])
+    yield
+    # Drop the test database after tests are done
+    await storage.drop()
+
+
+async def register(ac: AsyncClient, name: str) -> dict:
+    """Register a user, return its id, username and auth headers"""
+    username = f"{name}_{uuid.uuid4().hex[:8]}"
+    response = await ac.post("/auth/register", json={
+        "email": f"{username}@example.com", "username": username, "password": "testpassword"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    user_id = (await ac.get("/auth/me", headers=headers)).json()["_id"]
+    return {"id": user_id, "username": username, "headers": headers}
+
+
+@pytest.mark.anyio
+async def test_notifications():
+    """Test the likes, comments and follows are notified, coalesced, paginated and marked read."""
+    # the actions of the other tests
+    await notifications.flush()
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        alice, bob, carol = [await register(ac, name) for name in ("alice", "bob", "carol")]
+        response = await ac.post("/posts/", json={"user_id": alice["id"], "content": "hello"},
+                                 headers=alice["headers"])
+        post_id = response.json()["_id"]
+
+        for user in (alice, bob, carol):
+            await ac.post("/likes/", json={"user_id": user["id"], "post_id": post_id}, headers=user["headers"])
+        await ac.post("/comments/", json={"user_id": carol["id"], "post_id": post_id, "content": "hi"},
+                      headers=carol["headers"])
+        await ac.post(f"/users/follow/{alice['id']}", headers=bob["headers"])
+        # the like of the post by its author is not notified
+        assert await notifications.flush() == 3
+
+        response = await ac.get("/notifications", params={"limit": 2}, headers=alice["headers"])
+        assert response.status_code == 200
+        first = response.json()
+        assert first["unread_count"] == 3 and first["next_cursor"]
+        response = await ac.get("/notifications", params={"limit": 2, "cursor": first["next_cursor"]},
+                                headers=alice["headers"])
+        second = response.json()
+        assert second["next_cursor"] is None
+        by_kind = {notification["kind"]: notification for notification in first["results"] + second["results"]}
+        assert by_kind["like"]["actor_count"] == 2
+        assert by_kind["like"]["message"] == f"{carol['username']} and 1 other liked your post"
+        assert by_kind["comment"]["post_id"] == post_id
+        assert by_kind["follow"]["message"] == f"{bob['username']} started following you"
+
+        response = await ac.post("/notifications/read", json={"ids": [by_kind["like"]["_id"]]},
+                                 headers=alice["headers"])
+        assert response.json() == {"unread_count": 2}
+        # a like after the notification was read is a new one
+        await ac.delete(f"/likes/{(await Like.find_one(Like.user_id == bob['id'])).id}", headers=bob["headers"])
+        await ac.post("/likes/", json={"user_id": bob["id"], "post_id": post_id}, headers=bob["headers"])
+        await notifications.flush()
+        response = await ac.get("/notifications", params={"unread": True}, headers=alice["headers"])
+        unread = response.json()["results"]
+        assert len(unread) == 3 and unread[0]["kind"] == "like" and unread[0]["actor_count"] == 1
+
+        response = await ac.post("/notifications/read", headers=alice["headers"])
+        assert response.json() == {"unread_count": 0}
+        response = await ac.get("/notifications", params={"cursor": "invalid"}, headers=alice["headers"])
+        assert response.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_burst_coalesced():
+    """Test a burst of likes of a post is written as one notification."""
+    queue = NotificationQueue(max_pending=100)
+    user_id, post_id = str(uuid.uuid4()), str(uuid.uuid4())
+    for i in range(500):
+        queue.notify(user_id, 'like', f"actor-{i}", f"actor{i}", post_id=post_id)
+    queue.notify(user_id, 'like', user_id, "self", post_id=post_id)
+    assert len(queue) == 1
+    assert await queue.flush() == 1
+    for i in range(500, 813):
+        queue.notify(user_id, 'like', f"actor-{i}", f"actor{i}", post_id=post_id)
+    await queue.flush()
+
+    notification = await Notification.find_one(Notification.user_id == user_id)
+    assert notification.actor_count == 813
+    assert notification.actor_names == ["actor810", "actor811", "actor812"]
+    message = NotificationResponse(**notification.model_dump(by_alias=True)).message
+    assert message == "actor812 and 812 others liked your post"
+
+
+@pytest.mark.anyio
+async def test_one_unread_notification():
+    """Test a user has one unread notification at most for the same kind and post."""
+    collection = Notification.get_motor_collection()
+    user_id, post_id = str(uuid.uuid4()), str(uuid.uuid4())
+    key = {'user_id': user_id, 'kind': 'like', 'post_id': post_id}
+    await collection.insert_one({'_id': str(uuid.uuid4()), **key, 'read': False})
+    with pytest.raises(DuplicateKeyError):
+        await collection.insert_one({'_id': str(uuid.uuid4()), **key, 'read': False})
+    # the read ones are kept
+    await collection.update_many(key, {'$set': {'read': True}})
+    await collection.insert_one({'_id': str(uuid.uuid4()), **key, 'read': False})
+    assert await collection.count_documents(key) == 2
+
+
+@pytest.mark.anyio
+@pytest.mark.skipif(CONFIG.test_storage_engine != 'mongodb', reason="mongomock does not fail the $inc of a string")
+async def test_failed_notifications_queued_again():
+    """Test the actions of a failed write are written with the next flush, at most max_retries times."""
+    queue = NotificationQueue(max_retries=1)
+    collection = Notification.get_motor_collection()
+    user_id, post_id = str(uuid.uuid4()), str(uuid.uuid4())
+    await collection.insert_one({'_id': str(uuid.uuid4()), 'user_id': user_id, 'kind': 'like',
+                                 'post_id': post_id, 'read': False, 'actor_count': 'many'})
+    queue.notify(user_id, 'like', 'actor-1', 'actor1', post_id=post_id)
+    assert await queue.flush() == 0
+    queue.notify(user_id, 'like', 'actor-2', 'actor2', post_id=post_id)
+    assert len(queue) == 1
+
+    await collection.update_one({'user_id': user_id}, {'$set': {'actor_count': 0}})
+    assert await queue.flush() == 1
+    notification = await Notification.find_one(Notification.user_id == user_id)
+    assert (notification.actor_count, notification.actor_ids) == (2, ['actor-1', 'actor-2'])
+
+    await collection.update_one({'user_id': user_id}, {'$set': {'actor_count': 'many'}})
+    queue.notify(user_id, 'like', 'actor-3', 'actor3', post_id=post_id)
+    await queue.flush()
+    await queue.flush()
+    assert len(queue) == 0
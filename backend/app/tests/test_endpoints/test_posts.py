@@ -5,23 +5,25 @@ import uuid
 import pytest
 from httpx import AsyncClient
 from app.api.app import app
+from app.models.engine.db_storage import get_storage
+from app.core.config import CONFIG
 from app.models.user import User
 from app.models.post import Post
 from app.models.comment import Comment
 from app.models.like import Like
+from app.models.notification import Notification
 from app.models.token import BlackListedTokens
-from beanie import init_beanie
-from motor.motor_asyncio import AsyncIOMotorClient
+from app.utils.views import view_counters
 
 
 @pytest.fixture(scope="module", autouse=True)
 async def initialize_db():
     """Initialize the test database."""
-    client = AsyncIOMotorClient("mongodb://localhost:27017")
-    await init_beanie(database=client.test_db, document_models=[User, Post, Comment, Like, BlackListedTokens])
+    storage = get_storage(CONFIG.test_storage_engine, db_name="test_db")
+    await storage.init(document_models=[User, Post, Comment, Like, Notification, BlackListedTokens])
     yield
     # Drop the test database after tests are done
-    await client.drop_database("test_db")
+    await storage.drop()
 
 
 @pytest.mark.anyio
@@ -300,3 +302,67 @@ async def test_update_post_with_no_content_and_no_media_url():
         response = await ac.put(f"/posts/{post_id}", json=updated_post_data, headers=headers)
 
         assert response.status_code == 422  # 422 Unprocessable Entity
+
+
+@pytest.mark.anyio
+async def test_post_views():
+    """Test the impressions and views of a post, counted in memory then added in bulk."""
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        username = f"viewer_{uuid.uuid4().hex[:8]}"
+        response = await ac.post("/auth/register", json={
+            "email": f"{username}@example.com", "username": username, "password": "testpassword"})
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        user_id = (await ac.get("/auth/me", headers=headers)).json()["_id"]
+        post_id = (await ac.post("/posts/", json={"user_id": user_id, "content": "seen"},
+                                 headers=headers)).json()["_id"]
+
+        for _ in range(2):
+            response = await ac.get(f"/posts/{post_id}", headers=headers)
+        assert (response.json()["views"], response.json()["impressions"]) == (2, 0)
+        posts = (await ac.get(f"/posts/user/{user_id}", headers=headers)).json()
+        assert (posts[0]["views"], posts[0]["impressions"]) == (2, 1)
+        assert (await Post.get(post_id)).views == 0
+
+        assert await view_counters.flush() >= 1
+        assert view_counters.pending(post_id) == (0, 0)
+        stored = await Post.get(post_id)
+        assert (stored.views, stored.impressions) == (2, 1)
+
+        # the links of a comment are pushed alone, the counts written meanwhile are kept
+        await ac.get(f"/posts/{post_id}", headers=headers)
+        await view_counters.flush()
+        await ac.post("/comments/", json={"user_id": user_id, "post_id": post_id, "content": "hi"}, headers=headers)
+        response = await ac.get(f"/posts/{post_id}", headers=headers)
+        assert response.json()["views"] == 4
+        stored = await Post.get(post_id, fetch_links=True)
+        assert stored.views == 3 and [comment.content for comment in stored.comments] == ["hi"]
+
+
+@pytest.mark.anyio
+@pytest.mark.skipif(CONFIG.test_storage_engine != 'mongodb', reason="the write errors of a bulk write need MongoDB")
+async def test_post_views_partial_failure():
+    """Test only the counts of the updates which failed are written again."""
+    collection = Post.get_motor_collection()
+    good, bad = str(uuid.uuid4()), str(uuid.uuid4())
+    # $inc fails on a string
+    await collection.insert_many([{'_id': good, 'views': 0, 'impressions': 0},
+                                  {'_id': bad, 'views': 'many', 'impressions': 0}])
+    view_counters.view(good)
+    view_counters.view(bad)
+    await view_counters.flush()
+    assert view_counters.pending(good) == (0, 0)
+    assert view_counters.pending(bad) == (0, 1)
+
+    await collection.update_one({'_id': bad}, {'$set': {'views': 0}})
+    await view_counters.flush()
+    assert (await collection.find_one({'_id': good}))['views'] == 1
+    assert (await collection.find_one({'_id': bad}))['views'] == 1
+
+    # an update failing for good is dropped after max_retries writes
+    await collection.update_one({'_id': bad}, {'$set': {'views': 'many'}})
+    view_counters.view(bad)
+    for _ in range(view_counters.max_retries):
+        await view_counters.flush()
+        assert view_counters.pending(bad) == (0, 1)
+    await view_counters.flush()
+    assert view_counters.pending(bad) == (0, 0)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+""" testing the profiling of the requests """
+
+import uuid
+import pytest
+from httpx import AsyncClient
+from app.api.app import app
+from app.core.profiling import profiler
+from app.models.comment import Comment
+from app.models.post import Post
+from app.models.token import BlackListedTokens
+from app.models.user import User
+from app.models.like import Like
+from app.models.notification import Notification
+from app.models.engine.db_storage import get_storage
+from app.core.config import CONFIG
+
+
+ADMIN_HEADERS = {"X-Admin-Token": "test-admin-token"}
+
+
+@pytest.fixture(scope="module", autouse=True)
+async def initialize_db():
+    """Initialize the test database."""
+    storage = get_storage(CONFIG.test_storage_engine, db_name="test_db")
+    await storage.init(document_models=[User, Post, Comment, Like, Notification, BlackListedTokens])
+    admin_token = CONFIG.admin_token
+    CONFIG.admin_token = ADMIN_HEADERS["X-Admin-Token"]
+    yield
+    CONFIG.admin_token = admin_token
+    profiler.clear()
+    # Drop the test database after tests are done
+    await storage.drop()
+
+
+def register_data():
+    unique_id = uuid.uuid4()
+    return {
+        "email": f"test_profiling_{unique_id}@example.com",
+        "username": f"test_profiling_{unique_id}",
+        "password": "testpassword"
+    }
+
+
+@pytest.mark.anyio
+async def test_profile_of_request():
+    """Test a request sent with the profile flag and the admin token is profiled."""
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        headers = {**ADMIN_HEADERS, "X-Profile": "1"}
+        response = await ac.post("/auth/register", json=register_data(), headers=headers)
+        assert response.status_code == 201
+        profile_id = response.headers["x-profile-id"]
+
+        response = await ac.get(f"/admin/profiles/{profile_id}", headers=ADMIN_HEADERS)
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        lines = response.text.splitlines()
+        assert lines
+        for line in lines:
+            stack, count = line.rsplit(" ", 1)
+            assert int(count) > 0
+        # bcrypt runs on the loop, its frames are sampled under the ones of the middleware
+        assert any("hash_password (app/utils/auth.py" in line for line in lines)
+        assert all(line.startswith("__call__ (app/api/profiling.py") or line.startswith("(")
+                   for line in lines)
+
+        response = await ac.get("/admin/profiles", headers=ADMIN_HEADERS)
+        summary = next(summary for summary in response.json() if summary["id"] == profile_id)
+        assert summary["route"] == "/auth/register"
+        assert summary["samples"] == sum(int(line.rsplit(" ", 1)[1]) for line in lines)
+
+        response = await ac.get("/?profile=1", headers=ADMIN_HEADERS)
+        assert "x-profile-id" in response.headers
+
+
+@pytest.mark.anyio
+async def test_profile_needs_admin_token():
+    """Test the profile flag is ignored without the admin token."""
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get("/", headers={"X-Profile": "1"})
+        assert response.status_code == 200
+        assert "x-profile-id" not in response.headers
+        response = await ac.get("/?profile=1", headers={"X-Admin-Token": "wrong"})
+        assert "x-profile-id" not in response.headers
+
+        response = await ac.get(f"/admin/profiles/{uuid.uuid4().hex}", headers=ADMIN_HEADERS)
+        assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_continuous_profile():
+    """Test every request is sampled for the profile of its route in continuous mode."""
+    profiler.continuous_hz = 1000
+    try:
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            response = await ac.post("/auth/register", json=register_data())
+            assert response.status_code == 201
+            assert "x-profile-id" not in response.headers
+    finally:
+        profiler.continuous_hz = 0
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get("/admin/profiles/routes", headers=ADMIN_HEADERS,
+                                params={"route": "POST /auth/register"})
+        assert response.status_code == 200
+        assert "hash_password (app/utils/auth.py" in response.text
+
+        response = await ac.get("/admin/profiles/routes", headers=ADMIN_HEADERS)
+        assert all(line.startswith("POST /auth/register;") for line in response.text.splitlines())
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+""" testing the rate limits of the auth routes """
+
+import uuid
+import pytest
+from httpx import AsyncClient
+from app.api.app import app
+from app.core.rate_limit import MongoBucketStore, RateLimiter, RateRule, load_rules, rate_limiter
+from app.models.engine import db_storage
+from app.models.engine.db_storage import get_storage
+from app.core.config import CONFIG
+from app.models.token import BlackListedTokens
+from app.models.user import User
+
+
+@pytest.fixture(scope="module", autouse=True)
+async def initialize_db():
+    """Initialize the test database."""
+    db_storage.storage = get_storage(CONFIG.test_storage_engine, db_name="test_db")
+    await db_storage.storage.init(document_models=[User, BlackListedTokens])
+    yield
+    storage, db_storage.storage = db_storage.storage, None
+    # Drop the test database after tests are done
+    await storage.drop()
+
+
+@pytest.fixture
+def rate_limits():
+    """Rate limits enabled, with small rules."""
+    rules = rate_limiter.rules
+    rate_limiter.enabled = True
+    rate_limiter.rules = load_rules('{"login": {"ip": {"burst": 4, "per_minute": 1},'
+                                    ' "user": {"burst": 2, "per_minute": 1}}}')
+    rate_limiter.clear()
+    yield
+    rate_limiter.enabled = False
+    rate_limiter.rules = rules
+    rate_limiter.clear()
+
+
+@pytest.mark.anyio
+async def test_login_rate_limited(rate_limits):
+    """Test a 429 once the account, then the IP, is out of tokens."""
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        for _ in range(2):
+            response = await ac.post("/auth/login", data={"username": "victim@example.com", "password": "x"})
+            assert response.status_code == 401
+        response = await ac.post("/auth/login", data={"username": "Victim@example.com", "password": "x"})
+        assert response.status_code == 429
+        assert int(response.headers["retry-after"]) > 0
+
+        # the IP has 4 tokens, one taken by the refused request
+        response = await ac.post("/auth/login", data={"username": f"{uuid.uuid4()}@example.com", "password": "x"})
+        assert response.status_code == 401
+        response = await ac.post("/auth/login", data={"username": f"{uuid.uuid4()}@example.com", "password": "x"})
+        assert response.status_code == 429
+
+        # other routes keep their own buckets
+        response = await ac.post("/auth/forgot-password", json={"email": f"{uuid.uuid4()}@example.com"})
+        assert response.status_code == 404
+
+
+@pytest.mark.anyio
+@pytest.mark.skipif(CONFIG.test_storage_engine != 'mongodb', reason="the shared buckets need MongoDB")
+async def test_shared_buckets():
+    """Test the buckets kept in MongoDB for all the workers."""
+    store = MongoBucketStore(db_storage.storage.database)
+    await store.init()
+    rule = RateRule(burst=2, per_minute=60)
+    assert await store.hit("key", rule, now=0) == 0
+    assert await store.hit("key", rule, now=0) == 0
+    assert await store.hit("key", rule, now=0.5) == pytest.approx(0.5)
+    assert await store.hit("key", rule, now=1) == 0
+
+
+def test_token_bucket():
+    """Test the burst, the lazy refill and the time to wait."""
+    limiter = RateLimiter(shards=4, gc_seconds=60, rules={})
+    rule = RateRule(burst=2, per_minute=60)
+    assert limiter.take("key", rule, now=0) == 0
+    assert limiter.take("key", rule, now=0) == 0
+    assert limiter.take("key", rule, now=0) == pytest.approx(1)
+    assert limiter.take("key", rule, now=0.5) == pytest.approx(0.5)
+    assert limiter.take("key", rule, now=1) == 0
+    # refilled up to the burst only
+    assert limiter.take("key", rule, now=100) == 0
+    assert limiter.take("key", rule, now=100) == 0
+    assert limiter.take("key", rule, now=100) > 0
+    assert limiter.take("other", rule, now=100) == 0
+
+
+def test_collect_full_buckets():
+    """Test the full buckets are dropped, one shard at a time."""
+    limiter = RateLimiter(shards=4, gc_seconds=60, rules={})
+    rule = RateRule(burst=2, per_minute=60)
+    for i in range(100):
+        limiter.take(f"key-{i}", rule, now=0)
+    assert len(limiter) == 100
+    # not full yet
+    assert sum(limiter.collect(now=0.5) for _ in range(4)) == 0
+    assert sum(limiter.collect(now=1) for _ in range(4)) == 100
+    assert len(limiter) == 0
+
+
+def test_load_rules():
+    """Test the rules set in RATE_LIMITS override the defaults."""
+    rules = load_rules('{"sign_up": {"ip": {"burst": 1, "per_minute": 0.5}}}')
+    assert rules["sign_up"]["ip"] == RateRule(burst=1, per_minute=0.5)
+    assert rules["login"]["user"].burst == 5
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Testing the read routing against a local replica set
+
+    mongod --replSet rs0 --port 27017 --dbpath /tmp/rs0-0
+    mongod --replSet rs0 --port 27018 --dbpath /tmp/rs0-1
+    mongosh --eval 'rs.initiate({_id: "rs0", members: [
+        {_id: 0, host: "localhost:27017"}, {_id: 1, host: "localhost:27018"}]})'
+
+    MONGODB_REPLICA_SET_URL="mongodb://localhost:27017,localhost:27018/?replicaSet=rs0" pytest
+"""
+
+import os
+import uuid
+import pytest
+from httpx import AsyncClient
+from app.api.app import app
+from app.core.config import CONFIG
+from app.models.comment import Comment
+from app.models.engine.db_storage import DBStorage
+from app.models.engine.read_routing import read_router
+from app.models.like import Like
+from app.models.notification import Notification
+from app.models.post import Post
+from app.models.token import BlackListedTokens
+from app.models.user import User
+
+
+REPLICA_SET_URL = os.getenv("MONGODB_REPLICA_SET_URL")
+
+pytestmark = pytest.mark.skipif(
+    not REPLICA_SET_URL, reason="MONGODB_REPLICA_SET_URL is not set")
+
+
+@pytest.fixture(scope="module", autouse=True)
+async def initialize_db():
+    """Initialize the test database on the replica set."""
+    storage = DBStorage(url=REPLICA_SET_URL, db_name="test_db")
+    await storage.init(document_models=[User, Post, Comment, Like, Notification, BlackListedTokens])
+    CONFIG.secondary_reads = True
+    yield
+    CONFIG.secondary_reads = False
+    read_router.bind(None)
+    await storage.drop()
+
+
+@pytest.mark.anyio
+async def test_read_your_writes():
+    """A user reading from the secondaries always sees his own writes."""
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        # Register a new user and obtain tokens
+        unique_id = uuid.uuid4()
+        register_data = {
+            "email": f"test_routing_{unique_id}@example.com",
+            "username": f"test_routing_{unique_id}",
+            "password": "testpassword"
+        }
+        login_response = await ac.post("/auth/register", json=register_data)
+        assert login_response.status_code == 201
+        access_token = login_response.json()["access_token"]
+        headers = {"Authorization": f"Bearer {access_token}"}
+
+        user_response = await ac.get("/auth/me", headers=headers)
+        assert user_response.status_code == 200
+        user_id = user_response.json()['_id']
+
+        for i in range(10):
+            # write on the primary, then read right away from a secondary
+            post_data = {"user_id": user_id, "content": f"post {i}"}
+            post_response = await ac.post("/posts/", json=post_data, headers=headers)
+            assert post_response.status_code == 201
+            post_id = post_response.json()["_id"]
+
+            response = await ac.get(f"/posts/{post_id}", headers=headers)
+            assert response.status_code == 200
+            assert response.json()["content"] == f"post {i}"
+
+            response = await ac.put(f"/posts/{post_id}", json={"content": f"updated {i}"}, headers=headers)
+            assert response.status_code == 200
+
+            response = await ac.get(f"/posts/user/{user_id}", headers=headers)
+            assert response.status_code == 200
+            assert len(response.json()) == i + 1
+            assert response.json()[-1]["content"] == f"updated {i}"
+
+
+@pytest.mark.anyio
+async def test_logout_is_seen_by_secondary_reads():
+    """A logged out token is rejected even by the routes reading from secondaries."""
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        unique_id = uuid.uuid4()
+        register_data = {
+            "email": f"test_routing_{unique_id}@example.com",
+            "username": f"test_routing_{unique_id}",
+            "password": "testpassword"
+        }
+        login_response = await ac.post("/auth/register", json=register_data)
+        assert login_response.status_code == 201
+        access_token = login_response.json()["access_token"]
+        headers = {"Authorization": f"Bearer {access_token}"}
+
+        response = await ac.post("/auth/logout", headers=headers)
+        assert response.status_code == 200
+
+        response = await ac.get("/users/", headers=headers)
+        assert response.status_code == 401
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+""" testing the search of the posts """
+
+import uuid
+from datetime import datetime
+import pytest
+from httpx import AsyncClient
+from app.api.app import app
+from app.models.engine.db_storage import get_storage
+from app.core.config import CONFIG
+from app.models.comment import Comment
+from app.models.like import Like
+from app.models.notification import Notification
+from app.models.post import Post
+from app.models.token import BlackListedTokens
+from app.models.user import User
+from app.utils import search
+from app.utils.search import InvertedIndex, PrefixIndex, decode_cursor, encode_cursor, normalize_name, tokenize
+
+
+@pytest.fixture(scope="module", autouse=True)
+async def initialize_db():
+    """Initialize the test database."""
+    storage = get_storage(CONFIG.test_storage_engine, db_name="test_db")
+    await storage.init(document_models=[User, Post, Comment, Like, Notification, BlackListedTokens])
+    yield
+    # Drop the test database after tests are done
+    await storage.drop()
+
+
+@pytest.mark.anyio
+async def test_search_posts():
+    """Test the posts are searched as they are created, updated and deleted."""
+    # words of this test only, the index is shared by the tests
+    word, other = f"w{uuid.uuid4().hex[:12]}", f"w{uuid.uuid4().hex[:12]}"
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        unique_id = uuid.uuid4()
+        response = await ac.post("/auth/register", json={
+            "email": f"test_search_{unique_id}@example.com",
+            "username": f"test_search_{unique_id}",
+            "password": "testpassword"
+        })
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        user_id = (await ac.get("/auth/me", headers=headers)).json()["_id"]
+
+        post_ids = []
+        for i in range(5):
+            response = await ac.post("/posts/", json={
+                "user_id": user_id, "content": f"Post {i} about {word} " + f"{other} " * i}, headers=headers)
+            post_ids.append(response.json()["_id"])
+
+        response = await ac.get("/search/posts", params={"q": other}, headers=headers)
+        assert response.status_code == 200
+        # the most occurrences first
+        assert [post["_id"] for post in response.json()["results"]] == post_ids[:0:-1]
+
+        # two pages of 3 and 2
+        response = await ac.get("/search/posts", params={"q": word, "limit": 3}, headers=headers)
+        first = response.json()
+        assert len(first["results"]) == 3 and first["next_cursor"]
+        response = await ac.get("/search/posts", params={"q": word, "limit": 3, "cursor": first["next_cursor"]},
+                                headers=headers)
+        second = response.json()
+        assert len(second["results"]) == 2 and second["next_cursor"] is None
+        assert {post["_id"] for post in first["results"] + second["results"]} == set(post_ids)
+
+        await ac.put(f"/posts/{post_ids[0]}", json={"content": "nothing to find"}, headers=headers)
+        await ac.delete(f"/posts/{post_ids[1]}", headers=headers)
+        response = await ac.get("/search/posts", params={"q": word.upper()}, headers=headers)
+        assert {post["_id"] for post in response.json()["results"]} == set(post_ids[2:])
+
+        response = await ac.get("/search/posts", params={"q": word, "cursor": "invalid"}, headers=headers)
+        assert response.status_code == 400
+
+
+
+@pytest.mark.anyio
+async def test_refresh_from_other_workers():
+    """Test a refresh adds the posts written since the last one, once, and removes the deleted ones."""
+    index, deletions = InvertedIndex(), search.Deletions()
+    await deletions.init()
+    word = f"w{uuid.uuid4().hex[:12]}"
+    collection = Post.get_motor_collection()
+    await index.build(search._post_documents())
+    # written at the same time, the millisecond of MongoDB
+    now = datetime.now()
+    updated_at = now.replace(microsecond=now.microsecond // 1000 * 1000)
+    post_ids = [str(uuid.uuid4()) for _ in range(3)]
+    await collection.insert_many([{'_id': post_id, 'content': f"refreshed {word}", 'updated_at': updated_at}
+                                  for post_id in post_ids])
+
+    assert await index.build(search._post_documents(index.since)) == 3
+    assert {doc_id for _, _, doc_id in index.search(word)} == set(post_ids)
+    slots = len(index._ids)
+    # nothing written since
+    assert await index.build(search._post_documents(index.since)) == 0
+    assert len(index._ids) == slots
+
+    # deleted by another worker
+    await collection.delete_one({'_id': post_ids[0]})
+    await deletions.record([('post', post_ids[0])])
+    search.post_index, post_index = index, search.post_index
+    try:
+        assert await deletions.apply() == 1
+        assert await deletions.apply() == 0
+    finally:
+        search.post_index = post_index
+    assert {doc_id for _, _, doc_id in index.search(word)} == set(post_ids[1:])
+
+
+@pytest.mark.anyio
+async def test_search_users():
+    """Test the users are found by the beginning of their names as they sign up, change and leave."""
+    prefix = f"u{uuid.uuid4().hex[:8]}"
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        tokens = []
+        for username, full_name in ((f"{prefix}_zoe", "Zoë Martin"), (f"{prefix}_al", f"Al {prefix}son")):
+            response = await ac.post("/auth/register", json={
+                "email": f"{username}@example.com", "username": username,
+                "full_name": full_name, "password": "testpassword"})
+            tokens.append(response.json()["access_token"])
+        headers = {"Authorization": f"Bearer {tokens[0]}"}
+        zoe_id = (await ac.get("/auth/me", headers=headers)).json()["_id"]
+
+        response = await ac.get("/search/users", params={"q": prefix.upper()}, headers=headers)
+        assert response.status_code == 200
+        # the last name of Al is the shortest key
+        assert [user["username"] for user in response.json()] == [f"{prefix}_al", f"{prefix}_zoe"]
+        assert set(response.json()[0]) == {"_id", "username", "full_name", "profile_picture_url"}
+        response = await ac.get("/search/users", params={"q": f"{prefix}_z", "limit": 1}, headers=headers)
+        assert [user["_id"] for user in response.json()] == [zoe_id]
+
+        await ac.put(f"/users/{zoe_id}", json={"full_name": f"Zoe {prefix}x Martin"}, headers=headers)
+        response = await ac.get("/search/users", params={"q": f"{prefix}x mar"}, headers=headers)
+        assert [user["_id"] for user in response.json()] == [zoe_id]
+
+        await ac.delete(f"/users/{zoe_id}", headers=headers)
+        headers = {"Authorization": f"Bearer {tokens[1]}"}
+        response = await ac.get("/search/users", params={"q": prefix}, headers=headers)
+        assert [user["username"] for user in response.json()] == [f"{prefix}_al"]
+
+def test_bm25_ranking():
+    """Test the rare terms, the frequent occurrences and the short texts rank first."""
+    index = InvertedIndex(max_scan=100)
+    index.add("short", "cat")
+    index.add("long", "cat and a very long text about other things entirely")
+    index.add("twice", "cat cat dog")
+    index.add("dog", "dog")
+    assert [doc_id for _, _, doc_id in index.search("cat")] == ["twice", "short", "long"]
+    # 'cat' is rarer than 'dog' in the index with more dogs
+    for i in range(10):
+        index.add(f"dog-{i}", "dog")
+    assert index.search("cat dog")[0][2] == "twice"
+
+    index.remove("twice")
+    index.add("short", "bird")
+    assert [doc_id for _, _, doc_id in index.search("cat")] == ["long"]
+    assert len(index) == 13
+
+
+def test_common_terms():
+    """Test the terms in too many documents are only looked up, or scanned from the most recent."""
+    index = InvertedIndex(max_scan=10)
+    for i in range(100):
+        index.add(f"doc-{i}", "common" + (" rare" if i in (5, 50) else ""))
+    results = index.search("rare common")
+    assert {doc_id for _, _, doc_id in results} == {"doc-5", "doc-50"}
+    results = index.search("common", limit=100)
+    assert {doc_id for _, _, doc_id in results} == {f"doc-{i}" for i in range(90, 100)}
+
+
+def test_pagination_and_tokens():
+    """Test the cursors and the tokenizer."""
+    index = InvertedIndex()
+    for i in range(25):
+        index.add(str(i), "same words")
+    seen, after = [], None
+    while True:
+        page = index.search("words", limit=10, after=after)
+        if not page:
+            break
+        seen += [doc_id for _, _, doc_id in page]
+        after = decode_cursor(encode_cursor(page[-1][0], page[-1][1]))
+    assert sorted(seen, key=int) == [str(i) for i in range(25)]
+    assert tokenize("The Café is OPEN, isn't it?") == ["cafe", "open", "isn", "t"]
+
+
+def test_prefix_index():
+    """Test the prefixes of the names and of their later words, the shortest names first."""
+    index = PrefixIndex()
+    index.add("1", "ann", "Ann Smith")
+    index.add("2", "annabel", None)
+    index.add("3", "bob", "Bob Anderson-Smith")
+    assert index.search("ann") == ["1", "2"]
+    assert index.search("an") == ["3", "1", "2"]
+    assert index.search("ANN", limit=2) == ["1", "2"]
+    assert index.search("smi") == ["1", "3"]
+    assert index.search("ann sm") == ["1"]
+    assert index.search("  ") == []
+    index.add("1", "zed")
+    assert index.search("an") == ["3", "2"]
+    index.remove("3")
+    assert index.search("smith") == []
+    assert len(index) == 2
+    assert normalize_name("  Zoë  O'Brien ") == "zoe o brien"
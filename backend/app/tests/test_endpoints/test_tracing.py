@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+""" testing the tracing of the requests """
+
+import uuid
+import pytest
+from httpx import AsyncClient
+from app.api.app import app
+from app.core.tracing import parse_traceparent, tracer
+from app.models.comment import Comment
+from app.models.post import Post
+from app.models.token import BlackListedTokens
+from app.models.user import User
+from app.models.like import Like
+from app.models.notification import Notification
+from app.models.engine.db_storage import get_storage
+from app.core.config import CONFIG
+
+
+class ListExporter:
+    """Keeps the exported traces"""
+
+    def __init__(self):
+        self.traces = []
+
+    def export(self, payload):
+        self.traces.append(payload)
+
+    def spans(self, root_name):
+        """Spans of the last trace whose root span has this name"""
+        for payload in reversed(self.traces):
+            spans = payload["resourceSpans"][0]["scopeSpans"][0]["spans"]
+            if spans[0]["name"] == root_name:
+                return spans
+        raise AssertionError(f"no trace of {root_name}")
+
+
+@pytest.fixture(scope="module", autouse=True)
+async def initialize_db():
+    """Initialize the test database, every request being traced."""
+    storage = get_storage(CONFIG.test_storage_engine, db_name="test_db")
+    await storage.init(document_models=[User, Post, Comment, Like, Notification, BlackListedTokens])
+    sample_rate, exporter = tracer.sample_rate, tracer._exporter
+    tracer.sample_rate = 1
+    yield
+    tracer.sample_rate, tracer.exporter = sample_rate, exporter
+    # Drop the test database after tests are done
+    await storage.drop()
+
+
+@pytest.fixture()
+def exporter():
+    """Collect the traces of the test"""
+    tracer.exporter = ListExporter()
+    return tracer.exporter
+
+
+@pytest.mark.anyio
+async def test_trace_of_request(exporter):
+    """Test the spans of a request share its trace id and are nested under its root span."""
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        unique_id = uuid.uuid4()
+        register_data = {
+            "email": f"test_tracing_{unique_id}@example.com",
+            "username": f"test_tracing_{unique_id}",
+            "password": "testpassword"
+        }
+        login_response = await ac.post("/auth/register", json=register_data)
+        assert login_response.status_code == 201
+        headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+        assert "hash_password" in [span["name"] for span in exporter.spans("POST /auth/register")]
+
+        user_id = (await ac.get("/auth/me", headers=headers)).json()["_id"]
+        post_data = {"user_id": user_id, "content": "traced", "media_type": "image",
+                     "media_url": "http://example.com/image.jpg"}
+        post_id = (await ac.post("/posts/", json=post_data, headers=headers)).json()["_id"]
+
+        response = await ac.get(f"/posts/{post_id}", headers=headers)
+        assert response.status_code == 200
+        spans = exporter.spans("GET /posts/{post_id}")
+        root, children = spans[0], spans[1:]
+        trace_id, span_id, sampled = parse_traceparent(response.headers["traceparent"])
+        assert (trace_id, span_id, sampled) == (root["traceId"], root["spanId"], True)
+
+        assert all(span["traceId"] == trace_id for span in spans)
+        span_ids = {span["spanId"] for span in spans}
+        assert all(span["parentSpanId"] in span_ids for span in children)
+        assert all(int(span["startTimeUnixNano"]) <= int(span["endTimeUnixNano"]) for span in spans)
+        attributes = {item["key"]: item["value"] for item in root["attributes"]}
+        assert attributes["http.status_code"] == {"intValue": "200"}
+        assert attributes["http.route"] == {"stringValue": "/posts/{post_id}"}
+
+        by_name = {span["name"]: span for span in children}
+        assert {"dependencies", "auth", "handler get_post_by_id", "serialize"} <= set(by_name)
+        assert by_name["auth"]["parentSpanId"] == by_name["dependencies"]["spanId"]
+        # the blacklist and the user of the authentication, the post of the handler
+        db_spans = [span for span in children if span["name"].startswith("db.")]
+        assert any(span["parentSpanId"] == by_name["auth"]["spanId"] for span in db_spans)
+        assert any(span["parentSpanId"] == by_name["handler get_post_by_id"]["spanId"]
+                   for span in db_spans)
+        collections = {item["value"]["stringValue"] for span in db_spans
+                       for item in span["attributes"] if item["key"] == "db.collection"}
+        assert {"black_listed_tokens", "users", "posts"} <= collections
+
+
+@pytest.mark.anyio
+async def test_traceparent_continued(exporter):
+    """Test a sampled traceparent header is continued, only when tracing is on."""
+    tracer.sample_rate = 0
+    try:
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            response = await ac.get("/")
+            assert "traceparent" not in response.headers
+            trace_id, parent_id = uuid.uuid4().hex, uuid.uuid4().hex[:16]
+            response = await ac.get("/", headers={"traceparent": f"00-{trace_id}-{parent_id}-01"})
+            assert "traceparent" not in response.headers
+            assert exporter.traces == []
+
+            # tracing on, with the requests of no caller sampled
+            tracer.sample_rate = 1e-12
+            response = await ac.get("/", headers={"traceparent": f"00-{trace_id}-{parent_id}-01"})
+            root = exporter.spans("GET /")[0]
+            assert (root["traceId"], root["parentSpanId"]) == (trace_id, parent_id)
+            assert parse_traceparent(response.headers["traceparent"])[0] == trace_id
+
+            # not sampled by the caller
+            await ac.get("/", headers={"traceparent": f"00-{trace_id}-{parent_id}-00"})
+            assert len(exporter.traces) == 1
+    finally:
+        tracer.sample_rate = 1
+
+
+def test_parse_traceparent():
+    """Test the invalid traceparent headers are ignored."""
+    assert parse_traceparent("00-" + "a" * 32 + "-" + "b" * 16 + "-01") == ("a" * 32, "b" * 16, True)
+    assert parse_traceparent(None) is None
+    assert parse_traceparent("00-" + "0" * 32 + "-" + "b" * 16 + "-01") is None
+    assert parse_traceparent("00-" + "x" * 32 + "-" + "b" * 16 + "-01") is None
+    assert parse_traceparent("garbage") is None
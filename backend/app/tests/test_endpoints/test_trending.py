@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+""" testing the hashtags and the trending ones """
+
+import uuid
+import pytest
+from httpx import AsyncClient
+from app.api.app import app
+from app.models.engine.db_storage import get_storage
+from app.core.config import CONFIG
+from app.models.comment import Comment
+from app.models.like import Like
+from app.models.notification import Notification
+from app.models.post import Post
+from app.models.token import BlackListedTokens
+from app.models.user import User
+from app.utils.trending import TrendingTags, extract_hashtags, load_trending, save_trending, trending_tags
+
+
+@pytest.fixture(scope="module", autouse=True)
+async def initialize_db():
+    """Initialize the test database."""
+    storage = get_storage(CONFIG.test_storage_engine, db_name="test_db")
+    await storage.init(document_models=[User, Post, Comment, Like, Notification, BlackListedTokens])
+    yield
+    # Drop the test database after tests are done
+    await storage.drop()
+
+
+@pytest.mark.anyio
+async def test_hashtags_and_trending():
+    """Test the hashtags of the posts are stored, listed and counted in the trends."""
+    # tags of this test only, the trends are shared by the tests
+    tag, other = f"t{uuid.uuid4().hex[:10]}", f"t{uuid.uuid4().hex[:10]}"
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        unique_id = uuid.uuid4()
+        response = await ac.post("/auth/register", json={
+            "email": f"test_trending_{unique_id}@example.com",
+            "username": f"test_trending_{unique_id}",
+            "password": "testpassword"
+        })
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        user_id = (await ac.get("/auth/me", headers=headers)).json()["_id"]
+
+        post_ids = []
+        for i in range(3):
+            response = await ac.post("/posts/", json={
+                "user_id": user_id, "content": f"Post {i} #{tag.upper()} #{tag}"}, headers=headers)
+            assert response.json()["hashtags"] == [tag]
+            post_ids.append(response.json()["_id"])
+        response = await ac.put(f"/posts/{post_ids[0]}", json={"content": f"now #{other} and #{tag}"},
+                                headers=headers)
+        assert response.json()["hashtags"] == [other, tag]
+
+        response = await ac.get(f"/posts/tag/{tag}", headers=headers)
+        assert [post["_id"] for post in response.json()] == post_ids[::-1]
+        response = await ac.get(f"/posts/tag/{other}", params={"limit": 1}, headers=headers)
+        assert [post["_id"] for post in response.json()] == post_ids[:1]
+
+        response = await ac.get("/trending", params={"limit": 100})
+        assert response.status_code == 200
+        counts = {trend["tag"]: trend["count"] for trend in response.json()}
+        # the update only counted the new tag
+        assert counts[tag] >= 3 and counts[other] >= 1
+        assert list(counts).index(tag) < list(counts).index(other)
+
+
+@pytest.mark.anyio
+async def test_checkpoint():
+    """Test the trends are saved and restored."""
+    database = Post.get_motor_collection().database
+    tag = f"t{uuid.uuid4().hex[:10]}"
+    trending_tags.add([tag, tag])
+    await save_trending(database)
+    saved = trending_tags.count(tag)
+    # emptied
+    assert trending_tags.load(TrendingTags().state())
+    assert trending_tags.count(tag) == 0
+    assert await load_trending(database)
+    assert trending_tags.count(tag) == saved
+    assert (tag, saved) in trending_tags.trending(100)
+
+
+@pytest.mark.anyio
+async def test_checkpoints_of_workers():
+    """Test the checkpoints of the workers add up, each use saved once."""
+    database = Post.get_motor_collection().database
+    tag = f"t{uuid.uuid4().hex[:10]}"
+    first, second = TrendingTags(), TrendingTags()
+    await load_trending(database)
+    before = trending_tags.count(tag)
+    first.add([tag] * 3)
+    second.add([tag] * 2)
+    await save_trending(database, first)
+    await save_trending(database, second)
+    # nothing counted since the last checkpoint
+    await save_trending(database, first)
+    first.add([tag])
+    await save_trending(database, first)
+
+    restarted = TrendingTags()
+    assert await load_trending(database, restarted)
+    assert restarted.count(tag) == before + 6
+    assert (tag, before + 6) in restarted.trending(100)
+
+
+def test_sliding_window():
+    """Test the counts expire with their bucket, and the most used tags are kept."""
+    trends = TrendingTags(window=60, buckets=6, width=256, depth=3, top=3)
+    trends.add(["old", "old"], now=0)
+    trends.add(["new"], now=30)
+    assert trends.count("old") == 2
+    assert trends.trending(now=30) == [("old", 2), ("new", 1)]
+    # the bucket of 'old' left the window
+    assert trends.trending(now=61) == [("new", 1)]
+    assert trends.count("old") == 0
+    assert trends.trending(now=200) == []
+
+    for tag, uses in (("a", 5), ("b", 4), ("c", 3), ("d", 1)):
+        trends.add([tag] * uses, now=200)
+    assert [tag for tag, _ in trends.trending(now=200)] == ["a", "b", "c"]
+    trends.add(["d"] * 5, now=201)
+    assert trends.trending(now=201) == [("d", 6), ("a", 5), ("b", 4)]
+
+    other = TrendingTags(window=60, buckets=6, width=256, depth=3, top=3)
+    assert other.load(trends.state(), now=201)
+    assert other.trending(now=201) == trends.trending(now=201)
+    assert not TrendingTags(window=60, buckets=6, width=128, depth=3).load(trends.state())
+
+
+def test_extract_hashtags():
+    """Test the hashtags are parsed from the text."""
+    assert extract_hashtags("Summer #Beach #café, #beach again! a#b ##c #") == ["beach", "cafe"]
+    assert extract_hashtags("no tags") == []
+    assert extract_hashtags(None) == []
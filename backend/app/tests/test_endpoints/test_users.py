@@ -4,14 +4,20 @@
 import uuid
 from app.models.comment import Comment
 from app.models.like import Like
+from app.models.notification import Notification
 from app.models.post import Post
+from app.models.suggestion import Suggestions
 import pytest
 from httpx import AsyncClient
 from app.api.app import app
+from app.models.engine.db_storage import get_storage
+from app.core.config import CONFIG
+from app.tests.query_budget import query_budget
 from app.models.user import User
 from app.models.token import BlackListedTokens
-from beanie import init_beanie
-from motor.motor_asyncio import AsyncIOMotorClient
+from app.core.graph import FollowIndex, FriendsOfFriends, csr_from_edges
+from app.utils.follow_graph import follow_graph
+from app.utils.suggestions import refresh_suggestions
 
 
 # 'fixture': This decorator is used to create a fixture in pytest.
@@ -26,12 +32,11 @@ from motor.motor_asyncio import AsyncIOMotorClient
 @pytest.fixture(scope="module", autouse=True)
 async def initialize_db():
     """Initialize the test database."""
-    client = AsyncIOMotorClient(
-        "mongodb://localhost:27017")
-    await init_beanie(database=client.test_db, document_models=[User, Post, Comment, Like, BlackListedTokens])
+    storage = get_storage(CONFIG.test_storage_engine, db_name="test_db")
+    await storage.init(document_models=[User, Post, Comment, Like, Notification, Suggestions, BlackListedTokens])
     yield
     # Drop the test database after tests are done
-    await client.drop_database("test_db")
+    await storage.drop()
 
 
 @pytest.mark.anyio
@@ -171,6 +176,7 @@ async def test_delete_user():
         }
         response = await ac.post("/comments/", json=comment_data, headers=headers)
         assert response.status_code == 201
+        await Suggestions(id=user_id, users=[]).insert()
 
         # Send a DELETE request to delete the user with valid token
         response = await ac.delete(f"/users/{user_id}", headers=headers)
@@ -186,6 +192,7 @@ async def test_delete_user():
 
         get_comment_response = await ac.get(f"/comments/post/{post_id}", headers=headers)
         assert get_comment_response.status_code == 404
+        assert await Suggestions.get(user_id) is None
 
 
 @pytest.mark.anyio
@@ -310,3 +317,135 @@ async def test_get_following():
         assert response.status_code == 200
         following_response = response.json()
         assert isinstance(following_response, list)
+
+
+@pytest.mark.anyio
+async def test_delete_user_query_budget():
+    """Test the queries sent to delete a user with posts."""
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        unique_id = uuid.uuid4()
+        register_data = {
+            "email": f"test_budget_{unique_id}@example.com",
+            "username": f"test_budget_{unique_id}",
+            "password": "testpassword"
+        }
+        login_response = await ac.post("/auth/register", json=register_data)
+        assert login_response.status_code == 201
+        headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+        user_id = (await ac.get("/auth/me", headers=headers)).json()['_id']
+
+        posts = 3
+        for i in range(posts):
+            post_data = {"user_id": user_id, "content": f"post {i}"}
+            response = await ac.post("/posts/", json=post_data, headers=headers)
+            assert response.status_code == 201
+
+        # 2 to authenticate, 1 for the user and his posts, 1 for his notifications, 1 for his
+        # suggestions, 1 to delete him, 1 to record the deletions for the search indexes of the
+        # other workers, and for each post: its comments, its likes, the post and the user update
+        with query_budget(7 + 4 * posts):
+            response = await ac.delete(f"/users/{user_id}", headers=headers)
+        assert response.status_code == 200
+
+
+@pytest.mark.anyio
+async def test_relationship():
+    """Test the relationship of two users, from the follow index updated by the routes and built from the users."""
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        users = []
+        for name in ("ann", "ben", "cat"):
+            username = f"{name}_{uuid.uuid4().hex[:8]}"
+            response = await ac.post("/auth/register", json={
+                "email": f"{username}@example.com", "username": username, "password": "testpassword"})
+            headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+            user_id = (await ac.get("/auth/me", headers=headers)).json()['_id']
+            users.append({"id": user_id, "headers": headers})
+        ann, ben, cat = users
+        for follower, followed in ((ann, ben), (ann, cat), (ben, cat), (cat, ann)):
+            await ac.post(f"/users/follow/{followed['id']}", headers=follower["headers"])
+
+        expected = {"following": True, "followed_by": True, "followers_count": 2,
+                    "following_count": 1, "known_followers_count": 1}
+        # 2 to authenticate, 1 to find the user
+        with query_budget(3):
+            response = await ac.get(f"/users/{cat['id']}/relationship", headers=ann["headers"])
+        assert response.json() == expected
+        response = await ac.get(f"/users/{uuid.uuid4()}/relationship", headers=ann["headers"])
+        assert response.status_code == 404
+        await ac.delete(f"/users/unfollow/{ann['id']}", headers=cat["headers"])
+        response = await ac.get(f"/users/{cat['id']}/relationship", headers=ann["headers"])
+        assert response.json() == {**expected, "followed_by": False, "following_count": 0}
+
+        index = await follow_graph.build()
+        assert index.follows(ann["id"], ben["id"]) and not index.follows(cat["id"], ann["id"])
+        assert index.known_followers(ann["id"], cat["id"]) == [ben["id"]]
+        await ac.delete(f"/users/{ben['id']}", headers=ben["headers"])
+        assert follow_graph.index.followers_count(cat["id"]) == 1
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+async def test_suggestions():
+    """Test the users suggested to follow, computed in batch then read by the route."""
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        users = []
+        for name in ("alice", "bob", "carol", "dave", "erin"):
+            username = f"{name}_{uuid.uuid4().hex[:8]}"
+            response = await ac.post("/auth/register", json={
+                "email": f"{username}@example.com", "username": username, "password": "testpassword"})
+            headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+            user_id = (await ac.get("/auth/me", headers=headers)).json()['_id']
+            users.append({"id": user_id, "username": username, "headers": headers})
+        alice, bob, carol, dave, erin = users
+
+        for follower, followed in ((alice, bob), (alice, carol), (bob, dave), (carol, dave), (carol, erin)):
+            await ac.post(f"/users/follow/{followed['id']}", headers=follower["headers"])
+        assert (await ac.get("/users/suggestions", headers=alice["headers"])).json() == []
+
+        assert await refresh_suggestions(k=5, workers=0) >= 1
+        with query_budget(3):
+            response = await ac.get("/users/suggestions", headers=alice["headers"])
+        assert response.status_code == 200
+        suggested = response.json()
+        assert [(user["_id"], user["mutual"]) for user in suggested] == [(dave["id"], 2), (erin["id"], 1)]
+        assert suggested[0]["username"] == dave["username"]
+
+        # the users followed since the last run are dropped
+        await ac.post(f"/users/follow/{dave['id']}", headers=alice["headers"])
+        response = await ac.get("/users/suggestions?limit=1", headers=alice["headers"])
+        assert [user["_id"] for user in response.json()] == [erin["id"]]
+
+
+def test_friends_of_friends():
+    """Test the friends of friends are ranked by the number of accounts followed following them."""
+    # 0 follows 1 and 2, who both follow 3; 2 also follows 4 and 0; 5 follows everyone
+    sources = [0, 0, 1, 2, 2, 2, 2, 5, 5, 5, 5, 5]
+    targets = [1, 2, 3, 3, 4, 0, 3, 0, 1, 2, 3, 4]
+    indptr, indices = csr_from_edges(6, sources, targets)
+    assert list(indptr) == [0, 2, 3, 6, 6, 6, 11]
+    assert list(indices[indptr[2]:indptr[3]]) == [0, 3, 4]
+    graph = FriendsOfFriends(indptr, indices)
+    assert graph.suggest(0, 5) == [(3, 2), (4, 1)]
+    assert graph.suggest(5, 5) == []
+    assert FriendsOfFriends(indptr, indices, max_fanout=1).suggest(0, 5) == [(3, 1)]
+    candidates, scores = graph.suggest_range(0, 2, 3)
+    assert list(candidates) == [3, 4, -1, -1, -1, -1] and list(scores) == [2, 1, 0, 0, 0, 0]
+
+
+def test_follow_index():
+    """Test the follow index answers from its CSR arrays, then from the rows changed."""
+    index = FollowIndex()
+    # a follows b and c, b follows c, c follows a
+    indptr, indices = csr_from_edges(3, [0, 0, 1, 2], [1, 2, 2, 0])
+    index.build(["a", "b", "c"], indptr, indices)
+    assert index.follows("a", "b") and not index.follows("b", "a") and index.mutual("a", "c")
+    assert (index.following_count("a"), index.followers_count("c"), index.edges) == (2, 2, 4)
+    assert index.known_followers("a", "c") == ["b"] and index.common_following("a", "b") == ["c"]
+
+    assert index.add("b", "a") and not index.add("b", "a")
+    assert index.add("d", "c") and index.follows("d", "c") and index.followers("c") == ["a", "b", "d"]
+    assert index.remove("a", "b") and not index.remove("a", "b") and index.following("a") == ["c"]
+    assert index.edges == 5 and index.nbytes() > 0
+    index.remove_user("c")
+    assert index.followers_count("c") == 0 and index.following("d") == [] and index.edges == 1
+    assert not index.follows("x", "a") and index.followers_count("x") == 0
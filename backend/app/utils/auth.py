@@ -6,6 +6,7 @@ from typing import Optional
 import bcrypt
 import jwt
 from app.core.config import CONFIG
+from app.core.tracing import tracer
 
 
 ACCESS_TOKEN_EXPIRE_MINUTES = 30 # minutes
@@ -13,6 +14,7 @@ REFRESH_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
 ALGORITHM = "HS256"
 
 
+@tracer.traced()
 def hash_password(password: str) -> str:
     """
     Hashes the provided password using bcrypt.
@@ -27,6 +29,7 @@ def hash_password(password: str) -> str:
     return hashed.decode()
 
 
+@tracer.traced()
 def verify_password(password: str, hashed_password) -> bool:
     """
     Verifies a password against a hashed password using bcrypt.
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Server-Sent Events streams of the comments of the posts.
+
+The viewers of a post share one broadcaster: it loads the latest
+SSE_PAGE_SIZE comments of the post once, for its first viewer, then keeps
+them up to date with the live events of the post (see app/utils/live.py),
+and puts each event, encoded once as an SSE frame, in the queue of every
+viewer. A new viewer gets the page from memory, so N viewers make one query.
+The broadcaster stops with its last viewer.
+
+Each comment is sent with its id as the id of the event: a client
+reconnecting with the Last-Event-ID header gets the comments after that one
+when it is still in the page, else the whole page again. A viewer too slow
+for its events gets a `reset` event with the whole page instead of the
+events it missed.
+"""
+
+import asyncio
+import json
+import logging
+from typing import Any, Dict, List, Optional, Set, Tuple
+from app.core.config import CONFIG
+from app.core.metrics import REGISTRY
+from app.core.pubsub import Subscriber
+from app.core.tasks import detached
+from app.models.comment import Comment, CommentResponse
+from app.utils.live import post_events
+
+logger = logging.getLogger(__name__)
+
+COMMENT_EVENTS = ('comment', 'comment_updated', 'comment_deleted')
+
+BROADCASTERS = REGISTRY.gauge("comment_stream_broadcasters", "Number of posts with comment stream viewers")
+VIEWERS = REGISTRY.gauge("comment_stream_viewers", "Number of comment stream viewers")
+
+# the fields of a comment sent
+FIELDS = tuple(field.alias or name for name, field in CommentResponse.model_fields.items())
+
+
+def sse_frame(event: str, data: str, event_id: Optional[str] = None) -> str:
+    """An event in the text/event-stream format"""
+    frame = f"id: {event_id}\n" if event_id else ""
+    return f"{frame}event: {event}\ndata: {data}\n\n"
+
+
+class CommentBroadcaster:
+    """
+    The latest comments of a post, sent to its viewers.
+
+    Attributes:
+        post_id (str): ID of the post.
+        page_size (int): Number of latest comments kept.
+        viewers (Set[Subscriber]): The queues of the frames of the viewers.
+        refs (int): Number of viewers, those still waiting for the page included.
+    """
+
+    def __init__(self, post_id: str, page_size: int = CONFIG.sse_page_size):
+        self.post_id = post_id
+        self.page_size = page_size
+        self.viewers: Set[Subscriber] = set()
+        self.refs = 0
+        # the latest comments, the oldest first
+        self._page: List[Dict[str, Any]] = []
+        self._source = Subscriber(max_queue=1000)
+        self._task: Optional[asyncio.Task] = None
+        self.loading: Optional[asyncio.Future] = None
+
+    async def start(self) -> None:
+        """Load the latest comments and follow the events of the post"""
+        # subscribed first: the events during the query are applied to the page after it
+        post_events.broker.subscribe(self._source, [self.post_id])
+        comments = await Comment.find(Comment.post_id == self.post_id).sort(
+            -Comment.created_at, -Comment.id).limit(self.page_size).to_list()
+        self._page = [CommentResponse(**comment.model_dump(by_alias=True)).model_dump(mode='json', by_alias=True)
+                      for comment in reversed(comments)]
+        self._task = detached(self._run())
+
+    def stop(self) -> None:
+        post_events.broker.unsubscribe(self._source)
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self) -> None:
+        while True:
+            messages = await self._source.get()
+            for message in messages:
+                try:
+                    self._broadcast(json.loads(message))
+                except Exception:
+                    logger.exception("Failed to send a comment event of post %s", self.post_id)
+
+    def _broadcast(self, event: Dict[str, Any]) -> None:
+        event_type = event['type']
+        if event_type not in COMMENT_EVENTS:
+            return
+        comment = {field: value for field, value in event['data'].items() if field in FIELDS}
+        comment_id = comment.get('_id')
+        index = next((i for i, kept in enumerate(self._page) if kept['_id'] == comment_id), None)
+        if event_type == 'comment':
+            if index is not None:
+                # already in the page loaded
+                return
+            self._page = (self._page + [comment])[-self.page_size:]
+        elif index is not None:
+            if event_type == 'comment_updated':
+                self._page[index] = comment
+            else:
+                del self._page[index]
+        frame = sse_frame(event_type, json.dumps(comment), comment_id if event_type == 'comment' else None)
+        for viewer in self.viewers:
+            viewer.put(frame)
+
+    def frames(self, last_event_id: Optional[str] = None) -> List[str]:
+        """The comments of the page after the one of the id, all of them when it is not in the page"""
+        page = self._page
+        if last_event_id:
+            index = next((i for i, comment in enumerate(page) if comment['_id'] == last_event_id), None)
+            if index is not None:
+                page = page[index + 1:]
+        return [sse_frame('comment', json.dumps(comment), comment['_id']) for comment in page]
+
+    def reset_frame(self) -> str:
+        """The whole page, for a viewer who missed events"""
+        last_id = self._page[-1]['_id'] if self._page else None
+        return sse_frame('reset', json.dumps(self._page), last_id)
+
+
+class CommentStreams:
+    """The broadcasters of the posts with viewers"""
+
+    def __init__(self):
+        self._broadcasters: Dict[str, CommentBroadcaster] = {}
+
+    def __len__(self) -> int:
+        return len(self._broadcasters)
+
+    def watched(self, post_id: str) -> bool:
+        """Whether the post has viewers"""
+        return post_id in self._broadcasters
+
+    async def open(self, post_id: str, last_event_id: Optional[str] = None,
+                   max_queue: int = CONFIG.live_queue_size) -> Tuple[CommentBroadcaster, Subscriber, List[str]]:
+        """A new viewer of the post: its broadcaster, the queue of its frames and the frames to send first"""
+        broadcaster = self._broadcasters.get(post_id)
+        if broadcaster is None:
+            broadcaster = self._broadcasters[post_id] = CommentBroadcaster(post_id)
+            # shared by the viewers, it outlives the deadline and the trace of the first one
+            broadcaster.loading = detached(broadcaster.start())
+            BROADCASTERS.set(len(self._broadcasters))
+        broadcaster.refs += 1
+        viewer = Subscriber(max_queue)
+        try:
+            await asyncio.shield(broadcaster.loading)
+        except BaseException:
+            self.close(broadcaster, viewer)
+            raise
+        # the page and the events after it, nothing in between
+        broadcaster.viewers.add(viewer)
+        VIEWERS.inc()
+        return broadcaster, viewer, broadcaster.frames(last_event_id)
+
+    def close(self, broadcaster: CommentBroadcaster, viewer: Subscriber) -> None:
+        """A viewer left, the broadcaster stops with the last one"""
+        if viewer in broadcaster.viewers:
+            broadcaster.viewers.discard(viewer)
+            VIEWERS.dec()
+        broadcaster.refs -= 1
+        if broadcaster.refs == 0:
+            broadcaster.stop()
+            if self._broadcasters.get(broadcaster.post_id) is broadcaster:
+                del self._broadcasters[broadcaster.post_id]
+            BROADCASTERS.set(len(self._broadcasters))
+
+
+comment_streams = CommentStreams()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+The follow graph of the users, in memory (see FollowIndex in app/core/graph.py).
+
+Built from the users at startup, then updated by the follows, unfollows and
+deletes of the routes, so whether a user follows another one, the follower
+counts and the accounts followed in common are answered without a query.
+The follows written by the other workers are seen when the index is built
+again, every FOLLOW_GRAPH_REFRESH_SECONDS: a new index is built off to the
+side, the changes made meanwhile applied to it, then it replaces the old one.
+"""
+
+import asyncio
+import logging
+import time
+from array import array
+from typing import List, Optional, Tuple
+from app.core.config import CONFIG
+from app.core.graph import FollowIndex, csr_from_edges
+from app.core.metrics import REGISTRY
+from app.models.user import User
+
+logger = logging.getLogger(__name__)
+
+BUILD_SECONDS = REGISTRY.histogram(
+    "follow_graph_build_seconds", "Time to build the follow index from the users, in seconds")
+EDGES = REGISTRY.gauge("follow_graph_edges", "Number of follows in the follow index")
+
+
+def _ref_id(link) -> str:
+    """The id of a link as stored, a DBRef"""
+    return link.id if hasattr(link, 'id') else link['$id']
+
+
+async def load_follow_graph() -> Tuple[List[str], array, array]:
+    """The ids of the users, numbered by their index, and the CSR arrays of their follows"""
+    collection = User.get_motor_collection()
+    ids = [doc['_id'] async for doc in collection.find({}, {'_id': 1})]
+    numbers = {user_id: number for number, user_id in enumerate(ids)}
+    sources, targets = array('i'), array('i')
+    async for doc in collection.find({}, {'following': 1}):
+        source = numbers.get(doc['_id'])
+        if source is None:
+            # created since the ids were read
+            continue
+        for link in doc.get('following') or []:
+            target = numbers.get(_ref_id(link))
+            if target is not None:
+                sources.append(source)
+                targets.append(target)
+    # sorted in a thread, the requests keep being served
+    indptr, indices = await asyncio.to_thread(csr_from_edges, len(ids), sources, targets)
+    return ids, indptr, indices
+
+
+class FollowGraph:
+    """
+    The follow index of the process, and the changes made while it is built again.
+
+    Attributes:
+        index (FollowIndex): The follows of the users.
+    """
+
+    def __init__(self):
+        self.index = FollowIndex()
+        self._changes: Optional[List[Tuple[str, str, Optional[str]]]] = None
+
+    def _apply(self, index: FollowIndex, change: str, user_id: str, other_id: Optional[str]) -> None:
+        if change == 'follow':
+            index.add(user_id, other_id)
+        elif change == 'unfollow':
+            index.remove(user_id, other_id)
+        else:
+            index.remove_user(user_id)
+
+    def _change(self, change: str, user_id: str, other_id: Optional[str] = None) -> None:
+        self._apply(self.index, change, user_id, other_id)
+        if self._changes is not None:
+            self._changes.append((change, user_id, other_id))
+        EDGES.set(self.index.edges)
+
+    def follow(self, user_id: str, other_id: str) -> None:
+        self._change('follow', user_id, other_id)
+
+    def unfollow(self, user_id: str, other_id: str) -> None:
+        self._change('unfollow', user_id, other_id)
+
+    def remove_user(self, user_id: str) -> None:
+        self._change('remove_user', user_id)
+
+    async def build(self) -> FollowIndex:
+        """Build the index from the users, keeping the changes made meanwhile"""
+        start = time.perf_counter()
+        self._changes = []
+        try:
+            ids, indptr, indices = await load_follow_graph()
+            index = FollowIndex()
+            # the reverse direction sorted in a thread too
+            await asyncio.to_thread(index.build, ids, indptr, indices)
+            for change in self._changes:
+                self._apply(index, *change)
+            self.index = index
+        finally:
+            self._changes = None
+        EDGES.set(self.index.edges)
+        BUILD_SECONDS.observe(time.perf_counter() - start)
+        return self.index
+
+
+follow_graph = FollowGraph()
+
+
+async def build_follow_graph() -> None:
+    """Build the follow index from the users"""
+    index = await follow_graph.build()
+    logger.info("Follow index built: %d users, %d follows, %d bytes",
+                index.users, index.edges, index.nbytes())
+
+
+async def refresh_follow_graph(interval: float = CONFIG.follow_graph_refresh_seconds) -> None:
+    """Build the follow index again every interval, with the follows of the other workers"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await follow_graph.build()
+        except Exception:
+            logger.exception("Failed to build the follow index")
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Defining the HTTP range and conditional request helpers"""
+
+from datetime import datetime
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Mapping, Optional, Tuple
+
+
+class RangeNotSatisfiable(Exception):
+    """The requested range is outside of the content"""
+
+
+def http_date(date: datetime) -> str:
+    """Format an aware datetime as an HTTP date (Last-Modified, ...)"""
+    return format_datetime(date.replace(microsecond=0), usegmt=True)
+
+
+def _parse_http_date(value: Optional[str]) -> Optional[datetime]:
+    try:
+        return parsedate_to_datetime(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """Whether an If-None-Match / If-Range header lists the etag (weak comparison)"""
+    if header.strip() == '*':
+        return True
+    return any(tag.strip().removeprefix('W/') == etag for tag in header.split(','))
+
+
+def not_modified(headers: Mapping[str, str], etag: str, last_modified: datetime) -> bool:
+    """
+    Whether a conditional GET can be answered with a 304: If-None-Match lists the
+    etag, or, without If-None-Match, the content is not newer than If-Modified-Since.
+    """
+    if_none_match = headers.get('if-none-match')
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    since = _parse_http_date(headers.get('if-modified-since'))
+    return since is not None and last_modified.replace(microsecond=0) <= since
+
+
+def parse_range(headers: Mapping[str, str], length: int, etag: str,
+                last_modified: datetime) -> Optional[Tuple[int, int]]:
+    """
+    The byte range (first, last included) requested by the Range header, None for the
+    whole content: no Range, several ranges, an unknown unit, or an If-Range not
+    matching the current content. Raise RangeNotSatisfiable when it starts past the end.
+    """
+    header = headers.get('range')
+    if not header:
+        return None
+    if_range = headers.get('if-range')
+    if if_range:
+        if if_range.startswith(('"', 'W/')):
+            if if_range.strip() != etag:
+                return None
+        else:
+            date = _parse_http_date(if_range)
+            if date is None or last_modified.replace(microsecond=0) > date:
+                return None
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, sep, last = spec.strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if not first:
+            # the last bytes: bytes=-500
+            suffix = int(last)
+            if suffix <= 0:
+                raise RangeNotSatisfiable()
+            return max(length - suffix, 0), length - 1
+        start = int(first)
+        end = int(last) if last else length - 1
+    except ValueError:
+        return None
+    if start >= length:
+        raise RangeNotSatisfiable()
+    if start > end:
+        return None
+    return start, min(end, length - 1)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Resized variants of the images of the posts.
+
+When a post gets an uploaded image (media_type 'image', media_url
+/media/{id}), its variants (a thumbnail and the size of the feed) are made
+in the background: the image is resized by a pool of IMAGE_WORKERS
+processes, so neither the event loop nor the other threads of the server
+wait for Pillow, the variants are saved in the media store next to the
+original, and their urls set in `Post.media_variants`.
+
+Pillow is only needed to make the variants: without it the posts keep the
+original image only.
+"""
+
+import asyncio
+import io
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from importlib.util import find_spec
+from typing import Coroutine, Dict, Optional, Set, Tuple
+from app.core.config import CONFIG
+from app.core.metrics import REGISTRY
+from app.core.tasks import detached
+from app.models.engine import media_storage
+from app.models.media import MEDIA_URL_PREFIX, media_id_from_url
+from app.models.post import Post
+
+logger = logging.getLogger(__name__)
+
+# the variants by name, with the size of their longest side in pixels
+VARIANTS = {
+    'thumbnail': 160,
+    'feed': 1080,
+}
+
+VARIANT_JOBS = REGISTRY.counter(
+    "image_variant_jobs_total", "Number of images resized, by result", ("result",))
+VARIANT_SECONDS = REGISTRY.histogram(
+    "image_variant_seconds", "Time to make the variants of an image in the pool, in seconds")
+
+
+def render_variants(data: bytes, sizes: Dict[str, int], quality: int = 85) -> Dict[str, Tuple[bytes, str]]:
+    """
+    Resize the image to each size, keeping its proportions and never enlarging it.
+    Runs in the processes of the pool. Returns the bytes and the content type by variant,
+    JPEG or PNG for the images with transparency.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as original:
+        # a JPEG is decoded at the smallest scale still larger than the largest variant
+        largest = max(sizes.values())
+        original.draft('RGB', (largest, largest))
+        # the orientation of the camera applied, the EXIF data is dropped
+        image = ImageOps.exif_transpose(original)
+        transparent = image.mode in ('RGBA', 'LA', 'P') and (image.mode != 'P' or 'transparency' in image.info)
+        image = image.convert('RGBA' if transparent else 'RGB')
+        variants = {}
+        # the largest first, each smaller one resized from the previous one
+        for name, size in sorted(sizes.items(), key=lambda item: item[1], reverse=True):
+            image.thumbnail((size, size), Image.LANCZOS)
+            out = io.BytesIO()
+            if transparent:
+                image.save(out, 'PNG', optimize=True)
+                variants[name] = (out.getvalue(), 'image/png')
+            else:
+                image.save(out, 'JPEG', quality=quality, optimize=True, progressive=True)
+                variants[name] = (out.getvalue(), 'image/jpeg')
+        return variants
+
+
+class VariantGenerator:
+    """
+    Makes the variants of the images of the posts in the background.
+
+    Attributes:
+        workers (int): Number of processes of the pool.
+        max_pending (int): Images waiting to be resized past which the new ones are skipped.
+        max_bytes (int): Size of the largest image resized.
+        enabled (bool): Whether the variants are made, False without Pillow.
+    """
+
+    def __init__(self, workers: int = CONFIG.image_workers, max_pending: int = CONFIG.image_max_pending,
+                 max_bytes: int = CONFIG.image_max_bytes):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_bytes = max_bytes
+        self.enabled = workers > 0 and find_spec('PIL') is not None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        """The pool, started with the first image"""
+        if self._pool is None:
+            # spawned: forking the threads of the server (motor, tracing) is unsafe
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
+
+    def schedule(self, post: Post) -> bool:
+        """Make the variants of the image of the post in the background, whether it will"""
+        media_id = media_id_from_url(post.media_url)
+        if not self.enabled or post.media_type != 'image' or media_id is None:
+            return False
+        if len(self._tasks) >= self.max_pending:
+            VARIANT_JOBS.inc(('skipped',))
+            logger.warning("Too many images waiting to be resized, no variants for post %s", post.id)
+            return False
+        self._start(self._generate(post.id, media_id))
+        return True
+
+    def _start(self, job: Coroutine) -> asyncio.Task:
+        # the job outlives the deadline, the trace and the query stats of the request
+        task = detached(job)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _generate(self, post_id: str, media_id: str) -> None:
+        try:
+            variants = await self.generate(media_id)
+            if variants:
+                # referenced first, released when the post does not show this image any more
+                await media_storage.retain(variants.values())
+                media_url = f"{MEDIA_URL_PREFIX}{media_id}"
+                attached = False
+                try:
+                    result = await Post.find_one(Post.id == post_id, Post.media_url == media_url).update(
+                        {'$set': {'media_variants': variants}})
+                    attached = bool(result.modified_count)
+                finally:
+                    if not attached:
+                        await media_storage.release(variants.values())
+            VARIANT_JOBS.inc(('done' if variants else 'skipped',))
+        except Exception:
+            VARIANT_JOBS.inc(('failed',))
+            logger.exception("Failed to make the variants of media %s", media_id)
+
+    async def generate(self, media_id: str) -> Optional[Dict[str, str]]:
+        """Resize the uploaded image in the pool and save its variants, return their urls"""
+        store = media_storage.media_store
+        media = await store.info(media_id)
+        if media is None or media.length > self.max_bytes:
+            return None
+        data = b''.join([chunk async for chunk in store.read(media_id)])
+        start = time.perf_counter()
+        rendered = await asyncio.get_running_loop().run_in_executor(self.pool, render_variants, data, VARIANTS)
+        VARIANT_SECONDS.observe(time.perf_counter() - start)
+
+        urls = {}
+        for name, (body, content_type) in rendered.items():
+            variant = await store.save(_single_chunk(body), f"{name}-{media.filename}", content_type,
+                                       user_id=media.user_id)
+            urls[name] = variant.url
+        return urls
+
+    async def wait(self) -> None:
+        """Wait for the images being resized"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def close(self) -> None:
+        """Wait for the images being resized, then stop the pool"""
+        await self.wait()
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+async def _single_chunk(body: bytes):
+    yield body
+
+
+image_variants = VariantGenerator()
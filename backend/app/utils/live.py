@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Live events of the posts: their likes and comments, pushed to the clients
+subscribed to them.
+
+The events come from a single MongoDB change stream per process, watching
+the inserts, updates and deletes of the likes and comments, whichever
+worker wrote them. Change streams need a replica set: on a standalone
+server, or with the in-memory storage engine, the routes publish the events
+of their own writes instead, so a client only sees the events of the worker
+it is connected to. The deleted documents are found in the pre-images of
+the change stream, enabled on the two collections at startup (MongoDB 6.0).
+When the change stream resumes after an error, an event can be pushed twice.
+
+Each event is encoded once as JSON and fanned out to the subscribers of its
+post by the broker (app/core/pubsub.py).
+"""
+
+import asyncio
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, Mapping, Optional
+from pymongo.errors import OperationFailure, PyMongoError
+from app.core.pubsub import Broker
+from app.models.comment import Comment
+from app.models.like import Like
+
+logger = logging.getLogger(__name__)
+
+# the event of a change, by collection and operation
+EVENT_TYPES = {
+    (Like.Settings.name, 'insert'): 'like',
+    (Like.Settings.name, 'delete'): 'unlike',
+    (Comment.Settings.name, 'insert'): 'comment',
+    (Comment.Settings.name, 'update'): 'comment_updated',
+    (Comment.Settings.name, 'replace'): 'comment_updated',
+    (Comment.Settings.name, 'delete'): 'comment_deleted',
+}
+
+# the error of a change stream on a standalone server
+NOT_A_REPLICA_SET = 40573
+
+
+def _encode(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+class PostEvents:
+    """
+    Publishes the events of the posts to their subscribers.
+
+    Attributes:
+        broker (Broker): The subscribers, by post id.
+        change_stream (bool): Whether the events come from the change stream, else from the routes.
+    """
+
+    def __init__(self):
+        self.broker = Broker()
+        self.change_stream = False
+
+    def publish(self, event_type: str, document: Mapping[str, Any]) -> int:
+        """Send the event of a like or comment to the subscribers of its post, return how many"""
+        post_id = document.get('post_id')
+        if not post_id:
+            return 0
+        message = json.dumps({'type': event_type, 'post_id': post_id, 'data': dict(document)}, default=_encode)
+        return self.broker.publish(post_id, message)
+
+    def emit(self, event_type: str, document: Mapping[str, Any]) -> None:
+        """The event of a write of a route, published unless the change stream publishes it"""
+        if not self.change_stream:
+            self.publish(event_type, document)
+
+    def dispatch(self, change: Mapping[str, Any]) -> Optional[str]:
+        """Publish the event of a change of the change stream, return its type"""
+        event_type = EVENT_TYPES.get((change['ns']['coll'], change['operationType']))
+        document = change.get('fullDocument') or change.get('fullDocumentBeforeChange')
+        if event_type is None or document is None:
+            return None
+        self.publish(event_type, document)
+        return event_type
+
+    async def watch(self, database, retry_seconds: float = 5) -> None:
+        """Publish the events of the change stream; return at once when change streams are not supported"""
+        collections = [Like.Settings.name, Comment.Settings.name]
+        for collection in collections:
+            try:
+                await database.command({'collMod': collection, 'changeStreamPreAndPostImages': {'enabled': True}})
+            except PyMongoError as e:
+                logger.info("No pre-images of %s, its deletes are not pushed: %s", collection, e)
+        pipeline = [{'$match': {'ns.coll': {'$in': collections},
+                                'operationType': {'$in': ['insert', 'update', 'replace', 'delete']}}}]
+        resume_token: Optional[Dict[str, Any]] = None
+        while True:
+            try:
+                async with database.watch(pipeline, full_document='updateLookup',
+                                          full_document_before_change='whenAvailable',
+                                          resume_after=resume_token) as stream:
+                    self.change_stream = True
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        self.dispatch(change)
+            except OperationFailure as e:
+                if e.code == NOT_A_REPLICA_SET:
+                    logger.info("Change streams are not supported, the routes publish the live events")
+                    self.change_stream = False
+                    return
+                logger.exception("The change stream failed")
+            except PyMongoError:
+                logger.exception("The change stream failed")
+            # the writes meanwhile are published by the routes until it is watched again
+            self.change_stream = False
+            await asyncio.sleep(retry_seconds)
+
+
+post_events = PostEvents()
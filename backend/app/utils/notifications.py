@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Notifications of the likes, comments and follows.
+
+The routes only queue the actions, in memory: the actions of a burst on the
+same thing (the likes of a post for its author, the new followers of a user)
+are merged as they are queued, into a count and the last few actors. Every
+NOTIFICATIONS_FLUSH_SECONDS, or as soon as NOTIFICATIONS_MAX_PENDING
+notifications are waiting, the queue is written in one unordered bulk write
+of upserts: each one adds its actions to the unread notification of the user
+for the same thing, or creates it. A viral post makes one write per flush
+for its author, "alice and 312 others liked your post", not one per like.
+
+An unread notification is unique by user, kind and post (a partial unique
+index): when the upsert of another worker created it meanwhile, the upsert
+failing on the index is run again, updating it.
+
+The notifications are best effort: the actions queued since the last flush
+are lost if the process dies. The actions of a failed write are queued
+again, like the view counts (see app/utils/views.py), only when they can not
+have been written, and at most NOTIFICATIONS_MAX_RETRIES times. The queue is
+flushed at shutdown.
+"""
+
+import asyncio
+import logging
+import uuid
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from app.core.config import CONFIG
+from app.core.metrics import REGISTRY
+from app.models.notification import Notification
+from app.utils.views import NOT_WRITTEN_ERRORS
+
+logger = logging.getLogger(__name__)
+
+# the actors kept in a notification
+MAX_ACTORS = 3
+
+DUPLICATE_KEY = 11000
+
+NOTIFICATIONS_QUEUED = REGISTRY.counter(
+    "notifications_queued_total", "Number of actions queued to notify, by kind", ("kind",))
+NOTIFICATIONS_WRITTEN = REGISTRY.counter(
+    "notifications_written_total", "Number of notifications written, by result", ("result",))
+NOTIFICATION_BATCH = REGISTRY.histogram(
+    "notification_batch_size", "Number of notifications written per bulk write")
+
+# the user notified, the kind, the post
+Key = Tuple[str, str, Optional[str]]
+
+
+class _Pending:
+    __slots__ = ('count', 'actor_ids', 'actor_names', 'attempts')
+
+    def __init__(self):
+        self.count = 0
+        self.actor_ids: List[str] = []
+        self.actor_names: List[str] = []
+        # the failed writes of these actions
+        self.attempts = 0
+
+    def add_actor(self, actor_id: str, actor_name: str) -> None:
+        """Add the actor as the most recent one"""
+        if actor_id in self.actor_ids:
+            index = self.actor_ids.index(actor_id)
+            del self.actor_ids[index], self.actor_names[index]
+        self.actor_ids = (self.actor_ids + [actor_id])[-MAX_ACTORS:]
+        self.actor_names = (self.actor_names + [actor_name])[-MAX_ACTORS:]
+
+
+class NotificationQueue:
+    """
+    The actions waiting to be written as notifications.
+
+    Attributes:
+        flush_seconds (float): Time between the writes.
+        max_pending (int): Notifications waiting from which they are written at once.
+        max_retries (int): Times the actions are written again after a failed write.
+    """
+
+    def __init__(self, flush_seconds: float = CONFIG.notifications_flush_seconds,
+                 max_pending: int = CONFIG.notifications_max_pending,
+                 max_retries: int = CONFIG.notifications_max_retries):
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self._pending: Dict[Key, _Pending] = {}
+        self._full: Optional[asyncio.Event] = None
+
+    def __len__(self) -> int:
+        """Number of notifications waiting"""
+        return len(self._pending)
+
+    def notify(self, user_id: str, kind: str, actor_id: str, actor_name: str,
+               post_id: Optional[str] = None) -> None:
+        """Queue an action of the actor for the user, nothing for the actions of the user"""
+        if user_id == actor_id:
+            return
+        pending = self._pending.get((user_id, kind, post_id))
+        if pending is None:
+            pending = self._pending[(user_id, kind, post_id)] = _Pending()
+        pending.count += 1
+        pending.add_actor(actor_id, actor_name)
+        NOTIFICATIONS_QUEUED.inc((kind,))
+        if len(self._pending) >= self.max_pending and self._full is not None:
+            self._full.set()
+
+    def _put_back(self, batch: Dict[Key, _Pending], keys: Iterable[Key]) -> int:
+        """Queue the actions again, before the ones queued since, return the number dropped instead"""
+        dropped = 0
+        for key in keys:
+            failed = batch[key]
+            if failed.attempts >= self.max_retries:
+                dropped += 1
+                continue
+            failed.attempts += 1
+            queued = self._pending.get(key)
+            if queued is not None:
+                failed.count += queued.count
+                for actor_id, actor_name in zip(queued.actor_ids, queued.actor_names):
+                    failed.add_actor(actor_id, actor_name)
+            self._pending[key] = failed
+        NOTIFICATIONS_WRITTEN.inc(('dropped',), amount=dropped)
+        return dropped
+
+    @staticmethod
+    async def _write(operations: List[UpdateOne]) -> List[int]:
+        """Run the upserts, return the index of the ones which failed"""
+        collection = Notification.get_motor_collection()
+        try:
+            await collection.bulk_write(operations, ordered=False)
+            return []
+        except BulkWriteError as error:
+            errors = error.details.get('writeErrors', [])
+        failed = [write_error['index'] for write_error in errors if write_error.get('code') != DUPLICATE_KEY]
+        # created by another worker meanwhile, updated when run again
+        duplicates = [write_error['index'] for write_error in errors if write_error.get('code') == DUPLICATE_KEY]
+        if duplicates:
+            try:
+                await collection.bulk_write([operations[index] for index in duplicates], ordered=False)
+            except BulkWriteError as error:
+                failed += [duplicates[write_error['index']] for write_error in error.details.get('writeErrors', [])]
+            except NOT_WRITTEN_ERRORS:
+                failed += duplicates
+        return failed
+
+    async def flush(self) -> int:
+        """Write the notifications waiting, return how many"""
+        if not self._pending:
+            return 0
+        batch, self._pending = self._pending, {}
+        now = datetime.now()
+        operations = [
+            UpdateOne(
+                {'user_id': user_id, 'kind': kind, 'post_id': post_id, 'read': False},
+                {'$inc': {'actor_count': pending.count},
+                 '$push': {'actor_ids': {'$each': pending.actor_ids, '$slice': -MAX_ACTORS},
+                           'actor_names': {'$each': pending.actor_names, '$slice': -MAX_ACTORS}},
+                 '$set': {'updated_at': now},
+                 '$setOnInsert': {'_id': str(uuid.uuid4()), 'created_at': now}},
+                upsert=True)
+            for (user_id, kind, post_id), pending in batch.items()
+        ]
+        NOTIFICATION_BATCH.observe(len(operations))
+        try:
+            failed = await self._write(operations)
+        except NOT_WRITTEN_ERRORS:
+            NOTIFICATIONS_WRITTEN.inc(('failed',), amount=len(operations))
+            dropped = self._put_back(batch, batch)
+            logger.exception("Failed to write %d notifications, %d kept for the next flush",
+                             len(operations), len(operations) - dropped)
+            return 0
+        except Exception:
+            # maybe written, not written again not to notify the actions twice
+            NOTIFICATIONS_WRITTEN.inc(('unknown',), amount=len(operations))
+            logger.exception("Failed to write %d notifications, dropped", len(operations))
+            return 0
+        if failed:
+            keys = list(batch)
+            NOTIFICATIONS_WRITTEN.inc(('failed',), amount=len(failed))
+            dropped = self._put_back(batch, [keys[index] for index in failed])
+            logger.error("Failed to write %d notifications of %d, %d kept for the next flush",
+                         len(failed), len(operations), len(failed) - dropped)
+        NOTIFICATIONS_WRITTEN.inc(('written',), amount=len(operations) - len(failed))
+        return len(operations) - len(failed)
+
+    async def run(self) -> None:
+        """Write the notifications every flush_seconds, or as soon as too many are waiting"""
+        self._full = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            await self.flush()
+
+
+notifications = NotificationQueue()
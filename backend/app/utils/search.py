@@ -0,0 +1,482 @@
+#!/usr/bin/env python3
+"""
+Full-text search of the posts, and typeahead search of the users.
+
+The content of the posts is tokenized (lowercased, accents removed, the
+most common English words dropped) into an inverted index kept in the
+process: for each term, the sorted list of the posts containing it, with
+the number of times it appears. It is built at startup, then updated by
+the routes creating, updating and deleting posts; every
+SEARCH_REFRESH_SECONDS the posts updated by the other workers are added.
+A refresh reads the documents updated after the last one indexed, by
+update time then id, so an idle refresh reads nothing. The deletions are
+recorded in the collection `search_deletions`, kept a day, which the
+refreshes of the other workers read to remove the deleted documents.
+
+The posts are numbered in the order they are indexed, and the lists are
+arrays of those numbers, a few bytes per post and term. A post updated or
+deleted is only marked dead (its length set to 0), the lists holding it
+are cleaned when a search goes through them.
+
+The results are ranked by BM25. A term in more than SEARCH_MAX_SCAN posts
+only adds to the score of the posts found by the rarer terms of the
+query, looked up in its list by bisection; when all the terms are that
+common, the candidates are the most recent posts of the rarest one.
+
+The users are found by the beginning of their username or full name, or of
+any later word of them, normalized the same way. Each of these keys is an
+entry of a sorted list, so the users whose keys start with what was typed
+are the entries after it, found by bisection whatever the number of users:
+the shortest keys, then the rest in alphabetical order. The entries are split
+by the first character of their key, so a new key is inserted in a list a few
+dozen times shorter.
+"""
+
+import asyncio
+import base64
+import logging
+import math
+import re
+import unicodedata
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter
+from datetime import datetime
+from heapq import nsmallest
+from typing import Any, AsyncIterator, Dict, Iterable, List, Mapping, Optional, Tuple
+from bson import ObjectId
+from app.core.config import CONFIG
+from app.core.metrics import REGISTRY
+from app.models.post import Post
+from app.models.user import User
+
+logger = logging.getLogger(__name__)
+
+INDEXED_POSTS = REGISTRY.gauge("search_indexed_posts", "Number of posts in the search index")
+INDEXED_USERS = REGISTRY.gauge("search_indexed_users", "Number of users in the typeahead index")
+
+TOKEN_PATTERN = re.compile(r'\w+')
+MAX_TOKEN_LENGTH = 40
+
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have i in is it its of on or so that the this to was were
+will with you your me my we our they their he she his her them not no do does did just
+""".split())
+
+# the words of a name from which a user is found: "mary ann smith", "ann smith", "smith"
+MAX_NAME_WORDS = 4
+
+# BM25 parameters
+K1, B = 1.2, 0.75
+
+# the update time and id of a document, the position of the refreshes
+Position = Tuple[datetime, Any]
+
+# the number of occurrences of a term in a post is counted up to this
+MAX_TF = 255
+
+
+def _last_position(since: Optional[Position], document: Mapping[str, Any],
+                   field: str = 'updated_at') -> Optional[Position]:
+    """The position of the document if after since, else since"""
+    updated_at = document.get(field)
+    if not updated_at:
+        return since
+    position = (updated_at, document['_id'])
+    return position if since is None or position > since else since
+
+
+def _after(since: Optional[Position], field: str = 'updated_at') -> Dict[str, Any]:
+    """The filter of the documents after the position, by update time then id"""
+    if since is None:
+        return {}
+    updated_at, doc_id = since
+    return {'$or': [{field: {'$gt': updated_at}}, {field: updated_at, '_id': {'$gt': doc_id}}]}
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """The terms of a text: lowercased words without accents, the stopwords dropped"""
+    if not text:
+        return []
+    text = text.lower()
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(char for char in text if not unicodedata.combining(char))
+    return [token for token in TOKEN_PATTERN.findall(text)
+            if token not in STOPWORDS and len(token) <= MAX_TOKEN_LENGTH]
+
+
+def normalize_name(text: Optional[str]) -> str:
+    """A name lowercased, without accents, its words separated by single spaces"""
+    if not text:
+        return ''
+    text = text.lower()
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(TOKEN_PATTERN.findall(text))
+
+
+def encode_cursor(score: float, doc: int) -> str:
+    """The opaque cursor of the page after a result"""
+    return base64.urlsafe_b64encode(f"{score!r}:{doc}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[float, int]:
+    """The score and number of the last result of the previous page, ValueError if invalid"""
+    try:
+        score, doc = base64.urlsafe_b64decode(cursor.encode()).decode().split(':')
+        return float(score), int(doc)
+    except (TypeError, UnicodeDecodeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+class _Postings:
+    __slots__ = ('docs', 'tfs')
+
+    def __init__(self):
+        self.docs = array('I')
+        self.tfs = array('B')
+
+
+class InvertedIndex:
+    """
+    BM25 inverted index of texts, identified by strings.
+
+    Attributes:
+        max_scan (int): Number of posts of a term from which it is not scanned whole.
+        since (Optional[Position]): Update time and id of the last document indexed, for the refreshes.
+    """
+
+    def __init__(self, max_scan: int = CONFIG.search_max_scan):
+        self.max_scan = max_scan
+        self.since: Optional[Position] = None
+        self._postings: Dict[str, _Postings] = {}
+        # by number: the id, the length in terms (0 once dead)
+        self._ids: List[Optional[str]] = []
+        self._lengths = array('H')
+        self._numbers: Dict[str, int] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        """Number of live documents"""
+        return len(self._numbers)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._numbers
+
+    def add(self, doc_id: str, text: Optional[str]) -> None:
+        """Index the text of a document, replacing its previous text"""
+        self.remove(doc_id)
+        terms = Counter(tokenize(text))
+        if not terms:
+            return
+        doc = len(self._ids)
+        self._ids.append(doc_id)
+        length = min(sum(terms.values()), 0xFFFF)
+        self._lengths.append(length)
+        self._numbers[doc_id] = doc
+        self._total_length += length
+        for term, tf in terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = _Postings()
+            postings.docs.append(doc)
+            postings.tfs.append(min(tf, MAX_TF))
+        INDEXED_POSTS.set(len(self._numbers))
+
+    def remove(self, doc_id: str) -> None:
+        """Remove a document, if indexed"""
+        doc = self._numbers.pop(doc_id, None)
+        if doc is None:
+            return
+        self._total_length -= self._lengths[doc]
+        self._lengths[doc] = 0
+        self._ids[doc] = None
+        INDEXED_POSTS.set(len(self._numbers))
+
+    def _scan(self, term: str, postings: _Postings, scores: Dict[int, float], idf: float, norm: float,
+              start: int = 0) -> None:
+        """Add the term to the score of the documents of its list from start, cleaning the list"""
+        lengths = self._lengths
+        dead = 0
+        for doc, tf in zip(postings.docs[start:], postings.tfs[start:]):
+            length = lengths[doc]
+            if not length:
+                dead += 1
+                continue
+            scores[doc] = scores.get(doc, 0.0) + idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / norm))
+        if dead * 2 > len(postings.docs) - start:
+            self._compact(term, postings)
+
+    def _compact(self, term: str, postings: _Postings) -> None:
+        lengths = self._lengths
+        kept = _Postings()
+        for doc, tf in zip(postings.docs, postings.tfs):
+            if lengths[doc]:
+                kept.docs.append(doc)
+                kept.tfs.append(tf)
+        if kept.docs:
+            self._postings[term] = kept
+        else:
+            del self._postings[term]
+
+    def search(self, query: str, limit: int = 20,
+               after: Optional[Tuple[float, int]] = None) -> List[Tuple[float, int, str]]:
+        """
+        The best documents for the query as (score, number, id), best first,
+        after the (score, number) of the last result of the previous page.
+        """
+        live = len(self._numbers)
+        terms = [term for term in dict.fromkeys(tokenize(query)) if term in self._postings]
+        if not terms or not live:
+            return []
+        norm = self._total_length / live
+        terms.sort(key=lambda term: len(self._postings[term].docs))
+
+        scores: Dict[int, float] = {}
+        lookups = []
+        for term in terms:
+            postings = self._postings[term]
+            df = len(postings.docs)
+            idf = math.log(1 + (live - df + 0.5) / (df + 0.5))
+            if df <= self.max_scan:
+                self._scan(term, postings, scores, idf, norm)
+            elif not scores and term == terms[0]:
+                # the most recent documents of the rarest term
+                self._scan(term, postings, scores, idf, norm, start=df - self.max_scan)
+            else:
+                lookups.append((postings, idf))
+
+        lengths = self._lengths
+        for postings, idf in lookups:
+            docs, tfs = postings.docs, postings.tfs
+            for doc in scores:
+                i = bisect_left(docs, doc)
+                if i < len(docs) and docs[i] == doc:
+                    tf = tfs[i]
+                    scores[doc] += idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * lengths[doc] / norm))
+
+        ranked = ((-score, doc) for doc, score in scores.items())
+        if after is not None:
+            cursor = (-after[0], after[1])
+            ranked = (key for key in ranked if key > cursor)
+        return [(-score, doc, self._ids[doc]) for score, doc in nsmallest(limit, ranked)]
+
+    async def build(self, documents: AsyncIterator[Mapping[str, Any]], field: str = 'content') -> int:
+        """Index the documents (with their _id, the field and updated_at), return how many"""
+        count = 0
+        async for document in documents:
+            self.add(str(document['_id']), document.get(field))
+            self.since = _last_position(self.since, document)
+            count += 1
+            if count % 1000 == 0:
+                # the loop keeps serving the requests during a long build
+                await asyncio.sleep(0)
+        return count
+
+
+class PrefixIndex:
+    """
+    Index of the names of documents, identified by strings, by their prefixes.
+
+    Attributes:
+        since (Optional[Position]): Update time and id of the last document indexed, for the refreshes.
+    """
+
+    # between the key and the id of an entry, before any character of the keys
+    SEPARATOR = '\x00'
+
+    def __init__(self):
+        self.since: Optional[Position] = None
+        # sorted "key\x00id", by first character of the key
+        self._entries: Dict[str, List[str]] = {}
+        self._keys: Dict[str, Tuple[str, ...]] = {}
+
+    def __len__(self) -> int:
+        """Number of documents"""
+        return len(self._keys)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._keys
+
+    def _entries_of(self, doc_id: str, names) -> Tuple[str, ...]:
+        keys = set()
+        for name in names:
+            words = normalize_name(name).split(' ')
+            for start in range(min(len(words), MAX_NAME_WORDS)):
+                if words[start]:
+                    keys.add(' '.join(words[start:]))
+        return tuple(f"{key}{self.SEPARATOR}{doc_id}" for key in keys)
+
+    def add(self, doc_id: str, *names: Optional[str]) -> None:
+        """Index the names of a document, replacing its previous ones"""
+        self.remove(doc_id)
+        entries = self._entries_of(doc_id, names)
+        if not entries:
+            return
+        for entry in entries:
+            insort(self._entries.setdefault(entry[0], []), entry)
+        self._keys[doc_id] = entries
+        INDEXED_USERS.set(len(self._keys))
+
+    def remove(self, doc_id: str) -> None:
+        """Remove a document, if indexed"""
+        for entry in self._keys.pop(doc_id, ()):
+            entries = self._entries[entry[0]]
+            i = bisect_left(entries, entry)
+            if i < len(entries) and entries[i] == entry:
+                del entries[i]
+        INDEXED_USERS.set(len(self._keys))
+
+    def search(self, prefix: str, limit: int = 10) -> List[str]:
+        """The ids of the first documents with a name starting with the prefix, the shortest names first"""
+        prefix = normalize_name(prefix)
+        if not prefix:
+            return []
+        entries = self._entries.get(prefix[0], [])
+        found: Dict[str, None] = {}
+        i = bisect_left(entries, prefix)
+        while i < len(entries) and len(found) < limit:
+            entry = entries[i]
+            if not entry.startswith(prefix):
+                break
+            found[entry[entry.index(self.SEPARATOR) + 1:]] = None
+            i += 1
+        return list(found)
+
+    async def build(self, documents: AsyncIterator[Mapping[str, Any]], fields: Tuple[str, ...]) -> int:
+        """Index the documents (with their _id, the fields and updated_at), return how many"""
+        # into an empty index, the entries are sorted once at the end
+        bulk = not self._keys
+        keys: Dict[str, Tuple[str, ...]] = {}
+        count = 0
+        async for document in documents:
+            doc_id = str(document['_id'])
+            names = [document.get(field) for field in fields]
+            if bulk:
+                keys.setdefault(doc_id, self._entries_of(doc_id, names))
+            else:
+                self.add(doc_id, *names)
+            self.since = _last_position(self.since, document)
+            count += 1
+            if count % 1000 == 0:
+                await asyncio.sleep(0)
+        if bulk:
+            # the documents added by the routes during the build are already up to date
+            for doc_id in keys.keys() & self._keys.keys():
+                del keys[doc_id]
+            for doc_entries in keys.values():
+                for entry in doc_entries:
+                    self._entries.setdefault(entry[0], []).append(entry)
+            for entries in self._entries.values():
+                entries.sort()
+            self._keys.update((doc_id, doc_entries) for doc_id, doc_entries in keys.items() if doc_entries)
+            INDEXED_USERS.set(len(self._keys))
+        return count
+
+
+# the index of the content of the posts
+post_index = InvertedIndex()
+
+# the index of the usernames and full names of the users
+user_index = PrefixIndex()
+
+USER_FIELDS = ('username', 'full_name')
+
+
+def _post_documents(since: Optional[Position] = None):
+    return Post.get_motor_collection().find(_after(since), {'content': 1, 'updated_at': 1})
+
+
+async def build_post_index() -> int:
+    """Index all the posts"""
+    count = await post_index.build(_post_documents())
+    logger.info("Indexed %d posts for search", count)
+    return count
+
+
+def _user_documents(since: Optional[Position] = None):
+    return User.get_motor_collection().find(
+        _after(since), {field: 1 for field in USER_FIELDS + ('updated_at',)})
+
+
+async def build_user_index() -> int:
+    """Index the names of all the users"""
+    count = await user_index.build(_user_documents(), USER_FIELDS)
+    logger.info("Indexed %d users for search", count)
+    return count
+
+
+class Deletions:
+    """
+    The posts and users deleted by the workers, in the collection `search_deletions`,
+    for the other workers to remove them from their indexes.
+
+    Attributes:
+        ttl_seconds (float): Time the deletions are kept, far longer than the refreshes.
+        since (Optional[Position]): Time and id of the last deletion read.
+    """
+
+    COLLECTION = 'search_deletions'
+
+    def __init__(self, ttl_seconds: float = 24 * 3600):
+        self.ttl_seconds = ttl_seconds
+        self.since: Optional[Position] = None
+
+    @classmethod
+    def collection(cls):
+        return Post.get_motor_collection().database[cls.COLLECTION]
+
+    async def init(self) -> None:
+        """Create the index expiring the deletions, and read only the ones from now"""
+        await self.collection().create_index('deleted_at', expireAfterSeconds=int(self.ttl_seconds))
+        now = datetime.now()
+        # the dates are stored to the millisecond
+        self.since = (now.replace(microsecond=now.microsecond // 1000 * 1000), ObjectId('0' * 24))
+
+    async def record(self, deleted: List[Tuple[str, str]]) -> None:
+        """Record the deletions of the ('post' or 'user', id)"""
+        now = datetime.now()
+        await self.collection().insert_many([{'_id': ObjectId(), 'kind': kind, 'doc_id': doc_id, 'deleted_at': now}
+                                             for kind, doc_id in deleted])
+
+    async def apply(self) -> int:
+        """Remove the documents deleted since the last time from the indexes, return how many"""
+        count = 0
+        async for deletion in self.collection().find(_after(self.since, 'deleted_at')):
+            index = post_index if deletion['kind'] == 'post' else user_index
+            index.remove(deletion['doc_id'])
+            self.since = _last_position(self.since, deletion, 'deleted_at')
+            count += 1
+        return count
+
+
+search_deletions = Deletions()
+
+
+async def remove_post(post_id: str) -> None:
+    """Remove a deleted post from the index, and from the ones of the other workers"""
+    post_index.remove(post_id)
+    await search_deletions.record([('post', post_id)])
+
+
+async def remove_user(user_id: str, post_ids: Iterable[str] = ()) -> None:
+    """Remove a deleted user, and their deleted posts, from the indexes and the ones of the other workers"""
+    deleted = [('post', post_id) for post_id in post_ids] + [('user', user_id)]
+    for post_id in post_ids:
+        post_index.remove(post_id)
+    user_index.remove(user_id)
+    await search_deletions.record(deleted)
+
+
+async def refresh_search_indexes(interval: float = CONFIG.search_refresh_seconds) -> None:
+    """Index the posts and users created, updated or deleted by the other workers, every interval seconds"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await post_index.build(_post_documents(post_index.since))
+            await user_index.build(_user_documents(user_index.since), USER_FIELDS)
+            await search_deletions.apply()
+        except Exception:
+            logger.exception("Failed to refresh the search indexes")
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+The users suggested to follow: the friends of friends.
+
+Every SUGGESTIONS_REFRESH_SECONDS a job loads the follow graph from the users
+in CSR arrays (app/utils/follow_graph.py), computes the SUGGESTIONS_TOP accounts
+most followed by the accounts each user follows, and saves them in one
+document per user, with the names and pictures of the users suggested, so
+`GET /users/suggestions` is a single read. The scores are computed by a
+pool of SUGGESTIONS_WORKERS processes (0 for a thread of the server), a
+chunk of users at a time, saved as they come.
+
+With several workers the job runs in one of them at a time: each run takes
+a lease in the `jobs` collection, which the others skip until it expires.
+The suggestions are as old as the last run: the route drops the users
+followed since.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from pymongo import ReplaceOne
+from pymongo.errors import DuplicateKeyError
+from app.core.config import CONFIG
+from app.core.graph import FriendsOfFriends
+from app.core.metrics import REGISTRY
+from app.models.suggestion import Suggestions
+from app.models.user import User, UserSummary
+from app.utils.follow_graph import load_follow_graph
+
+logger = logging.getLogger(__name__)
+
+JOBS_COLLECTION = 'jobs'
+JOB_ID = 'suggestions'
+
+# users computed at once by a process
+CHUNK_USERS = 1000
+
+SUMMARY_FIELDS = {field.alias or name: 1 for name, field in UserSummary.model_fields.items()}
+
+REFRESH_SECONDS = REGISTRY.histogram(
+    "suggestions_refresh_seconds", "Time to compute and save the follow suggestions, in seconds")
+
+# the graph of a process of the pool
+_graph: Optional[FriendsOfFriends] = None
+
+
+def _load_graph(indptr: array, indices: array, max_fanout: int) -> None:
+    global _graph
+    _graph = FriendsOfFriends(indptr, indices, max_fanout)
+
+
+def _suggest_range(start: int, stop: int, k: int) -> Tuple[array, array]:
+    return _graph.suggest_range(start, stop, k)
+
+
+async def _save(ids: List[str], start: int, candidates: array, scores: array, k: int, now: datetime) -> int:
+    """Save the suggestions of a chunk of users, return how many users got some"""
+    chosen = {ids[candidate] for candidate in candidates if candidate >= 0}
+    summaries: Dict[str, dict] = {doc['_id']: doc async for doc in User.get_motor_collection().find(
+        {'_id': {'$in': list(chosen)}}, SUMMARY_FIELDS)}
+    requests = []
+    for i in range(len(candidates) // k):
+        users = []
+        for j in range(i * k, (i + 1) * k):
+            if candidates[j] < 0:
+                break
+            summary = summaries.get(ids[candidates[j]])
+            if summary is not None:
+                users.append({**summary, 'mutual': scores[j]})
+        if users:
+            requests.append(ReplaceOne({'_id': ids[start + i]},
+                                       {'users': users, 'created_at': now, 'updated_at': now}, upsert=True))
+    if requests:
+        await Suggestions.get_motor_collection().bulk_write(requests, ordered=False)
+    return len(requests)
+
+
+async def refresh_suggestions(k: int = CONFIG.suggestions_top, max_fanout: int = CONFIG.suggestions_max_fanout,
+                              workers: int = CONFIG.suggestions_workers) -> int:
+    """Compute and save the suggestions of all the users, return how many users got some"""
+    start_time = time.perf_counter()
+    now = datetime.now()
+    ids, indptr, indices = await load_follow_graph()
+    pool, graph = None, None
+    if workers > 0:
+        # spawned: forking the threads of the server (motor, tracing) is unsafe
+        pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_load_graph, initargs=(indptr, indices, max_fanout))
+    else:
+        graph = FriendsOfFriends(indptr, indices, max_fanout)
+
+    async def compute(first: int, last: int) -> Tuple[array, array]:
+        if pool is not None:
+            return await asyncio.get_running_loop().run_in_executor(pool, _suggest_range, first, last, k)
+        return await asyncio.to_thread(graph.suggest_range, first, last, k)
+
+    saved = 0
+    try:
+        step = CHUNK_USERS * max(workers, 1)
+        for first in range(0, len(ids), step):
+            starts = range(first, min(first + step, len(ids)), CHUNK_USERS)
+            chunks = await asyncio.gather(*(compute(s, min(s + CHUNK_USERS, len(ids))) for s in starts))
+            for s, (candidates, scores) in zip(starts, chunks):
+                saved += await _save(ids, s, candidates, scores, k, now)
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False)
+    # the users without suggestions any more
+    await Suggestions.get_motor_collection().delete_many({'updated_at': {'$lt': now}})
+    REFRESH_SECONDS.observe(time.perf_counter() - start_time)
+    return saved
+
+
+async def take_turn(job_id: str, seconds: float) -> bool:
+    """Lease the job for the time given, unless another worker holds it"""
+    now = datetime.now()
+    jobs = User.get_motor_collection().database[JOBS_COLLECTION]
+    try:
+        await jobs.update_one({'_id': job_id, 'until': {'$lt': now}},
+                              {'$set': {'until': now + timedelta(seconds=seconds)}}, upsert=True)
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+async def run_suggestions(interval: float = CONFIG.suggestions_refresh_seconds) -> None:
+    """Refresh the suggestions every interval, in one worker at a time"""
+    while True:
+        try:
+            if await take_turn(JOB_ID, interval):
+                count = await refresh_suggestions()
+                logger.info("Follow suggestions computed for %d users", count)
+        except Exception:
+            logger.exception("Failed to compute the follow suggestions")
+        await asyncio.sleep(interval)
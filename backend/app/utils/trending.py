@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Hashtags of the posts and the trending ones.
+
+The hashtags of a post (#word) are parsed from its content when it is
+created or updated, and stored in `Post.hashtags`, indexed to list the posts
+of a tag.
+
+The uses of the tags are counted in the last TRENDING_WINDOW_SECONDS, in
+memory, without a query: the window is split in TRENDING_BUCKETS buckets of
+time, each a count-min sketch (a few rows of counters, a tag counted in one
+counter per row chosen by a hash, its count the smallest of them), and the
+sum of the buckets is kept so a count of the whole window is a lookup. When
+a bucket expires it is subtracted from the sum and reused for the next one.
+
+The tags with the highest counts are kept in a min-heap of TRENDING_TOP
+candidates: a tag counted higher than the lowest candidate replaces it. The
+sketch and the candidates are saved every TRENDING_CHECKPOINT_SECONDS in the
+`trending` collection and loaded at startup, so a restart keeps the trends.
+Each worker counts the posts it serves, and keeps the uses counted since its
+last checkpoint apart: a checkpoint adds them to the saved sketches, those
+of all the workers, and replaces the saved document only if no other worker
+replaced it meanwhile.
+"""
+
+import asyncio
+import hashlib
+import heapq
+import logging
+import re
+import time
+import unicodedata
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo.errors import DuplicateKeyError
+from app.core.config import CONFIG
+from app.core.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+HASHTAG_PATTERN = re.compile(r'(?<![\w#])#(\w{1,50})')
+MAX_HASHTAGS = 30
+
+HASHTAGS_COUNTED = REGISTRY.counter("hashtags_counted_total", "Number of uses of hashtags counted for the trends")
+
+
+def extract_hashtags(content: Optional[str]) -> List[str]:
+    """The distinct hashtags of a text, lowercased and without accents, in order"""
+    if not content or '#' not in content:
+        return []
+    tags = []
+    for tag in HASHTAG_PATTERN.findall(content):
+        tag = tag.lower()
+        if not tag.isascii():
+            tag = unicodedata.normalize('NFKD', tag)
+            tag = ''.join(char for char in tag if not unicodedata.combining(char))
+        tags.append(tag)
+    return list(dict.fromkeys(tags))[:MAX_HASHTAGS]
+
+
+class TrendingTags:
+    """
+    Counts of the tags used in a sliding window of time, and the most used ones.
+
+    Attributes:
+        window (float): Length of the window, in seconds.
+        buckets (int): Number of buckets of the window.
+        width (int): Counters per row of the sketches.
+        depth (int): Rows of the sketches.
+        top (int): Number of candidate tags kept.
+    """
+
+    def __init__(self, window: float = CONFIG.trending_window_seconds, buckets: int = CONFIG.trending_buckets,
+                 width: int = CONFIG.trending_width, depth: int = CONFIG.trending_depth,
+                 top: int = CONFIG.trending_top):
+        self.window = window
+        self.buckets = buckets
+        self.width = width
+        self.depth = depth
+        self.top = top
+        self._bucket_seconds = window / buckets
+        # the sketches of the buckets, rows one after the other, and their sum
+        self._sketches = [array('I', bytes(4 * width * depth)) for _ in range(buckets)]
+        self._total = array('I', bytes(4 * width * depth))
+        # the current bucket, from the first use
+        self._bucket: Optional[int] = None
+        # the candidates with their count, and the min-heap of (count, tag), with outdated entries
+        self._counts: Dict[str, int] = {}
+        self._heap: List[Tuple[int, str]] = []
+        self._ranked: Optional[List[Tuple[str, int]]] = None
+        # the uses counted since the last checkpoint, a sketch by bucket
+        self._unsaved: Dict[int, array] = {}
+
+    def _bucket_of(self, now: float) -> int:
+        return int(now // self._bucket_seconds)
+
+    def _cells(self, tag: str) -> List[int]:
+        # double hashing: a stable hash, the same after a restart
+        digest = hashlib.blake2b(tag.encode(), digest_size=8).digest()
+        h1, h2 = int.from_bytes(digest[:4], 'little'), int.from_bytes(digest[4:], 'little') | 1
+        return [row * self.width + (h1 + row * h2) % self.width for row in range(self.depth)]
+
+    def _advance(self, now: float) -> None:
+        """Expire the buckets older than the window"""
+        bucket = self._bucket_of(now)
+        if self._bucket is None:
+            self._bucket = bucket
+        if bucket <= self._bucket:
+            return
+        total = self._total
+        for expired in range(self._bucket + 1, min(bucket, self._bucket + self.buckets) + 1):
+            sketch = self._sketches[expired % self.buckets]
+            if any(sketch):
+                for i, count in enumerate(sketch):
+                    if count:
+                        total[i] -= count
+                self._sketches[expired % self.buckets] = array('I', bytes(4 * len(sketch)))
+        self._bucket = bucket
+        self._unsaved = {unsaved: sketch for unsaved, sketch in self._unsaved.items()
+                         if unsaved > bucket - self.buckets}
+        # the counts of the candidates went down
+        self._counts = {tag: self.count(tag) for tag in self._counts}
+        self._counts = {tag: count for tag, count in self._counts.items() if count}
+        self._heap = [(count, tag) for tag, count in self._counts.items()]
+        heapq.heapify(self._heap)
+        self._ranked = None
+
+    def add(self, tags: List[str], now: Optional[float] = None) -> None:
+        """Count a use of each tag"""
+        if not tags:
+            return
+        self._advance(time.time() if now is None else now)
+        sketch, total = self._sketches[self._bucket % self.buckets], self._total
+        unsaved = self._unsaved.get(self._bucket)
+        if unsaved is None:
+            unsaved = self._unsaved[self._bucket] = array('I', bytes(4 * len(sketch)))
+        for tag in tags:
+            cells = self._cells(tag)
+            for cell in cells:
+                sketch[cell] += 1
+                total[cell] += 1
+                unsaved[cell] += 1
+            self._offer(tag, min(total[cell] for cell in cells))
+        HASHTAGS_COUNTED.inc(amount=len(tags))
+
+    def count(self, tag: str) -> int:
+        """Estimated uses of the tag in the window, never lower than the real count"""
+        total = self._total
+        return min(total[cell] for cell in self._cells(tag))
+
+    def _offer(self, tag: str, count: int) -> None:
+        counts, heap = self._counts, self._heap
+        if tag not in counts and len(counts) >= self.top:
+            self._clean()
+            if count <= heap[0][0]:
+                return
+            _, lowest = heapq.heappop(heap)
+            del counts[lowest]
+        counts[tag] = count
+        heapq.heappush(heap, (count, tag))
+        if len(heap) > 4 * self.top:
+            # the outdated entries dropped
+            self._heap = [(count, tag) for tag, count in counts.items()]
+            heapq.heapify(self._heap)
+        self._ranked = None
+
+    def _clean(self) -> None:
+        """Pop the outdated entries at the top of the heap"""
+        heap, counts = self._heap, self._counts
+        while heap and counts.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+
+    def trending(self, limit: int = 10, now: Optional[float] = None) -> List[Tuple[str, int]]:
+        """The most used tags in the window with their counts, the most used first"""
+        self._advance(time.time() if now is None else now)
+        if self._ranked is None:
+            self._ranked = sorted(self._counts.items(), key=lambda item: (-item[1], item[0]))
+        return self._ranked[:limit]
+
+    def state(self) -> Dict[str, Any]:
+        """The sketches and candidates, to save"""
+        return {
+            'bucket': self._bucket,
+            'window': self.window, 'buckets': self.buckets, 'width': self.width, 'depth': self.depth,
+            'sketches': [sketch.tobytes() for sketch in self._sketches],
+            'counts': self._counts,
+        }
+
+    def load(self, state: Dict[str, Any], now: Optional[float] = None) -> bool:
+        """Restore saved sketches and candidates, unless saved with other dimensions; whether restored"""
+        if [state.get(key) for key in ('window', 'buckets', 'width', 'depth')] != \
+                [self.window, self.buckets, self.width, self.depth]:
+            return False
+        self._sketches = [array('I', bytes(sketch)) for sketch in state['sketches']]
+        self._total = array('I', bytes(4 * self.width * self.depth))
+        for sketch in self._sketches:
+            for i, count in enumerate(sketch):
+                if count:
+                    self._total[i] += count
+        self._bucket = state['bucket']
+        self._counts = dict(state['counts'])
+        self._heap = [(count, tag) for tag, count in self._counts.items()]
+        heapq.heapify(self._heap)
+        self._ranked = None
+        # the buckets expired while stopped
+        self._advance(time.time() if now is None else now)
+        return True
+
+    def take_unsaved(self) -> Dict[int, array]:
+        """The uses counted since the last checkpoint, by bucket, counted as saved from now"""
+        unsaved, self._unsaved = self._unsaved, {}
+        return unsaved
+
+    def put_back_unsaved(self, unsaved: Dict[int, array]) -> None:
+        """Count again as not saved the uses of a failed checkpoint"""
+        for bucket, sketch in unsaved.items():
+            current = self._unsaved.get(bucket)
+            if current is None:
+                self._unsaved[bucket] = sketch
+            else:
+                for i, count in enumerate(sketch):
+                    if count:
+                        current[i] += count
+
+    def merged_state(self, saved: Optional[Dict[str, Any]], unsaved: Dict[int, array],
+                     now: Optional[float] = None) -> Dict[str, Any]:
+        """The saved state, None for none, with the unsaved uses of this instance added"""
+        now = time.time() if now is None else now
+        merged = TrendingTags(self.window, self.buckets, self.width, self.depth, self.top)
+        if saved is None or not merged.load(saved, now):
+            merged._advance(now)
+        for bucket, sketch in unsaved.items():
+            if merged._bucket - self.buckets < bucket <= merged._bucket:
+                target = merged._sketches[bucket % self.buckets]
+                for i, count in enumerate(sketch):
+                    if count:
+                        target[i] += count
+                        merged._total[i] += count
+        for tag in list(merged._counts) + list(self._counts):
+            merged._offer(tag, merged.count(tag))
+        return merged.state()
+
+
+trending_tags = TrendingTags()
+
+CHECKPOINT_COLLECTION = 'trending'
+CHECKPOINT_ID = 'hashtags'
+
+
+async def load_trending(database, tags: TrendingTags = trending_tags) -> bool:
+    """Restore the trends saved by the checkpoints, whether there were some"""
+    state = await database[CHECKPOINT_COLLECTION].find_one({'_id': CHECKPOINT_ID})
+    return state is not None and tags.load(state)
+
+
+async def save_trending(database, tags: TrendingTags = trending_tags, attempts: int = 5) -> None:
+    """Add the uses counted since the last checkpoint to the saved trends"""
+    collection = database[CHECKPOINT_COLLECTION]
+    unsaved = tags.take_unsaved()
+    try:
+        for _ in range(attempts):
+            saved = await collection.find_one({'_id': CHECKPOINT_ID})
+            state = tags.merged_state(saved, unsaved)
+            if saved is None:
+                try:
+                    await collection.insert_one({'_id': CHECKPOINT_ID, **state, 'version': 1})
+                    return
+                except DuplicateKeyError:
+                    continue
+            # unless saved by another worker meanwhile
+            version = saved.get('version')
+            result = await collection.replace_one({'_id': CHECKPOINT_ID, 'version': version},
+                                                  {**state, 'version': (version or 0) + 1})
+            if result.matched_count:
+                return
+        raise RuntimeError(f"The trends were saved by other workers during {attempts} attempts")
+    except BaseException:
+        tags.put_back_unsaved(unsaved)
+        raise
+
+
+async def checkpoint_trending(database, interval: float = CONFIG.trending_checkpoint_seconds) -> None:
+    """Save the trends every interval seconds"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await save_trending(database)
+        except Exception:
+            logger.exception("Failed to save the trending hashtags")
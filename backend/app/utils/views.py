@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Impressions and views of the posts, counted in memory and written behind.
+
+A post shown in a list of posts (the posts of a user, of a hashtag, the
+search results) gets an impression, a post opened a view. The routes only
+add them to a map in memory, split in VIEWS_SHARDS shards by post id. Every
+VIEWS_FLUSH_SECONDS, or as soon as VIEWS_MAX_PENDING posts have counts
+waiting, each shard in turn is swapped for an empty one and written in one
+unordered bulk write of `$inc`, so a post viewed a thousand times between
+two flushes makes one write, and a flush never holds the whole map.
+
+The counts of a failed write are put back, to be written with the next
+flush, only when they can not have been added: those of the posts whose
+update failed when the bulk write failed in part, or all of them when no
+server could be reached. After a timeout or a network error the `$inc` may
+have been applied, the counts are dropped rather than counted twice. The
+counts of a post are put back at most VIEWS_MAX_RETRIES times, then
+dropped, so an update failing for good is not written forever.
+
+The counts are lost if the process dies, at most the ones of the last
+VIEWS_FLUSH_SECONDS; the map is flushed at shutdown. The responses add the
+counts still in memory to the stored ones, so a viewer sees its own view.
+"""
+
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, NotPrimaryError, ServerSelectionTimeoutError
+from app.core.config import CONFIG
+from app.core.metrics import REGISTRY
+from app.models.post import Post, PostResponse
+
+logger = logging.getLogger(__name__)
+
+IMPRESSION, VIEW, ATTEMPTS = 0, 1, 2
+
+# the errors raised before the writes reached a primary, nothing of them was applied
+NOT_WRITTEN_ERRORS = (ServerSelectionTimeoutError, NotPrimaryError)
+
+VIEWS_COUNTED = REGISTRY.counter(
+    "post_views_counted_total", "Number of impressions and views counted, by kind", ("kind",))
+VIEWS_WRITTEN = REGISTRY.counter(
+    "post_views_written_total", "Number of posts whose counts were written, by result", ("result",))
+VIEWS_BATCH = REGISTRY.histogram(
+    "post_views_batch_size", "Number of posts written per bulk write")
+
+
+class ViewCounters:
+    """
+    The impressions and views waiting to be written.
+
+    Attributes:
+        flush_seconds (float): Time between the writes, the most counts lost if the process dies.
+        max_pending (int): Posts with counts waiting from which they are written at once.
+        max_retries (int): Times the counts of a post are written again after a failed write.
+    """
+
+    def __init__(self, flush_seconds: float = CONFIG.views_flush_seconds,
+                 max_pending: int = CONFIG.views_max_pending, shards: int = CONFIG.views_shards,
+                 max_retries: int = CONFIG.views_max_retries):
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        # the counts by post id, [impressions, views, failed writes]
+        self._shards: List[Dict[str, List[int]]] = [{} for _ in range(shards)]
+        # the counts being written, still shown in the responses
+        self._writing: List[Dict[str, List[int]]] = [{} for _ in range(shards)]
+        self._full: Optional[asyncio.Event] = None
+
+    def __len__(self) -> int:
+        """Number of posts with counts waiting"""
+        return sum(len(shard) for shard in self._shards)
+
+    def _shard(self, post_id: str) -> int:
+        return hash(post_id) % len(self._shards)
+
+    def _add(self, post_id: str, kind: int, amount: int = 1) -> None:
+        shard = self._shards[self._shard(post_id)]
+        counts = shard.get(post_id)
+        if counts is None:
+            counts = shard[post_id] = [0, 0, 0]
+            # the posts waiting estimated from the shard, the ids spread evenly
+            if self._full is not None and len(shard) * len(self._shards) >= self.max_pending:
+                self._full.set()
+        counts[kind] += amount
+
+    def view(self, post_id: str) -> None:
+        """Count a view of the post"""
+        self._add(post_id, VIEW)
+        VIEWS_COUNTED.inc(('view',))
+
+    def impressions(self, post_ids: Iterable[str]) -> None:
+        """Count an impression of each post"""
+        count = 0
+        for post_id in post_ids:
+            self._add(post_id, IMPRESSION)
+            count += 1
+        VIEWS_COUNTED.inc(('impression',), amount=count)
+
+    def pending(self, post_id: str) -> Tuple[int, int]:
+        """The impressions and views of the post not written yet"""
+        index = self._shard(post_id)
+        impressions = views = 0
+        for counts in (self._shards[index].get(post_id), self._writing[index].get(post_id)):
+            if counts is not None:
+                impressions += counts[IMPRESSION]
+                views += counts[VIEW]
+        return impressions, views
+
+    def response(self, post: Post) -> PostResponse:
+        """The response of the post, with its counts not written yet"""
+        data = post.model_dump(by_alias=True)
+        impressions, views = self.pending(post.id)
+        data['impressions'] += impressions
+        data['views'] += views
+        return PostResponse(**data)
+
+    def _put_back(self, batch: Dict[str, List[int]], post_ids: Iterable[str]) -> int:
+        """Put back the counts of the posts for the next flush, return the number dropped instead"""
+        dropped = 0
+        for post_id in post_ids:
+            counts = batch[post_id]
+            if counts[ATTEMPTS] >= self.max_retries:
+                dropped += 1
+                continue
+            self._add(post_id, IMPRESSION, counts[IMPRESSION])
+            self._add(post_id, VIEW, counts[VIEW])
+            self._add(post_id, ATTEMPTS, counts[ATTEMPTS] + 1)
+        VIEWS_WRITTEN.inc(('dropped',), amount=dropped)
+        return dropped
+
+    async def _flush_shard(self, index: int) -> int:
+        batch = self._shards[index]
+        if not batch:
+            return 0
+        self._shards[index], self._writing[index] = {}, batch
+        operations = [
+            UpdateOne({'_id': post_id}, {'$inc': {'impressions': counts[IMPRESSION], 'views': counts[VIEW]}})
+            for post_id, counts in batch.items()
+        ]
+        VIEWS_BATCH.observe(len(operations))
+        try:
+            await Post.get_motor_collection().bulk_write(operations, ordered=False)
+        except BulkWriteError as error:
+            # the operations not listed were applied, their counts are not added twice
+            post_ids = list(batch)
+            failed = [post_ids[write_error['index']] for write_error in error.details.get('writeErrors', [])]
+            VIEWS_WRITTEN.inc(('written',), amount=len(operations) - len(failed))
+            VIEWS_WRITTEN.inc(('failed',), amount=len(failed))
+            dropped = self._put_back(batch, failed)
+            logger.error("Failed to write the counts of %d posts of %d, %d kept for the next flush: %s",
+                         len(failed), len(operations), len(failed) - dropped,
+                         error.details.get('writeErrors', [])[:1])
+            return len(operations) - len(failed)
+        except NOT_WRITTEN_ERRORS:
+            VIEWS_WRITTEN.inc(('failed',), amount=len(operations))
+            dropped = self._put_back(batch, batch)
+            logger.exception("Failed to write the counts of %d posts, %d kept for the next flush",
+                             len(operations), len(operations) - dropped)
+            return 0
+        except Exception:
+            # maybe applied, not written again not to count them twice
+            VIEWS_WRITTEN.inc(('unknown',), amount=len(operations))
+            logger.exception("Failed to write the counts of %d posts, dropped", len(operations))
+            return 0
+        finally:
+            self._writing[index] = {}
+        VIEWS_WRITTEN.inc(('written',), amount=len(operations))
+        return len(operations)
+
+    async def flush(self) -> int:
+        """Write the counts waiting, a shard at a time, return the number of posts written"""
+        written = 0
+        for index in range(len(self._shards)):
+            written += await self._flush_shard(index)
+        return written
+
+    async def run(self) -> None:
+        """Write the counts every flush_seconds, or as soon as too many posts are waiting"""
+        self._full = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            await self.flush()
+
+
+view_counters = ViewCounters()
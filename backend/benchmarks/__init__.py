@@ -0,0 +1,6 @@
+#!/usr/bin/env python3
+"""
+Performance benchmarks of the backend, run from the backend directory:
+
+    python -m benchmarks.load --help
+"""
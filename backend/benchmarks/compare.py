@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Compare two reports of the load benchmark, route by route:
+
+    python -m benchmarks.compare before.json after.json --threshold 10
+
+Prints the change of the throughput and of the latency percentiles, and
+exits with status 1 when a percentile got slower by more than the threshold.
+"""
+
+import argparse
+import json
+import sys
+from typing import Dict, List, Optional
+
+
+METRICS = ("throughput", "p50", "p95", "p99")
+
+
+def change(before: float, after: float) -> float:
+    """Relative change in percent"""
+    if not before:
+        return 0.0
+    return (after - before) / before * 100
+
+
+def compare(before: Dict, after: Dict, threshold: float) -> List[str]:
+    """Print the comparison, return the routes that regressed"""
+    regressions = []
+    print(f"{'route':40} " + " ".join(f"{metric:>20}" for metric in METRICS))
+    for route in sorted(set(before["routes"]) | set(after["routes"])):
+        old, new = before["routes"].get(route), after["routes"].get(route)
+        if old is None or new is None:
+            print(f"{route:40} {'only in ' + ('after' if old is None else 'before'):>20}")
+            continue
+
+        cells = []
+        for metric in METRICS:
+            delta = change(old[metric], new[metric])
+            cells.append(f"{new[metric]:>10.2f} ({delta:+6.1f}%)")
+            # a higher latency is a regression
+            if metric != "throughput" and delta > threshold and route not in regressions:
+                regressions.append(route)
+        print(f"{route:40} " + " ".join(f"{cell:>20}" for cell in cells))
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Compare two load benchmark reports")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10,
+                        help="latency increase, in percent, reported as a regression")
+    args = parser.parse_args(argv)
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    regressions = compare(before, after, args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} route(s) slower by more than {args.threshold}%:")
+        for route in regressions:
+            print(f"  {route}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Synthetic dataset for the benchmarks.
+
+The dataset is seeded by `benchmarks.seed`, deterministic for a given seed:
+users following each other with power-law degrees (a few celebrities get
+most of the followers), posts written mostly by the popular users, likes
+and comments going mostly to the viral posts.
+"""
+
+from typing import Dict, List, Set, Tuple
+from pydantic import BaseModel
+from app.models.engine.db_storage import DBStorage
+from app.utils.auth import create_access_token, create_refresh_access_token
+from benchmarks.seed import PASSWORD, SeedConfig, seed
+
+
+class DatasetConfig(SeedConfig):
+    """Seeding of the load benchmark, small enough to seed in a few seconds"""
+    users: int = 100
+    posts: int = 500
+    likes: int = 1500
+    comments: int = 500
+    mean_following: float = 4
+    celebrities: int = 2
+    celebrity_share: float = 0.1
+    viral_posts: int = 5
+    viral_share: float = 0.1
+
+
+class Dataset(BaseModel):
+    """
+    Ids of the seeded documents, used to build the benchmark requests.
+
+    Attributes:
+        users (List[str]): Ids of the users.
+        emails (Dict[str, str]): Email of each user.
+        tokens (Dict[str, str]): Access token of each user.
+        refresh_tokens (Dict[str, str]): Refresh token of each user.
+        posts (List[Tuple[str, str]]): (post_id, user_id) of the posts.
+        comments (List[Tuple[str, str, str]]): (comment_id, post_id, user_id) of the comments.
+        likes (List[Tuple[str, str, str]]): (like_id, post_id, user_id) of the likes.
+        liked (Set[Tuple[str, str]]): (user_id, post_id) of the likes.
+        following (Set[Tuple[str, str]]): (user_id, friend_id) of the follow edges.
+    """
+    users: List[str] = []
+    emails: Dict[str, str] = {}
+    tokens: Dict[str, str] = {}
+    refresh_tokens: Dict[str, str] = {}
+    posts: List[Tuple[str, str]] = []
+    comments: List[Tuple[str, str, str]] = []
+    likes: List[Tuple[str, str, str]] = []
+    liked: Set[Tuple[str, str]] = set()
+    following: Set[Tuple[str, str]] = set()
+
+
+async def build_dataset(storage: DBStorage, config: DatasetConfig) -> Dataset:
+    """
+    Seed the dataset in the database of the storage engine and read back the ids.
+    """
+    await seed(storage, config, workers=0)
+    database = storage.database
+    dataset = Dataset()
+
+    async for user in database["users"].find({}, {"email": 1, "following": 1}):
+        payload = {"user_id": user["_id"], "email": user["email"]}
+        dataset.users.append(user["_id"])
+        dataset.emails[user["_id"]] = user["email"]
+        dataset.tokens[user["_id"]] = create_access_token(payload)
+        dataset.refresh_tokens[user["_id"]] = create_refresh_access_token(payload)
+        dataset.following.update((user["_id"], friend.id) for friend in user["following"])
+
+    async for post in database["posts"].find({}, {"user_id": 1}):
+        dataset.posts.append((post["_id"], post["user_id"]))
+    async for like in database["likes"].find({}, {"post_id": 1, "user_id": 1}):
+        dataset.likes.append((like["_id"], like["post_id"], like["user_id"]))
+        dataset.liked.add((like["user_id"], like["post_id"]))
+    async for comment in database["comments"].find({}, {"post_id": 1, "user_id": 1}):
+        dataset.comments.append((comment["_id"], comment["post_id"], comment["user_id"]))
+
+    return dataset
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Cost of the follow index:
+
+    python -m benchmarks.follow_graph --users 1000000 --degree 10
+
+Builds the index of a power-law follow graph (see benchmarks.suggestions)
+with uuid ids, and reports its memory, in total and per million follows
+(the arrays of the two directions, and the table of the interned ids), the
+time to build it, and the time of its queries on random users: whether one
+follows another, a follower count, the accounts followed who follow another
+user, and a follow then unfollow.
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+from app.core.graph import FollowIndex, csr_from_edges
+from benchmarks.suggestions import power_law_graph
+
+
+def per_call_us(function: Callable[[int], Any], calls: int) -> float:
+    start = time.perf_counter()
+    for i in range(calls):
+        function(i)
+    return round((time.perf_counter() - start) / calls * 1e6, 2)
+
+
+def run(users: int, degree: int, queries: int, seed: int) -> Dict[str, Any]:
+    sources, targets = power_law_graph(users, degree, seed)
+    indptr, indices = csr_from_edges(users, sources, targets)
+    del sources, targets
+    edges = len(indices)
+
+    ids = [str(uuid.UUID(int=i)) for i in range(users)]
+    index = FollowIndex()
+    start = time.perf_counter()
+    index.build(ids, indptr, indices)
+    built = time.perf_counter() - start
+    del ids
+    arrays = index.nbytes()
+    interned = (sys.getsizeof(index._ids) + sys.getsizeof(index._numbers)
+                + sum(sys.getsizeof(user_id) for user_id in index._ids))
+    total = arrays + interned
+
+    rng = random.Random(seed)
+    pairs = [(index._ids[rng.randrange(users)], index._ids[rng.randrange(users)]) for _ in range(queries)]
+    # the followers of the popular accounts, the rows the intersections are the longest for
+    popular = [(a, index._ids[int(users * rng.random() ** 3)]) for a, _ in pairs]
+
+    def follow_unfollow(i: int) -> None:
+        index.add(*pairs[i])
+        index.remove(*pairs[i])
+
+    return {
+        "users": users,
+        "edges": edges,
+        "build_s": round(built, 2),
+        "index_mb": round(total / 1e6, 1),
+        "interned_ids_mb": round(interned / 1e6, 1),
+        "arrays_mb_per_million_edges": round(arrays / edges, 2),
+        "total_mb_per_million_edges": round(total / edges, 2),
+        "follows_us": per_call_us(lambda i: index.follows(*pairs[i]), queries),
+        "followers_count_us": per_call_us(lambda i: index.followers_count(pairs[i][1]), queries),
+        "known_followers_us": per_call_us(lambda i: index.known_followers(*popular[i]), queries),
+        "follow_unfollow_us": per_call_us(follow_unfollow, queries),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Cost of the follow index")
+    parser.add_argument("--users", type=int, default=1000000, help="users of the graph")
+    parser.add_argument("--degree", type=int, default=10, help="mean number of accounts followed")
+    parser.add_argument("--queries", type=int, default=100000, help="queries of each kind")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+    report = run(args.users, args.degree, args.queries, args.seed)
+    sys.stdout.write(json.dumps(report, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
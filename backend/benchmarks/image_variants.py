@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Throughput of the pool resizing the images of the posts:
+
+    python -m benchmarks.image_variants --images 200 --workers 1 2 4
+
+Makes photo-like JPEG images (noise over a gradient, which compresses like a
+photo), then resizes them to the variants of the posts (see
+`app.utils.images`) in a pool of each size, all submitted at once like a burst
+of uploads, and reports the images per second, their mean latency, and the
+longest the event loop was blocked meanwhile.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+from PIL import Image
+from app.core.loop_monitor import LoopMonitor
+from app.utils.images import VARIANTS, render_variants
+
+
+def make_image(width: int, height: int, seed: int) -> bytes:
+    """A JPEG of the size of a phone photo, resized"""
+    rng = random.Random(seed)
+    base = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    noise = Image.effect_noise((width, height), 40).convert('RGB')
+    image = Image.blend(base, noise, 0.3)
+    image = Image.eval(image, lambda v, shift=rng.randint(0, 60): min(255, v + shift))
+    out = io.BytesIO()
+    image.save(out, 'JPEG', quality=90)
+    return out.getvalue()
+
+
+async def run_pool(images: List[bytes], workers: int) -> Dict[str, Any]:
+    loop = asyncio.get_running_loop()
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        # the processes started and Pillow imported before timing
+        await asyncio.gather(*[loop.run_in_executor(pool, render_variants, images[0], VARIANTS)
+                               for _ in range(workers)])
+        monitor = LoopMonitor(interval_ms=1, threshold_ms=1000)
+        monitor.start()
+        latencies = []
+
+        async def resize(data: bytes) -> None:
+            start = time.perf_counter()
+            await loop.run_in_executor(pool, render_variants, data, VARIANTS)
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[resize(data) for data in images])
+        elapsed = time.perf_counter() - start
+        await monitor.stop()
+    return {
+        "workers": workers,
+        "images_per_second": round(len(images) / elapsed, 2),
+        "mean_latency_ms": round(sum(latencies) / len(latencies) * 1000, 1),
+        "max_loop_lag_ms": round(monitor.max_lag * 1000, 3),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Throughput of the image variants pool")
+    parser.add_argument("--images", type=int, default=100, help="images resized per pool")
+    parser.add_argument("--width", type=int, default=3024, help="width of the images")
+    parser.add_argument("--height", type=int, default=4032, help="height of the images")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, os.cpu_count() or 1],
+                        help="sizes of the pools")
+    args = parser.parse_args(argv)
+
+    # a few distinct images, reused: the time is in the decoding and resizing
+    distinct = [make_image(args.width, args.height, seed) for seed in range(min(args.images, 8))]
+    images = [distinct[i % len(distinct)] for i in range(args.images)]
+    report = {
+        "images": args.images,
+        "size": f"{args.width}x{args.height}",
+        "mean_bytes": sum(map(len, distinct)) // len(distinct),
+        "variants": VARIANTS,
+        "pools": [asyncio.run(run_pool(images, workers)) for workers in sorted(set(args.workers))],
+    }
+    sys.stdout.write(json.dumps(report, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Cost of the idle live connections and of the fan-out of their events:
+
+    python -m benchmarks.live_fanout --connections 50000 --hot 10000
+
+Opens in-process subscribers, each with a task waiting for its events like
+the sender of a WebSocket, subscribed to a few random posts, `--hot` of
+them to the same post. Reports the memory per idle connection (subscriber
+and waiting task, the socket itself not included), the time to publish an
+event to the subscribers of the hot post and until all of them got it.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+from app.core.pubsub import Broker, Subscriber
+
+
+async def consume(subscriber: Subscriber, received: List[int]) -> None:
+    while True:
+        messages = await subscriber.get()
+        received[0] += len(messages)
+
+
+async def run(connections: int, hot: int, posts: int, events: int, seed: int) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    broker = Broker()
+    received = [0]
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    subscribers, tasks = [], []
+    for i in range(connections):
+        subscriber = Subscriber()
+        topics = [f"post-{rng.randrange(posts)}" for _ in range(rng.randint(1, 5))]
+        if i < hot:
+            topics.append("hot")
+        broker.subscribe(subscriber, topics)
+        subscribers.append(subscriber)
+        tasks.append(asyncio.ensure_future(consume(subscriber, received)))
+    # the tasks started and waiting
+    await asyncio.sleep(0)
+    idle = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    message = json.dumps({"type": "like", "post_id": "hot", "data": {"_id": "x" * 36, "user_id": "y" * 36}})
+    publish, deliver = [], []
+    for _ in range(events):
+        received[0] = 0
+        start = time.perf_counter()
+        broker.publish("hot", message)
+        publish.append(time.perf_counter() - start)
+        while received[0] < hot:
+            await asyncio.sleep(0)
+        deliver.append(time.perf_counter() - start)
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return {
+        "connections": connections,
+        "hot_subscribers": hot,
+        "bytes_per_idle_connection": round(idle / connections),
+        "publish_ms": round(sorted(publish)[len(publish) // 2] * 1000, 3),
+        "delivered_ms": round(sorted(deliver)[len(deliver) // 2] * 1000, 3),
+        "us_per_delivery": round(sorted(deliver)[len(deliver) // 2] / hot * 1e6, 3),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Cost of the idle live connections and of the fan-out")
+    parser.add_argument("--connections", type=int, default=50000, help="idle connections")
+    parser.add_argument("--hot", type=int, default=10000, help="connections subscribed to the hot post")
+    parser.add_argument("--posts", type=int, default=100000, help="posts subscribed to")
+    parser.add_argument("--events", type=int, default=20, help="events published to the hot post")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+    report = asyncio.run(run(args.connections, args.hot, args.posts, args.events, args.seed))
+    sys.stdout.write(json.dumps(report, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,629 @@
+#!/usr/bin/env python3
+"""
+End-to-end load benchmark of the API routes.
+
+Seeds a synthetic dataset, builds the search indexes and the follow index as
+the server does at startup, then drives the routes of `app.api.app` with an
+in-process async client at a given concurrency, one route after the other,
+and reports the throughput and the latency percentiles of each route as JSON:
+
+    python -m benchmarks.load --requests 100 --concurrency 16 --output before.json
+    python -m benchmarks.compare before.json after.json
+
+The lag of the event loop is measured during each route, `--max-loop-block-ms`
+fails the run (exit status 1) when a route blocks the loop for longer, and
+prints the stack of the blocking code.
+
+The mail routes (`/auth/forgot-password`, `/auth/reset-password/{token}`),
+the "For Testing" delete-all routes, the admin and metrics routes, and the
+streams held open instead of answered (`GET /comments/post/{post_id}/stream`
+and the WebSocket `/live/posts`) are not benchmarked.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+from httpx import AsyncClient
+from pydantic import BaseModel
+from app.api.app import app
+from app.core.loop_monitor import LoopMonitor
+from app.core.rate_limit import rate_limiter
+from app.models.comment import Comment
+from app.models.engine import media_storage
+from app.models.engine.db_storage import get_storage
+from app.models.engine.media_storage import DiskMediaStore
+from app.models.like import Like
+from app.models.post import Post
+from app.models.user import User
+from app.utils.auth import create_access_token
+from app.utils.follow_graph import build_follow_graph
+from app.utils.notifications import notifications
+from app.utils.search import build_post_index, build_user_index
+from app.utils.suggestions import refresh_suggestions
+from benchmarks.dataset import PASSWORD, Dataset, DatasetConfig, build_dataset
+
+
+class RequestSpec(BaseModel):
+    """A request to send"""
+    method: str
+    url: str
+    token: Optional[str] = None
+    json_body: Any = None
+    form: Optional[Dict[str, str]] = None
+    content: Optional[bytes] = None
+    headers: Dict[str, str] = {}
+
+
+class RouteResult(BaseModel):
+    """
+    Measures of a route.
+
+    Attributes:
+        requests (int): Number of requests sent.
+        errors (int): Number of responses with a status code >= 400.
+        statuses (Dict[str, int]): Number of responses by status code.
+        throughput (float): Requests per second.
+        p50, p95, p99, max (float): Latency percentiles in milliseconds.
+        max_loop_lag (float): Longest time the event loop was blocked, in milliseconds.
+    """
+    requests: int
+    errors: int
+    statuses: Dict[str, int]
+    throughput: float
+    p50: float
+    p95: float
+    p99: float
+    max: float
+    max_loop_lag: float = 0.0
+
+
+def percentile(sorted_values: List[float], percent: float) -> float:
+    """Nearest-rank percentile of sorted values"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(percent / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class Scenario:
+    """
+    The requests of a route.
+
+    `build` returns the requests to send; it may first create,
+    untimed, the documents consumed by the requests (e.g. deletions).
+    """
+
+    def __init__(self, name: str, build: Callable):
+        self.name = name
+        self.build = build
+
+
+SCENARIOS: List[Scenario] = []
+
+
+def scenario(name: str):
+    """Register the request builder of a route"""
+    def decorator(build):
+        SCENARIOS.append(Scenario(name, build))
+        return build
+    return decorator
+
+
+# the hashtags of the posts created, #topic0 to #topic9
+TOPICS = 10
+
+# size of the files uploaded
+MEDIA_BYTES = 64 * 1024
+
+
+def _unique(prefix: str) -> str:
+    return f"{prefix}_{uuid.uuid4().hex}"
+
+
+async def _single_chunk(body: bytes):
+    yield body
+
+
+# Root
+@scenario("GET /")
+async def _root(ds: Dataset, rng: random.Random, n: int) -> List[RequestSpec]:
+    return [RequestSpec(method="GET", url="/") for _ in range(n)]
+
+
+# Auth
+@scenario("POST /auth/register")
+async def _register(ds, rng, n):
+    specs = []
+    for _ in range(n):
+        name = _unique("bench_register")
+        specs.append(RequestSpec(method="POST", url="/auth/register", json_body={
+            "email": f"{name}@example.com", "username": name, "password": PASSWORD}))
+    return specs
+
+
+@scenario("POST /auth/login")
+async def _login(ds, rng, n):
+    return [RequestSpec(method="POST", url="/auth/login",
+                        form={"username": ds.emails[rng.choice(ds.users)], "password": PASSWORD})
+            for _ in range(n)]
+
+
+@scenario("GET /auth/me")
+async def _me(ds, rng, n):
+    return [RequestSpec(method="GET", url="/auth/me", token=ds.tokens[rng.choice(ds.users)])
+            for _ in range(n)]
+
+
+@scenario("POST /auth/refresh-token")
+async def _refresh_token(ds, rng, n):
+    return [RequestSpec(method="POST", url="/auth/refresh-token",
+                        json_body={"refresh_token": ds.refresh_tokens[rng.choice(ds.users)]})
+            for _ in range(n)]
+
+
+@scenario("POST /auth/logout")
+async def _logout(ds, rng, n):
+    specs = []
+    for i in range(n):
+        user_id = rng.choice(ds.users)
+        # a distinct expiration gives a distinct token, the seeded tokens stay valid
+        token = create_access_token({"user_id": user_id, "email": ds.emails[user_id]},
+                                    expires_delta=timedelta(minutes=60, seconds=i))
+        specs.append(RequestSpec(method="POST", url="/auth/logout", token=token))
+    return specs
+
+
+# Users
+@scenario("GET /users/")
+async def _get_all_users(ds, rng, n):
+    return [RequestSpec(method="GET", url="/users/", token=ds.tokens[rng.choice(ds.users)])
+            for _ in range(n)]
+
+
+@scenario("GET /users/{user_id}")
+async def _get_user(ds, rng, n):
+    return [RequestSpec(method="GET", url=f"/users/{rng.choice(ds.users)}",
+                        token=ds.tokens[rng.choice(ds.users)])
+            for _ in range(n)]
+
+
+@scenario("GET /users/{user_id}/followers")
+async def _get_followers(ds, rng, n):
+    return [RequestSpec(method="GET", url=f"/users/{rng.choice(ds.users)}/followers",
+                        token=ds.tokens[rng.choice(ds.users)])
+            for _ in range(n)]
+
+
+@scenario("GET /users/{user_id}/following")
+async def _get_following(ds, rng, n):
+    return [RequestSpec(method="GET", url=f"/users/{rng.choice(ds.users)}/following",
+                        token=ds.tokens[rng.choice(ds.users)])
+            for _ in range(n)]
+
+
+@scenario("GET /users/{user_id}/relationship")
+async def _get_relationship(ds, rng, n):
+    return [RequestSpec(method="GET", url=f"/users/{rng.choice(ds.users)}/relationship",
+                        token=ds.tokens[rng.choice(ds.users)])
+            for _ in range(n)]
+
+
+@scenario("GET /users/suggestions")
+async def _get_suggestions(ds, rng, n):
+    # computed in the server by the periodic job
+    await refresh_suggestions(workers=0)
+    return [RequestSpec(method="GET", url="/users/suggestions", token=ds.tokens[rng.choice(ds.users)])
+            for _ in range(n)]
+
+
+@scenario("PUT /users/{user_id}")
+async def _update_user(ds, rng, n):
+    specs = []
+    for i in range(n):
+        user_id = rng.choice(ds.users)
+        specs.append(RequestSpec(method="PUT", url=f"/users/{user_id}", token=ds.tokens[user_id],
+                                 json_body={"bio": f"bio {i}"}))
+    return specs
+
+
+@scenario("POST /users/follow/{friend_id}")
+async def _follow(ds, rng, n):
+    specs = []
+    for _ in range(n):
+        user_id, friend_id = rng.sample(ds.users, 2)
+        specs.append(RequestSpec(method="POST", url=f"/users/follow/{friend_id}",
+                                 token=ds.tokens[user_id]))
+    return specs
+
+
+@scenario("DELETE /users/unfollow/{friend_id}")
+async def _unfollow(ds, rng, n):
+    edges = sorted(ds.following)
+    return [RequestSpec(method="DELETE", url=f"/users/unfollow/{friend_id}", token=ds.tokens[user_id])
+            for user_id, friend_id in rng.sample(edges, min(n, len(edges)))]
+
+
+@scenario("DELETE /users/{user_id}")
+async def _delete_user(ds, rng, n):
+    # users with a post to delete, created for this route
+    users, posts = [], []
+    for _ in range(n):
+        name = _unique("bench_delete")
+        user = User(email=f"{name}@example.com", username=name, hashed_password="-")
+        post = Post(user_id=user.id, content="post to delete")
+        user.posts.append(post)
+        users.append(user)
+        posts.append(post)
+    if users:
+        await User.insert_many(users)
+        await Post.insert_many(posts)
+    return [RequestSpec(method="DELETE", url=f"/users/{user.id}",
+                        token=create_access_token({"user_id": user.id, "email": user.email}))
+            for user in users]
+
+
+# Posts
+@scenario("POST /posts/")
+async def _create_post(ds, rng, n):
+    specs = []
+    for i in range(n):
+        user_id = rng.choice(ds.users)
+        specs.append(RequestSpec(method="POST", url="/posts/", token=ds.tokens[user_id], json_body={
+            "user_id": user_id, "content": f"new post {i} #topic{i % TOPICS}"}))
+    return specs
+
+
+@scenario("GET /posts/")
+async def _get_all_posts(ds, rng, n):
+    return [RequestSpec(method="GET", url="/posts/") for _ in range(n)]
+
+
+@scenario("GET /posts/user/{user_id}")
+async def _get_posts_of_user(ds, rng, n):
+    return [RequestSpec(method="GET", url=f"/posts/user/{rng.choice(ds.users)}",
+                        token=ds.tokens[rng.choice(ds.users)])
+            for _ in range(n)]
+
+
+@scenario("GET /posts/tag/{tag}")
+async def _get_posts_of_hashtag(ds, rng, n):
+    return [RequestSpec(method="GET", url=f"/posts/tag/topic{rng.randrange(TOPICS)}",
+                        token=ds.tokens[rng.choice(ds.users)])
+            for _ in range(n)]
+
+
+@scenario("GET /posts/{post_id}")
+async def _get_post(ds, rng, n):
+    return [RequestSpec(method="GET", url=f"/posts/{rng.choice(ds.posts)[0]}",
+                        token=ds.tokens[rng.choice(ds.users)])
+            for _ in range(n)]
+
+
+@scenario("PUT /posts/{post_id}")
+async def _update_post(ds, rng, n):
+    specs = []
+    for i in range(n):
+        post_id, user_id = rng.choice(ds.posts)
+        specs.append(RequestSpec(method="PUT", url=f"/posts/{post_id}", token=ds.tokens[user_id],
+                                 json_body={"content": f"updated post {i}"}))
+    return specs
+
+
+@scenario("DELETE /posts/{post_id}")
+async def _delete_post(ds, rng, n):
+    # posts created for this route, each one deleted by its author
+    authors: Dict[str, User] = {}
+    posts = []
+    for _ in range(n):
+        user_id = rng.choice(ds.users)
+        author = authors.get(user_id) or await User.get(user_id)
+        authors[user_id] = author
+        post = Post(user_id=user_id, content="post to delete")
+        author.posts.append(post)
+        posts.append(post)
+    if posts:
+        await Post.insert_many(posts)
+    for author in authors.values():
+        await author.save()
+    return [RequestSpec(method="DELETE", url=f"/posts/{post.id}", token=ds.tokens[post.user_id])
+            for post in posts]
+
+
+# Comments
+@scenario("POST /comments/")
+async def _create_comment(ds, rng, n):
+    specs = []
+    for i in range(n):
+        user_id = rng.choice(ds.users)
+        post_id = rng.choice(ds.posts)[0]
+        specs.append(RequestSpec(method="POST", url="/comments/", token=ds.tokens[user_id], json_body={
+            "post_id": post_id, "user_id": user_id, "content": f"new comment {i}"}))
+    return specs
+
+
+@scenario("GET /comments/post/{post_id}")
+async def _get_comments_of_post(ds, rng, n):
+    return [RequestSpec(method="GET", url=f"/comments/post/{rng.choice(ds.posts)[0]}",
+                        token=ds.tokens[rng.choice(ds.users)])
+            for _ in range(n)]
+
+
+@scenario("PUT /comments/{comment_id}")
+async def _update_comment(ds, rng, n):
+    specs = []
+    for i in range(n):
+        comment_id, _, user_id = rng.choice(ds.comments)
+        specs.append(RequestSpec(method="PUT", url=f"/comments/{comment_id}", token=ds.tokens[user_id],
+                                 json_body={"content": f"updated comment {i}"}))
+    return specs
+
+
+@scenario("DELETE /comments/{comment_id}")
+async def _delete_comment(ds, rng, n):
+    # comments created for this route
+    posts: Dict[str, Post] = {}
+    comments = []
+    for _ in range(n):
+        post_id = rng.choice(ds.posts)[0]
+        post = posts.get(post_id) or await Post.get(post_id)
+        posts[post_id] = post
+        comment = Comment(post_id=post_id, user_id=rng.choice(ds.users), content="comment to delete")
+        post.comments.append(comment)
+        comments.append(comment)
+    if comments:
+        await Comment.insert_many(comments)
+    for post in posts.values():
+        await post.save()
+    return [RequestSpec(method="DELETE", url=f"/comments/{comment.id}", token=ds.tokens[comment.user_id])
+            for comment in comments]
+
+
+# Likes
+@scenario("POST /likes/")
+async def _like_post(ds, rng, n):
+    specs = []
+    for _ in range(20 * n):
+        if len(specs) >= n:
+            break
+        user_id = rng.choice(ds.users)
+        post_id = rng.choice(ds.posts)[0]
+        if (user_id, post_id) in ds.liked:
+            continue
+        ds.liked.add((user_id, post_id))
+        specs.append(RequestSpec(method="POST", url="/likes/", token=ds.tokens[user_id],
+                                 json_body={"user_id": user_id, "post_id": post_id}))
+    return specs
+
+
+@scenario("GET /likes/post/{post_id}")
+async def _get_likes_of_post(ds, rng, n):
+    return [RequestSpec(method="GET", url=f"/likes/post/{rng.choice(ds.posts)[0]}",
+                        token=ds.tokens[rng.choice(ds.users)])
+            for _ in range(n)]
+
+
+@scenario("DELETE /likes/{like_id}")
+async def _unlike_post(ds, rng, n):
+    likes = rng.sample(ds.likes, min(n, len(ds.likes)))
+    return [RequestSpec(method="DELETE", url=f"/likes/{like_id}", token=ds.tokens[user_id])
+            for like_id, _, user_id in likes]
+
+
+# Media
+@scenario("POST /media/")
+async def _upload_media(ds, rng, n):
+    return [RequestSpec(method="POST", url="/media/?filename=bench.bin", token=ds.tokens[rng.choice(ds.users)],
+                        content=rng.randbytes(MEDIA_BYTES), headers={"Content-Type": "application/octet-stream"})
+            for _ in range(n)]
+
+
+@scenario("GET /media/{media_id}")
+async def _get_media(ds, rng, n):
+    # files uploaded for this route
+    files = [await media_storage.media_store.save(_single_chunk(rng.randbytes(MEDIA_BYTES)), "bench.bin",
+                                                  "application/octet-stream", user_id=rng.choice(ds.users))
+             for _ in range(10)]
+    return [RequestSpec(method="GET", url=rng.choice(files).url) for _ in range(n)]
+
+
+# Search
+@scenario("GET /search/posts")
+async def _search_posts(ds, rng, n):
+    return [RequestSpec(method="GET", url=f"/search/posts?q=post+{rng.randrange(len(ds.posts))}",
+                        token=ds.tokens[rng.choice(ds.users)])
+            for _ in range(n)]
+
+
+@scenario("GET /search/users")
+async def _search_users(ds, rng, n):
+    # the prefixes typed
+    return [RequestSpec(method="GET", url=f"/search/users?q={'user'[:rng.randint(1, 4)]}",
+                        token=ds.tokens[rng.choice(ds.users)])
+            for _ in range(n)]
+
+
+# Trending
+@scenario("GET /trending")
+async def _get_trending(ds, rng, n):
+    return [RequestSpec(method="GET", url="/trending") for _ in range(n)]
+
+
+# Notifications
+@scenario("GET /notifications")
+async def _get_notifications(ds, rng, n):
+    # the notifications of the follows, comments and likes sent before, written by the queue in the server
+    await notifications.flush()
+    return [RequestSpec(method="GET", url="/notifications", token=ds.tokens[rng.choice(ds.users)])
+            for _ in range(n)]
+
+
+@scenario("POST /notifications/read")
+async def _read_notifications(ds, rng, n):
+    return [RequestSpec(method="POST", url="/notifications/read", token=ds.tokens[rng.choice(ds.users)])
+            for _ in range(n)]
+
+
+async def run_requests(client: AsyncClient, specs: List[RequestSpec], concurrency: int) -> RouteResult:
+    """Send the requests with `concurrency` workers and measure them"""
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    pending = iter(specs)
+
+    async def worker():
+        for spec in pending:
+            headers = {**spec.headers, "Authorization": f"Bearer {spec.token}"} if spec.token else spec.headers
+            start = time.perf_counter()
+            response = await client.request(spec.method, spec.url, headers=headers,
+                                            json=spec.json_body, data=spec.form, content=spec.content)
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] += 1
+            # the loop runs its other tasks between two requests, as in a server
+            await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return RouteResult(
+        requests=len(latencies),
+        errors=sum(count for status, count in statuses.items() if status >= 400),
+        statuses={str(status): count for status, count in sorted(statuses.items())},
+        throughput=round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        p50=round(percentile(latencies, 50) * 1000, 3),
+        p95=round(percentile(latencies, 95) * 1000, 3),
+        p99=round(percentile(latencies, 99) * 1000, 3),
+        max=round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    )
+
+
+def git_commit() -> Optional[str]:
+    """Commit of the benchmarked code, if in a git repository"""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_benchmark(config: DatasetConfig, engine: str, requests: int, concurrency: int,
+                        warmup: int = 0, routes: Optional[List[str]] = None,
+                        loop_block_ms: float = 100) -> Dict[str, Any]:
+    """
+    Seed the dataset and run the scenarios, return the report,
+    with the stack of the longest block of the loop of the routes blocking it longer than loop_block_ms
+    """
+    storage = get_storage(engine, db_name=f"benchmark_{config.seed}")
+    await storage.init()
+    # all the requests come from the same client: measure the routes, not their rate limits
+    rate_limiter.enabled = False
+    monitor = LoopMonitor(interval_ms=1, threshold_ms=loop_block_ms)
+    media_dir = tempfile.TemporaryDirectory()
+    try:
+        seed_start = time.perf_counter()
+        dataset = await build_dataset(storage, config)
+        seed_time = time.perf_counter() - seed_start
+        # what the server builds at startup
+        await build_post_index()
+        await build_user_index()
+        await build_follow_graph()
+        # the files uploaded in GridFS with --engine mongodb, else in a temporary directory
+        store = media_storage.get_media_store(storage)
+        media_storage.media_store = DiskMediaStore(media_dir.name) if isinstance(store, DiskMediaStore) else store
+        await media_storage.media_store.init()
+
+        results, loop_blocks = {}, {}
+        monitor.start()
+        async with AsyncClient(app=app, base_url="http://benchmark") as client:
+            for sc in SCENARIOS:
+                if routes and not any(route in sc.name for route in routes):
+                    continue
+                rng = random.Random(f"{config.seed}:{sc.name}")
+                specs = await sc.build(dataset, rng, warmup + requests)
+                if warmup:
+                    await run_requests(client, specs[:warmup], concurrency)
+                monitor.reset()
+                monitor.blocks.clear()
+                result = await run_requests(client, specs[warmup:], concurrency)
+                # the monitor measures the last block once the loop runs it again
+                await asyncio.sleep(monitor.interval)
+                result.max_loop_lag = round(monitor.reset() * 1000, 3)
+                results[sc.name] = result.model_dump()
+                if monitor.blocks:
+                    longest = max(monitor.blocks, key=lambda block: block.duration_ms)
+                    loop_blocks[sc.name] = longest.model_dump(mode="json")
+    finally:
+        await monitor.stop()
+        media_storage.media_store = None
+        media_dir.cleanup()
+        await storage.drop()
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "engine": engine,
+            "requests": requests,
+            "concurrency": concurrency,
+            "warmup": warmup,
+            "dataset": config.model_dump(),
+            "seed_seconds": round(seed_time, 3),
+            "loop_block_ms": loop_block_ms,
+        },
+        "routes": results,
+        "loop_blocks": loop_blocks,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="End-to-end load benchmark of the API routes")
+    parser.add_argument("--engine", default="memory", help="storage engine: memory or mongodb")
+    parser.add_argument("--requests", type=int, default=100, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent requests")
+    parser.add_argument("--warmup", type=int, default=10, help="untimed requests per route")
+    parser.add_argument("--route", action="append", dest="routes",
+                        help="only run the routes containing this text (repeatable)")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--max-loop-block-ms", type=float,
+                        help="fail when a route blocks the event loop longer than this")
+    for name, field in DatasetConfig.model_fields.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=field.annotation,
+                            default=field.default, help=f"dataset {name}")
+    args = parser.parse_args(argv)
+
+    config = DatasetConfig(**{name: getattr(args, name) for name in DatasetConfig.model_fields})
+    report = asyncio.run(run_benchmark(config, args.engine, args.requests, args.concurrency,
+                                       args.warmup, args.routes, args.max_loop_block_ms or 100))
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        sys.stdout.write(output + "\n")
+
+    if args.max_loop_block_ms is not None:
+        blocking = {name: result["max_loop_lag"] for name, result in report["routes"].items()
+                    if result["max_loop_lag"] > args.max_loop_block_ms}
+        for name, lag in blocking.items():
+            sys.stderr.write(f"{name} blocked the event loop for {lag:.1f}ms\n")
+            for line in report["loop_blocks"].get(name, {}).get("stack", [])[-15:]:
+                sys.stderr.write(f"    {line}\n")
+        if blocking:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
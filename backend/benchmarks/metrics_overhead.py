@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of the overhead of the metrics middleware:
+
+    python -m benchmarks.metrics_overhead --requests 100000
+
+Calls a minimal ASGI application directly, with and without the middleware,
+so the difference is the cost the middleware adds to every request. Also
+times `GET /` through the FastAPI application with and without it.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+from fastapi import FastAPI
+from app.api.metrics import MetricsMiddleware
+
+
+SCOPE = {"type": "http", "method": "GET", "path": "/", "headers": [], "query_string": b""}
+
+
+async def plain_app(scope, receive, send):
+    """Smallest HTTP application: reads the request and sends a small body"""
+    await receive()
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+async def receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def send(message):
+    pass
+
+
+async def time_calls(app: Callable, requests: int) -> float:
+    """Mean time of a call in microseconds"""
+    start = time.perf_counter()
+    for _ in range(requests):
+        await app(dict(SCOPE), receive, send)
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def fastapi_app(with_metrics: bool) -> FastAPI:
+    """Application with a single route, like the root route of the server"""
+    app = FastAPI()
+    if with_metrics:
+        app.add_middleware(MetricsMiddleware)
+
+    @app.get('/')
+    async def read_root() -> dict:
+        return {"message": "Welcome to your beanie powered app!"}
+
+    return app
+
+
+async def run(requests: int, rounds: int) -> Dict[str, Any]:
+    """Best of the rounds for each case, the least disturbed by the rest of the machine"""
+    cases: Dict[str, Callable] = {
+        "asgi": plain_app,
+        "asgi+metrics": MetricsMiddleware(plain_app),
+        "fastapi": fastapi_app(with_metrics=False),
+        "fastapi+metrics": fastapi_app(with_metrics=True),
+    }
+    best: Dict[str, List[float]] = {name: [] for name in cases}
+    for _ in range(rounds):
+        for name, app in cases.items():
+            best[name].append(await time_calls(app, requests))
+
+    results = {name: round(min(times), 3) for name, times in best.items()}
+    return {
+        "requests": requests,
+        "rounds": rounds,
+        "microseconds_per_request": results,
+        "overhead_microseconds": round(results["asgi+metrics"] - results["asgi"], 3),
+        "overhead_percent_of_fastapi": round(
+            (results["fastapi+metrics"] - results["fastapi"]) / results["fastapi"] * 100, 2),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Overhead of the metrics middleware")
+    parser.add_argument("--requests", type=int, default=100000, help="calls per round")
+    parser.add_argument("--rounds", type=int, default=5, help="rounds, the best one is kept")
+    args = parser.parse_args(argv)
+    report = asyncio.run(run(args.requests, args.rounds))
+    sys.stdout.write(json.dumps(report, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Latency of the search of the posts:
+
+    python -m benchmarks.search --posts 1000000 --queries 1000
+
+Indexes synthetic posts whose words follow a Zipf distribution, like the
+words of real texts (a few very common, most rare), then times queries of
+one to three words of each frequency class, and reports the p50/p95/p99
+latencies by class with the build time and the memory of the index.
+`--posts 10000000` needs about 4 GB of memory.
+"""
+
+import argparse
+import itertools
+import json
+import random
+import resource
+import sys
+import time
+from typing import Any, Dict, List, Optional
+from app.utils.search import InvertedIndex
+
+# ranges of the ranks of the words of each class of query
+CLASSES = {
+    'common': (20, 200),
+    'medium': (200, 5000),
+    'rare': (5000, 50000),
+}
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def run(posts: int, queries: int, vocabulary: int, words: int, seed: int) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    vocab = [f"word{rank}" for rank in range(vocabulary)]
+    cumulative = list(itertools.accumulate(1 / (rank + 1) ** 1.07 for rank in range(vocabulary)))
+
+    index = InvertedIndex()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    batch = 10000
+    for first in range(0, posts, batch):
+        count = min(batch, posts - first)
+        sampled = rng.choices(vocab, cum_weights=cumulative, k=count * words)
+        for i in range(count):
+            index.add(f"post-{first + i}", " ".join(sampled[i * words:(i + 1) * words]))
+    build = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    latencies: Dict[str, List[float]] = {}
+    for name, (low, high) in CLASSES.items():
+        for _ in range(queries):
+            query = " ".join(vocab[rng.randrange(low, min(high, vocabulary))] for _ in range(rng.randint(1, 3)))
+            start = time.perf_counter()
+            index.search(query, limit=21)
+            latencies.setdefault(name, []).append((time.perf_counter() - start) * 1000)
+
+    return {
+        "posts": posts,
+        "words_per_post": words,
+        "vocabulary": vocabulary,
+        "build_seconds": round(build, 1),
+        # ru_maxrss is in kilobytes on Linux, includes the generation of the posts
+        "bytes_per_post": round((rss_after - rss_before) * 1024 / posts, 1),
+        "latency_ms": {
+            name: {f"p{p}": round(percentile(values, p), 3) for p in (50, 95, 99)}
+            for name, values in latencies.items()
+        },
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Latency of the post search")
+    parser.add_argument("--posts", type=int, default=1000000, help="posts indexed")
+    parser.add_argument("--queries", type=int, default=1000, help="queries per class")
+    parser.add_argument("--vocabulary", type=int, default=100000, help="distinct words")
+    parser.add_argument("--words", type=int, default=12, help="words per post")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+    report = run(args.posts, args.queries, args.vocabulary, args.words, args.seed)
+    sys.stdout.write(json.dumps(report, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+"""
+Seed the database with a large synthetic dataset:
+
+    python -m benchmarks.seed --engine mongodb --users 1000000 --posts 2000000 \\
+        --likes 10000000 --comments 2000000 --workers 8
+
+The documents are built directly in the layout beanie stores them (links as
+lists of DBRef) and written with `insert_many` in parallel batches, without
+the routes, the models validation or one bcrypt hash per user. The posts,
+with their likes and comments, are generated by blocks which are spread over
+worker processes.
+
+The dataset only depends on the seed, not on the number of workers or on the
+batch size: the ids are derived from the seed and the index of the document,
+and each block of posts has its own random generator.
+
+A few celebrity accounts get a share of all the follow edges and a few viral
+posts a share of all the likes and comments, the rest follows a power-law.
+The links embedded in a document are capped by `max_refs` to stay under the
+16MB document limit of MongoDB.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import uuid
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from bson import DBRef
+from pydantic import BaseModel
+from app.models.engine.db_storage import DBStorage, get_storage
+from app.utils.auth import hash_password
+
+
+# every seeded user has the same password, hashed only once
+PASSWORD = "benchmark-password"
+
+# creation date of the first seeded document, the next ones are one second apart
+SEED_DATE = datetime(2024, 1, 1)
+
+# number of posts generated with the same random generator, the unit of work of the workers
+POST_BLOCK = 1000
+
+
+class SeedConfig(BaseModel):
+    """
+    Size and shape of the seeded dataset.
+
+    Attributes:
+        users (int): Number of users.
+        posts (int): Number of posts.
+        likes (int): Number of likes (at most one per user and post).
+        comments (int): Number of comments.
+        mean_following (float): Mean number of users followed by a user.
+        celebrities (int): Number of celebrity accounts.
+        celebrity_share (float): Share of all the follow edges going to the celebrities.
+        viral_posts (int): Number of viral posts.
+        viral_share (float): Share of all the likes and comments going to the viral posts.
+        exponent (float): Exponent of the power-law of the popularity of the other users and posts.
+        max_refs (int): Maximum number of links in a list of a document.
+        seed (int): Seed of the random generator.
+    """
+    users: int = 10000
+    posts: int = 50000
+    likes: int = 500000
+    comments: int = 100000
+    mean_following: float = 20
+    celebrities: int = 10
+    celebrity_share: float = 0.2
+    viral_posts: int = 20
+    viral_share: float = 0.2
+    exponent: float = 1.1
+    max_refs: int = 100000
+    seed: int = 42
+
+
+class SeedReport(BaseModel):
+    """
+    Result of a seeding.
+
+    Attributes:
+        documents (Dict[str, int]): Number of documents inserted by collection.
+        seconds (float): Duration of the seeding.
+    """
+    documents: Dict[str, int] = {}
+    seconds: float = 0.0
+
+
+def namespace(seed: int, kind: str) -> int:
+    """High bits of the ids of a kind of document"""
+    return random.Random(f"{seed}:{kind}").getrandbits(64) << 64
+
+
+def document_id(namespace: int, index: int) -> str:
+    """Deterministic uuid4-like id of the document of an index"""
+    return str(uuid.UUID(int=namespace | index, version=4))
+
+
+def power_law_weights(count: int, exponent: float) -> List[float]:
+    """Weight of the item of rank i (starting at 1) is 1 / i^exponent"""
+    return [1 / (rank ** exponent) for rank in range(1, count + 1)]
+
+
+def skewed_weights(rng: random.Random, count: int, exponent: float,
+                   hot: int, hot_share: float) -> List[float]:
+    """
+    Popularity of the items: `hot` random items share `hot_share` of the
+    total weight equally, the others follow a power-law in a random order.
+    """
+    weights = power_law_weights(count, exponent)
+    rng.shuffle(weights)
+    hot_items = rng.sample(range(count), min(hot, count))
+    if not hot_items:
+        return weights
+
+    hot_set = set(hot_items)
+    cold_total = sum(weight for i, weight in enumerate(weights) if i not in hot_set)
+    cold_scale = (1 - hot_share) / cold_total if cold_total else 0.0
+    weights = [weight * cold_scale for weight in weights]
+    for i in hot_items:
+        weights[i] = hot_share / len(hot_items)
+    return weights
+
+
+def allocate(total: int, weights: Sequence[float], cap: int) -> List[int]:
+    """
+    Split a total over the items in proportion to their weights,
+    no item getting more than `cap`. The excess of the capped items
+    goes to the others, the total is only missed when all are capped.
+    """
+    counts = [0] * len(weights)
+    open_items = [i for i, weight in enumerate(weights) if weight > 0]
+    remaining = total
+    if cap <= 0:
+        return counts
+
+    # the items whose share reaches the cap get the cap, the rest is shared again
+    while open_items and remaining > 0:
+        scale = remaining / sum(weights[i] for i in open_items)
+        capped = {i for i in open_items if weights[i] * scale >= cap}
+        if not capped:
+            break
+        for i in capped:
+            counts[i] = cap
+        remaining -= cap * len(capped)
+        open_items = [i for i in open_items if i not in capped]
+    if not open_items or remaining <= 0:
+        return counts
+
+    # largest remainder rounding of the shares, all below the cap
+    fractions = []
+    for i in open_items:
+        share = weights[i] * scale
+        counts[i] = int(share)
+        remaining -= counts[i]
+        fractions.append((share - counts[i], i))
+    if remaining:
+        fractions.sort(reverse=True)
+        for _, i in fractions[:remaining]:
+            counts[i] += 1
+    return counts
+
+
+def sample_without(rng: random.Random, population: int, k: int, excluded: int) -> List[int]:
+    """k distinct indexes of range(population), `excluded` not being one of them"""
+    chosen = rng.sample(range(population), min(k + 1, population))
+    return [i for i in chosen if i != excluded][:k]
+
+
+class BatchWriter:
+    """
+    Writes documents with `insert_many` in batches,
+    with at most `parallel` batches in flight.
+    """
+
+    def __init__(self, database, batch_size: int = 10000, parallel: int = 4):
+        self.database = database
+        self.batch_size = batch_size
+        self.parallel = parallel
+        self.pending = set()
+        self.inserted: Dict[str, int] = {}
+
+    async def write(self, collection: str, documents: Iterable[Dict[str, Any]]) -> None:
+        """Insert the documents in batches, returns once the last batch is sent"""
+        batch = []
+        for document in documents:
+            batch.append(document)
+            if len(batch) >= self.batch_size:
+                await self._send(collection, batch)
+                batch = []
+        if batch:
+            await self._send(collection, batch)
+
+    async def _send(self, collection: str, batch: List[Dict[str, Any]]) -> None:
+        while len(self.pending) >= self.parallel:
+            done, self.pending = await asyncio.wait(self.pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        insert = self.database[collection].insert_many(batch, ordered=False)
+        self.pending.add(asyncio.ensure_future(insert))
+        self.inserted[collection] = self.inserted.get(collection, 0) + len(batch)
+
+    async def close(self) -> None:
+        """Wait for the batches in flight"""
+        if self.pending:
+            await asyncio.gather(*self.pending)
+            self.pending = set()
+
+
+class PostsPlan(BaseModel):
+    """
+    What to generate for a range of posts, computed once by the main process.
+
+    Attributes:
+        start (int): Index of the first post.
+        authors (List[int]): Index of the author of each post.
+        likes (List[int]): Number of likes of each post.
+        comments (List[int]): Number of comments of each post.
+        like_start (int): Index of the first like of the first post.
+        comment_start (int): Index of the first comment of the first post.
+    """
+    start: int
+    authors: List[int]
+    likes: List[int]
+    comments: List[int]
+    like_start: int
+    comment_start: int
+
+
+def user_ids(config: SeedConfig) -> List[str]:
+    """Ids of all the users"""
+    users_namespace = namespace(config.seed, "users")
+    return [document_id(users_namespace, i) for i in range(config.users)]
+
+
+def post_documents(config: SeedConfig, users: List[str], plan: PostsPlan
+                   ) -> Tuple[List[Dict], List[Dict], List[Dict]]:
+    """Posts, likes and comments of a block of posts"""
+    rng = random.Random(f"{config.seed}:posts:{plan.start // POST_BLOCK}")
+    posts_namespace = namespace(config.seed, "posts")
+    likes_namespace = namespace(config.seed, "likes")
+    comments_namespace = namespace(config.seed, "comments")
+
+    posts, likes, comments = [], [], []
+    like_index, comment_index = plan.like_start, plan.comment_start
+    for offset, author in enumerate(plan.authors):
+        index = plan.start + offset
+        post_id = document_id(posts_namespace, index)
+        created_at = SEED_DATE + timedelta(seconds=index)
+
+        like_refs = []
+        for user in rng.sample(range(config.users), plan.likes[offset]):
+            like_id = document_id(likes_namespace, like_index)
+            like_index += 1
+            like_refs.append(DBRef("likes", like_id))
+            likes.append({"_id": like_id, "created_at": created_at, "updated_at": created_at,
+                          "user_id": users[user], "post_id": post_id})
+
+        comment_refs = []
+        for _ in range(plan.comments[offset]):
+            comment_id = document_id(comments_namespace, comment_index)
+            comment_refs.append(DBRef("comments", comment_id))
+            comments.append({"_id": comment_id, "created_at": created_at, "updated_at": created_at,
+                             "post_id": post_id, "user_id": users[rng.randrange(config.users)],
+                             "content": f"comment {comment_index}"})
+            comment_index += 1
+
+        posts.append({"_id": post_id, "created_at": created_at, "updated_at": created_at,
+                      "user_id": users[author], "content": f"post {index}",
+                      "media_type": None, "media_url": None,
+                      "comments": comment_refs, "likes": like_refs})
+    return posts, likes, comments
+
+
+async def write_posts(writer: BatchWriter, config: SeedConfig, plans: List[PostsPlan],
+                      users: Optional[List[str]] = None) -> Dict[str, int]:
+    """Generate and write blocks of posts"""
+    users = users or user_ids(config)
+    for plan in plans:
+        posts, likes, comments = post_documents(config, users, plan)
+        await writer.write("posts", posts)
+        await writer.write("likes", likes)
+        await writer.write("comments", comments)
+    await writer.close()
+    return writer.inserted
+
+
+def write_posts_process(url: str, db_name: str, config: SeedConfig, plans: List[PostsPlan],
+                        batch_size: int, parallel: int) -> Dict[str, int]:
+    """Worker process writing blocks of posts with its own client"""
+    async def run():
+        client = DBStorage(url=url, db_name=db_name).create_client()
+        try:
+            writer = BatchWriter(client[db_name], batch_size, parallel)
+            return await write_posts(writer, config, plans)
+        finally:
+            client.close()
+    return asyncio.run(run())
+
+
+def user_documents(config: SeedConfig, users: List[str], followers: List[array],
+                   following: List[array], posts: List[array], hashed_password: str):
+    """Generate the user documents with their links"""
+    posts_namespace = namespace(config.seed, "posts")
+    for i, user_id in enumerate(users):
+        created_at = SEED_DATE + timedelta(seconds=i)
+        yield {"_id": user_id, "created_at": created_at, "updated_at": created_at,
+               "email": f"seed{config.seed}_user{i}@example.com",
+               "hashed_password": hashed_password,
+               "username": f"seed{config.seed}_user{i}",
+               "full_name": f"User {i}", "bio": None, "profile_picture_url": None,
+               "posts": [DBRef("posts", document_id(posts_namespace, j)) for j in posts[i]],
+               "followers": [DBRef("users", users[j]) for j in followers[i]],
+               "following": [DBRef("users", users[j]) for j in following[i]]}
+
+
+def plan_posts(config: SeedConfig, rng: random.Random, popularity: List[float]
+               ) -> Tuple[List[PostsPlan], List[array]]:
+    """Split the posts in blocks, return the blocks and the posts of each user"""
+    authors = rng.choices(range(config.users), weights=popularity, k=config.posts) if config.users else []
+    user_posts = [array("q") for _ in range(config.users)]
+    for index, author in enumerate(authors):
+        user_posts[author].append(index)
+
+    weights = skewed_weights(rng, config.posts, config.exponent, config.viral_posts, config.viral_share)
+    likes = allocate(config.likes, weights, min(config.users, config.max_refs))
+    comments = allocate(config.comments, weights, config.max_refs)
+
+    plans = []
+    like_start = comment_start = 0
+    for start in range(0, config.posts, POST_BLOCK):
+        stop = min(start + POST_BLOCK, config.posts)
+        plans.append(PostsPlan(start=start, authors=authors[start:stop], likes=likes[start:stop],
+                               comments=comments[start:stop], like_start=like_start,
+                               comment_start=comment_start))
+        like_start += sum(likes[start:stop])
+        comment_start += sum(comments[start:stop])
+    return plans, user_posts
+
+
+def plan_follows(config: SeedConfig, rng: random.Random, popularity: List[float]
+                 ) -> Tuple[List[array], List[array]]:
+    """Followers and following of each user, by index"""
+    edges = round(config.users * config.mean_following)
+    counts = allocate(edges, popularity, min(config.users - 1, config.max_refs))
+    followers = [array("q", sample_without(rng, config.users, count, i))
+                 for i, count in enumerate(counts)]
+    following = [array("q") for _ in range(config.users)]
+    for friend, users in enumerate(followers):
+        for user in users:
+            following[user].append(friend)
+    # the following lists are capped too, the extra edges are dropped on both sides
+    for user, friends in enumerate(following):
+        if len(friends) > config.max_refs:
+            for friend in friends[config.max_refs:]:
+                followers[friend].remove(user)
+            following[user] = friends[:config.max_refs]
+    return followers, following
+
+
+async def seed(storage: DBStorage, config: SeedConfig, batch_size: int = 10000,
+               parallel: int = 4, workers: int = 0) -> SeedReport:
+    """
+    Insert the dataset in the database of an initialized storage engine.
+    The posts are written by `workers` processes, or in this process when 0
+    or with the in-memory engine.
+    """
+    start = time.perf_counter()
+    rng = random.Random(config.seed)
+    hashed_password = hash_password(PASSWORD)
+
+    # the popular users are the most followed and the most active ones
+    popularity = skewed_weights(rng, config.users, config.exponent,
+                                config.celebrities, config.celebrity_share)
+    followers, following = plan_follows(config, rng, popularity)
+    plans, user_posts = plan_posts(config, rng, popularity)
+    users = user_ids(config)
+
+    writer = BatchWriter(storage.database, batch_size, parallel)
+    documents = user_documents(config, users, followers, following, user_posts, hashed_password)
+    if workers and storage.name != 'memory':
+        loop = asyncio.get_running_loop()
+        with ProcessPoolExecutor(workers) as pool:
+            # each worker gets every workers-th block, to spread the viral posts
+            futures = [loop.run_in_executor(pool, write_posts_process, storage.url, storage.db_name,
+                                            config, plans[i::workers], batch_size, parallel)
+                       for i in range(workers)]
+            await writer.write("users", documents)
+            await writer.close()
+            results = await asyncio.gather(*futures)
+    else:
+        await writer.write("users", documents)
+        await write_posts(writer, config, plans, users)
+        results = []
+
+    report = SeedReport(documents=dict(writer.inserted))
+    for result in results:
+        for collection, count in result.items():
+            report.documents[collection] = report.documents.get(collection, 0) + count
+    report.seconds = round(time.perf_counter() - start, 3)
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Seed the database with a synthetic dataset")
+    parser.add_argument("--engine", default="mongodb", help="storage engine: mongodb or memory")
+    parser.add_argument("--db-name", help="database name, defaults to DB_NAME")
+    parser.add_argument("--drop", action="store_true", help="drop the database first")
+    parser.add_argument("--batch-size", type=int, default=10000, help="documents per insert_many")
+    parser.add_argument("--parallel", type=int, default=4, help="batches in flight per process")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="processes writing the posts, likes and comments (0: this process)")
+    for name, field in SeedConfig.model_fields.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=field.annotation,
+                            default=field.default, help=f"dataset {name}")
+    args = parser.parse_args(argv)
+    config = SeedConfig(**{name: getattr(args, name) for name in SeedConfig.model_fields})
+
+    async def run() -> SeedReport:
+        storage = get_storage(args.engine, db_name=args.db_name)
+        await storage.init()
+        if args.drop:
+            await storage.drop()
+            await storage.init()
+        return await seed(storage, config, args.batch_size, args.parallel, args.workers)
+
+    report = asyncio.run(run())
+    for collection, count in sorted(report.documents.items()):
+        sys.stdout.write(f"{collection:10} {count:>12}\n")
+    total = sum(report.documents.values())
+    sys.stdout.write(f"{total} documents in {report.seconds}s "
+                     f"({total / report.seconds if report.seconds else 0:.0f}/s)\n")
+
+
+if __name__ == "__main__":
+    main()
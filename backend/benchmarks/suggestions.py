@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Cost of the friends of friends computed for the follow suggestions:
+
+    python -m benchmarks.suggestions --users 1000000 --degree 10 --sample 20000
+
+Generates a power-law follow graph in memory: the number of accounts each
+user follows is Pareto distributed around `--degree`, and the accounts
+followed are drawn with a popularity decreasing as a power of their rank,
+so a few accounts have a large share of the followers. Reports the time to
+build the CSR arrays and their size, and the time to compute the top
+suggestions of `--sample` users (all of them with 0), extrapolated to the
+whole graph for one process.
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+from array import array
+from typing import Any, Dict, List, Optional
+from app.core.graph import FriendsOfFriends, csr_from_edges
+
+
+def power_law_graph(users: int, degree: int, seed: int):
+    """The edges (sources, targets) of a follow graph with power-law degrees"""
+    rng = random.Random(seed)
+    sources, targets = array('i'), array('i')
+    for user in range(users):
+        follows = min(int(degree / 2 * rng.paretovariate(2)), users - 1)
+        sources.extend([user] * follows)
+        targets.extend([int(users * rng.random() ** 3) for _ in range(follows)])
+    return sources, targets
+
+
+def run(users: int, degree: int, sample: int, top: int, max_fanout: int, seed: int) -> Dict[str, Any]:
+    start = time.perf_counter()
+    sources, targets = power_law_graph(users, degree, seed)
+    generated = time.perf_counter() - start
+
+    start = time.perf_counter()
+    indptr, indices = csr_from_edges(users, sources, targets)
+    built = time.perf_counter() - start
+    del sources, targets
+
+    graph = FriendsOfFriends(indptr, indices, max_fanout)
+    computed = users if sample <= 0 else min(sample, users)
+    rng = random.Random(seed)
+    chosen = range(users) if computed == users else sorted(rng.sample(range(users), computed))
+    suggested = 0
+    start = time.perf_counter()
+    for user in chosen:
+        suggested += bool(graph.suggest(user, top))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "users": users,
+        "edges": len(indices),
+        "max_followers": max(graph.followers),
+        "generate_s": round(generated, 2),
+        "csr_build_s": round(built, 2),
+        "csr_mb": round((indptr.itemsize * len(indptr) + indices.itemsize * len(indices)) / 1e6, 1),
+        "users_computed": computed,
+        "users_with_suggestions": suggested,
+        "us_per_user": round(elapsed / computed * 1e6, 1),
+        "all_users_s": round(elapsed / computed * users, 1),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Cost of the friends of friends of the follow suggestions")
+    parser.add_argument("--users", type=int, default=1000000, help="users of the graph")
+    parser.add_argument("--degree", type=int, default=10, help="mean number of accounts followed")
+    parser.add_argument("--sample", type=int, default=20000, help="users whose suggestions are computed, 0 for all")
+    parser.add_argument("--top", type=int, default=20, help="suggestions per user")
+    parser.add_argument("--max-fanout", type=int, default=1000, help="accounts following more are not summed")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+    report = run(args.users, args.degree, args.sample, args.top, args.max_fanout, args.seed)
+    sys.stdout.write(json.dumps(report, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
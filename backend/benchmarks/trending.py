@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Cost and accuracy of the trending hashtags:
+
+    python -m benchmarks.trending --uses 1000000 --tags 100000
+
+Counts uses of hashtags drawn from a Zipf distribution (a few tags used a
+lot, most rarely) over one window, then reports the time to count a use and
+to read the trends, how many of the real top tags the trends found, and the
+overestimate of their counts by the sketch.
+"""
+
+import argparse
+import itertools
+import json
+import random
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+from app.utils.trending import TrendingTags
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def run(uses: int, tags: int, top: int, limit: int, seed: int) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    names = [f"tag{rank}" for rank in range(tags)]
+    cumulative = list(itertools.accumulate(1 / (rank + 1) ** 1.1 for rank in range(tags)))
+    # the most used tags are not the first ones in alphabetical order
+    rng.shuffle(names)
+    sampled = rng.choices(names, cum_weights=cumulative, k=uses)
+
+    trends = TrendingTags(window=3600, buckets=12, top=top)
+    start = time.perf_counter()
+    for i, tag in enumerate(sampled):
+        # the uses spread over the window
+        trends.add([tag], now=i * 3000 / uses)
+    counting = time.perf_counter() - start
+
+    latencies = []
+    for _ in range(1000):
+        start = time.perf_counter()
+        trends.trending(limit, now=3000)
+        latencies.append((time.perf_counter() - start) * 1e6)
+
+    exact = Counter(sampled)
+    real = [tag for tag, _ in exact.most_common(limit)]
+    found = trends.trending(limit, now=3000)
+    errors = [count - exact[tag] for tag, count in found]
+    return {
+        "uses": uses,
+        "tags": tags,
+        "count_us_per_use": round(counting / uses * 1e6, 2),
+        "trending_us": {f"p{p}": round(percentile(latencies, p), 2) for p in (50, 99)},
+        "top_recall": round(len(set(real) & {tag for tag, _ in found}) / limit, 3),
+        "max_overestimate": max(errors),
+        "sketch_bytes": 4 * trends.width * trends.depth * (trends.buckets + 1),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Cost and accuracy of the trending hashtags")
+    parser.add_argument("--uses", type=int, default=1000000, help="uses of hashtags counted")
+    parser.add_argument("--tags", type=int, default=100000, help="distinct hashtags")
+    parser.add_argument("--top", type=int, default=100, help="candidate tags kept")
+    parser.add_argument("--limit", type=int, default=10, help="trending tags read")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+    report = run(args.uses, args.tags, args.top, args.limit, args.seed)
+    sys.stdout.write(json.dumps(report, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Latency of the typeahead search of the users:
+
+    python -m benchmarks.typeahead --users 2000000 --queries 2000
+
+Indexes synthetic users (a username and a full name of two or three words
+drawn from lists of syllables), then times the searches of the first one to
+six characters of the names of random users, the way they are typed, and
+the sign up of new users into the full index. Reports the p50/p95/p99
+latencies by length of the prefix with the build time and the memory of the
+index.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import resource
+import sys
+import time
+from typing import Any, Dict, List, Optional
+from app.utils.search import PrefixIndex
+
+SYLLABLES = ["an", "be", "ca", "da", "el", "fa", "gi", "ha", "io", "ja", "ka", "li", "ma", "na", "ol",
+             "pa", "ri", "sa", "ta", "ul", "va", "wi", "xa", "yo", "za", "mar", "son", "ber", "ton", "ley"]
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def word(rng: random.Random) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def run(users: int, queries: int, seed: int) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    names = []
+
+    async def documents():
+        for i in range(users):
+            full_name = " ".join(word(rng).capitalize() for _ in range(rng.choice((2, 2, 3))))
+            username = f"{word(rng)}{rng.choice(('', '_', '.'))}{rng.randrange(10000)}"
+            if i % 100 == 0:
+                names.append(full_name)
+            yield {"_id": f"user-{i}", "username": username, "full_name": full_name}
+
+    index = PrefixIndex()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    asyncio.run(index.build(documents(), ("username", "full_name")))
+    build = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    latencies: Dict[str, List[float]] = {}
+    for _ in range(queries):
+        name = rng.choice(names)
+        for length in range(1, 7):
+            start = time.perf_counter()
+            index.search(name[:length], limit=10)
+            latencies.setdefault(str(length), []).append((time.perf_counter() - start) * 1000)
+
+    for i in range(queries):
+        start = time.perf_counter()
+        index.add(f"new-{i}", f"{word(rng)}{i}", f"{word(rng)} {word(rng)}")
+        latencies.setdefault("sign_up", []).append((time.perf_counter() - start) * 1000)
+
+    return {
+        "users": users,
+        "entries": sum(len(entries) for entries in index._entries.values()),
+        "build_seconds": round(build, 1),
+        # ru_maxrss is in kilobytes on Linux, includes the generation of the users
+        "bytes_per_user": round((rss_after - rss_before) * 1024 / users, 1),
+        "latency_ms": {
+            name: {f"p{p}": round(percentile(values, p), 3) for p in (50, 95, 99)}
+            for name, values in latencies.items()
+        },
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Latency of the typeahead search of the users")
+    parser.add_argument("--users", type=int, default=1000000, help="users indexed")
+    parser.add_argument("--queries", type=int, default=2000, help="names typed")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+    report = run(args.users, args.queries, args.seed)
+    sys.stdout.write(json.dumps(report, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()